@@ -0,0 +1,63 @@
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app.db.session import get_db
+from app.schemas.assignments.assignment import (
+  AssignmentAgentOut,
+  AssignmentAgentUpdate,
+  AssignmentLoadsOut,
+  AssignmentPolicyOut,
+  AssignmentPolicyUpdate,
+)
+from app.services.assignment import (
+  assignment_engine,
+  delete_agent,
+  get_policy,
+  list_agents,
+  set_agent,
+  set_policy,
+)
+
+router = APIRouter()
+
+
+@router.get("/policy", response_model=AssignmentPolicyOut)
+def read_policy(company_id: int, db: Session = Depends(get_db)):
+  policy = get_policy(db, company_id)
+  if not policy:
+    raise HTTPException(status_code=404, detail="La empresa no tiene asignación automática")
+  return policy
+
+
+@router.put("/policy", response_model=AssignmentPolicyOut)
+def update_policy(payload: AssignmentPolicyUpdate, company_id: int, db: Session = Depends(get_db)):
+  try:
+    return set_policy(db, company_id, payload)
+  except ValueError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/agents", response_model=List[AssignmentAgentOut])
+def read_agents(company_id: int, db: Session = Depends(get_db)):
+  return list_agents(db, company_id)
+
+
+@router.put("/agents/{user_id}", response_model=AssignmentAgentOut)
+def update_agent(user_id: int, payload: AssignmentAgentUpdate, company_id: int, db: Session = Depends(get_db)):
+  try:
+    return set_agent(db, company_id, user_id, payload)
+  except ValueError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.delete("/agents/{user_id}")
+def remove_agent(user_id: int, company_id: int, db: Session = Depends(get_db)):
+  if not delete_agent(db, company_id, user_id):
+    raise HTTPException(status_code=404, detail="Agente no encontrado")
+  return {"success": True}
+
+
+@router.get("/loads", response_model=AssignmentLoadsOut)
+def read_loads(company_id: int, db: Session = Depends(get_db)):
+  """Chats abiertos por agente según los contadores en memoria de este proceso"""
+  return assignment_engine.snapshot(db, company_id)
@@ -38,7 +38,7 @@ def login(payload: UserLogin, db: Session = Depends(get_db)):
   company_data = None
   if getattr(user, "company_id", None):
     company = db.get(Company, user.company_id)
-    if company:
+    if company and company.deleted_at is None:
       company_data = {
         "id": company.id,
         "nombre": company.nombre,
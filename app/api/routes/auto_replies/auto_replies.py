@@ -0,0 +1,68 @@
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app.db.session import get_db
+from app.schemas.auto_replies.auto_reply import (
+  AutoReplyRuleCreate,
+  AutoReplyRuleOut,
+  AutoReplyRuleUpdate,
+  AutoReplyTestRequest,
+  AutoReplyTestResult,
+)
+from app.services.auto_replies import (
+  auto_reply_engine,
+  create_rule,
+  delete_rule,
+  get_rule,
+  list_rules,
+  update_rule,
+)
+
+router = APIRouter()
+
+
+@router.get("/", response_model=List[AutoReplyRuleOut])
+def list_(company_id: int, db: Session = Depends(get_db)):
+  return list_rules(db, company_id)
+
+
+@router.post("/", response_model=AutoReplyRuleOut)
+def create(payload: AutoReplyRuleCreate, company_id: int, db: Session = Depends(get_db)):
+  try:
+    return create_rule(db, company_id, payload)
+  except ValueError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/test", response_model=AutoReplyTestResult)
+def test(payload: AutoReplyTestRequest, company_id: int, db: Session = Depends(get_db)):
+  """Reglas que coincidirían con un mensaje, sin enviar nada"""
+  rule_ids = [rule.id for rule in auto_reply_engine.match(db, company_id, payload.text)]
+  rules = {rule.id: rule for rule in list_rules(db, company_id)}
+  return AutoReplyTestResult(matches=[rules[rule_id] for rule_id in rule_ids if rule_id in rules])
+
+
+@router.get("/{rule_id}", response_model=AutoReplyRuleOut)
+def get(rule_id: int, company_id: int, db: Session = Depends(get_db)):
+  rule = get_rule(db, company_id, rule_id)
+  if not rule:
+    raise HTTPException(status_code=404, detail="Regla no encontrada")
+  return rule
+
+
+@router.put("/{rule_id}", response_model=AutoReplyRuleOut)
+def update(rule_id: int, payload: AutoReplyRuleUpdate, company_id: int, db: Session = Depends(get_db)):
+  try:
+    rule = update_rule(db, company_id, rule_id, payload)
+  except ValueError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  if not rule:
+    raise HTTPException(status_code=404, detail="Regla no encontrada")
+  return rule
+
+
+@router.delete("/{rule_id}")
+def delete(rule_id: int, company_id: int, db: Session = Depends(get_db)):
+  if not delete_rule(db, company_id, rule_id):
+    raise HTTPException(status_code=404, detail="Regla no encontrada")
+  return {"success": True}
@@ -78,6 +78,8 @@ async def generate_summary_endpoint(
     else:
         interest = "Indeciso"
     row = save_chat_summary(db, company_id, data.chat_id, content, interest, provider="gemini", model="gemini-2.5-flash")
+    if not row:
+        raise HTTPException(status_code=404, detail="Chat no encontrado")
     return {
         "id": row.id,
         "summary": row.summary,
@@ -70,6 +70,8 @@ def create_appointment_endpoint(
             }
         })
     appt = create_appointment(db, company_id, data.chat_id, data.assigned_user_id, data.start_at)
+    if not appt:
+        raise HTTPException(status_code=404, detail="Chat no encontrado")
     return {
         "id": appt.id,
         "company_id": appt.company_id,
@@ -11,9 +11,9 @@ from app.services.chats import (
     unpin_chat,
     snooze_chat,
     unsnooze_chat,
-    bulk_update_chats,
-    bulk_set_tags_for_chats,
 )
+from app.services.deletion import soft_delete_chat
+from app.services.bulk import run_bulk_operations
 from app.schemas.chats.chat import (
     ChatWithLastMessage,
     ChatOut,
@@ -78,21 +78,11 @@ def delete_chat(
     company_id: int,
     db: Session = Depends(get_db)
 ):
-    from app.models.chats.chat import Chat, Message
-    chat = db.query(Chat).filter(
-        Chat.id == chat_id,
-        Chat.company_id == company_id
-    ).first()
-    if not chat:
+    # El chat se oculta de inmediato; sus datos y archivos se borran en segundo plano
+    job = soft_delete_chat(db, company_id, chat_id)
+    if not job:
         raise HTTPException(status_code=404, detail="Chat no encontrado")
-    try:
-        db.query(Message).filter(Message.chat_id == chat_id).delete()
-        db.query(Chat).filter(Chat.id == chat_id).delete()
-        db.commit()
-        return {"success": True, "message": "Chat eliminado exitosamente"}
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Error eliminando chat: {str(e)}")
+    return {"success": True, "message": "Chat eliminado exitosamente", "deletion_job_id": job.id}
 
 
 @router.post("/assign")
@@ -121,7 +111,8 @@ def update_status_endpoint(
 
 @router.post("/{chat_id}/pin")
 def pin_chat_endpoint(chat_id: int, user_id: int, db: Session = Depends(get_db)):
-    pin_chat(db, chat_id, user_id)
+    if not pin_chat(db, chat_id, user_id):
+        raise HTTPException(status_code=404, detail="Chat no encontrado")
     return {"success": True}
 
 
@@ -134,7 +125,8 @@ def unpin_chat_endpoint(chat_id: int, user_id: int, db: Session = Depends(get_db
 @router.post("/{chat_id}/snooze")
 def snooze_chat_endpoint(chat_id: int, user_id: int, until_at: str, db: Session = Depends(get_db)):
     from datetime import datetime
-    snooze_chat(db, chat_id, user_id, datetime.fromisoformat(until_at))
+    if not snooze_chat(db, chat_id, user_id, datetime.fromisoformat(until_at)):
+        raise HTTPException(status_code=404, detail="Chat no encontrado")
     return {"success": True}
 
 
@@ -152,11 +144,19 @@ def bulk_actions(
     priority: Optional[str] = None,
     assigned_user_id: Optional[int] = None,
     tag_ids: Optional[List[int]] = None,
+    user_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    updated = bulk_update_chats(db, company_id, chat_ids, status=status, priority=priority, assigned_user_id=assigned_user_id)
-    if tag_ids is not None:
-        bulk_set_tags_for_chats(db, chat_ids, tag_ids)
-    return {"updated": updated, "success": True}
+    counts = run_bulk_operations(
+        db,
+        company_id,
+        chat_ids,
+        status=status,
+        priority=priority,
+        assigned_user_id=assigned_user_id,
+        tag_ids=tag_ids,
+        user_id=user_id,
+    )
+    return {**counts, "success": True}
 
 
@@ -1,29 +1,129 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from app.services.realtime import manager
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from app.core.config import settings
+from app.services.realtime import manager, SLOW_CONSUMER_POLICIES, SSEStream
+from app.services.visibility import chat_scope_for_user
 
 
 router = APIRouter()
 
+# Milisegundos que el EventSource espera antes de reconectar
+SSE_RETRY_MS = 3000
+
+
+def _policy(policy: Optional[str]) -> Optional[str]:
+  # Política de consumidor lento pedida por el cliente (?policy=coalesce); si no es válida se usa la global
+  return policy if policy in SLOW_CONSUMER_POLICIES else None
+
+
+# Cierre de websocket para un ?user_id= inexistente
+UNKNOWN_USER_CLOSE_CODE = 4404
+
+
+async def _chat_scope(user_id: Optional[int]) -> Optional[str]:
+  # Con ?user_id= los eventos de chats de la empresa se filtran según lo que ese usuario puede ver
+  if user_id is None:
+    return None
+  return await run_in_threadpool(chat_scope_for_user, user_id)
+
 
 @router.websocket("/ws/company/{company_id}")
-async def websocket_company_endpoint(websocket: WebSocket, company_id: int):
+async def websocket_company_endpoint(
+  websocket: WebSocket,
+  company_id: int,
+  policy: Optional[str] = None,
+  last_seq: Optional[int] = None,
+  user_id: Optional[int] = None,
+):
   await websocket.accept()
-  await manager.connect_company(websocket, company_id)
+  chat_scope = await _chat_scope(user_id)
+  if user_id is not None and chat_scope is None:
+    await websocket.close(code=UNKNOWN_USER_CLOSE_CODE)
+    return
+  # Con ?last_seq= se repiten los eventos perdidos, o llega resync.required si ya no están
+  await manager.connect_company(
+    websocket, company_id, policy=_policy(policy), last_seq=last_seq, user_id=user_id, chat_scope=chat_scope,
+  )
   try:
     while True:
       await websocket.receive_text()
+      manager.touch(websocket)
   except WebSocketDisconnect:
     manager.disconnect_company(websocket, company_id)
 
 
+@router.get("/events/company/{company_id}")
+async def company_event_stream(
+  company_id: int,
+  policy: Optional[str] = None,
+  last_seq: Optional[int] = None,
+  user_id: Optional[int] = None,
+  last_event_id: Optional[str] = Header(None),
+):
+  """
+  Server-Sent Events con los mismos eventos de empresa que ``/ws/company/{company_id}``.
+
+  Pensado para tableros y supervisores que solo leen. Al reconectar, el navegador manda
+  ``Last-Event-ID`` (el ``seq`` del último evento) y se repite lo perdido o llega
+  ``resync.required``; ``?last_seq=`` sirve para la primera conexión.
+  """
+  if last_event_id and last_event_id.isdigit():
+    last_seq = int(last_event_id)
+  chat_scope = await _chat_scope(user_id)
+  if user_id is not None and chat_scope is None:
+    raise HTTPException(status_code=404, detail="Usuario no encontrado")
+  stream = SSEStream()
+  await manager.connect_stream(
+    stream, company_id, policy=_policy(policy), last_seq=last_seq, user_id=user_id, chat_scope=chat_scope,
+  )
+
+  async def body():
+    try:
+      yield f"retry: {SSE_RETRY_MS}\n\n"
+      async for chunk in stream.events(settings.realtime_sse_keepalive):
+        yield chunk
+    finally:
+      manager.disconnect_stream(stream)
+
+  return StreamingResponse(
+    body(),
+    media_type="text/event-stream",
+    # Sin caché ni buffering del proxy (nginx) para que cada evento salga al momento
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+  )
+
+
 @router.websocket("/ws/{company_id}/{chat_id}")
-async def websocket_endpoint(websocket: WebSocket, company_id: int, chat_id: int):
+async def websocket_endpoint(
+  websocket: WebSocket,
+  company_id: int,
+  chat_id: int,
+  policy: Optional[str] = None,
+  last_seq: Optional[int] = None,
+):
   await websocket.accept()
-  await manager.connect(websocket, company_id, chat_id)
+  await manager.connect(websocket, company_id, chat_id, policy=_policy(policy), last_seq=last_seq)
   try:
     while True:
       await websocket.receive_text()
+      manager.touch(websocket)
   except WebSocketDisconnect:
     manager.disconnect(websocket, company_id, chat_id)
 
 
+@router.websocket("/ws")
+async def websocket_multiplex_endpoint(websocket: WebSocket, policy: Optional[str] = None, user_id: Optional[int] = None):
+  # Una conexión para todos los canales: {"action": "subscribe" | "unsubscribe", "channel": ..., "last_seq": ...}
+  await websocket.accept()
+  chat_scope = await _chat_scope(user_id)
+  if user_id is not None and chat_scope is None:
+    await websocket.close(code=UNKNOWN_USER_CLOSE_CODE)
+    return
+  await manager.connect_client(websocket, policy=_policy(policy), user_id=user_id, chat_scope=chat_scope)
+  try:
+    while True:
+      manager.handle_control(websocket, await websocket.receive_text())
+  except WebSocketDisconnect:
+    manager.disconnect_client(websocket)
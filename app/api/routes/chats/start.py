@@ -7,6 +7,7 @@ from app.services.chats import (
 )
 from app.services.ycloud import create_ycloud_service
 from app.services.companies import get_company
+from app.services.phones import normalize_phone
 from app.schemas.chats.chat import (
     MessageCreate,
     StartChatRequest,
@@ -23,14 +24,9 @@ async def start_chat_and_send(
     user_id: int,
     db: Session = Depends(get_db)
 ):
-    phone = payload.phone_number.strip()
-    if not phone:
+    if not payload.phone_number.strip():
         raise HTTPException(status_code=400, detail="phone_number requerido")
-    phone = phone.replace(" ", "").replace("-", "")
-    if phone.startswith("+"):
-        normalized = phone
-    else:
-        normalized = "+" + phone
+    normalized = normalize_phone(payload.phone_number)
     chat = get_or_create_chat(db, normalized, company_id, payload.customer_name)
     company = get_company(db, company_id)
     if not company or not company.ycloud_api_key or not company.whatsapp_phone_number:
@@ -74,9 +70,7 @@ async def start_chat_with_template(
     user_id: int,
     db: Session = Depends(get_db)
 ):
-    phone = payload.phone_number.strip().replace(" ", "").replace("-", "")
-    if not phone.startswith("+"):
-        phone = "+" + phone
+    phone = normalize_phone(payload.phone_number)
     chat = get_or_create_chat(db, phone, company_id, payload.customer_name)
     company = get_company(db, company_id)
     if not company or not company.ycloud_api_key or not company.whatsapp_phone_number:
@@ -43,13 +43,16 @@ def list_tags_for_chat(chat_id: int, db: Session = Depends(get_db)):
 
 @router.put("/{chat_id}/tags")
 def set_tags_for_chat(chat_id: int, tag_ids: List[int], db: Session = Depends(get_db)):
-    set_chat_tags(db, chat_id, tag_ids)
+    if not set_chat_tags(db, chat_id, tag_ids):
+        raise HTTPException(status_code=404, detail="Chat no encontrado")
     return {"success": True}
 
 
 @router.post("/{chat_id}/notes", response_model=NoteOut)
 def add_note_to_chat(chat_id: int, company_id: int, user_id: int, content: str, db: Session = Depends(get_db)):
     note = add_note(db, company_id, chat_id, user_id, content)
+    if not note:
+        raise HTTPException(status_code=404, detail="Chat no encontrado")
     return note
 
 
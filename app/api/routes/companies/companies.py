@@ -46,10 +46,10 @@ def update(company_id: int, payload: CompanyUpdate, db: Session = Depends(get_db
 
 @router.delete("/{company_id}")
 def delete(company_id: int, db: Session = Depends(get_db)):
-  ok = delete_company(db, company_id)
-  if not ok:
+  job = delete_company(db, company_id)
+  if not job:
     raise HTTPException(status_code=404, detail="Empresa no encontrada")
-  return {"ok": True}
+  return {"ok": True, "deletion_job_id": job.id}
 
 
 @router.put("/{company_id}/ycloud-config", response_model=CompanyOut)
@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+from .maintenance import router as maintenance_router
+from .sql_metrics import router as sql_metrics_router
+from .backups import router as backups_router
+from .deletions import router as deletions_router
+from .webhooks import router as webhooks_router
+from .realtime import router as realtime_router, stats_router as realtime_stats_router
+
+router = APIRouter()
+
+router.include_router(maintenance_router)
+router.include_router(sql_metrics_router)
+router.include_router(backups_router)
+router.include_router(deletions_router)
+router.include_router(realtime_router)
+router.include_router(webhooks_router)
+
+__all__ = ["router", "realtime_stats_router"]
@@ -0,0 +1,37 @@
+from fastapi import APIRouter, HTTPException
+from app.services import backup
+from app.services.maintenance import maintenance_scheduler
+
+router = APIRouter()
+
+
+@router.get("/backups")
+def list_backups():
+  last = backup.last_backup
+  return {
+    "snapshots": backup.list_snapshots(),
+    "last_backup": last.as_dict() if last else None,
+    "job": maintenance_scheduler.jobs["backup"].status,
+  }
+
+
+@router.post("/backups")
+def create_backup():
+  status = maintenance_scheduler.run_job("backup")
+  if status is None:
+    raise HTTPException(status_code=409, detail="Hay un backup en curso en otro worker")
+  if status.last_error:
+    raise HTTPException(status_code=500, detail=f"Error generando backup: {status.last_error}")
+  last = backup.last_backup
+  return last.as_dict() if last else {"detail": status.last_detail}
+
+
+@router.post("/backups/{name}/verify")
+def verify_backup(name: str):
+  try:
+    path = backup.resolve_snapshot(name)
+  except ValueError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  except FileNotFoundError:
+    raise HTTPException(status_code=404, detail="Snapshot no encontrado")
+  return backup.verify_snapshot(path)
@@ -0,0 +1,38 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app.db.session import get_db
+from app.services.deletion import get_deletion_job, list_deletion_jobs
+
+router = APIRouter()
+
+
+def _serialize(job) -> dict:
+  return {
+    "id": job.id,
+    "entity": job.entity,
+    "entity_id": job.entity_id,
+    "company_id": job.company_id,
+    "status": job.status,
+    "step": job.step,
+    "rows_deleted": job.rows_deleted,
+    "files_deleted": job.files_deleted,
+    "attempts": job.attempts,
+    "error": job.error,
+    "created_at": job.created_at,
+    "started_at": job.started_at,
+    "finished_at": job.finished_at,
+  }
+
+
+@router.get("/deletions")
+def deletion_status(status: Optional[str] = None, limit: int = 50, db: Session = Depends(get_db)):
+  return [_serialize(job) for job in list_deletion_jobs(db, status=status, limit=min(limit, 500))]
+
+
+@router.get("/deletions/{job_id}")
+def deletion_job_status(job_id: int, db: Session = Depends(get_db)):
+  job = get_deletion_job(db, job_id)
+  if not job:
+    raise HTTPException(status_code=404, detail="Borrado no encontrado")
+  return _serialize(job)
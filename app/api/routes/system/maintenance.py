@@ -0,0 +1,18 @@
+from fastapi import APIRouter, HTTPException
+from app.services.maintenance import maintenance_scheduler
+
+router = APIRouter()
+
+
+@router.get("/maintenance")
+def maintenance_status():
+  return maintenance_scheduler.status()
+
+
+@router.post("/maintenance/{job_name}/run")
+def run_maintenance_job(job_name: str):
+  if job_name not in maintenance_scheduler.jobs:
+    raise HTTPException(status_code=404, detail="Job de mantenimiento no encontrado")
+  if maintenance_scheduler.run_job(job_name) is None:
+    raise HTTPException(status_code=409, detail="El job se está ejecutando en otro worker")
+  return maintenance_scheduler.status()
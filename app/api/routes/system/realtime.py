@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from app.services.realtime import manager
+
+router = APIRouter()
+
+
+@router.get("/realtime")
+async def realtime_status():
+  return {
+    "broker": manager.broker.stats(),
+    "queues": manager.queue_stats(),
+  }
+
+
+# Montado en /api/realtime
+stats_router = APIRouter()
+
+
+@stats_router.get("/stats")
+async def realtime_connection_stats(top_channels: int = 50):
+  return await manager.connection_stats(top_channels=top_channels)
@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from app.db.session import sql_metrics
+
+router = APIRouter()
+
+
+@router.get("/sql-metrics")
+def get_sql_metrics(top: int = 20):
+  return sql_metrics.snapshot(top=top)
+
+
+@router.delete("/sql-metrics")
+def reset_sql_metrics():
+  sql_metrics.reset()
+  return {"success": True}
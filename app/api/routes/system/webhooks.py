@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException
+from app.services.assignment import assignment_engine
+from app.services.auto_replies import auto_reply_engine
+from app.services.message_dedupe import inbound_dedupe
+from app.services.message_status import status_batcher
+from app.services.webhook_archive import webhook_archive
+from app.services.webhook_queue import webhook_queue
+
+router = APIRouter()
+
+
+@router.get("/webhooks")
+def webhook_queue_status():
+  return dict(
+    webhook_queue.stats(),
+    dedupe=inbound_dedupe.stats(),
+    statuses=status_batcher.stats(),
+    archive=webhook_archive.stats(),
+    auto_replies=auto_reply_engine.stats(),
+    assignment=assignment_engine.stats(),
+  )
+
+
+@router.get("/webhooks/dead-letters")
+def webhook_dead_letters(limit: int = 50):
+  return webhook_queue.dead_letters(limit=min(limit, 500))
+
+
+@router.post("/webhooks/dead-letters/{dead_letter_id}/retry")
+def retry_webhook_dead_letter(dead_letter_id: int):
+  event_id = webhook_queue.retry_dead_letter(dead_letter_id)
+  if event_id is None:
+    raise HTTPException(status_code=404, detail="Dead letter no encontrado")
+  return {"event_id": event_id}
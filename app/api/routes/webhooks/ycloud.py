@@ -1,13 +1,24 @@
-from fastapi import APIRouter, Request, HTTPException, Depends
+from fastapi import APIRouter, Request, HTTPException
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from app.db.session import get_db
-from app.services.chats import get_or_create_chat, create_message
+import anyio
+from app.db.session import SessionLocal
+from app.services.chats import get_or_create_chat_id, create_message, forget_chat
 from app.services.media_handler import media_handler
+from app.services.phones import normalize_phone, phone_variants
+from app.services.webhook_queue import webhook_queue
+from app.services.webhook_archive import webhook_archive
+from app.services.message_dedupe import find_message_id, inbound_dedupe
+from app.services.message_status import status_batcher
+from app.services.auto_replies import auto_reply_engine
+from app.services.assignment import assignment_engine
+from app.core.config import settings
 from app.schemas.chats.chat import MessageCreate
 from app.services.realtime import manager
 from app.models.companies.company import Company
 import json
 import logging
+import time
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -16,50 +27,109 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.post("/ycloud")
-async def ycloud_webhook(request: Request, db: Session = Depends(get_db)):
+async def ycloud_webhook(request: Request):
     """
-    Webhook endpoint para recibir eventos de YCloud WhatsApp
+    Webhook endpoint para recibir eventos de YCloud WhatsApp.
+
+    Solo valida el JSON y lo guarda en la cola durable; los workers de ``webhook_queue``
+    lo procesan después, en orden por chat. Sin la cola en marcha se procesa en línea.
     """
+    # Obtener el cuerpo de la petición
+    received_at = time.time()
+    body = await request.body()
+    body_text = body.decode('utf-8')
+    
+    # Los headers y el cuerpo completo solo en DEBUG: el payload queda en el archivo de webhooks
+    logger.debug(f"Headers: {dict(request.headers)}")
+    logger.debug(f"Body: {body_text}")
+    
+    # Parsear el JSON
+    try:
+        payload = json.loads(body_text)
+    except json.JSONDecodeError as e:
+        logger.error(f"Error parseando JSON: {e}")
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    
+    # Obtener el tipo de evento
+    event_type = payload.get('type', 'unknown')
+    logger.info(f"Webhook YCloud recibido: {event_type} ({len(body)} bytes)")
+    webhook_archive.append(body_text, event_type, received_at)
+    
+    # Reintento de YCloud de un mensaje que ya pasó por aquí: se confirma sin volver a procesarlo
+    message_ids = inbound_message_ids(payload)
+    if message_ids and inbound_dedupe.seen(*message_ids):
+        logger.info(f"Webhook duplicado ignorado: {message_ids}")
+        return {"status": "success", "message": "Webhook duplicado"}
+    
+    try:
+        if webhook_queue.running:
+            await anyio.to_thread.run_sync(webhook_queue.enqueue, event_type, body_text, partition_key(payload))
+            # Ya es durable: los reintentos que lleguen mientras espera en la cola también se ignoran
+            if message_ids:
+                inbound_dedupe.remember(*message_ids)
+            return {"status": "success", "message": "Webhook encolado"}
+        await anyio.to_thread.run_sync(process_ycloud_event, payload)
+    except Exception as e:
+        logger.error(f"Error procesando webhook: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    # Responder con éxito (YCloud espera un 200)
+    return {"status": "success", "message": "Webhook procesado"}
+
+
+def inbound_message_ids(payload: dict):
+    """(id de YCloud, wamid) de un mensaje entrante; ``None`` para otros eventos"""
+    if payload.get('type') != 'whatsapp.inbound_message.received':
+        return None
+    message = payload.get('whatsappInboundMessage') or {}
+    return message.get('id'), message.get('wamid')
+
+
+def partition_key(payload: dict) -> str:
+    """
+    Clave de orden de un evento en la cola: el chat, como ``<número empresa>:<número cliente>``.
+
+    Los mensajes entrantes vienen del cliente a la empresa y las actualizaciones de estado
+    al revés; ambos caen en la misma partición. Otros eventos se ordenan por tipo.
+    """
+    event_type = payload.get('type', 'unknown')
+    if event_type == 'whatsapp.inbound_message.received':
+        message = payload.get('whatsappInboundMessage') or {}
+        business, customer = message.get('to'), message.get('from')
+    elif event_type == 'whatsapp.message.updated':
+        message = payload.get('whatsappMessage') or {}
+        business, customer = message.get('from'), message.get('to')
+    else:
+        return event_type
+    if not isinstance(business, str) or not isinstance(customer, str):
+        return event_type
+    return f"{normalize_phone(business)}:{normalize_phone(customer)}"
+
+
+def process_ycloud_event(payload: dict) -> None:
+    """Procesa un evento de YCloud con una sesión propia; lo llaman los workers de la cola"""
+    db = SessionLocal()
     try:
-        # Obtener el cuerpo de la petición
-        body = await request.body()
-        headers = dict(request.headers)
-        
-        # Log de la petición recibida
-        logger.info(f"Webhook YCloud recibido:")
-        logger.info(f"Headers: {headers}")
-        logger.info(f"Body: {body.decode('utf-8')}")
-        
-        # Parsear el JSON
-        try:
-            payload = json.loads(body.decode('utf-8'))
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parseando JSON: {e}")
-            raise HTTPException(status_code=400, detail="Invalid JSON")
-        
-        # Obtener el tipo de evento
-        event_type = payload.get('type', 'unknown')
-        logger.info(f"Tipo de evento: {event_type}")
-        
         # Procesar diferentes tipos de eventos
+        event_type = payload.get('type', 'unknown')
         if event_type == 'whatsapp.inbound_message.received':
-            await handle_inbound_message(payload, db)
+            handle_inbound_message(payload, db)
         elif event_type == 'whatsapp.message.updated':
-            await handle_message_updated(payload, db)
+            handle_message_updated(payload, db)
         elif event_type.startswith('whatsapp.'):
-            await handle_whatsapp_event(payload, db)
+            handle_whatsapp_event(payload, db)
         else:
             logger.info(f"Evento no manejado: {event_type}")
-        
-        # Responder con éxito (YCloud espera un 200)
-        return {"status": "success", "message": "Webhook procesado"}
-        
-    except Exception as e:
-        logger.error(f"Error procesando webhook: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        # Confirma lo que quede pendiente y libera los eventos de tiempo real registrados con on_commit
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
 
 
-async def handle_inbound_message(payload: dict, db: Session):
+def handle_inbound_message(payload: dict, db: Session):
     """Manejar mensajes entrantes de WhatsApp"""
     try:
         logger.info("📨 Procesando mensaje entrante de WhatsApp")
@@ -117,9 +187,16 @@ async def handle_inbound_message(payload: dict, db: Session):
         logger.info(f"🆔 ID: {message_id}")
         logger.info(f"🔗 WAMID: {wamid}")
         
+        # Reintento que la LRU no vio (otro proceso, reinicio): no se descarga ni se guarda de nuevo
+        if find_message_id(db, message_id, wamid) is not None:
+            logger.info(f"Mensaje {message_id} ya registrado; reintento ignorado")
+            inbound_dedupe.record_stored_duplicate(message_id, wamid)
+            return
+        
         # Buscar la empresa que tiene configurado este número de WhatsApp
         company = db.query(Company).filter(
-            Company.whatsapp_phone_number == to_number
+            Company.whatsapp_phone_number.in_(phone_variants(to_number)),
+            Company.deleted_at.is_(None),
         ).first()
         
         if not company:
@@ -129,65 +206,86 @@ async def handle_inbound_message(payload: dict, db: Session):
         logger.info(f"🏢 Empresa encontrada: {company.nombre}")
         
         # Crear o obtener el chat
-        chat = get_or_create_chat(
+        chat_id = get_or_create_chat_id(
             db=db,
             company_id=company.id,
             phone_number=from_number,
             customer_name=customer_name
         )
         
-        logger.info(f"💬 Chat ID: {chat.id}")
+        logger.info(f"💬 Chat ID: {chat_id}")
         
-        # Si hay archivo adjunto, descargarlo y guardarlo localmente
-        local_attachment_url = attachment_url
-        if attachment_url:
-            logger.info(f"📥 Descargando archivo multimedia...")
-            local_path = media_handler.download_and_save_media(
-                media_url=attachment_url,
-                company_id=company.id,
-                chat_id=chat.id,
-                message_id=message_id,
-                mime_type=whatsapp_message.get(message_type, {}).get('mime_type') if message_type in ['image', 'audio', 'video', 'document', 'sticker'] else None
+        def _save_message(chat_id: int):
+            # Si hay archivo adjunto, descargarlo y guardarlo localmente
+            local_attachment_url = attachment_url
+            if attachment_url:
+                logger.info(f"📥 Descargando archivo multimedia...")
+                local_path = media_handler.download_and_save_media(
+                    media_url=attachment_url,
+                    company_id=company.id,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    mime_type=whatsapp_message.get(message_type, {}).get('mime_type') if message_type in ['image', 'audio', 'video', 'document', 'sticker'] else None
+                )
+                if local_path:
+                    local_attachment_url = local_path
+                    logger.info(f"✅ Archivo guardado localmente: {local_path}")
+                else:
+                    logger.warning(f"⚠️ No se pudo descargar el archivo, usando URL original")
+        
+            # Crear el mensaje en la base de datos
+            message_data = MessageCreate(
+                chat_id=chat_id,
+                content=message_text,
+                message_type=message_type or "text",
+                direction="incoming",
+                whatsapp_message_id=message_id,
+                wamid=wamid,
+                sender_name=customer_name,
+                attachment_url=local_attachment_url  # Usar la URL local si se descargó correctamente
             )
-            if local_path:
-                local_attachment_url = local_path
-                logger.info(f"✅ Archivo guardado localmente: {local_path}")
-            else:
-                logger.warning(f"⚠️ No se pudo descargar el archivo, usando URL original")
-        
-        # Crear el mensaje en la base de datos
-        message_data = MessageCreate(
-            chat_id=chat.id,
-            content=message_text,
-            message_type=message_type or "text",
-            direction="incoming",
-            whatsapp_message_id=message_id,
-            wamid=wamid,
-            sender_name=customer_name,
-            attachment_url=local_attachment_url  # Usar la URL local si se descargó correctamente
-        )
         
-        message = create_message(db, message_data)
-        logger.info(f"✅ Mensaje guardado con ID: {message.id}")
+            return create_message(db, message_data)
+
         try:
-            await manager.broadcast_to_company(company.id, "chat.updated", {
-                "chat_id": chat.id,
-                "company_id": company.id
-            })
-        except Exception as be:
-            logger.warning(f"No se pudo emitir chat.updated: {be}")
-        
-        # TODO: Aquí puedes agregar:
-        # 1. Respuestas automáticas
-        # 2. Asignación automática de agentes
-        # 3. Análisis de sentimientos
+            message = _save_message(chat_id)
+        except LookupError:
+            # La caché de este worker apuntaba a un chat eliminado desde otro worker
+            forget_chat(company.id, from_number)
+            chat_id = get_or_create_chat_id(db=db, company_id=company.id, phone_number=from_number, customer_name=customer_name)
+            message = _save_message(chat_id)
+        except IntegrityError:
+            # Otro worker guardó el mismo mensaje entre la consulta y el insert
+            db.rollback()
+            if find_message_id(db, message_id, wamid) is None:
+                raise
+            logger.info(f"Mensaje {message_id} guardado en paralelo; reintento ignorado")
+            inbound_dedupe.record_stored_duplicate(message_id, wamid)
+            return
+        inbound_dedupe.remember(message_id, wamid)
+        logger.info(f"✅ Mensaje guardado con ID: {message.id}")
+        company_id = company.id
+
+        manager.emit_to_company(db, company_id, "chat.updated", {
+            "chat_id": chat_id,
+            "company_id": company_id
+        })
+        
+        # Chats nuevos o sin agente: asignación automática según la política de la empresa
+        if settings.auto_assign_enabled:
+            assignment_engine.assign_inbound(db, company_id, chat_id)
+        
+        # Respuesta automática por palabras clave; confirma antes de llamar a YCloud
+        if settings.auto_replies_enabled and message_type == 'text':
+            db.commit()
+            auto_reply_engine.handle_inbound(db, company, chat_id, from_number, message_text)
         
     except Exception as e:
         logger.error(f"Error manejando mensaje entrante: {e}")
         raise
 
 
-async def handle_message_updated(payload: dict, db: Session):
+def handle_message_updated(payload: dict, db: Session):
     """Manejar actualizaciones de estado de mensajes"""
     try:
         logger.info("🔄 Procesando actualización de mensaje")
@@ -204,14 +302,14 @@ async def handle_message_updated(payload: dict, db: Session):
         if error_code and error_message:
             logger.warning(f"❌ Error en mensaje {message_id}: {error_code} - {error_message}")
         
-        # Estados posibles: sent, delivered, read, failed
-        # Aquí puedes actualizar el estado del mensaje en tu base de datos
+        # Estados posibles: sent, delivered, read, failed. Se aplican por lotes y solo avanzan
+        status_batcher.submit(message_id, status)
         
     except Exception as e:
         logger.error(f"Error manejando actualización de mensaje: {e}")
 
 
-async def handle_whatsapp_event(payload: dict, db: Session):
+def handle_whatsapp_event(payload: dict, db: Session):
     """Manejar otros eventos de WhatsApp"""
     try:
         event_type = payload.get('type')
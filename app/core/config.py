@@ -12,6 +12,8 @@ class Settings:
   server_url: str = os.getenv("SERVER_URL", "http://localhost:8000")
   # URL pública para recursos (usar ngrok cuando esté disponible)
   public_url: str = os.getenv("PUBLIC_URL", "https://d79757fc9d41.ngrok-free.app")
+  # API de YCloud; se puede apuntar a un doble local para pruebas de carga
+  ycloud_api_base_url: str = os.getenv("YCLOUD_API_BASE_URL", "https://api.ycloud.com/v2").rstrip("/")
   deepseek_api_key: str | None = os.getenv("DEEPSEEK_API_KEY")
   gemini_api_key: str | None = os.getenv("GEMINI_API_KEY")
 
@@ -29,6 +31,128 @@ class Settings:
   admin_email: str | None = os.getenv("ADMIN_EMAIL")
   admin_password: str | None = os.getenv("ADMIN_PASSWORD")
 
+  debug: bool = os.getenv("DEBUG", "0") == "1"
+
+  # Unidad de trabajo: un solo commit por petición HTTP
+  unit_of_work: bool = os.getenv("UNIT_OF_WORK", "1") == "1"
+
+  # Instrumentación SQL (conteo por petición, detección de N+1 y log de consultas lentas)
+  sql_metrics_enabled: bool = os.getenv("SQL_METRICS_ENABLED", "1") == "1"
+  sql_slow_query_ms: float = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+  sql_n_plus_one_threshold: int = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "10"))
+
+  # Tiempo real: "memory" (un worker) o "sqlite" (varios workers comparten data/realtime.db)
+  realtime_broker: str = os.getenv("REALTIME_BROKER", "memory")
+  realtime_poll_ms: float = float(os.getenv("REALTIME_POLL_MS", "50"))
+  realtime_retention_seconds: float = float(os.getenv("REALTIME_RETENTION_SECONDS", "300"))
+
+  # Cola de salida por websocket y política ante consumidores lentos (drop_oldest, coalesce, disconnect)
+  realtime_queue_size: int = int(os.getenv("REALTIME_QUEUE_SIZE", "256"))
+  realtime_slow_consumer_policy: str = os.getenv("REALTIME_SLOW_CONSUMER_POLICY", "drop_oldest")
+  realtime_send_timeout: float = float(os.getenv("REALTIME_SEND_TIMEOUT", "10"))
+  # Ventana para agrupar chat.updated en chats.batch_updated; 0 envía cada evento por separado
+  realtime_coalesce_ms: float = float(os.getenv("REALTIME_COALESCE_MS", "100"))
+  # Eventos recientes por empresa que se repiten a un cliente que se reconecta con ?last_seq=
+  realtime_replay_size: int = int(os.getenv("REALTIME_REPLAY_SIZE", "1000"))
+  # Canales por conexión en el endpoint multiplexado /ws
+  realtime_max_subscriptions: int = int(os.getenv("REALTIME_MAX_SUBSCRIPTIONS", "200"))
+  # Eventos confirmados pendientes de difundir por el dispatcher del loop
+  realtime_outbox_size: int = int(os.getenv("REALTIME_OUTBOX_SIZE", "10000"))
+  # Segundos sin eventos tras los que un stream SSE envía un comentario de keepalive
+  realtime_sse_keepalive: float = float(os.getenv("REALTIME_SSE_KEEPALIVE", "15"))
+  # Ping de aplicación cada N segundos (0 desactiva). El timeout solo cierra a los clientes
+  # que ya respondieron un pong; los demás dependen del ping de protocolo de uvicorn
+  realtime_heartbeat_interval: float = float(os.getenv("REALTIME_HEARTBEAT_INTERVAL", "25"))
+  realtime_heartbeat_timeout: float = float(os.getenv("REALTIME_HEARTBEAT_TIMEOUT", "75"))
+  # Ping de protocolo websocket (uvicorn): el navegador responde solo, detecta peers caídos en cualquier cliente
+  ws_ping_interval: float = float(os.getenv("WS_PING_INTERVAL", "20"))
+  ws_ping_timeout: float = float(os.getenv("WS_PING_TIMEOUT", "20"))
+
+  # permessage-deflate en websockets (uvicorn); útil con payloads grandes como chats.bulk_updated
+  ws_per_message_deflate: bool = os.getenv("WS_PER_MESSAGE_DEFLATE", "1") == "1"
+
+  # Cola durable de webhooks: el endpoint persiste el payload y responde de inmediato;
+  # los workers procesan en orden por chat, con reintentos y dead letters
+  webhook_queue_enabled: bool = os.getenv("WEBHOOK_QUEUE_ENABLED", "1") == "1"
+  webhook_workers: int = int(os.getenv("WEBHOOK_WORKERS", "4"))
+  webhook_batch_size: int = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+  webhook_poll_ms: float = float(os.getenv("WEBHOOK_POLL_MS", "200"))
+  webhook_max_attempts: int = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "6"))
+  webhook_backoff_seconds: float = float(os.getenv("WEBHOOK_BACKOFF_SECONDS", "2"))
+  webhook_backoff_max_seconds: float = float(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", "300"))
+  webhook_lease_seconds: float = float(os.getenv("WEBHOOK_LEASE_SECONDS", "60"))
+
+  # Respuestas automáticas por palabras clave; cada proceso revisa si otro cambió las reglas
+  auto_replies_enabled: bool = os.getenv("AUTO_REPLIES_ENABLED", "1") == "1"
+  auto_reply_reload_seconds: float = float(os.getenv("AUTO_REPLY_RELOAD_SECONDS", "30"))
+
+  # Asignación automática de chats entrantes; la carga por agente se recalcula desde la base cada tanto
+  auto_assign_enabled: bool = os.getenv("AUTO_ASSIGN_ENABLED", "1") == "1"
+  auto_assign_resync_seconds: float = float(os.getenv("AUTO_ASSIGN_RESYNC_SECONDS", "300"))
+
+  # Archivo comprimido y rotado de los payloads crudos, para reprocesar o reproducir carga
+  webhook_archive_enabled: bool = os.getenv("WEBHOOK_ARCHIVE_ENABLED", "1") == "1"
+  webhook_archive_rotate_mb: float = float(os.getenv("WEBHOOK_ARCHIVE_ROTATE_MB", "64"))
+  webhook_archive_rotate_seconds: float = float(os.getenv("WEBHOOK_ARCHIVE_ROTATE_SECONDS", "3600"))
+  webhook_archive_keep_days: float = float(os.getenv("WEBHOOK_ARCHIVE_KEEP_DAYS", "30"))
+
+  @property
+  def webhook_archive_dir(self) -> str:
+    if os.getenv("WEBHOOK_ARCHIVE_DIR"):
+      return os.getenv("WEBHOOK_ARCHIVE_DIR")
+    return str(Path(self.sqlite_path).parent / "webhook_archive")
+
+  @property
+  def webhook_queue_path(self) -> str:
+    if os.getenv("WEBHOOK_QUEUE_PATH"):
+      return os.getenv("WEBHOOK_QUEUE_PATH")
+    return str(Path(self.sqlite_path).parent / "webhooks.db")
+
+  @property
+  def realtime_broker_path(self) -> str:
+    if os.getenv("REALTIME_BROKER_PATH"):
+      return os.getenv("REALTIME_BROKER_PATH")
+    return str(Path(self.sqlite_path).parent / "realtime.db")
+
+  # Caché (company_id, teléfono) -> chat_id para el camino caliente del webhook
+  chat_cache_size: int = int(os.getenv("CHAT_CACHE_SIZE", "10000"))
+  # Ids de YCloud (id y wamid) de los mensajes entrantes recientes, para reconocer reintentos sin ir a la base
+  message_id_cache_size: int = int(os.getenv("MESSAGE_ID_CACHE_SIZE", "50000"))
+  # Acuses de entrega/lectura: se agrupan durante la ventana y se aplican con un UPDATE por lote
+  message_status_window_ms: float = float(os.getenv("MESSAGE_STATUS_WINDOW_MS", "200"))
+  message_status_max_batch: int = int(os.getenv("MESSAGE_STATUS_MAX_BATCH", "500"))
+
+  # SQLite: WAL permite lecturas concurrentes con escrituras
+  sqlite_wal: bool = os.getenv("SQLITE_WAL", "1") == "1"
+  sqlite_busy_timeout_ms: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+  # Mantenimiento en segundo plano (intervalos en segundos, 0 deshabilita el job)
+  maintenance_enabled: bool = os.getenv("MAINTENANCE_ENABLED", "1") == "1"
+  maintenance_batch_size: int = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+  maintenance_busy_requests: int = int(os.getenv("MAINTENANCE_BUSY_REQUESTS", "4"))
+  maintenance_purge_interval: int = int(os.getenv("MAINTENANCE_PURGE_INTERVAL", "900"))
+  maintenance_optimize_interval: int = int(os.getenv("MAINTENANCE_OPTIMIZE_INTERVAL", "3600"))
+  maintenance_checkpoint_interval: int = int(os.getenv("MAINTENANCE_CHECKPOINT_INTERVAL", "300"))
+  maintenance_vacuum_interval: int = int(os.getenv("MAINTENANCE_VACUUM_INTERVAL", "21600"))
+  maintenance_vacuum_pages: int = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "256"))
+  # Los workers comparten la base: cada job corre en un solo proceso a la vez gracias a un lease
+  maintenance_lease_seconds: int = int(os.getenv("MAINTENANCE_LEASE_SECONDS", "120"))
+  audit_retention_days: int = int(os.getenv("AUDIT_RETENTION_DAYS", "180"))
+  # Respaldo del borrado en cascada; cada borrado también despierta el job al confirmarse
+  deletion_interval: int = int(os.getenv("DELETION_INTERVAL", "60"))
+
+  # Snapshots en línea con la API de backup de SQLite
+  backup_interval: int = int(os.getenv("BACKUP_INTERVAL", "86400"))
+  backup_keep: int = int(os.getenv("BACKUP_KEEP", "7"))
+  backup_pages_per_step: int = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+  backup_step_pause_ms: float = float(os.getenv("BACKUP_STEP_PAUSE_MS", "5"))
+
+  @property
+  def backup_dir(self) -> str:
+    if os.getenv("BACKUP_DIR"):
+      return os.getenv("BACKUP_DIR")
+    return str(Path(self.sqlite_path).parent / "backups")
+
 
 settings = Settings()
 
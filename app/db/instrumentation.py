@@ -0,0 +1,192 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("app.sql")
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_LIST = re.compile(r"(\(\?\.\.\.\))(?:\s*,\s*\(\?\.\.\.\))+")
+_POSTCOMPILE = re.compile(r"__\[POSTCOMPILE_\w+\]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalize_statement(statement: str) -> str:
+  """Reduce una sentencia SQL a su forma: sin literales y con listas IN (...) colapsadas"""
+  shape = _WHITESPACE.sub(" ", statement).strip()
+  shape = _STRING_LITERAL.sub("?", shape)
+  shape = _NUMBER_LITERAL.sub("?", shape)
+  shape = _POSTCOMPILE.sub("?", shape)
+  shape = _IN_LIST.sub("(?...)", shape)
+  shape = _VALUES_LIST.sub(r"\1", shape)
+  return shape[:500]
+
+
+def parameter_shape(parameters: Any, executemany: bool = False) -> str:
+  """Describe los tipos de los parámetros sin exponer sus valores"""
+  if executemany and isinstance(parameters, (list, tuple)):
+    first = parameters[0] if parameters else ()
+    return f"{len(parameters)}x{parameter_shape(first)}"
+  if isinstance(parameters, dict):
+    return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+  if isinstance(parameters, (list, tuple)):
+    return "(" + ", ".join(type(v).__name__ for v in parameters) + ")"
+  return type(parameters).__name__
+
+
+class RequestQueryStats:
+  """Consultas ejecutadas durante una petición"""
+
+  def __init__(self, label: str) -> None:
+    self.label = label
+    self.count = 0
+    self.total_ms = 0.0
+    self.shapes: Counter = Counter()
+
+  def record(self, shape: str, duration_ms: float) -> None:
+    self.count += 1
+    self.total_ms += duration_ms
+    self.shapes[shape] += 1
+
+  def repeated_shapes(self, threshold: int) -> List[Tuple[str, int]]:
+    return [(shape, n) for shape, n in self.shapes.most_common() if n > threshold]
+
+
+_current_stats: ContextVar[Optional[RequestQueryStats]] = ContextVar("sql_request_stats", default=None)
+
+
+class SqlMetrics:
+  """Agregados de consultas del proceso, expuestos en /api/system/sql-metrics"""
+
+  def __init__(
+    self,
+    *,
+    slow_query_ms: float = 200.0,
+    n_plus_one_threshold: int = 10,
+    max_shapes: int = 500,
+    max_routes: int = 500,
+  ) -> None:
+    self.slow_query_ms = slow_query_ms
+    self.n_plus_one_threshold = n_plus_one_threshold
+    self.max_shapes = max_shapes
+    self.max_routes = max_routes
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self) -> None:
+    with self._lock:
+      self.total_queries = 0
+      self.total_ms = 0.0
+      self.total_requests = 0
+      self.shapes: Dict[str, Dict[str, float]] = {}
+      self.routes: Dict[str, Dict[str, float]] = {}
+      self.n_plus_one: deque = deque(maxlen=50)
+      self.slow_queries: deque = deque(maxlen=50)
+
+  def record_query(self, shape: str, duration_ms: float, param_shape: str) -> None:
+    with self._lock:
+      self.total_queries += 1
+      self.total_ms += duration_ms
+      entry = self.shapes.get(shape)
+      if entry is None:
+        if len(self.shapes) >= self.max_shapes:
+          entry = self.shapes.setdefault("<otras>", {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        else:
+          entry = self.shapes[shape] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+      entry["count"] += 1
+      entry["total_ms"] += duration_ms
+      entry["max_ms"] = max(entry["max_ms"], duration_ms)
+    if duration_ms >= self.slow_query_ms:
+      logger.warning(f"Consulta lenta ({duration_ms:.1f} ms): {shape} params={param_shape}")
+      with self._lock:
+        self.slow_queries.append({
+          "statement": shape,
+          "params": param_shape,
+          "duration_ms": round(duration_ms, 2),
+          "at": time.time(),
+        })
+
+  def record_request(self, stats: RequestQueryStats) -> List[Tuple[str, int]]:
+    repeated = stats.repeated_shapes(self.n_plus_one_threshold)
+    with self._lock:
+      self.total_requests += 1
+      label = stats.label
+      if label not in self.routes and len(self.routes) >= self.max_routes:
+        label = "<otras>"
+      route = self.routes.setdefault(label, {"requests": 0, "queries": 0, "total_ms": 0.0, "max_queries": 0, "n_plus_one": 0})
+      route["requests"] += 1
+      route["queries"] += stats.count
+      route["total_ms"] += stats.total_ms
+      route["max_queries"] = max(route["max_queries"], stats.count)
+      if repeated:
+        route["n_plus_one"] += 1
+        self.n_plus_one.append({
+          "route": stats.label,
+          "queries": stats.count,
+          "repeated": [{"statement": shape, "count": n} for shape, n in repeated[:3]],
+          "at": time.time(),
+        })
+    if repeated:
+      shape, n = repeated[0]
+      logger.warning(f"Posible N+1 en {stats.label}: {n} ejecuciones de {shape}")
+    return repeated
+
+  def snapshot(self, top: int = 20) -> Dict[str, Any]:
+    with self._lock:
+      shapes = sorted(self.shapes.items(), key=lambda item: item[1]["total_ms"], reverse=True)[:top]
+      return {
+        "total_requests": self.total_requests,
+        "total_queries": self.total_queries,
+        "total_ms": round(self.total_ms, 2),
+        "slow_query_ms": self.slow_query_ms,
+        "n_plus_one_threshold": self.n_plus_one_threshold,
+        "routes": {
+          label: {**data, "total_ms": round(data["total_ms"], 2), "avg_queries": round(data["queries"] / data["requests"], 2)}
+          for label, data in self.routes.items()
+        },
+        "top_statements": [
+          {"statement": shape, "count": data["count"], "total_ms": round(data["total_ms"], 2), "max_ms": round(data["max_ms"], 2)}
+          for shape, data in shapes
+        ],
+        "n_plus_one": list(self.n_plus_one),
+        "slow_queries": list(self.slow_queries),
+      }
+
+
+def install_query_instrumentation(engine: Engine, metrics: SqlMetrics) -> None:
+  """Registra los hooks de SQLAlchemy que miden cada consulta del engine"""
+
+  @event.listens_for(engine, "before_cursor_execute")
+  def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+  @event.listens_for(engine, "after_cursor_execute")
+  def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started_at"].pop()
+    duration_ms = (time.perf_counter() - started) * 1000
+    shape = normalize_statement(statement)
+    stats = _current_stats.get()
+    if stats is not None:
+      stats.record(shape, duration_ms)
+    metrics.record_query(shape, duration_ms, parameter_shape(parameters, executemany))
+
+
+@contextmanager
+def track_queries(label: str) -> Iterator[RequestQueryStats]:
+  """Asocia las consultas ejecutadas dentro del bloque (y sus hilos hijos) a una petición"""
+  stats = RequestQueryStats(label)
+  token = _current_stats.set(stats)
+  try:
+    yield stats
+  finally:
+    _current_stats.reset(token)
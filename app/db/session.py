@@ -1,6 +1,9 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from fastapi.requests import HTTPConnection
 from app.core.config import settings
+from app.db.instrumentation import SqlMetrics, install_query_instrumentation
+from app.db.unit_of_work import bind_request_session
 import os
 
 
@@ -12,11 +15,35 @@ db_dir = os.path.dirname(settings.sqlite_path)
 os.makedirs(db_dir, exist_ok=True)
 
 engine = create_engine(f"sqlite:///{settings.sqlite_path}", connect_args={"check_same_thread": False})
+
+
+@event.listens_for(engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+  cursor = dbapi_connection.cursor()
+  try:
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+    # Solo tiene efecto en bases nuevas; habilita PRAGMA incremental_vacuum
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    if settings.sqlite_wal:
+      cursor.execute("PRAGMA journal_mode=WAL")
+      cursor.execute("PRAGMA synchronous=NORMAL")
+  finally:
+    cursor.close()
+
+
+sql_metrics = SqlMetrics(
+  slow_query_ms=settings.sql_slow_query_ms,
+  n_plus_one_threshold=settings.sql_n_plus_one_threshold,
+)
+if settings.sql_metrics_enabled:
+  install_query_instrumentation(engine, sql_metrics)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
-def get_db():
+def get_db(connection: HTTPConnection):
   db = SessionLocal()
+  bind_request_session(db, connection.scope.get("endpoint"))
   try:
     yield db
   finally:
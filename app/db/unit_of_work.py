@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+import anyio
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+_request_sessions: ContextVar[Optional[List[Session]]] = ContextVar("uow_request_sessions", default=None)
+
+
+def bind_request_session(db: Session, endpoint: Optional[Callable] = None) -> None:
+  """
+  Si hay una unidad de trabajo activa, la sesión se confirma una sola vez al final de la petición.
+
+  Solo aplica a endpoints síncronos (threadpool). En un endpoint async la transacción
+  seguiría abierta a través de cada ``await`` (YCloud, descargas, importaciones) y su
+  bloqueo de escritura de SQLite frenaría a las demás peticiones; ahí cada ``commit``
+  de los servicios confirma de inmediato.
+  """
+  if endpoint is not None and asyncio.iscoroutinefunction(endpoint):
+    return
+  sessions = _request_sessions.get()
+  if sessions is not None:
+    db.info["unit_of_work"] = True
+    sessions.append(db)
+
+
+def commit(db: Session) -> None:
+  """Dentro de una unidad de trabajo solo hace flush; fuera de ella confirma de inmediato"""
+  if db.info.get("unit_of_work"):
+    db.flush()
+  else:
+    db.commit()
+
+
+def on_commit(db: Session, callback: Callable[[], None]) -> None:
+  """Ejecuta ``callback`` después del próximo commit real de la sesión; se descarta si hay rollback"""
+  db.info.setdefault("post_commit_hooks", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_post_commit_hooks(session: Session) -> None:
+  hooks = session.info.pop("post_commit_hooks", None)
+  for hook in hooks or ():
+    try:
+      hook()
+    except Exception as e:
+      logger.warning(f"Hook post-commit falló: {e}")
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_post_commit_hooks(session: Session, previous_transaction) -> None:
+  if previous_transaction.parent is None and not previous_transaction.nested:
+    session.info.pop("post_commit_hooks", None)
+
+
+def _commit_all(sessions: List[Session]) -> None:
+  for db in sessions:
+    db.commit()
+
+
+def _rollback_all(sessions: List[Session]) -> None:
+  for db in sessions:
+    try:
+      db.rollback()
+    except Exception:
+      pass
+
+
+class UnitOfWorkMiddleware:
+  """
+  Unidad de trabajo por petición.
+
+  Las sesiones abiertas con ``get_db`` durante la petición se confirman una sola vez,
+  justo antes de enviar la respuesta: si el estado es < 400 se hace commit y, en caso
+  contrario, rollback. Si el commit falla se responde 500 en lugar de la respuesta original.
+  """
+
+  def __init__(self, app) -> None:
+    self.app = app
+
+  async def __call__(self, scope, receive, send) -> None:
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+
+    sessions: List[Session] = []
+    token = _request_sessions.set(sessions)
+    finalized = False
+    replaced = False
+
+    async def send_wrapper(message) -> None:
+      nonlocal finalized, replaced
+      if replaced:
+        return
+      if message["type"] == "http.response.start" and not finalized:
+        finalized = True
+        if sessions:
+          if message["status"] < 400:
+            try:
+              await anyio.to_thread.run_sync(_commit_all, sessions)
+            except Exception as e:
+              logger.error(f"Error confirmando la unidad de trabajo: {e}")
+              await anyio.to_thread.run_sync(_rollback_all, sessions)
+              replaced = True
+              body = json.dumps({"detail": "Error confirmando la transacción"}).encode()
+              await send({
+                "type": "http.response.start",
+                "status": 500,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+              })
+              await send({"type": "http.response.body", "body": body})
+              return
+          else:
+            await anyio.to_thread.run_sync(_rollback_all, sessions)
+      await send(message)
+
+    try:
+      await self.app(scope, receive, send_wrapper)
+    finally:
+      _request_sessions.reset(token)
+      if not finalized and sessions:
+        await anyio.to_thread.run_sync(_rollback_all, sessions)
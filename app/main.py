@@ -2,21 +2,37 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
+from starlette.routing import Mount
+import logging
 import os
+import anyio
 from .core.config import settings
-from .db.session import Base, engine
+from .db.session import Base, SessionLocal, engine, sql_metrics
+from .db.instrumentation import track_queries
+from .db.unit_of_work import UnitOfWorkMiddleware
 from . import models  # noqa: F401
 from .api.routes.auth.login import router as auth_router
 from .api.routes.users.users import router as users_router
 from .api.routes.roles.roles import router as roles_router
 from .api.routes.companies.companies import router as companies_router
 from .api.routes.companies.stickers import router as stickers_router
-from .api.routes.webhooks.ycloud import router as webhooks_router
+from .api.routes.webhooks.ycloud import router as webhooks_router, process_ycloud_event
 from .api.routes.chats import router as chats_router
 from .api.routes.media import router as media_router
 from .api.routes.templates.templates import router as templates_router
+from .api.routes.auto_replies.auto_replies import router as auto_replies_router
+from .api.routes.assignments.assignments import router as assignments_router
+from .api.routes.system import router as system_router, realtime_stats_router
+from .services.maintenance import maintenance_scheduler, load_monitor
+from .services.realtime import manager as realtime_manager
+from .services.webhook_queue import webhook_queue
+from .services.message_status import status_batcher
+from .services.webhook_archive import webhook_archive
+from .services.chat_dedupe import merge_duplicate_chats
 from sqlalchemy import text
 
+logger = logging.getLogger(__name__)
+
 
 def create_app() -> FastAPI:
   Base.metadata.create_all(bind=engine)
@@ -39,6 +55,8 @@ def create_app() -> FastAPI:
         conn.exec_driver_sql("ALTER TABLE companies ADD COLUMN ycloud_webhook_url TEXT")
       if 'whatsapp_phone_number' not in cols:
         conn.exec_driver_sql("ALTER TABLE companies ADD COLUMN whatsapp_phone_number TEXT")
+      if 'deleted_at' not in cols:
+        conn.exec_driver_sql("ALTER TABLE companies ADD COLUMN deleted_at TIMESTAMP")
       
       # Verificar y crear tablas de chats si no existen
       try:
@@ -63,6 +81,8 @@ def create_app() -> FastAPI:
         cols = [row[1] for row in info]
         if 'priority' not in cols:
           conn.exec_driver_sql("ALTER TABLE chats ADD COLUMN priority VARCHAR(10) DEFAULT 'low'")
+        if 'deleted_at' not in cols:
+          conn.exec_driver_sql("ALTER TABLE chats ADD COLUMN deleted_at TIMESTAMP")
       except Exception:
         pass
         
@@ -193,6 +213,64 @@ def create_app() -> FastAPI:
     except Exception:
       pass
 
+  # Índices por chat_id para el borrado en cascada por lotes
+  with engine.begin() as conn:
+    for table in ("messages", "chat_summaries", "appointments", "chat_tag_map", "chat_notes", "chat_pins", "chat_snoozes", "chat_audit"):
+      try:
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_{table}_chat_id ON {table} (chat_id)")
+      except Exception:
+        pass
+    try:
+      conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_chats_deleted_at ON chats (deleted_at)")
+      conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_chats_company_assignee_live ON chats (company_id, assigned_user_id, status) "
+        "WHERE deleted_at IS NULL"
+      )
+    except Exception:
+      pass
+
+  # Teléfonos guardados antes de normalizar a E.164 (importaciones, versiones anteriores):
+  # se normalizan y fusionan para que el upsert por número normalizado los encuentre
+  with engine.connect() as conn:
+    legacy_phone = conn.exec_driver_sql(
+      "SELECT 1 FROM chats WHERE deleted_at IS NULL "
+      "AND (phone_number NOT LIKE '+%' OR phone_number GLOB '*[^+0-9]*') LIMIT 1"
+    ).first()
+  if legacy_phone:
+    with SessionLocal() as db:
+      counts = merge_duplicate_chats(db)
+    logger.info(f"Teléfonos de chats normalizados: {counts}")
+
+  # Índice único de chats activos por (empresa, teléfono): falla si la base tiene duplicados previos
+  try:
+    with engine.begin() as conn:
+      conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_chats_company_phone_live ON chats (company_id, phone_number) "
+        "WHERE deleted_at IS NULL"
+      )
+      # Reemplazado por el índice parcial: un chat eliminado no bloquea uno nuevo con el mismo número
+      conn.exec_driver_sql("DROP INDEX IF EXISTS uq_chats_company_phone")
+  except Exception as e:
+    logger.warning(f"No se pudo crear uq_chats_company_phone_live ({e}); ejecute scripts/dedupe_chats.py")
+
+  # Un mensaje por id de YCloud y por wamid. Las bases anteriores pueden tener duplicados
+  # de webhooks reintentados: se conserva el primero antes de crear cada índice
+  for column in ("whatsapp_message_id", "wamid"):
+    index = f"uq_messages_{column}"
+    try:
+      with engine.begin() as conn:
+        if conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,)).first():
+          continue
+        removed = conn.exec_driver_sql(
+          f"DELETE FROM messages WHERE {column} IS NOT NULL AND id NOT IN "
+          f"(SELECT MIN(id) FROM messages WHERE {column} IS NOT NULL GROUP BY {column})"
+        ).rowcount
+        if removed:
+          logger.warning(f"Mensajes duplicados por {column} eliminados: {removed}")
+        conn.exec_driver_sql(f"CREATE UNIQUE INDEX {index} ON messages ({column}) WHERE {column} IS NOT NULL")
+    except Exception as e:
+      logger.warning(f"No se pudo crear {index}: {e}")
+
   app = FastAPI(
     title=settings.app_name,
     openapi_tags=[
@@ -205,9 +283,68 @@ def create_app() -> FastAPI:
       {"name": "Webhooks", "description": "Webhooks de integración (YCloud)"},
       {"name": "Media", "description": "Servir archivos multimedia"},
       {"name": "Templates", "description": "Plantillas de contenido"},
+      {"name": "System", "description": "Estado y mantenimiento del servidor"},
     ]
   )
 
+  if settings.unit_of_work:
+    # Capa más interna: el commit ocurre antes de que la respuesta salga del servidor
+    app.add_middleware(UnitOfWorkMiddleware)
+
+  @app.middleware("http")
+  async def track_foreground_load(request, call_next):
+    # El mantenimiento en segundo plano cede mientras haya peticiones en curso
+    load_monitor.enter()
+    try:
+      return await call_next(request)
+    finally:
+      load_monitor.exit()
+
+  def _route_label(request) -> str:
+    route = request.scope.get("route")
+    if route is not None:
+      return route.path
+    for mount in app.routes:
+      if isinstance(mount, Mount) and request.url.path.startswith(mount.path + "/"):
+        return mount.path
+    return "<unmatched>"
+
+  @app.middleware("http")
+  async def instrument_sql(request, call_next):
+    with track_queries(request.url.path) as stats:
+      response = await call_next(request)
+    # Agrupar métricas por plantilla de ruta y no por URL concreta: cada archivo de
+    # /media o cada 404 sería una clave nueva
+    stats.label = f"{request.method} {_route_label(request)}"
+    repeated = sql_metrics.record_request(stats)
+    if settings.debug:
+      response.headers["X-SQL-Query-Count"] = str(stats.count)
+      response.headers["X-SQL-Query-Time-Ms"] = f"{stats.total_ms:.2f}"
+      if repeated:
+        response.headers["X-SQL-N-Plus-One"] = str(repeated[0][1])
+    return response
+
+  @app.on_event("startup")
+  async def start_background_services() -> None:
+    await realtime_manager.start()
+    status_batcher.start()
+    if settings.webhook_archive_enabled:
+      webhook_archive.start()
+    if settings.webhook_queue_enabled:
+      webhook_queue.start(process_ycloud_event)
+    if settings.maintenance_enabled:
+      maintenance_scheduler.start()
+
+  @app.on_event("shutdown")
+  async def stop_background_services() -> None:
+    maintenance_scheduler.stop()
+    # Los workers terminan el evento en curso (su outbox aún está activa); lo demás queda en la cola
+    await anyio.to_thread.run_sync(webhook_queue.stop)
+    # Aplica los acuses pendientes mientras la outbox de tiempo real sigue activa
+    await anyio.to_thread.run_sync(status_batcher.stop)
+    await anyio.to_thread.run_sync(webhook_archive.stop)
+    await realtime_manager.stop()
+
   # Endpoint específico para archivos webp con tipo MIME correcto (ANTES del mount)
   @app.get("/media/{company_id}/stickers/{filename}", tags=["Media"])
   async def serve_sticker(company_id: str, filename: str):
@@ -245,6 +382,10 @@ def create_app() -> FastAPI:
   app.include_router(webhooks_router, prefix=f"{settings.api_prefix}/webhooks", tags=["Webhooks"])
   app.include_router(media_router, prefix=settings.api_prefix, tags=["Media"])
   app.include_router(templates_router, prefix=f"{settings.api_prefix}/templates", tags=["Templates"])
+  app.include_router(auto_replies_router, prefix=f"{settings.api_prefix}/auto-replies", tags=["Auto Replies"])
+  app.include_router(assignments_router, prefix=f"{settings.api_prefix}/assignment", tags=["Assignment"])
+  app.include_router(system_router, prefix=f"{settings.api_prefix}/system", tags=["System"])
+  app.include_router(realtime_stats_router, prefix=f"{settings.api_prefix}/realtime", tags=["System"])
 
   return app
 
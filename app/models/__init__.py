@@ -4,5 +4,9 @@ from app.models.companies.sticker import CompanySticker  # noqa: F401
 from app.models.roles.role import Role  # noqa: F401
 from app.models.chats.chat import Chat, Message  # noqa: F401
 from app.models.templates.template import Template, TemplateItem  # noqa: F401
+from app.models.auto_replies.auto_reply import AutoReplyRule  # noqa: F401
+from app.models.assignments.assignment import AssignmentAgent, AssignmentPolicy  # noqa: F401
 
 
+from app.models.system.deletion import DeletionJob  # noqa: F401
+from app.models.system.maintenance import MaintenanceLease  # noqa: F401
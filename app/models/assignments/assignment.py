@@ -0,0 +1,34 @@
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Text, UniqueConstraint
+from sqlalchemy.sql import func
+from app.db.session import Base
+
+
+class AssignmentPolicy(Base):
+  """Asignación automática de chats entrantes de una empresa; sin fila, los chats llegan sin asignar"""
+  __tablename__ = "assignment_policies"
+
+  id = Column(Integer, primary_key=True, index=True)
+  company_id = Column(Integer, ForeignKey("companies.id"), nullable=False, unique=True)
+  strategy = Column(String(20), nullable=False, default="least_open")  # round_robin, least_open, tags
+  active = Column(Boolean, nullable=False, default=True)
+  created_at = Column(DateTime(timezone=True), server_default=func.now())
+  updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class AssignmentAgent(Base):
+  """Usuario que recibe chats de la asignación automática"""
+  __tablename__ = "assignment_agents"
+  __table_args__ = (
+    UniqueConstraint("company_id", "user_id", name="uq_assignment_agents_company_user"),
+  )
+
+  id = Column(Integer, primary_key=True, index=True)
+  company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+  user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+  active = Column(Boolean, nullable=False, default=True)
+  # Chats abiertos a partir de los cuales no recibe más; vacío, sin límite
+  max_open_chats = Column(Integer, nullable=True)
+  # JSON con los ids de etiquetas que atiende (estrategia ``tags``)
+  tag_ids = Column(Text, nullable=False, default="[]")
+  created_at = Column(DateTime(timezone=True), server_default=func.now())
+  updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,29 @@
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer, String, Text
+from sqlalchemy.sql import func
+from app.db.session import Base
+
+
+class AutoReplyRule(Base):
+  """Regla de respuesta automática de una empresa: palabras clave o regex que disparan un texto o un template"""
+  __tablename__ = "auto_reply_rules"
+  __table_args__ = (
+    Index("ix_auto_reply_rules_company", "company_id", "id"),
+  )
+
+  id = Column(Integer, primary_key=True, index=True)
+  company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+  name = Column(String(255), nullable=False)
+  match_type = Column(String(20), nullable=False, default="keyword")  # keyword, regex
+  # keyword: frases separadas por coma; regex: una expresión regular
+  pattern = Column(Text, nullable=False)
+  whole_word = Column(Boolean, nullable=False, default=True)
+  reply_type = Column(String(20), nullable=False, default="text")  # text, template
+  reply_text = Column(Text, nullable=True)
+  template_id = Column(Integer, ForeignKey("templates.id"), nullable=True)
+  # Menor número, mayor prioridad: si varias reglas coinciden responde solo la primera
+  priority = Column(Integer, nullable=False, default=100)
+  # Minutos durante los que la misma regla no vuelve a responder en el mismo chat
+  cooldown_minutes = Column(Integer, nullable=False, default=60)
+  active = Column(Boolean, nullable=False, default=True)
+  created_at = Column(DateTime(timezone=True), server_default=func.now())
+  updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
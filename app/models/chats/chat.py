@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db.session import Base
@@ -6,6 +6,26 @@ from app.db.session import Base
 
 class Chat(Base):
     __tablename__ = "chats"
+    __table_args__ = (
+        # Un chat activo por cliente y empresa; el número se guarda normalizado en E.164.
+        # Los chats eliminados quedan fuera del índice hasta que el borrado en cascada los purga
+        Index(
+            "uq_chats_company_phone_live",
+            "company_id",
+            "phone_number",
+            unique=True,
+            sqlite_where=text("deleted_at IS NULL"),
+        ),
+        Index("ix_chats_deleted_at", "deleted_at"),
+        # Carga abierta por agente para la asignación automática (services/assignment.py)
+        Index(
+            "ix_chats_company_assignee_live",
+            "company_id",
+            "assigned_user_id",
+            "status",
+            sqlite_where=text("deleted_at IS NULL"),
+        ),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     phone_number = Column(String(20), nullable=False)  # Número de teléfono del cliente
@@ -17,6 +37,7 @@ class Chat(Base):
     last_message_time = Column(DateTime(timezone=True), server_default=func.now())
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    deleted_at = Column(DateTime(timezone=True), nullable=True)  # Borrado lógico; ver services/deletion.py
     
     # Relaciones
     company = relationship("Company", back_populates="chats")
@@ -28,7 +49,7 @@ class ChatSummary(Base):
     __tablename__ = "chat_summaries"
 
     id = Column(Integer, primary_key=True, index=True)
-    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
     summary = Column(Text, nullable=False)
     interest = Column(String(20), default="Indeciso")  # Interesado, No interesado, Indeciso
@@ -43,7 +64,7 @@ class Appointment(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
-    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, index=True)
     assigned_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     start_at = Column(DateTime(timezone=True), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -51,9 +72,20 @@ class Appointment(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # YCloud reintenta los webhooks: un mismo mensaje nunca se guarda dos veces.
+        # Parciales porque los mensajes importados o creados a mano no traen ids
+        Index(
+            "uq_messages_whatsapp_message_id",
+            "whatsapp_message_id",
+            unique=True,
+            sqlite_where=text("whatsapp_message_id IS NOT NULL"),
+        ),
+        Index("uq_messages_wamid", "wamid", unique=True, sqlite_where=text("wamid IS NOT NULL")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, index=True)
     content = Column(Text, nullable=False)
     message_type = Column(String(20), default="text")  # text, image, document, etc.
     direction = Column(String(10), nullable=False)  # incoming, outgoing
@@ -82,7 +114,7 @@ class ChatTagMap(Base):
     __tablename__ = "chat_tag_map"
 
     id = Column(Integer, primary_key=True, index=True)
-    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, index=True)
     tag_id = Column(Integer, ForeignKey("chat_tags.id"), nullable=False)
 
 
@@ -91,7 +123,7 @@ class ChatNote(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
-    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     content = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -101,7 +133,7 @@ class ChatPin(Base):
     __tablename__ = "chat_pins"
 
     id = Column(Integer, primary_key=True, index=True)
-    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -110,7 +142,7 @@ class ChatSnooze(Base):
     __tablename__ = "chat_snoozes"
 
     id = Column(Integer, primary_key=True, index=True)
-    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     until_at = Column(DateTime(timezone=True), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -121,7 +153,7 @@ class ChatAudit(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
-    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     action = Column(String(64), nullable=False)
     details = Column(Text, nullable=True)
@@ -25,6 +25,9 @@ class Company(Base):
   ycloud_api_key: Mapped[str] = mapped_column(Text, nullable=True)
   ycloud_webhook_url: Mapped[str] = mapped_column(String(500), nullable=True)
   whatsapp_phone_number: Mapped[str] = mapped_column(String(20), nullable=True)
+
+  # Borrado lógico; los datos dependientes se eliminan en segundo plano
+  deleted_at: Mapped[DateTime | None] = mapped_column(DateTime(timezone=True), nullable=True)
   
   # Relaciones
   chats = relationship("Chat", back_populates="company")
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
+from sqlalchemy.sql import func
+from app.db.session import Base
+
+
+class DeletionJob(Base):
+    """Borrado en cascada pendiente de un chat o empresa ya marcados como eliminados"""
+    __tablename__ = "deletion_jobs"
+    __table_args__ = (
+        Index("ix_deletion_jobs_status", "status", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    entity = Column(String(20), nullable=False)  # chat, company
+    entity_id = Column(Integer, nullable=False)
+    company_id = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, done, failed
+    step = Column(String(64), nullable=True)  # Tabla o recurso que se está borrando
+    rows_deleted = Column(Integer, nullable=False, default=0)
+    files_deleted = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, String, Float
+from app.db.session import Base
+
+
+class MaintenanceLease(Base):
+    """Lease de un job de mantenimiento compartido entre todos los workers que usan la misma base"""
+    __tablename__ = "maintenance_leases"
+
+    name = Column(String(64), primary_key=True)
+    owner = Column(String(128), nullable=True)  # host:pid:token del worker que lo ejecuta
+    expires_at = Column(Float, nullable=False, default=0)  # epoch; vencido = libre
+    next_run_at = Column(Float, nullable=False, default=0)  # epoch de la próxima ejecución programada
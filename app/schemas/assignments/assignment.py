@@ -0,0 +1,57 @@
+import json
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel, Field, field_validator
+from pydantic.config import ConfigDict
+
+
+class AssignmentPolicyUpdate(BaseModel):
+  # round_robin, least_open, tags o cualquier estrategia registrada
+  strategy: str = "least_open"
+  active: bool = True
+
+
+class AssignmentPolicyOut(BaseModel):
+  model_config = ConfigDict(from_attributes=True)
+
+  company_id: int
+  strategy: str
+  active: bool
+  updated_at: Optional[datetime] = None
+
+
+class AssignmentAgentUpdate(BaseModel):
+  active: bool = True
+  max_open_chats: Optional[int] = Field(default=None, ge=1)
+  tag_ids: List[int] = []
+
+
+class AssignmentAgentOut(BaseModel):
+  model_config = ConfigDict(from_attributes=True)
+
+  user_id: int
+  active: bool
+  max_open_chats: Optional[int]
+  tag_ids: List[int]
+
+  @field_validator("tag_ids", mode="before")
+  @classmethod
+  def _parse_tag_ids(cls, value):
+    if isinstance(value, str):
+      return json.loads(value or "[]")
+    return value
+
+
+class AgentLoadOut(BaseModel):
+  user_id: int
+  open_chats: int
+  max_open_chats: Optional[int]
+  tag_ids: List[int]
+  available: bool
+
+
+class AssignmentLoadsOut(BaseModel):
+  # Contadores en memoria de este proceso; ``agents`` vacío si la empresa no tiene política
+  strategy: Optional[str]
+  active: bool
+  agents: List[AgentLoadOut]
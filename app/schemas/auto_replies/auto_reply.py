@@ -0,0 +1,62 @@
+from datetime import datetime
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
+from pydantic.config import ConfigDict
+
+
+AutoReplyMatchType = Literal["keyword", "regex"]
+AutoReplyReplyType = Literal["text", "template"]
+
+
+class AutoReplyRuleCreate(BaseModel):
+  name: str = Field(min_length=1)
+  match_type: AutoReplyMatchType = "keyword"
+  pattern: str = Field(min_length=1)
+  whole_word: bool = True
+  reply_type: AutoReplyReplyType = "text"
+  reply_text: Optional[str] = None
+  template_id: Optional[int] = None
+  priority: int = 100
+  cooldown_minutes: int = Field(default=60, ge=0)
+  active: bool = True
+
+
+class AutoReplyRuleUpdate(BaseModel):
+  name: Optional[str] = None
+  match_type: Optional[AutoReplyMatchType] = None
+  pattern: Optional[str] = None
+  whole_word: Optional[bool] = None
+  reply_type: Optional[AutoReplyReplyType] = None
+  reply_text: Optional[str] = None
+  template_id: Optional[int] = None
+  priority: Optional[int] = None
+  cooldown_minutes: Optional[int] = Field(default=None, ge=0)
+  active: Optional[bool] = None
+
+
+class AutoReplyRuleOut(BaseModel):
+  model_config = ConfigDict(from_attributes=True)
+
+  id: int
+  company_id: int
+  name: str
+  match_type: AutoReplyMatchType
+  pattern: str
+  whole_word: bool
+  reply_type: AutoReplyReplyType
+  reply_text: Optional[str]
+  template_id: Optional[int]
+  priority: int
+  cooldown_minutes: int
+  active: bool
+  created_at: Optional[datetime] = None
+  updated_at: Optional[datetime] = None
+
+
+class AutoReplyTestRequest(BaseModel):
+  text: str
+
+
+class AutoReplyTestResult(BaseModel):
+  # Reglas que coinciden, en orden de prioridad; la primera es la que respondería
+  matches: List[AutoReplyRuleOut]
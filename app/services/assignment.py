@@ -0,0 +1,461 @@
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.unit_of_work import commit, on_commit
+from app.models.assignments.assignment import AssignmentAgent, AssignmentPolicy
+from app.models.chats.chat import Chat, ChatTag, ChatTagMap
+from app.models.users.user import User
+from app.schemas.assignments.assignment import AssignmentAgentUpdate, AssignmentPolicyUpdate
+
+logger = logging.getLogger(__name__)
+
+# Estados que cuentan como carga de un agente
+OPEN_STATUSES = ("active", "pending")
+
+# (usuario asignado, estado) de un chat; ``(None, None)`` si no existe o se eliminó
+ChatState = Tuple[Optional[int], Optional[str]]
+
+
+def _is_open(status: Optional[str]) -> bool:
+  return status in OPEN_STATUSES
+
+
+def _deltas(before: ChatState, after: ChatState) -> List[Tuple[int, int]]:
+  """Cambios de carga por usuario que produce un chat al pasar de ``before`` a ``after``"""
+  deltas = []
+  if before[0] is not None and _is_open(before[1]):
+    deltas.append((before[0], -1))
+  if after[0] is not None and _is_open(after[1]):
+    deltas.append((after[0], 1))
+  # Reasignarlo al mismo agente o cambiar entre dos estados abiertos no mueve la carga
+  if len(deltas) == 2 and deltas[0][0] == deltas[1][0]:
+    return []
+  return deltas
+
+
+@dataclass
+class AgentState:
+  user_id: int
+  capacity: Optional[int] = None
+  tag_ids: FrozenSet[int] = frozenset()
+  # Secuencia de la última asignación recibida; el round robin elige la más antigua
+  last_assigned: int = 0
+  # Cada cambio invalida las entradas anteriores del agente en los montículos
+  version: int = 0
+
+
+class AssignmentStrategy:
+  """
+  Estrategia de asignación: cómo se ordenan los agentes y en qué grupos se busca.
+
+  ``key`` es la prioridad de un agente en los montículos (menor gana) y ``pools`` da los
+  grupos de montículos a consultar en orden: ``None`` es el de todos los agentes y un
+  id de etiqueta, el de los agentes que la atienden. Se elige el mejor del primer grupo
+  que tenga alguien disponible.
+  """
+  name = ""
+  # Si la decisión necesita las etiquetas del chat
+  uses_tags = False
+
+  def key(self, load: int, agent: AgentState) -> Tuple[int, ...]:
+    raise NotImplementedError
+
+  def pools(self, tag_ids: Sequence[int]) -> List[List[Optional[int]]]:
+    return [[None]]
+
+
+class RoundRobinStrategy(AssignmentStrategy):
+  """Turnos: el agente que hace más tiempo no recibe un chat"""
+  name = "round_robin"
+
+  def key(self, load: int, agent: AgentState) -> Tuple[int, ...]:
+    return (agent.last_assigned,)
+
+
+class LeastOpenStrategy(AssignmentStrategy):
+  """El agente con menos chats abiertos; en empate, el que hace más tiempo no recibe uno"""
+  name = "least_open"
+
+  def key(self, load: int, agent: AgentState) -> Tuple[int, ...]:
+    return (load, agent.last_assigned)
+
+
+class TagStrategy(LeastOpenStrategy):
+  """Entre los agentes que atienden alguna etiqueta del chat, el de menos carga; si no hay, entre todos"""
+  name = "tags"
+  uses_tags = True
+
+  def pools(self, tag_ids: Sequence[int]) -> List[List[Optional[int]]]:
+    return [list(tag_ids), [None]] if tag_ids else [[None]]
+
+
+STRATEGIES: Dict[str, AssignmentStrategy] = {}
+
+
+def register_strategy(strategy: AssignmentStrategy) -> None:
+  STRATEGIES[strategy.name] = strategy
+
+
+for _strategy in (RoundRobinStrategy(), LeastOpenStrategy(), TagStrategy()):
+  register_strategy(_strategy)
+
+
+class CompanyLoads:
+  """
+  Chats abiertos por usuario de una empresa y montículos de sus agentes disponibles.
+
+  Cada cambio de carga vuelve a insertar al agente con una versión nueva; las entradas
+  viejas se descartan al llegar a la cima (borrado perezoso). Así ajustar una carga y
+  elegir cuestan O(log agentes), amortizado. Un agente que llega a su ``capacity`` no se
+  inserta hasta que libere un chat.
+  """
+
+  def __init__(self, strategy: Optional[AssignmentStrategy], agents: Iterable[AgentState], loads: Dict[int, int], active: bool = True) -> None:
+    self.strategy = strategy
+    self.active = active and strategy is not None
+    self.loads = {user_id: count for user_id, count in loads.items() if count > 0}
+    self.agents = {agent.user_id: agent for agent in agents}
+    self.loaded_at = time.monotonic()
+    self._heaps: Dict[Optional[int], List[Tuple[Tuple[int, ...], int, int]]] = {}
+    self._pushes = 0
+    self.rebuild()
+
+  def rebuild(self) -> None:
+    self._heaps = {}
+    self._pushes = 0
+    # Las entradas vencidas se acumulan; se compacta cuando superan varias veces a las vigentes
+    self._max_pushes = 4 * sum(1 + len(agent.tag_ids) for agent in self.agents.values()) + 64
+    if self.strategy is None:
+      return
+    for agent in self.agents.values():
+      self._push(agent)
+
+  def _push(self, agent: AgentState) -> None:
+    agent.version += 1
+    load = self.loads.get(agent.user_id, 0)
+    if agent.capacity is not None and load >= agent.capacity:
+      return
+    entry = (self.strategy.key(load, agent), agent.user_id, agent.version)
+    for pool in (None, *agent.tag_ids):
+      heapq.heappush(self._heaps.setdefault(pool, []), entry)
+      self._pushes += 1
+
+  def _top(self, pool: Optional[int]) -> Optional[Tuple[Tuple[int, ...], int, int]]:
+    heap = self._heaps.get(pool)
+    while heap:
+      entry = heap[0]
+      agent = self.agents.get(entry[1])
+      if agent is not None and agent.version == entry[2]:
+        return entry
+      heapq.heappop(heap)
+    return None
+
+  def adjust(self, user_id: int, delta: int, assigned_seq: Optional[int] = None) -> None:
+    load = self.loads.get(user_id, 0) + delta
+    if load > 0:
+      self.loads[user_id] = load
+    else:
+      self.loads.pop(user_id, None)
+    agent = self.agents.get(user_id)
+    if agent is None or self.strategy is None:
+      return
+    if assigned_seq is not None:
+      agent.last_assigned = assigned_seq
+    self._push(agent)
+    if self._pushes > self._max_pushes:
+      self.rebuild()
+
+  def choose(self, tag_ids: Sequence[int] = ()) -> Optional[int]:
+    if not self.active:
+      return None
+    for group in self.strategy.pools(tag_ids):
+      tops = [entry for entry in (self._top(pool) for pool in group) if entry is not None]
+      if tops:
+        return min(tops)[1]
+    return None
+
+
+def _parse_tag_ids(raw: Optional[str]) -> FrozenSet[int]:
+  try:
+    return frozenset(int(tag_id) for tag_id in json.loads(raw or "[]"))
+  except (TypeError, ValueError):
+    return frozenset()
+
+
+def load_company(db: Session, company_id: int) -> CompanyLoads:
+  """Política, agentes y carga abierta por usuario de la empresa; la carga sale de un GROUP BY por índice"""
+  policy = db.scalar(select(AssignmentPolicy).where(AssignmentPolicy.company_id == company_id))
+  if policy is None or not policy.active:
+    return CompanyLoads(None, (), {}, active=False)
+  strategy = STRATEGIES.get(policy.strategy)
+  if strategy is None:
+    logger.warning(f"Empresa {company_id}: estrategia de asignación desconocida {policy.strategy!r}")
+    return CompanyLoads(None, (), {}, active=False)
+  agents = [
+    AgentState(user_id=agent.user_id, capacity=agent.max_open_chats, tag_ids=_parse_tag_ids(agent.tag_ids))
+    for agent in db.scalars(
+      select(AssignmentAgent).where(AssignmentAgent.company_id == company_id, AssignmentAgent.active.is_(True))
+    )
+  ]
+  rows = db.execute(
+    select(Chat.assigned_user_id, func.count(Chat.id))
+    .where(
+      Chat.company_id == company_id,
+      Chat.deleted_at.is_(None),
+      Chat.assigned_user_id.is_not(None),
+      Chat.status.in_(OPEN_STATUSES),
+    )
+    .group_by(Chat.assigned_user_id)
+  )
+  return CompanyLoads(strategy, agents, dict(rows.all()))
+
+
+class AssignmentEngine:
+  """
+  Asignación automática de chats entrantes con contadores de carga en memoria.
+
+  La primera decisión de una empresa carga su política y su carga por agente con una sola
+  consulta; desde ahí ``assign_chat``, ``update_chat_status``, las operaciones masivas y
+  el borrado de chats ajustan los contadores al confirmar, y cada decisión es
+  O(log agentes) sin tocar la tabla de chats. Los cambios hechos por otro proceso se
+  corrigen al recargar la empresa, como mucho cada ``resync_seconds``.
+
+  Al elegir, el chat se reserva para el agente y su carga sube de inmediato, así dos
+  chats que entran a la vez no van al mismo agente por leer la misma carga.
+  """
+
+  def __init__(self, resync_seconds: float = 300.0) -> None:
+    self.resync_seconds = resync_seconds
+    self._companies: Dict[int, CompanyLoads] = {}
+    # Empresas cargándose: cambios recibidos mientras tanto, para aplicarlos sobre la carga nueva
+    self._pending: Dict[int, List[Tuple[int, int, Optional[int]]]] = {}
+    # chat_id -> agente elegido cuya carga ya se sumó, hasta que se confirme la asignación
+    self._reserved: Dict[int, int] = {}
+    self._lock = threading.Lock()
+    self._seq = itertools.count(1)
+    self.loads = 0
+    self.decisions = 0
+    self.assigned = 0
+    self.no_agent = 0
+    self.errors = 0
+
+  def is_tracking(self, company_id: int) -> bool:
+    return company_id in self._companies or company_id in self._pending
+
+  def invalidate(self, company_id: int) -> None:
+    with self._lock:
+      self._companies.pop(company_id, None)
+
+  def company_loads(self, db: Session, company_id: int) -> Optional[CompanyLoads]:
+    """Estado de la empresa, cargándolo si falta o venció; ``None`` si otro hilo lo carga por primera vez"""
+    state = self._companies.get(company_id)
+    if state is not None and time.monotonic() - state.loaded_at < self.resync_seconds:
+      return state
+    with self._lock:
+      if company_id in self._pending:
+        return state
+      self._pending[company_id] = []
+    try:
+      fresh = load_company(db, company_id)
+    except Exception:
+      with self._lock:
+        self._pending.pop(company_id, None)
+      raise
+    with self._lock:
+      for user_id, delta, seq in self._pending.pop(company_id, []):
+        fresh.adjust(user_id, delta, seq)
+      previous = self._companies.get(company_id)
+      if previous is not None:
+        # Conservar los turnos del round robin entre recargas
+        for user_id, agent in fresh.agents.items():
+          if user_id in previous.agents:
+            agent.last_assigned = max(agent.last_assigned, previous.agents[user_id].last_assigned)
+        fresh.rebuild()
+      self._companies[company_id] = fresh
+      self.loads += 1
+    return fresh
+
+  def _apply(self, company_id: int, user_id: int, delta: int, seq: Optional[int]) -> None:
+    state = self._companies.get(company_id)
+    if state is not None:
+      state.adjust(user_id, delta, seq)
+    pending = self._pending.get(company_id)
+    if pending is not None:
+      pending.append((user_id, delta, seq))
+
+  def chats_changed(self, company_id: int, changes: Iterable[Tuple[int, ChatState, ChatState]]) -> None:
+    """Aplica cambios ya confirmados de ``(chat_id, antes, después)`` a los contadores"""
+    with self._lock:
+      tracking = self.is_tracking(company_id)
+      for chat_id, before, after in changes:
+        reserved = self._reserved.pop(chat_id, None)
+        if not tracking:
+          continue
+        new_owner = after[0] if after[0] is not None and after[0] != before[0] else None
+        for user_id, delta in _deltas(before, after):
+          if delta > 0 and user_id == reserved:
+            # La reserva ya sumó esta carga
+            continue
+          self._apply(company_id, user_id, delta, next(self._seq) if user_id == new_owner else None)
+
+  def chat_changed(self, company_id: int, chat_id: int, before: ChatState, after: ChatState) -> None:
+    self.chats_changed(company_id, [(chat_id, before, after)])
+
+  def forget_company(self, company_id: int) -> None:
+    self.invalidate(company_id)
+
+  def _reserve(self, company_id: int, state: CompanyLoads, chat_id: int, tag_ids: Sequence[int]) -> Optional[int]:
+    with self._lock:
+      self.decisions += 1
+      user_id = state.choose(tag_ids)
+      if user_id is None:
+        self.no_agent += 1
+        return None
+      self._apply(company_id, user_id, 1, next(self._seq))
+      self._reserved[chat_id] = user_id
+      return user_id
+
+  def _release(self, company_id: int, chat_id: int) -> None:
+    with self._lock:
+      user_id = self._reserved.pop(chat_id, None)
+      if user_id is not None:
+        self._apply(company_id, user_id, -1, None)
+
+  def assign_inbound(self, db: Session, company_id: int, chat_id: int) -> Optional[int]:
+    """
+    Asigna un chat abierto y sin agente según la política de la empresa.
+
+    Retorna el usuario asignado. Nunca lanza: un fallo deja el chat sin asignar, como
+    antes, y no reintenta el webhook que ya guardó el mensaje.
+    """
+    from app.services.chats import assign_chat
+
+    try:
+      state = self.company_loads(db, company_id)
+      if state is None or not state.active:
+        return None
+      chat = db.get(Chat, chat_id)
+      if chat is None or chat.deleted_at is not None or chat.assigned_user_id is not None or not _is_open(chat.status):
+        return None
+      tag_ids: List[int] = []
+      if state.strategy.uses_tags:
+        tag_ids = list(db.scalars(select(ChatTagMap.tag_id).where(ChatTagMap.chat_id == chat_id)))
+      user_id = self._reserve(company_id, state, chat_id, tag_ids)
+      if user_id is None:
+        return None
+      try:
+        assign_chat(db, company_id, chat_id, user_id, chat.priority or "low")
+      except Exception:
+        self._release(company_id, chat_id)
+        raise
+      self.assigned += 1
+      return user_id
+    except Exception as e:
+      self.errors += 1
+      logger.error(f"Error asignando automáticamente el chat {chat_id}: {e}")
+      return None
+
+  def snapshot(self, db: Session, company_id: int) -> Dict[str, object]:
+    state = self.company_loads(db, company_id) or self._companies.get(company_id)
+    if state is None:
+      return {"strategy": None, "active": False, "agents": []}
+    with self._lock:
+      agents = [
+        {
+          "user_id": agent.user_id,
+          "open_chats": state.loads.get(agent.user_id, 0),
+          "max_open_chats": agent.capacity,
+          "tag_ids": sorted(agent.tag_ids),
+          "available": agent.capacity is None or state.loads.get(agent.user_id, 0) < agent.capacity,
+        }
+        for agent in sorted(state.agents.values(), key=lambda agent: agent.user_id)
+      ]
+    return {"strategy": state.strategy.name if state.strategy else None, "active": state.active, "agents": agents}
+
+  def stats(self) -> Dict[str, int]:
+    companies = dict(self._companies)
+    return {
+      "companies": len(companies),
+      "agents": sum(len(state.agents) for state in companies.values()),
+      "open_assigned_chats": sum(sum(state.loads.values()) for state in companies.values()),
+      "reserved": len(self._reserved),
+      "loads": self.loads,
+      "decisions": self.decisions,
+      "assigned": self.assigned,
+      "no_agent": self.no_agent,
+      "errors": self.errors,
+    }
+
+
+assignment_engine = AssignmentEngine(resync_seconds=settings.auto_assign_resync_seconds)
+
+
+def _invalidate_on_commit(db: Session, company_id: int) -> None:
+  on_commit(db, lambda: assignment_engine.invalidate(company_id))
+
+
+def get_policy(db: Session, company_id: int) -> Optional[AssignmentPolicy]:
+  return db.scalar(select(AssignmentPolicy).where(AssignmentPolicy.company_id == company_id))
+
+
+def set_policy(db: Session, company_id: int, payload: AssignmentPolicyUpdate) -> AssignmentPolicy:
+  """ValueError si la estrategia no está registrada"""
+  if payload.strategy not in STRATEGIES:
+    raise ValueError(f"Estrategia desconocida; opciones: {', '.join(sorted(STRATEGIES))}")
+  policy = get_policy(db, company_id)
+  if policy is None:
+    policy = AssignmentPolicy(company_id=company_id)
+    db.add(policy)
+  policy.strategy = payload.strategy
+  policy.active = payload.active
+  _invalidate_on_commit(db, company_id)
+  commit(db)
+  db.refresh(policy)
+  return policy
+
+
+def list_agents(db: Session, company_id: int) -> List[AssignmentAgent]:
+  return list(db.scalars(
+    select(AssignmentAgent).where(AssignmentAgent.company_id == company_id).order_by(AssignmentAgent.user_id)
+  ))
+
+
+def set_agent(db: Session, company_id: int, user_id: int, payload: AssignmentAgentUpdate) -> AssignmentAgent:
+  """ValueError si el usuario o alguna etiqueta no son de la empresa"""
+  user = db.get(User, user_id)
+  if user is None or user.company_id != company_id:
+    raise ValueError("Usuario no encontrado en la empresa")
+  tag_ids = sorted(set(payload.tag_ids))
+  if tag_ids:
+    known = set(db.scalars(select(ChatTag.id).where(ChatTag.company_id == company_id, ChatTag.id.in_(tag_ids))))
+    if known != set(tag_ids):
+      raise ValueError("Etiqueta no encontrada")
+  agent = db.scalar(select(AssignmentAgent).where(AssignmentAgent.company_id == company_id, AssignmentAgent.user_id == user_id))
+  if agent is None:
+    agent = AssignmentAgent(company_id=company_id, user_id=user_id)
+    db.add(agent)
+  agent.active = payload.active
+  agent.max_open_chats = payload.max_open_chats
+  agent.tag_ids = json.dumps(tag_ids)
+  _invalidate_on_commit(db, company_id)
+  commit(db)
+  db.refresh(agent)
+  return agent
+
+
+def delete_agent(db: Session, company_id: int, user_id: int) -> bool:
+  agent = db.scalar(select(AssignmentAgent).where(AssignmentAgent.company_id == company_id, AssignmentAgent.user_id == user_id))
+  if agent is None:
+    return False
+  db.delete(agent)
+  _invalidate_on_commit(db, company_id)
+  commit(db)
+  return True
@@ -0,0 +1,487 @@
+import functools
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import anyio
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.unit_of_work import commit, on_commit
+from app.models.auto_replies.auto_reply import AutoReplyRule
+from app.models.companies.company import Company
+from app.models.templates.template import Template
+from app.schemas.auto_replies.auto_reply import AutoReplyRuleCreate, AutoReplyRuleUpdate
+from app.schemas.chats.chat import MessageCreate
+from app.services.cache import LRUCache
+
+try:
+  from re import _parser as sre_parse
+  from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+  import sre_parse
+  import sre_constants
+
+logger = logging.getLogger(__name__)
+
+# Literal mínimo extraído de una regex para usarlo como disparador en el autómata
+MIN_TRIGGER_LENGTH = 3
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _fold(text: str) -> str:
+  decomposed = unicodedata.normalize("NFKD", text)
+  stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+  return _WHITESPACE.sub(" ", stripped.casefold())
+
+
+def normalize_text(text: str) -> str:
+  """Minúsculas sin tildes y con espacios simples: "¿Cuál es el  HORARIO?" -> "¿cual es el horario?" """
+  return _fold(text).strip()
+
+
+def _strip_accents(pattern: str) -> str:
+  # A una regex solo se le quitan las tildes: casefold rompería escapes como \S o \D
+  decomposed = unicodedata.normalize("NFKD", pattern)
+  return unicodedata.normalize("NFC", "".join(ch for ch in decomposed if not unicodedata.combining(ch)))
+
+
+class AhoCorasick:
+  """
+  Autómata de Aho-Corasick sobre caracteres.
+
+  ``search`` recorre el texto una sola vez y entrega cada aparición de cada patrón en
+  O(len(texto) + apariciones), sin importar cuántos patrones haya. Cada nodo guarda sus
+  propias salidas y un enlace al siguiente nodo con salidas en su cadena de fallos, así
+  ninguna lista se copia al construir.
+  """
+
+  def __init__(self, patterns: Sequence[Tuple[str, Any]]) -> None:
+    self._goto: List[Dict[str, int]] = [{}]
+    self._fail: List[int] = [0]
+    self._outputs: List[List[Tuple[int, Any]]] = [[]]
+    self._output_link: List[int] = [0]
+    for pattern, value in patterns:
+      if pattern:
+        self._add(pattern, value)
+    self._build()
+
+  def __len__(self) -> int:
+    return len(self._goto)
+
+  def _add(self, pattern: str, value: Any) -> None:
+    node = 0
+    for ch in pattern:
+      following = self._goto[node].get(ch)
+      if following is None:
+        following = len(self._goto)
+        self._goto[node][ch] = following
+        self._goto.append({})
+        self._fail.append(0)
+        self._outputs.append([])
+        self._output_link.append(0)
+      node = following
+    self._outputs[node].append((len(pattern), value))
+
+  def _build(self) -> None:
+    queue = deque(self._goto[0].values())
+    while queue:
+      node = queue.popleft()
+      for ch, child in self._goto[node].items():
+        queue.append(child)
+        fallback = self._fail[node]
+        while fallback and ch not in self._goto[fallback]:
+          fallback = self._fail[fallback]
+        target = self._goto[fallback].get(ch, 0)
+        self._fail[child] = target if target != child else 0
+        failed = self._fail[child]
+        self._output_link[child] = failed if self._outputs[failed] else self._output_link[failed]
+
+  def search(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+    """(inicio, fin, valor) de cada aparición, en orden de fin"""
+    goto, fail, outputs, output_link = self._goto, self._fail, self._outputs, self._output_link
+    node = 0
+    for index, ch in enumerate(text):
+      while node and ch not in goto[node]:
+        node = fail[node]
+      node = goto[node].get(ch, 0)
+      match = node if outputs[node] else output_link[node]
+      while match:
+        for length, value in outputs[match]:
+          yield index + 1 - length, index + 1, value
+        match = output_link[match]
+
+
+def _literal_runs(parsed) -> List[str]:
+  """Secuencias de literales que toda coincidencia de la regex debe contener"""
+  runs: List[str] = []
+  current: List[str] = []
+
+  def flush():
+    if current:
+      runs.append("".join(current))
+      current.clear()
+
+  for op, av in parsed:
+    if op is sre_constants.LITERAL:
+      current.append(chr(av))
+      continue
+    flush()
+    if op is sre_constants.SUBPATTERN:
+      runs.extend(_literal_runs(av[-1]))
+    elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+      runs.extend(_literal_runs(av[2]))
+  flush()
+  return runs
+
+
+def required_literal(pattern: str) -> Optional[str]:
+  """
+  Literal más largo presente en toda coincidencia de ``pattern``, ya normalizado.
+
+  Es el disparador de la regla en el autómata: la regex solo se evalúa si el literal
+  aparece en el mensaje. ``None`` si no hay uno útil (alternativas en el nivel superior,
+  clases de caracteres); esas reglas se evalúan con cada mensaje.
+  """
+  try:
+    parsed = sre_parse.parse(_strip_accents(pattern))
+  except re.error:
+    return None
+  # Sin recortar los bordes: " a " exige los espacios tanto como la regex
+  runs = [_fold(run) for run in _literal_runs(parsed)]
+  best = max(runs, key=len, default="")
+  return best if len(best) >= MIN_TRIGGER_LENGTH else None
+
+
+def split_keywords(pattern: str) -> List[str]:
+  return [keyword for keyword in (normalize_text(part) for part in pattern.split(",")) if keyword]
+
+
+def compile_regex(pattern: str) -> "re.Pattern[str]":
+  return re.compile(_strip_accents(pattern), re.IGNORECASE)
+
+
+@dataclass
+class RuleSnapshot:
+  """Copia inmutable de una regla: el autómata se comparte entre hilos y sobrevive a la sesión"""
+  id: int
+  name: str
+  match_type: str
+  pattern: str
+  whole_word: bool
+  reply_type: str
+  reply_text: Optional[str]
+  template_id: Optional[int]
+  priority: int
+  cooldown_minutes: int
+
+  @property
+  def order(self) -> Tuple[int, int]:
+    return self.priority, self.id
+
+
+@dataclass
+class CompiledRules:
+  rules: Dict[int, RuleSnapshot]
+  automaton: AhoCorasick
+  regexes: Dict[int, "re.Pattern[str]"]
+  # Reglas regex sin literal disparador: se evalúan con cada mensaje
+  untriggered: List[int]
+  signature: Tuple[Any, ...]
+  build_ms: float
+  checked_at: float = field(default_factory=time.monotonic)
+
+  def match(self, text: str) -> List[RuleSnapshot]:
+    """Reglas que coinciden con ``text``, en orden de prioridad"""
+    normalized = normalize_text(text)
+    matched = set()
+    candidates = set(self.untriggered)
+    for start, end, (rule_id, is_trigger) in self.automaton.search(normalized):
+      if rule_id in matched:
+        continue
+      if is_trigger:
+        candidates.add(rule_id)
+      elif not self.rules[rule_id].whole_word or _is_word(normalized, start, end):
+        matched.add(rule_id)
+    for rule_id in candidates - matched:
+      if self.regexes[rule_id].search(normalized):
+        matched.add(rule_id)
+    return sorted((self.rules[rule_id] for rule_id in matched), key=lambda rule: rule.order)
+
+
+def _is_word(text: str, start: int, end: int) -> bool:
+  return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+
+def compile_rules(rules: Sequence[RuleSnapshot], signature: Tuple[Any, ...] = ()) -> CompiledRules:
+  started = time.perf_counter()
+  patterns: List[Tuple[str, Tuple[int, bool]]] = []
+  regexes: Dict[int, "re.Pattern[str]"] = {}
+  untriggered: List[int] = []
+  for rule in rules:
+    if rule.match_type == "regex":
+      try:
+        regexes[rule.id] = compile_regex(rule.pattern)
+      except re.error as e:
+        logger.warning(f"Regla {rule.id} con regex inválida, se ignora: {e}")
+        continue
+      trigger = required_literal(rule.pattern)
+      if trigger:
+        patterns.append((trigger, (rule.id, True)))
+      else:
+        untriggered.append(rule.id)
+    else:
+      patterns.extend((keyword, (rule.id, False)) for keyword in split_keywords(rule.pattern))
+  return CompiledRules(
+    rules={rule.id: rule for rule in rules},
+    automaton=AhoCorasick(patterns),
+    regexes=regexes,
+    untriggered=untriggered,
+    signature=signature,
+    build_ms=round((time.perf_counter() - started) * 1000, 3),
+  )
+
+
+def _snapshot(rule: AutoReplyRule) -> RuleSnapshot:
+  return RuleSnapshot(
+    id=rule.id,
+    name=rule.name,
+    match_type=rule.match_type,
+    pattern=rule.pattern,
+    whole_word=rule.whole_word,
+    reply_type=rule.reply_type,
+    reply_text=rule.reply_text,
+    template_id=rule.template_id,
+    priority=rule.priority,
+    cooldown_minutes=rule.cooldown_minutes,
+  )
+
+
+def _signature(db: Session, company_id: int) -> Tuple[Any, ...]:
+  """Huella barata de las reglas activas de la empresa, por índice: cambia con cualquier alta, baja o edición"""
+  row = db.execute(
+    select(func.count(AutoReplyRule.id), func.max(AutoReplyRule.id), func.max(AutoReplyRule.updated_at))
+    .where(AutoReplyRule.company_id == company_id)
+  ).one()
+  return tuple(str(value) for value in row)
+
+
+def _send(coroutine_function: Callable[..., Any], **kwargs: Any) -> Dict[str, Any]:
+  # Los workers de la cola no tienen event loop: cada envío corre en uno propio
+  return anyio.run(functools.partial(coroutine_function, **kwargs))
+
+
+class AutoReplyEngine:
+  """
+  Respuestas automáticas por empresa sobre un autómata de Aho-Corasick.
+
+  Las palabras clave de todas las reglas de una empresa, y un literal obligatorio de cada
+  regex, forman un único autómata; encontrar las reglas que coinciden cuesta
+  O(largo del mensaje) sin importar cuántas haya. Las regex solo se evalúan si su
+  literal apareció. El autómata compilado vive en memoria y se reconstruye solo si las
+  reglas cambian: al instante cuando cambian en este proceso (``invalidate`` tras el
+  commit) y, para cambios hechos por otro proceso, al notar otra huella, que se consulta
+  como mucho cada ``reload_seconds``.
+  """
+
+  def __init__(self, reload_seconds: float = 30.0, cooldown_size: int = 50000) -> None:
+    self.reload_seconds = reload_seconds
+    self._compiled: Dict[int, CompiledRules] = {}
+    self._lock = threading.Lock()
+    # (chat_id, rule_id) -> última respuesta, para no repetir la misma regla en el mismo chat
+    self._cooldowns = LRUCache(maxsize=cooldown_size)
+    self.builds = 0
+    self.matched = 0
+    self.replies = 0
+    self.cooldown_skips = 0
+    self.errors = 0
+
+  def invalidate(self, company_id: int) -> None:
+    with self._lock:
+      self._compiled.pop(company_id, None)
+
+  def rules_for(self, db: Session, company_id: int) -> CompiledRules:
+    compiled = self._compiled.get(company_id)
+    now = time.monotonic()
+    if compiled is not None and now - compiled.checked_at < self.reload_seconds:
+      return compiled
+    signature = _signature(db, company_id)
+    if compiled is not None and compiled.signature == signature:
+      compiled.checked_at = now
+      return compiled
+    rows = db.scalars(
+      select(AutoReplyRule).where(AutoReplyRule.company_id == company_id, AutoReplyRule.active.is_(True))
+    ).all()
+    compiled = compile_rules([_snapshot(row) for row in rows], signature)
+    with self._lock:
+      self._compiled[company_id] = compiled
+      self.builds += 1
+    logger.info(f"Reglas de respuesta automática de la empresa {company_id}: {len(rows)} compiladas en {compiled.build_ms} ms")
+    return compiled
+
+  def match(self, db: Session, company_id: int, text: str) -> List[RuleSnapshot]:
+    if not text:
+      return []
+    return self.rules_for(db, company_id).match(text)
+
+  def handle_inbound(self, db: Session, company: Company, chat_id: int, phone_number: str, text: str) -> List[Any]:
+    """
+    Responde un mensaje entrante con la regla de mayor prioridad que coincida.
+
+    Retorna los mensajes salientes guardados. Nunca lanza: una respuesta fallida no debe
+    reintentar el webhook que ya guardó el mensaje del cliente.
+    """
+    try:
+      matches = self.match(db, company.id, text)
+      if not matches:
+        return []
+      self.matched += 1
+      rule = matches[0]
+      key = (chat_id, rule.id)
+      last = self._cooldowns.get(key)
+      if last is not None and time.time() - last < rule.cooldown_minutes * 60:
+        self.cooldown_skips += 1
+        return []
+      if not company.ycloud_api_key or not company.whatsapp_phone_number:
+        logger.warning(f"Empresa {company.id} sin YCloud configurado; no se envía la respuesta automática {rule.id}")
+        return []
+      messages = self._reply(db, company, chat_id, phone_number, rule)
+      if messages:
+        self._cooldowns.put(key, time.time())
+        self.replies += 1
+      return messages
+    except Exception as e:
+      self.errors += 1
+      logger.error(f"Error en la respuesta automática del chat {chat_id}: {e}")
+      return []
+
+  def _reply(self, db: Session, company: Company, chat_id: int, phone_number: str, rule: RuleSnapshot) -> List[Any]:
+    from app.services.chats import create_message
+    from app.services.ycloud import create_ycloud_service
+
+    if rule.reply_type == "template":
+      template = db.get(Template, rule.template_id) if rule.template_id else None
+      if template is None or template.company_id != company.id:
+        logger.warning(f"Regla {rule.id}: template {rule.template_id} no existe")
+        return []
+      parts = [
+        (item.item_type, item.text_content if item.item_type == "text" else item.media_url, item.caption, item.media_url)
+        for item in template.items
+      ]
+    else:
+      parts = [("text", rule.reply_text, None, None)]
+
+    service = create_ycloud_service(company.ycloud_api_key)
+    saved = []
+    for message_type, content, caption, media_url in parts:
+      if not content:
+        continue
+      result = _send(
+        service.send_message,
+        to=phone_number, message=content, from_number=company.whatsapp_phone_number,
+        message_type=message_type, caption=caption,
+      )
+      if not result.get("success"):
+        logger.warning(f"Regla {rule.id}: YCloud rechazó la respuesta automática: {result.get('error')}")
+        break
+      saved.append(create_message(db, MessageCreate(
+        chat_id=chat_id,
+        content=content if message_type == "text" else (caption or content),
+        message_type=message_type,
+        direction="outgoing",
+        whatsapp_message_id=result.get("message_id"),
+        sender_name="Respuesta automática",
+        attachment_url=media_url,
+      )))
+    return saved
+
+  def stats(self) -> Dict[str, Any]:
+    compiled = dict(self._compiled)
+    return {
+      "companies": len(compiled),
+      "rules": sum(len(entry.rules) for entry in compiled.values()),
+      "automaton_nodes": sum(len(entry.automaton) for entry in compiled.values()),
+      "untriggered_regexes": sum(len(entry.untriggered) for entry in compiled.values()),
+      "last_build_ms": max((entry.build_ms for entry in compiled.values()), default=None),
+      "builds": self.builds,
+      "matched": self.matched,
+      "replies": self.replies,
+      "cooldown_skips": self.cooldown_skips,
+      "errors": self.errors,
+    }
+
+
+auto_reply_engine = AutoReplyEngine(reload_seconds=settings.auto_reply_reload_seconds)
+
+
+def _validate(db: Session, company_id: int, rule: AutoReplyRule) -> None:
+  if rule.match_type == "regex":
+    try:
+      compile_regex(rule.pattern)
+    except re.error as e:
+      raise ValueError(f"Expresión regular inválida: {e}")
+  elif not split_keywords(rule.pattern):
+    raise ValueError("La regla necesita al menos una palabra clave")
+  if rule.reply_type == "template":
+    template = db.get(Template, rule.template_id) if rule.template_id else None
+    if template is None or template.company_id != company_id:
+      raise ValueError("Template no encontrado")
+  elif not (rule.reply_text or "").strip():
+    raise ValueError("La respuesta de texto está vacía")
+
+
+def _invalidate_on_commit(db: Session, company_id: int) -> None:
+  on_commit(db, lambda: auto_reply_engine.invalidate(company_id))
+
+
+def list_rules(db: Session, company_id: int) -> List[AutoReplyRule]:
+  return list(db.scalars(
+    select(AutoReplyRule)
+    .where(AutoReplyRule.company_id == company_id)
+    .order_by(AutoReplyRule.priority, AutoReplyRule.id)
+  ))
+
+
+def get_rule(db: Session, company_id: int, rule_id: int) -> Optional[AutoReplyRule]:
+  rule = db.get(AutoReplyRule, rule_id)
+  if rule is None or rule.company_id != company_id:
+    return None
+  return rule
+
+
+def create_rule(db: Session, company_id: int, payload: AutoReplyRuleCreate) -> AutoReplyRule:
+  """ValueError si la regex o la respuesta no son válidas"""
+  rule = AutoReplyRule(company_id=company_id, **payload.model_dump())
+  _validate(db, company_id, rule)
+  db.add(rule)
+  _invalidate_on_commit(db, company_id)
+  commit(db)
+  db.refresh(rule)
+  return rule
+
+
+def update_rule(db: Session, company_id: int, rule_id: int, payload: AutoReplyRuleUpdate) -> Optional[AutoReplyRule]:
+  rule = get_rule(db, company_id, rule_id)
+  if rule is None:
+    return None
+  for name, value in payload.model_dump(exclude_unset=True).items():
+    setattr(rule, name, value)
+  _validate(db, company_id, rule)
+  _invalidate_on_commit(db, company_id)
+  commit(db)
+  db.refresh(rule)
+  return rule
+
+
+def delete_rule(db: Session, company_id: int, rule_id: int) -> bool:
+  rule = get_rule(db, company_id, rule_id)
+  if rule is None:
+    return False
+  db.delete(rule)
+  _invalidate_on_commit(db, company_id)
+  commit(db)
+  return True
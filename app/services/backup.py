@@ -0,0 +1,261 @@
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SUFFIX = ".db.gz"
+# Reinicios tolerados (la base cambió desde otra conexión) antes de duplicar el tamaño del paso
+MAX_RESTARTS_PER_ATTEMPT = 3
+
+
+@dataclass
+class BackupResult:
+  path: str
+  created_at: datetime
+  pages: int
+  page_size: int
+  steps: int
+  restarts: int
+  duration_ms: float
+  compress_ms: float
+  max_step_ms: float
+  raw_bytes: int
+  compressed_bytes: int
+
+  @property
+  def throughput_mb_s(self) -> float:
+    seconds = self.duration_ms / 1000
+    return round(self.raw_bytes / 1024 / 1024 / seconds, 2) if seconds > 0 else 0.0
+
+  def as_dict(self) -> Dict[str, Any]:
+    return {**asdict(self), "name": os.path.basename(self.path), "throughput_mb_s": self.throughput_mb_s}
+
+
+class _TooManyRestarts(Exception):
+  pass
+
+
+last_backup: Optional[BackupResult] = None
+
+
+def _copy_online(
+  source_path: str,
+  dest_path: str,
+  pages_per_step: int,
+  pause: Callable[[], None],
+) -> Dict[str, Any]:
+  """
+  Copia la base con ``sqlite3_backup_step`` en pasos de ``pages_per_step`` páginas.
+
+  Cada paso toma el lock de lectura de la fuente solo mientras copia sus páginas y lo
+  libera al retornar, así que entre pasos los escritores avanzan. Si otra conexión
+  escribe durante la copia SQLite la reinicia; tras varios reinicios seguidos se duplica
+  el tamaño del paso para garantizar que la copia termine bajo carga sostenida.
+  """
+  stats = {"steps": 0, "restarts": 0, "max_step_ms": 0.0, "pages": 0}
+  step = max(1, pages_per_step)
+  while True:
+    attempt_restarts = 0
+    previous_remaining: Optional[int] = None
+    last_end = time.perf_counter()
+
+    def progress(status: int, remaining: int, total: int) -> None:
+      nonlocal attempt_restarts, previous_remaining, last_end
+      # Duración del último backup_step: el tiempo que la copia retuvo el lock de
+      # lectura de la fuente. No es la espera de los escritores (en WAL no se bloquean)
+      step_ms = (time.perf_counter() - last_end) * 1000
+      stats["steps"] += 1
+      stats["pages"] = total
+      stats["max_step_ms"] = max(stats["max_step_ms"], step_ms)
+      if previous_remaining is not None and remaining > previous_remaining:
+        stats["restarts"] += 1
+        attempt_restarts += 1
+        if attempt_restarts > MAX_RESTARTS_PER_ATTEMPT and step < total:
+          raise _TooManyRestarts()
+      previous_remaining = remaining
+      if remaining:
+        pause()
+      last_end = time.perf_counter()
+
+    src = sqlite3.connect(source_path, timeout=settings.sqlite_busy_timeout_ms / 1000)
+    dst = sqlite3.connect(dest_path)
+    try:
+      src.backup(dst, pages=step, progress=progress)
+      stats["page_size"] = dst.execute("PRAGMA page_size").fetchone()[0]
+      stats["pages_per_step"] = step
+      return stats
+    except _TooManyRestarts:
+      step *= 2
+      logger.info(f"Backup reiniciado por escrituras concurrentes; nuevo tamaño de paso {step} páginas")
+    finally:
+      dst.close()
+      src.close()
+
+
+def create_snapshot(
+  source_path: Optional[str] = None,
+  backup_dir: Optional[str] = None,
+  *,
+  pages_per_step: Optional[int] = None,
+  pause: Optional[Callable[[], None]] = None,
+) -> BackupResult:
+  """Genera un snapshot comprimido ``<base>-<timestamp>.db.gz`` sin detener las escrituras"""
+  global last_backup
+  source_path = source_path or settings.sqlite_path
+  backup_dir = backup_dir or settings.backup_dir
+  pages_per_step = pages_per_step or settings.backup_pages_per_step
+  if pause is None:
+    pause_seconds = settings.backup_step_pause_ms / 1000
+    pause = lambda: time.sleep(pause_seconds)
+
+  os.makedirs(backup_dir, exist_ok=True)
+  created_at = datetime.utcnow()
+  name = f"{Path(source_path).stem}-{created_at:%Y%m%dT%H%M%S%f}"
+  raw_path = os.path.join(backup_dir, f".{name}.db.partial")
+  gz_path = os.path.join(backup_dir, f".{name}{SNAPSHOT_SUFFIX}.partial")
+  final_path = os.path.join(backup_dir, f"{name}{SNAPSHOT_SUFFIX}")
+
+  try:
+    started = time.perf_counter()
+    stats = _copy_online(source_path, raw_path, pages_per_step, pause)
+    duration_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with open(raw_path, "rb") as raw, gzip.open(gz_path, "wb", compresslevel=6) as gz:
+      shutil.copyfileobj(raw, gz, 1024 * 1024)
+    compress_ms = (time.perf_counter() - started) * 1000
+    raw_bytes = os.path.getsize(raw_path)
+    os.replace(gz_path, final_path)
+  finally:
+    for leftover in (raw_path, gz_path):
+      if os.path.exists(leftover):
+        os.remove(leftover)
+
+  result = BackupResult(
+    path=final_path,
+    created_at=created_at,
+    pages=stats["pages"],
+    page_size=stats["page_size"],
+    steps=stats["steps"],
+    restarts=stats["restarts"],
+    duration_ms=round(duration_ms, 2),
+    compress_ms=round(compress_ms, 2),
+    max_step_ms=round(stats["max_step_ms"], 2),
+    raw_bytes=raw_bytes,
+    compressed_bytes=os.path.getsize(final_path),
+  )
+  last_backup = result
+  logger.info(
+    f"Snapshot {os.path.basename(final_path)}: {result.pages} páginas en {result.steps} pasos, "
+    f"{result.throughput_mb_s} MB/s, paso más largo {result.max_step_ms} ms"
+  )
+  return result
+
+
+def list_snapshots(backup_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+  """Snapshots disponibles, del más reciente al más antiguo"""
+  backup_dir = backup_dir or settings.backup_dir
+  if not os.path.isdir(backup_dir):
+    return []
+  snapshots = []
+  for entry in os.scandir(backup_dir):
+    if entry.is_file() and entry.name.endswith(SNAPSHOT_SUFFIX) and not entry.name.startswith("."):
+      stat = entry.stat()
+      snapshots.append({
+        "name": entry.name,
+        "path": entry.path,
+        "size": stat.st_size,
+        "modified_at": datetime.utcfromtimestamp(stat.st_mtime),
+      })
+  # El timestamp forma parte del nombre, así que el orden alfabético es cronológico
+  return sorted(snapshots, key=lambda s: s["name"], reverse=True)
+
+
+def apply_retention(backup_dir: Optional[str] = None, keep: Optional[int] = None) -> List[str]:
+  """Elimina los snapshots más antiguos dejando los ``keep`` más recientes"""
+  keep = settings.backup_keep if keep is None else keep
+  if keep <= 0:
+    return []
+  removed = []
+  for snapshot in list_snapshots(backup_dir)[keep:]:
+    os.remove(snapshot["path"])
+    removed.append(snapshot["name"])
+  return removed
+
+
+def resolve_snapshot(name: str, backup_dir: Optional[str] = None) -> str:
+  """Ruta de un snapshot por nombre, rechazando rutas fuera del directorio de backups"""
+  if os.path.basename(name) != name or not name.endswith(SNAPSHOT_SUFFIX):
+    raise ValueError("Nombre de snapshot inválido")
+  path = os.path.join(backup_dir or settings.backup_dir, name)
+  if not os.path.isfile(path):
+    raise FileNotFoundError(name)
+  return path
+
+
+def _decompress(path: str, dest_path: str) -> None:
+  with gzip.open(path, "rb") as gz, open(dest_path, "wb") as raw:
+    shutil.copyfileobj(gz, raw, 1024 * 1024)
+
+
+def verify_snapshot(path: str) -> Dict[str, Any]:
+  """Descomprime el snapshot en un temporal y ejecuta ``PRAGMA integrity_check``"""
+  tmp_path = f"{path}.verify"
+  try:
+    _decompress(path, tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+      problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+      tables = conn.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+      pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+      conn.close()
+  except (OSError, EOFError, sqlite3.DatabaseError) as e:
+    return {"name": os.path.basename(path), "ok": False, "errors": [str(e)]}
+  finally:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+  ok = problems == ["ok"]
+  return {
+    "name": os.path.basename(path),
+    "ok": ok,
+    "errors": [] if ok else problems[:20],
+    "tables": tables,
+    "pages": pages,
+  }
+
+
+def restore_snapshot(path: str, target_path: Optional[str] = None) -> Dict[str, Any]:
+  """
+  Restaura un snapshot verificado sobre ``target_path`` usando la API de backup.
+
+  A diferencia de copiar el archivo, respeta el WAL y los locks de la base destino.
+  Debe ejecutarse con el servidor detenido.
+  """
+  target_path = target_path or settings.sqlite_path
+  report = verify_snapshot(path)
+  if not report["ok"]:
+    raise ValueError(f"Snapshot inválido: {report['errors']}")
+  tmp_path = f"{path}.restore"
+  try:
+    _decompress(path, tmp_path)
+    src = sqlite3.connect(tmp_path)
+    dst = sqlite3.connect(target_path, timeout=settings.sqlite_busy_timeout_ms / 1000)
+    try:
+      src.backup(dst)
+    finally:
+      dst.close()
+      src.close()
+  finally:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+  return {**report, "target": target_path}
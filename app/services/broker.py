@@ -0,0 +1,342 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import anyio
+
+logger = logging.getLogger(__name__)
+
+
+def company_channel(company_id: int) -> str:
+  return f"company:{company_id}"
+
+
+def chat_channel(company_id: int, chat_id: int) -> str:
+  return f"chat:{company_id}:{chat_id}"
+
+
+def parse_channel(channel: Any) -> Tuple[int, Optional[int]]:
+  """``company:<id>`` o ``chat:<company_id>:<chat_id>`` -> (company_id, chat_id)"""
+  parts = channel.split(":") if isinstance(channel, str) else []
+  try:
+    if len(parts) == 2 and parts[0] == "company":
+      return int(parts[1]), None
+    if len(parts) == 3 and parts[0] == "chat":
+      return int(parts[1]), int(parts[2])
+  except ValueError:
+    pass
+  raise ValueError(f"Canal inválido: {channel}")
+
+
+@dataclass
+class BrokerEvent:
+  """Evento de tiempo real dirigido a los clientes de un chat o de una empresa"""
+  scope: str  # chat, company
+  company_id: int
+  chat_id: Optional[int]
+  event: str
+  data: Any
+  # Número de secuencia dentro de su canal; lo asigna el broker al publicar
+  seq: Optional[int] = None
+
+  @property
+  def channel(self) -> str:
+    if self.scope == "chat":
+      return chat_channel(self.company_id, self.chat_id)
+    return company_channel(self.company_id)
+
+
+Deliver = Callable[[BrokerEvent], Awaitable[None]]
+
+
+class Broker:
+  """
+  Transporte de eventos entre workers.
+
+  ``publish`` numera el evento dentro de su canal (``seq``) y lo entrega a todos los
+  workers suscritos (incluido el propio), que lo reenvían a sus websockets locales a
+  través de ``deliver``. Todos los workers ven el mismo ``seq`` para un mismo evento.
+  """
+
+  name = "base"
+
+  def __init__(self) -> None:
+    self._deliver: Optional[Deliver] = None
+    self._sequences: Dict[str, int] = {}
+
+  def stamp(self, event: BrokerEvent) -> BrokerEvent:
+    """Asigna el siguiente ``seq`` del canal con contadores locales al proceso"""
+    seq = self._sequences.get(event.channel, 0) + 1
+    self._sequences[event.channel] = seq
+    event.seq = seq
+    return event
+
+  async def start(self, deliver: Deliver) -> None:
+    self._deliver = deliver
+
+  async def stop(self) -> None:
+    self._deliver = None
+
+  @property
+  def running(self) -> bool:
+    return self._deliver is not None
+
+  async def publish(self, event: BrokerEvent) -> None:
+    raise NotImplementedError
+
+  async def _deliver_local(self, event: BrokerEvent) -> None:
+    if self._deliver is not None:
+      await self._deliver(event)
+
+  def stats(self) -> Dict[str, Any]:
+    return {"backend": self.name}
+
+  async def report_worker(self, summary: Dict[str, Any]) -> None:
+    """Publica el resumen de conexiones de este worker (solo útil con varios workers)"""
+
+  async def workers(self, local: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Resumen de conexiones de cada worker activo; en un solo proceso, solo el local"""
+    return [dict(local, worker_id=str(os.getpid()))]
+
+
+class InProcessBroker(Broker):
+  """Un solo proceso: publicar equivale a entregar localmente"""
+
+  name = "memory"
+
+  async def publish(self, event: BrokerEvent) -> None:
+    await self._deliver_local(self.stamp(event))
+
+
+class SQLiteBroker(Broker):
+  """
+  Fan-out entre procesos a través de una tabla de eventos en un archivo SQLite compartido.
+
+  Cada worker entrega de inmediato sus propios eventos y consulta periódicamente los
+  de los demás (``id > último visto``). SQLite serializa las escrituras, así que los ids
+  se confirman en orden y un worker nunca salta un evento: mientras el proceso esté vivo
+  y su retraso sea menor que la retención, cada evento se entrega exactamente una vez
+  por worker, respetando el orden de publicación de cada worker de origen. Los eventos
+  publicados antes de que un worker arranque no se le entregan.
+
+  Los contadores de secuencia por canal viven en la tabla ``realtime_sequences`` y se
+  incrementan en la misma transacción que inserta el evento, así que el ``seq`` es
+  consistente entre workers. Un worker puede recibir los eventos de un mismo canal
+  publicados por otros workers fuera de orden de ``seq`` si llegan dentro del mismo
+  intervalo de consulta que los suyos.
+  """
+
+  name = "sqlite"
+
+  def __init__(
+    self,
+    path: str,
+    *,
+    poll_interval: float = 0.05,
+    retention_seconds: float = 300.0,
+    batch_size: int = 500,
+    worker_id: Optional[str] = None,
+    worker_ttl: float = 90.0,
+  ) -> None:
+    super().__init__()
+    self.path = path
+    self.poll_interval = poll_interval
+    self.retention_seconds = retention_seconds
+    self.batch_size = batch_size
+    self.worker_ttl = worker_ttl
+    self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    self.last_id = 0
+    self.published = 0
+    self.received = 0
+    self.poll_errors = 0
+    self._conn: Optional[sqlite3.Connection] = None
+    self._task: Optional[asyncio.Task] = None
+    self._lock: Optional[anyio.Lock] = None
+    self._last_prune = 0.0
+
+  def _connect(self) -> sqlite3.Connection:
+    directory = os.path.dirname(self.path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS realtime_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        origin TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        company_id INTEGER NOT NULL,
+        chat_id INTEGER,
+        event TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at REAL NOT NULL
+      )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(realtime_events)")}
+    if "seq" not in columns:
+      conn.execute("ALTER TABLE realtime_events ADD COLUMN seq INTEGER")
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS realtime_sequences (
+        channel TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL
+      )
+    """)
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS realtime_workers (
+        worker_id TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        updated_at REAL NOT NULL
+      )
+    """)
+    return conn
+
+  async def _run(self, func, *args):
+    # Una sola conexión compartida; las llamadas se serializan y salen del event loop
+    async with self._lock:
+      return await anyio.to_thread.run_sync(func, *args)
+
+  @property
+  def running(self) -> bool:
+    return self._conn is not None
+
+  async def start(self, deliver: Deliver) -> None:
+    await super().start(deliver)
+    self._lock = anyio.Lock()
+    self._conn = await anyio.to_thread.run_sync(self._connect)
+    row = await self._run(lambda: self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM realtime_events").fetchone())
+    self.last_id = row[0]
+    self._task = asyncio.get_running_loop().create_task(self._poll_loop())
+
+  async def stop(self) -> None:
+    if self._task is not None:
+      self._task.cancel()
+      try:
+        await self._task
+      except asyncio.CancelledError:
+        pass
+      self._task = None
+    if self._conn is not None:
+      conn, self._conn = self._conn, None
+      await self._run(conn.close)
+    await super().stop()
+
+  def _insert(self, event: BrokerEvent) -> None:
+    # IMMEDIATE: el orden de los ids coincide con el de los seq de cada canal
+    self._conn.execute("BEGIN IMMEDIATE")
+    try:
+      (event.seq,) = self._conn.execute(
+        "INSERT INTO realtime_sequences (channel, seq) VALUES (?, 1) "
+        "ON CONFLICT(channel) DO UPDATE SET seq = seq + 1 RETURNING seq",
+        (event.channel,),
+      ).fetchone()
+      self._conn.execute(
+        "INSERT INTO realtime_events (origin, scope, company_id, chat_id, event, payload, created_at, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (self.worker_id, event.scope, event.company_id, event.chat_id, event.event, json.dumps(event.data, default=str), time.time(), event.seq),
+      )
+      self._conn.execute("COMMIT")
+    except BaseException:
+      self._conn.execute("ROLLBACK")
+      raise
+
+  async def publish(self, event: BrokerEvent) -> None:
+    if self._conn is None:
+      raise RuntimeError("SQLiteBroker no iniciado")
+    await self._run(self._insert, event)
+    self.published += 1
+    await self._deliver_local(event)
+
+  def _fetch(self) -> List[tuple]:
+    rows = self._conn.execute(
+      "SELECT id, origin, scope, company_id, chat_id, event, payload, seq FROM realtime_events WHERE id > ? ORDER BY id LIMIT ?",
+      (self.last_id, self.batch_size),
+    ).fetchall()
+    now = time.time()
+    if now - self._last_prune > self.retention_seconds / 10:
+      self._last_prune = now
+      self._conn.execute("DELETE FROM realtime_events WHERE created_at < ?", (now - self.retention_seconds,))
+    return rows
+
+  async def poll_once(self) -> int:
+    """Entrega los eventos de otros workers publicados desde la última consulta"""
+    delivered = 0
+    while True:
+      fetched, batch_delivered = await self._poll_batch()
+      delivered += batch_delivered
+      if fetched < self.batch_size:
+        return delivered
+
+  async def _poll_batch(self) -> tuple:
+    rows = await self._run(self._fetch)
+    delivered = 0
+    for row_id, origin, scope, company_id, chat_id, event, payload, seq in rows:
+      self.last_id = row_id
+      if origin == self.worker_id:
+        continue
+      await self._deliver_local(BrokerEvent(scope, company_id, chat_id, event, json.loads(payload), seq))
+      delivered += 1
+    self.received += delivered
+    return len(rows), delivered
+
+  async def _poll_loop(self) -> None:
+    while True:
+      try:
+        await self.poll_once()
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        self.poll_errors += 1
+        logger.warning(f"Error consultando eventos de tiempo real: {e}")
+      await asyncio.sleep(self.poll_interval)
+
+  def _report(self, summary: Dict[str, Any]) -> None:
+    now = time.time()
+    self._conn.execute(
+      "INSERT INTO realtime_workers (worker_id, summary, updated_at) VALUES (?, ?, ?) "
+      "ON CONFLICT(worker_id) DO UPDATE SET summary = excluded.summary, updated_at = excluded.updated_at",
+      (self.worker_id, json.dumps(summary), now),
+    )
+    # Los worker_id incluyen el pid: cada reinicio deja una fila que hay que olvidar
+    self._conn.execute("DELETE FROM realtime_workers WHERE updated_at < ?", (now - 10 * self.worker_ttl,))
+
+  async def report_worker(self, summary: Dict[str, Any]) -> None:
+    if self._conn is not None:
+      await self._run(self._report, summary)
+
+  async def workers(self, local: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if self._conn is None:
+      return await super().workers(local)
+    # Un worker que no reportó dentro del TTL se considera caído
+    rows = await self._run(
+      lambda: self._conn.execute(
+        "SELECT worker_id, summary, updated_at FROM realtime_workers WHERE updated_at >= ?",
+        (time.time() - self.worker_ttl,),
+      ).fetchall()
+    )
+    workers = {worker_id: dict(json.loads(summary), worker_id=worker_id, updated_at=updated_at) for worker_id, summary, updated_at in rows}
+    workers[self.worker_id] = dict(local, worker_id=self.worker_id, updated_at=time.time())
+    return sorted(workers.values(), key=lambda worker: worker["worker_id"])
+
+  def stats(self) -> Dict[str, Any]:
+    return {
+      "backend": self.name,
+      "worker_id": self.worker_id,
+      "last_id": self.last_id,
+      "published": self.published,
+      "received": self.received,
+      "poll_errors": self.poll_errors,
+    }
+
+
+def create_broker(backend: str, **options: Any) -> Broker:
+  if backend == "sqlite":
+    return SQLiteBroker(**options)
+  if backend in ("memory", "", None):
+    return InProcessBroker()
+  raise ValueError(f"Backend de tiempo real desconocido: {backend}")
@@ -0,0 +1,192 @@
+from typing import Any, Dict, Iterator, List, Optional
+from sqlalchemy import select, update, delete, insert, literal, Integer, String, Text
+from sqlalchemy.orm import Session
+from app.models.chats.chat import Chat, ChatTag, ChatTagMap, ChatAudit
+from app.services.realtime import manager, BULK_UPDATED_EVENT
+from app.services.visibility import assignments
+from app.services.assignment import assignment_engine
+
+
+# Tamaño de cada lote: cada chunk es una transacción corta y mantiene los
+# parámetros del IN (...) por debajo del límite de variables de SQLite
+BULK_CHUNK_SIZE = 500
+# Máximo de ids que viajan en el evento coalescido; por encima el frontend refresca la lista
+BULK_EVENT_MAX_IDS = 1000
+
+
+def _chunks(ids: List[int], size: int) -> Iterator[List[int]]:
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _owned_chat_ids(company_id: int, chunk: List[int]):
+    """Subconsulta con los ids del chunk que realmente pertenecen a la empresa"""
+    return select(Chat.id).where(Chat.company_id == company_id, Chat.id.in_(chunk), Chat.deleted_at.is_(None))
+
+
+def _audit_details(status: Optional[str], priority: Optional[str], assigned_user_id: Optional[int], tag_ids: Optional[List[int]]) -> str:
+    parts = []
+    if status is not None:
+        parts.append(f"status={status}")
+    if priority is not None:
+        parts.append(f"priority={priority}")
+    if assigned_user_id is not None:
+        parts.append(f"assigned_user_id={assigned_user_id}")
+    if tag_ids is not None:
+        parts.append(f"tags={','.join(str(t) for t in tag_ids)}")
+    return ";".join(parts)
+
+
+def _load_changes(db: Session, company_id: int, chunk: List[int], status: Optional[str], assigned_user_id: Optional[int]) -> List[tuple]:
+    """(chat_id, antes, después) de los chats del chunk, para ajustar la carga de los agentes"""
+    rows = db.execute(
+        select(Chat.id, Chat.assigned_user_id, Chat.status)
+        .where(Chat.company_id == company_id, Chat.id.in_(chunk), Chat.deleted_at.is_(None))
+    )
+    return [
+        (chat_id, (user_id, current), (assigned_user_id if assigned_user_id is not None else user_id, status or current))
+        for chat_id, user_id, current in rows
+    ]
+
+
+def _update_chunk(db: Session, company_id: int, chunk: List[int], values: Dict[str, Any]) -> int:
+    if not values:
+        return 0
+    result = db.execute(
+        update(Chat)
+        .where(Chat.company_id == company_id, Chat.id.in_(chunk), Chat.deleted_at.is_(None))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount or 0
+
+
+def _replace_tags_chunk(db: Session, company_id: int, chunk: List[int], tag_ids: List[int]) -> tuple[int, int]:
+    removed = db.execute(
+        delete(ChatTagMap)
+        .where(ChatTagMap.chat_id.in_(_owned_chat_ids(company_id, chunk)))
+        .execution_options(synchronize_session=False)
+    ).rowcount or 0
+    if not tag_ids:
+        return removed, 0
+    # INSERT ... SELECT: el producto chats x etiquetas se arma dentro de SQLite,
+    # sin crear un objeto ORM por pareja y descartando etiquetas de otra empresa
+    pairs = (
+        select(Chat.id, ChatTag.id)
+        .join(ChatTag, ChatTag.company_id == Chat.company_id)
+        .where(Chat.company_id == company_id, Chat.id.in_(chunk), Chat.deleted_at.is_(None), ChatTag.id.in_(tag_ids))
+    )
+    added = db.execute(insert(ChatTagMap).from_select(["chat_id", "tag_id"], pairs)).rowcount or 0
+    return removed, added
+
+
+def _audit_chunk(db: Session, company_id: int, chunk: List[int], user_id: Optional[int], details: str) -> List[int]:
+    """Audita los chats del chunk que pertenecen a la empresa y retorna sus ids"""
+    rows = select(
+        literal(company_id, Integer),
+        Chat.id,
+        literal(user_id, Integer),
+        literal("bulk", String),
+        literal(details, Text),
+    ).where(Chat.company_id == company_id, Chat.id.in_(chunk), Chat.deleted_at.is_(None))
+    result = db.execute(
+        insert(ChatAudit)
+        .from_select(["company_id", "chat_id", "user_id", "action", "details"], rows)
+        .returning(ChatAudit.chat_id)
+    )
+    return list(result.scalars())
+
+
+def run_bulk_operations(
+    db: Session,
+    company_id: int,
+    chat_ids: List[int],
+    *,
+    status: Optional[str] = None,
+    priority: Optional[str] = None,
+    assigned_user_id: Optional[int] = None,
+    tag_ids: Optional[List[int]] = None,
+    user_id: Optional[int] = None,
+    chunk_size: int = BULK_CHUNK_SIZE,
+) -> Dict[str, int]:
+    """
+    Aplica cambios masivos sobre chats de una empresa por lotes.
+
+    Cada lote se ejecuta con sentencias set-based (UPDATE, DELETE e INSERT ... SELECT)
+    y se confirma por separado, de modo que la memoria y el tiempo de bloqueo quedan
+    acotados por ``chunk_size`` y no por el tamaño de la selección. Al final se emite
+    un único evento ``chats.bulk_updated`` para toda la operación.
+
+    Retorna los conteos por operación.
+    """
+    ids = list(dict.fromkeys(int(c) for c in chat_ids))
+    values: Dict[str, Any] = {}
+    if status is not None:
+        values["status"] = status
+    if priority is not None:
+        values["priority"] = priority
+    if assigned_user_id is not None:
+        values["assigned_user_id"] = assigned_user_id
+    unique_tags = list(dict.fromkeys(int(t) for t in tag_ids)) if tag_ids is not None else None
+
+    counts = {
+        "selected": len(ids),
+        "updated": 0,
+        "tags_removed": 0,
+        "tags_added": 0,
+        "audit_rows": 0,
+        "chunks": 0,
+    }
+    if not ids or (not values and unique_tags is None):
+        return counts
+
+    details = _audit_details(status, priority, assigned_user_id, unique_tags)
+    # Solo los chats que coincidieron viajan en el evento: los ids ajenos o
+    # eliminados que mande el cliente no se difunden a la empresa
+    matched: List[int] = []
+    moves_load = status is not None or assigned_user_id is not None
+    for chunk in _chunks(ids, max(1, chunk_size)):
+        changes: List[tuple] = []
+        try:
+            # Solo si este proceso lleva la carga de la empresa; si no, se leerá completa al cargarla
+            if moves_load and assignment_engine.is_tracking(company_id):
+                changes = _load_changes(db, company_id, chunk, status, assigned_user_id)
+            counts["updated"] += _update_chunk(db, company_id, chunk, values)
+            if unique_tags is not None:
+                removed, added = _replace_tags_chunk(db, company_id, chunk, unique_tags)
+                counts["tags_removed"] += removed
+                counts["tags_added"] += added
+            audited = _audit_chunk(db, company_id, chunk, user_id, details)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        if changes:
+            assignment_engine.chats_changed(company_id, changes)
+        matched.extend(audited)
+        counts["audit_rows"] += len(audited)
+        counts["chunks"] += 1
+
+    if not matched:
+        return counts
+
+    payload: Dict[str, Any] = {
+        "company_id": company_id,
+        "count": counts["audit_rows"],
+        "changes": {
+            "status": status,
+            "priority": priority,
+            "assigned_user_id": assigned_user_id,
+            "tag_ids": unique_tags,
+        },
+    }
+    if len(matched) <= BULK_EVENT_MAX_IDS:
+        payload["chat_ids"] = matched
+    else:
+        payload["full_refresh"] = True
+
+    if assigned_user_id is not None:
+        assignments.assign(company_id, matched, assigned_user_id)
+    # Todos los lotes ya están confirmados: el evento va directo a la outbox
+    manager.emit_to_company(None, company_id, BULK_UPDATED_EVENT, payload)
+    return counts
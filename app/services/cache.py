@@ -0,0 +1,55 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+  """Caché LRU acotada y segura entre hilos"""
+
+  def __init__(self, maxsize: int = 1024) -> None:
+    self.maxsize = max(1, maxsize)
+    self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key: Hashable, default: Any = None) -> Any:
+    with self._lock:
+      if key in self._data:
+        self._data.move_to_end(key)
+        self.hits += 1
+        return self._data[key]
+      self.misses += 1
+      return default
+
+  def put(self, key: Hashable, value: Any) -> None:
+    with self._lock:
+      self._data[key] = value
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+  def pop(self, key: Hashable, default: Any = None) -> Any:
+    with self._lock:
+      return self._data.pop(key, default)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._data.clear()
+
+  def __contains__(self, key: Hashable) -> bool:
+    with self._lock:
+      return key in self._data
+
+  def __len__(self) -> int:
+    return len(self._data)
+
+  def stats(self) -> Dict[str, Optional[float]]:
+    total = self.hits + self.misses
+    return {
+      "size": len(self._data),
+      "maxsize": self.maxsize,
+      "hits": self.hits,
+      "misses": self.misses,
+      "hit_rate": round(self.hits / total, 4) if total else None,
+    }
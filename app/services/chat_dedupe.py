@@ -0,0 +1,99 @@
+from collections import defaultdict
+from typing import Dict, List, Tuple
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+from app.models.chats.chat import (
+    Chat,
+    Message,
+    ChatSummary,
+    Appointment,
+    ChatTagMap,
+    ChatNote,
+    ChatPin,
+    ChatSnooze,
+    ChatAudit,
+)
+from app.services.phones import normalize_phone
+
+
+# Tablas cuyas filas se reasignan al chat superviviente
+_DEPENDENT_MODELS = (Message, ChatSummary, Appointment, ChatTagMap, ChatNote, ChatPin, ChatSnooze, ChatAudit)
+
+
+def find_duplicate_groups(db: Session) -> Dict[Tuple[int, str], List[Chat]]:
+    """Agrupa los chats por (empresa, teléfono normalizado); solo retorna grupos con duplicados"""
+    groups: Dict[Tuple[int, str], List[Chat]] = defaultdict(list)
+    for chat in db.scalars(select(Chat).where(Chat.deleted_at.is_(None)).order_by(Chat.id)):
+        groups[(chat.company_id, normalize_phone(chat.phone_number))].append(chat)
+    return {key: chats for key, chats in groups.items() if len(chats) > 1}
+
+
+def _remove_duplicate_links(db: Session, chat_id: int) -> int:
+    """Tras la fusión, una misma etiqueta o pin puede quedar repetido en el superviviente"""
+    removed = 0
+    for model, column in ((ChatTagMap, ChatTagMap.tag_id), (ChatPin, ChatPin.user_id)):
+        keep = (
+            select(func.min(model.id))
+            .where(model.chat_id == chat_id)
+            .group_by(column)
+        )
+        removed += db.execute(
+            delete(model)
+            .where(model.chat_id == chat_id, model.id.not_in(keep))
+            .execution_options(synchronize_session=False)
+        ).rowcount or 0
+    return removed
+
+
+def merge_duplicate_chats(db: Session, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Fusiona chats duplicados de un mismo cliente y normaliza los teléfonos a E.164.
+
+    En cada grupo sobrevive el chat más antiguo: recibe los mensajes, notas, etiquetas,
+    pins, citas, resúmenes y auditoría de los demás, conserva el último ``last_message_time``
+    y completa los campos vacíos. Debe ejecutarse antes de crear el índice único
+    ``uq_chats_company_phone_live`` en bases existentes.
+    """
+    groups = find_duplicate_groups(db)
+    counts = {"groups": len(groups), "merged": 0, "moved_rows": 0, "normalized": 0}
+
+    for (_, phone), chats in groups.items():
+        survivor, duplicates = chats[0], chats[1:]
+        duplicate_ids = [c.id for c in duplicates]
+        counts["merged"] += len(duplicates)
+        if dry_run:
+            continue
+        for model in _DEPENDENT_MODELS:
+            counts["moved_rows"] += db.execute(
+                update(model)
+                .where(model.chat_id.in_(duplicate_ids))
+                .values(chat_id=survivor.id)
+                .execution_options(synchronize_session=False)
+            ).rowcount or 0
+        _remove_duplicate_links(db, survivor.id)
+
+        for dup in duplicates:
+            survivor.customer_name = survivor.customer_name or dup.customer_name
+            survivor.assigned_user_id = survivor.assigned_user_id or dup.assigned_user_id
+            if dup.last_message_time and (not survivor.last_message_time or dup.last_message_time > survivor.last_message_time):
+                survivor.last_message_time = dup.last_message_time
+                survivor.status = dup.status
+        db.execute(delete(Chat).where(Chat.id.in_(duplicate_ids)).execution_options(synchronize_session=False))
+        for dup in duplicates:
+            db.expunge(dup)
+        # Liberar el número antes de normalizar los chats que quedan sin grupo
+        survivor.phone_number = phone
+        db.flush()
+
+    for chat in db.scalars(select(Chat).where(Chat.deleted_at.is_(None))):
+        normalized = normalize_phone(chat.phone_number)
+        if normalized != chat.phone_number:
+            counts["normalized"] += 1
+            if not dry_run:
+                chat.phone_number = normalized
+
+    if dry_run:
+        db.rollback()
+    else:
+        db.commit()
+    return counts
@@ -1,12 +1,27 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, func, and_, or_, exists
-from typing import List, Optional
+from sqlalchemy import desc, func, and_, or_, exists, case, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from typing import Dict, List, Optional, Tuple
 from app.models.chats.chat import Chat, Message, ChatSummary, Appointment, ChatTag, ChatTagMap, ChatNote, ChatPin, ChatSnooze, ChatAudit
 from app.schemas.chats.chat import ChatCreate, MessageCreate, ChatOut, MessageOut, ChatWithLastMessage
-from app.services.realtime import manager
+from app.db.unit_of_work import commit, on_commit
+from app.services.realtime import manager, ASSIGNED_EVENT
+from app.services.visibility import assignments
+from app.services.assignment import assignment_engine
+from app.services.cache import LRUCache
+from app.services.phones import normalize_phone
+from app.core.config import settings
 from fastapi.encoders import jsonable_encoder
 
 
+# (company_id, teléfono E.164) -> chat_id
+chat_id_cache = LRUCache(maxsize=settings.chat_cache_size)
+
+# Estados de entrega de un mensaje en orden; solo se avanza. ``failed`` reemplaza a ``sent``
+# y un ``read`` posterior prevalece (el mensaje sí llegó)
+MESSAGE_STATUS_RANK = {"sent": 1, "delivered": 2, "failed": 2, "read": 3}
+
+
 def get_chats_by_company(db: Session, company_id: int, *,
                          status: Optional[str] = None,
                          priority: Optional[str] = None,
@@ -17,7 +32,7 @@ def get_chats_by_company(db: Session, company_id: int, *,
                          tag_ids: Optional[list[int]] = None,
                          pinned_by_user_id: Optional[int] = None,
                          exclude_snoozed_for_user_id: Optional[int] = None) -> List[ChatWithLastMessage]:
-    filters = [Chat.company_id == company_id]
+    filters = [Chat.company_id == company_id, Chat.deleted_at.is_(None)]
     if status:
         filters.append(Chat.status == status)
     if priority:
@@ -93,51 +108,109 @@ def get_chats_by_company(db: Session, company_id: int, *,
     return result
 
 
+def _live_chat(chat_id: int, company_id: Optional[int] = None):
+    """Condición SQL: el chat existe y no está eliminado (sus datos se purgan en segundo plano)"""
+    criteria = [Chat.id == chat_id, Chat.deleted_at.is_(None)]
+    if company_id is not None:
+        criteria.append(Chat.company_id == company_id)
+    return exists().where(*criteria)
+
+
+def _is_live_chat(db: Session, chat_id: int, company_id: Optional[int] = None) -> bool:
+    return db.query(_live_chat(chat_id, company_id)).scalar()
+
+
 def get_chat_by_id(db: Session, chat_id: int, company_id: int) -> Optional[Chat]:
     """Obtener un chat específico con todos sus mensajes"""
     return (
         db.query(Chat)
-        .filter(Chat.id == chat_id, Chat.company_id == company_id)
+        .filter(Chat.id == chat_id, Chat.company_id == company_id, Chat.deleted_at.is_(None))
         .first()
     )
 
 
-def get_or_create_chat(db: Session, phone_number: str, company_id: int, customer_name: str = None) -> Chat:
-    """Obtener un chat existente o crear uno nuevo"""
-    
-    # Buscar chat existente
-    existing_chat = (
+def _upsert_chat(db: Session, phone: str, company_id: int, customer_name: Optional[str]) -> Chat:
+    # El índice único parcial (company_id, phone_number) de chats activos resuelve
+    # webhooks concurrentes del mismo cliente
+    inserted = db.execute(
+        sqlite_insert(Chat)
+        .values(
+            phone_number=phone,
+            customer_name=customer_name,
+            company_id=company_id,
+            status="active",
+            priority="low",
+        )
+        .on_conflict_do_nothing(
+            index_elements=["company_id", "phone_number"],
+            index_where=Chat.deleted_at.is_(None),
+        )
+    ).rowcount
+    chat = (
         db.query(Chat)
-        .filter(Chat.phone_number == phone_number, Chat.company_id == company_id)
-        .first()
+        .filter(Chat.company_id == company_id, Chat.phone_number == phone, Chat.deleted_at.is_(None))
+        .one()
     )
-    
-    if existing_chat:
-        # Actualizar nombre del cliente si se proporciona
-        if customer_name and not existing_chat.customer_name:
-            existing_chat.customer_name = customer_name
-            db.commit()
-            db.refresh(existing_chat)
-        return existing_chat
-    
-    # Crear nuevo chat
-    new_chat = Chat(
-        phone_number=phone_number,
-        customer_name=customer_name,
-        company_id=company_id,
-        status="active",
-        priority="low"
-    )
-    
-    db.add(new_chat)
-    db.commit()
-    db.refresh(new_chat)
-    return new_chat
+    key, chat_id = (company_id, phone), chat.id
+    if inserted:
+        # Solo se cachea un chat confirmado: si la transacción se revierte el id no existe
+        on_commit(db, lambda: chat_id_cache.put(key, chat_id))
+        commit(db)
+    else:
+        chat_id_cache.put(key, chat_id)
+    return chat
+
+
+def get_or_create_chat_id(db: Session, phone_number: str, company_id: int, customer_name: str = None) -> int:
+    """
+    Id del chat activo del cliente, creándolo si no existe.
+
+    Camino caliente del webhook: con la entrada en caché no se consulta la base. La caché
+    se invalida con ``forget_chat`` al eliminar o fusionar chats.
+    """
+    phone = normalize_phone(phone_number)
+    cached_id = chat_id_cache.get((company_id, phone))
+    if cached_id is not None:
+        return cached_id
+    chat = _upsert_chat(db, phone, company_id, customer_name)
+    _fill_customer_name(db, chat, customer_name)
+    return chat.id
+
+
+def _fill_customer_name(db: Session, chat: Chat, customer_name: Optional[str]) -> None:
+    if customer_name and not chat.customer_name:
+        chat.customer_name = customer_name
+        commit(db)
+        db.refresh(chat)
+
+
+def get_or_create_chat(db: Session, phone_number: str, company_id: int, customer_name: str = None) -> Chat:
+    """Obtener un chat existente o crear uno nuevo sin duplicados (INSERT ... ON CONFLICT)"""
+    phone = normalize_phone(phone_number)
+    chat = None
+    cached_id = chat_id_cache.get((company_id, phone))
+    if cached_id is not None:
+        chat = db.get(Chat, cached_id)
+        if chat is None or chat.deleted_at is not None:
+            chat_id_cache.pop((company_id, phone))
+            chat = None
+    if chat is None:
+        chat = _upsert_chat(db, phone, company_id, customer_name)
+    _fill_customer_name(db, chat, customer_name)
+    return chat
+
+
+def forget_chat(company_id: int, phone_number: str) -> None:
+    """Invalidar la caché de chats al eliminar o fusionar un chat"""
+    chat_id_cache.pop((company_id, normalize_phone(phone_number)))
 
 
 def create_message(db: Session, message_data: MessageCreate) -> Message:
-    """Crear un nuevo mensaje"""
-    
+    """Crear un nuevo mensaje; LookupError si el chat no existe o fue eliminado"""
+    chat = db.query(Chat).filter(Chat.id == message_data.chat_id, Chat.deleted_at.is_(None)).first()
+    if chat is None:
+        raise LookupError(f"Chat {message_data.chat_id} no existe o fue eliminado")
+
     # Convertir a dict y remover timestamp si existe
     message_dict = message_data.model_dump()
     custom_timestamp = message_dict.pop('timestamp', None)
@@ -152,7 +225,6 @@ def create_message(db: Session, message_data: MessageCreate) -> Message:
     db.add(message)
     
     # Actualizar la hora del último mensaje en el chat
-    chat = db.query(Chat).filter(Chat.id == message_data.chat_id).first()
     if chat:
         # Si es un mensaje importado con timestamp personalizado, usar ese
         if custom_timestamp:
@@ -160,84 +232,77 @@ def create_message(db: Session, message_data: MessageCreate) -> Message:
         else:
             chat.last_message_time = func.now()
     
-    db.commit()
+    db.flush()
     db.refresh(message)
 
-    try:
-        company_id = chat.company_id if chat else None
-        if company_id is not None:
-            payload = jsonable_encoder(MessageOut.from_orm(message))
-            # Agregar company_id para que el frontend pueda validar
-            payload["company_id"] = company_id
-            # Emitir evento a los clientes del chat
-            import anyio
-            async def _broadcast() -> None:
-                await manager.broadcast_to_chat(company_id, message.chat_id, "message.created", payload)
-                # Emitir actualización a nivel de empresa para refrescar lista de chats
-                await manager.broadcast_to_company(company_id, "chat.updated", {
-                    "chat_id": message.chat_id,
-                    "company_id": company_id,
-                    "last_message": payload
-                })
-            try:
-                anyio.from_thread.run(_broadcast)
-            except RuntimeError:
-                # Si ya estamos en un loop async, ejecutar directamente
-                import asyncio
-                async def _broadcast_asyncio() -> None:
-                    await manager.broadcast_to_chat(company_id, message.chat_id, "message.created", payload)
-                    await manager.broadcast_to_company(company_id, "chat.updated", {
-                        "chat_id": message.chat_id,
-                        "company_id": company_id,
-                        "last_message": payload
-                    })
-                asyncio.create_task(_broadcast_asyncio())
-    except Exception:
-        # Evitar que errores de broadcast rompan la creación del mensaje
-        pass
+    company_id = chat.company_id if chat else None
+    if company_id is not None:
+        payload = jsonable_encoder(MessageOut.from_orm(message))
+        # Agregar company_id para que el frontend pueda validar
+        payload["company_id"] = company_id
+
+        # Los eventos pasan por la outbox: salen solo si el mensaje queda confirmado
+        # y quien escribe nunca espera los envíos por websocket
+        manager.emit_to_chat(db, company_id, message.chat_id, "message.created", payload)
+        # Actualización a nivel de empresa para refrescar la lista de chats
+        manager.emit_to_company(db, company_id, "chat.updated", {
+            "chat_id": message.chat_id,
+            "company_id": company_id,
+            "last_message": payload
+        })
+    commit(db)
     return message
 
 
 def assign_chat(db: Session, company_id: int, chat_id: int, assigned_user_id: int, priority: str) -> Optional[Chat]:
     chat = (
         db.query(Chat)
-        .filter(Chat.id == chat_id, Chat.company_id == company_id)
+        .filter(Chat.id == chat_id, Chat.company_id == company_id, Chat.deleted_at.is_(None))
         .first()
     )
     if not chat:
         return None
+    previous_user_id = chat.assigned_user_id
+    status = chat.status
     chat.assigned_user_id = assigned_user_id
     chat.priority = priority
-    db.commit()
+    db.add(ChatAudit(company_id=company_id, chat_id=chat_id, user_id=assigned_user_id, action="assign", details=f"priority={priority}"))
+    # El mapa de este worker se actualiza al confirmar; los demás lo hacen con el evento
+    on_commit(db, lambda: assignments.assign(company_id, [chat_id], assigned_user_id))
+    on_commit(db, lambda: assignment_engine.chat_changed(company_id, chat_id, (previous_user_id, status), (assigned_user_id, status)))
+    manager.emit_to_company(db, company_id, ASSIGNED_EVENT, {
+        "chat_id": chat_id,
+        "company_id": company_id,
+        "assigned_user_id": assigned_user_id,
+        "previous_assigned_user_id": previous_user_id,
+        "priority": priority,
+    })
+    commit(db)
     db.refresh(chat)
-    try:
-        db.add(ChatAudit(company_id=company_id, chat_id=chat_id, user_id=assigned_user_id, action="assign", details=f"priority={priority}"))
-        db.commit()
-    except Exception:
-        db.rollback()
     return chat
 
 
 def update_chat_status(db: Session, company_id: int, chat_id: int, status: str) -> Optional[Chat]:
     chat = (
         db.query(Chat)
-        .filter(Chat.id == chat_id, Chat.company_id == company_id)
+        .filter(Chat.id == chat_id, Chat.company_id == company_id, Chat.deleted_at.is_(None))
         .first()
     )
     if not chat:
         return None
+    previous_status = chat.status
+    assigned_user_id = chat.assigned_user_id
     chat.status = status
-    db.commit()
+    db.add(ChatAudit(company_id=company_id, chat_id=chat_id, action="status", details=f"status={status}"))
+    on_commit(db, lambda: assignment_engine.chat_changed(company_id, chat_id, (assigned_user_id, previous_status), (assigned_user_id, status)))
+    commit(db)
     db.refresh(chat)
-    try:
-        db.add(ChatAudit(company_id=company_id, chat_id=chat_id, action="status", details=f"status={status}"))
-        db.commit()
-    except Exception:
-        db.rollback()
     return chat
 
 
 def create_appointment(db: Session, company_id: int, chat_id: int, assigned_user_id: int, start_at) -> Appointment | None:
+    if not _is_live_chat(db, chat_id, company_id):
+        return None
     exists = (
         db.query(Appointment)
         .filter(
@@ -256,12 +321,14 @@ def create_appointment(db: Session, company_id: int, chat_id: int, assigned_user
         start_at=start_at,
     )
     db.add(appt)
-    db.commit()
+    commit(db)
     db.refresh(appt)
     return appt
 
 
-def save_chat_summary(db: Session, company_id: int, chat_id: int, summary: str, interest: str, provider: str = "gemini", model: str = "gemini-2.5-flash") -> ChatSummary:
+def save_chat_summary(db: Session, company_id: int, chat_id: int, summary: str, interest: str, provider: str = "gemini", model: str = "gemini-2.5-flash") -> ChatSummary | None:
+    if not _is_live_chat(db, chat_id, company_id):
+        return None
     row = (
         db.query(ChatSummary)
         .filter(ChatSummary.company_id == company_id, ChatSummary.chat_id == chat_id)
@@ -282,14 +349,14 @@ def save_chat_summary(db: Session, company_id: int, chat_id: int, summary: str,
             model=model,
         )
         db.add(row)
-    db.commit()
+    commit(db)
     db.refresh(row)
     return row
 
 def get_chat_summary(db: Session, company_id: int, chat_id: int) -> ChatSummary | None:
     return (
         db.query(ChatSummary)
-        .filter(ChatSummary.company_id == company_id, ChatSummary.chat_id == chat_id)
+        .filter(ChatSummary.company_id == company_id, ChatSummary.chat_id == chat_id, _live_chat(chat_id))
         .first()
     )
 
@@ -297,7 +364,7 @@ def get_chat_summary(db: Session, company_id: int, chat_id: int) -> ChatSummary
 def list_appointments_by_chat(db: Session, company_id: int, chat_id: int) -> list[Appointment]:
     return (
         db.query(Appointment)
-        .filter(Appointment.company_id == company_id, Appointment.chat_id == chat_id)
+        .filter(Appointment.company_id == company_id, Appointment.chat_id == chat_id, _live_chat(chat_id))
         .order_by(Appointment.start_at)
         .all()
     )
@@ -328,7 +395,7 @@ def update_appointment(db: Session, company_id: int, appointment_id: int, *, ass
         if exists:
             return None
         appt.start_at = start_at
-    db.commit()
+    commit(db)
     db.refresh(appt)
     return appt
 
@@ -342,7 +409,7 @@ def delete_appointment(db: Session, company_id: int, appointment_id: int) -> boo
     if not appt:
         return False
     db.delete(appt)
-    db.commit()
+    commit(db)
     return True
 
 
@@ -350,27 +417,45 @@ def get_messages_by_chat(db: Session, chat_id: int, limit: int = 50) -> List[Mes
     """Obtener mensajes de un chat específico"""
     return (
         db.query(Message)
-        .filter(Message.chat_id == chat_id)
+        .filter(Message.chat_id == chat_id, _live_chat(chat_id))
         .order_by(desc(Message.created_at))
         .limit(limit)
         .all()
     )
 
 
+def apply_message_statuses(db: Session, statuses: Dict[str, str]) -> List[Tuple[int, int, str, str]]:
+    """
+    Aplica ``whatsapp_message_id -> estado`` con un solo UPDATE sobre ``uq_messages_whatsapp_message_id``.
+
+    Solo avanza (ver ``MESSAGE_STATUS_RANK``): un ``delivered`` que llega después del
+    ``read`` no lo pisa. Retorna ``(id, chat_id, whatsapp_message_id, status)`` de las
+    filas que cambiaron; no confirma.
+    """
+    statuses = {key: value for key, value in statuses.items() if key and value in MESSAGE_STATUS_RANK}
+    if not statuses:
+        return []
+    new_rank = case({key: MESSAGE_STATUS_RANK[value] for key, value in statuses.items()}, value=Message.whatsapp_message_id)
+    current_rank = case(MESSAGE_STATUS_RANK, value=Message.status, else_=0)
+    stmt = (
+        update(Message)
+        .where(Message.whatsapp_message_id.in_(list(statuses)), current_rank < new_rank)
+        .values(status=case(statuses, value=Message.whatsapp_message_id))
+        .returning(Message.id, Message.chat_id, Message.whatsapp_message_id, Message.status)
+        .execution_options(synchronize_session=False)
+    )
+    return [tuple(row) for row in db.execute(stmt)]
+
+
 def update_message_status(db: Session, whatsapp_message_id: str, status: str) -> Optional[Message]:
-    """Actualizar el estado de un mensaje"""
-    message = (
+    """Actualizar el estado de un mensaje si avanza; los webhooks usan ``status_batcher``"""
+    apply_message_statuses(db, {whatsapp_message_id: status})
+    commit(db)
+    return (
         db.query(Message)
         .filter(Message.whatsapp_message_id == whatsapp_message_id)
         .first()
     )
-    
-    if message:
-        message.status = status
-        db.commit()
-        db.refresh(message)
-    
-    return message
 
 
 def list_tags(db: Session, company_id: int) -> List[ChatTag]:
@@ -380,7 +465,7 @@ def list_tags(db: Session, company_id: int) -> List[ChatTag]:
 def create_tag(db: Session, company_id: int, name: str) -> ChatTag:
     row = ChatTag(company_id=company_id, name=name)
     db.add(row)
-    db.commit()
+    commit(db)
     db.refresh(row)
     return row
 
@@ -391,91 +476,78 @@ def delete_tag(db: Session, company_id: int, tag_id: int) -> bool:
         return False
     db.query(ChatTagMap).filter(ChatTagMap.tag_id == tag_id).delete()
     db.delete(row)
-    db.commit()
+    commit(db)
     return True
 
 
-def set_chat_tags(db: Session, chat_id: int, tag_ids: List[int]) -> None:
+def set_chat_tags(db: Session, chat_id: int, tag_ids: List[int]) -> bool:
+    if not _is_live_chat(db, chat_id):
+        return False
     db.query(ChatTagMap).filter(ChatTagMap.chat_id == chat_id).delete()
     for tid in tag_ids:
         db.add(ChatTagMap(chat_id=chat_id, tag_id=tid))
-    db.commit()
+    commit(db)
+    return True
 
 
 def list_chat_tags(db: Session, chat_id: int) -> List[int]:
-    rows = db.query(ChatTagMap).filter(ChatTagMap.chat_id == chat_id).all()
+    rows = db.query(ChatTagMap).filter(ChatTagMap.chat_id == chat_id, _live_chat(chat_id)).all()
     return [r.tag_id for r in rows]
 
 
-def add_note(db: Session, company_id: int, chat_id: int, user_id: int, content: str) -> ChatNote:
+def add_note(db: Session, company_id: int, chat_id: int, user_id: int, content: str) -> ChatNote | None:
+    if not _is_live_chat(db, chat_id, company_id):
+        return None
     note = ChatNote(company_id=company_id, chat_id=chat_id, user_id=user_id, content=content)
     db.add(note)
-    db.commit()
+    db.add(ChatAudit(company_id=company_id, chat_id=chat_id, user_id=user_id, action="note", details=content[:200]))
+    commit(db)
     db.refresh(note)
-    try:
-        db.add(ChatAudit(company_id=company_id, chat_id=chat_id, user_id=user_id, action="note", details=content[:200]))
-        db.commit()
-    except Exception:
-        db.rollback()
     return note
 
 
 def list_notes(db: Session, company_id: int, chat_id: int) -> List[ChatNote]:
-    return db.query(ChatNote).filter(ChatNote.company_id == company_id, ChatNote.chat_id == chat_id).order_by(desc(ChatNote.created_at)).all()
+    return db.query(ChatNote).filter(ChatNote.company_id == company_id, ChatNote.chat_id == chat_id, _live_chat(chat_id)).order_by(desc(ChatNote.created_at)).all()
 
 
-def pin_chat(db: Session, chat_id: int, user_id: int) -> None:
+def pin_chat(db: Session, chat_id: int, user_id: int) -> bool:
+    if not _is_live_chat(db, chat_id):
+        return False
     exists_row = db.query(ChatPin).filter(ChatPin.chat_id == chat_id, ChatPin.user_id == user_id).first()
     if not exists_row:
         db.add(ChatPin(chat_id=chat_id, user_id=user_id))
-        db.commit()
+        commit(db)
+    return True
 
 
 def unpin_chat(db: Session, chat_id: int, user_id: int) -> None:
     db.query(ChatPin).filter(ChatPin.chat_id == chat_id, ChatPin.user_id == user_id).delete()
-    db.commit()
+    commit(db)
 
 
-def snooze_chat(db: Session, chat_id: int, user_id: int, until_at) -> None:
+def snooze_chat(db: Session, chat_id: int, user_id: int, until_at) -> bool:
+    if not _is_live_chat(db, chat_id):
+        return False
     row = db.query(ChatSnooze).filter(ChatSnooze.chat_id == chat_id, ChatSnooze.user_id == user_id).first()
     if row:
         row.until_at = until_at
     else:
         db.add(ChatSnooze(chat_id=chat_id, user_id=user_id, until_at=until_at))
-    db.commit()
+    commit(db)
+    return True
 
 
 def unsnooze_chat(db: Session, chat_id: int, user_id: int) -> None:
     db.query(ChatSnooze).filter(ChatSnooze.chat_id == chat_id, ChatSnooze.user_id == user_id).delete()
-    db.commit()
-
-
-def bulk_update_chats(db: Session, company_id: int, chat_ids: List[int], *, status: Optional[str] = None, priority: Optional[str] = None, assigned_user_id: Optional[int] = None) -> int:
-    q = db.query(Chat).filter(Chat.company_id == company_id, Chat.id.in_(chat_ids))
-    updates: dict = {}
-    if status is not None:
-        updates[Chat.status] = status
-    if priority is not None:
-        updates[Chat.priority] = priority
-    if assigned_user_id is not None:
-        updates[Chat.assigned_user_id] = assigned_user_id
-    count = q.update(updates, synchronize_session=False) if updates else 0
-    db.commit()
-    return count
-
-
-def bulk_set_tags_for_chats(db: Session, chat_ids: List[int], tag_ids: List[int]) -> None:
-    db.query(ChatTagMap).filter(ChatTagMap.chat_id.in_(chat_ids)).delete(synchronize_session=False)
-    for cid in chat_ids:
-        for tid in tag_ids:
-            db.add(ChatTagMap(chat_id=cid, tag_id=tid))
-    db.commit()
+    commit(db)
 
 
 def list_appointments_by_user(db: Session, company_id: int, user_id: int, date_from, date_to) -> List[Appointment]:
     return (
         db.query(Appointment)
+        .join(Chat, Chat.id == Appointment.chat_id)
         .filter(
+            Chat.deleted_at.is_(None),
             Appointment.company_id == company_id,
             Appointment.assigned_user_id == user_id,
             Appointment.start_at >= date_from,
@@ -2,10 +2,15 @@ from sqlalchemy.orm import Session
 from sqlalchemy import select
 from app.models.companies.company import Company
 from app.schemas.companies.company import CompanyCreate, CompanyUpdate, YCloudConfig
+from app.models.system.deletion import DeletionJob
+from app.services.deletion import soft_delete_company
+from app.services.phones import normalize_phone
 
 
 def list_companies(db: Session) -> list[Company]:
-  return list(db.scalars(select(Company).order_by(Company.created_at.desc())))
+  return list(db.scalars(
+    select(Company).where(Company.deleted_at.is_(None)).order_by(Company.created_at.desc())
+  ))
 
 
 def create_company(db: Session, payload: CompanyCreate) -> Company:
@@ -27,11 +32,14 @@ def create_company(db: Session, payload: CompanyCreate) -> Company:
 
 
 def get_company(db: Session, company_id: int) -> Company | None:
-  return db.get(Company, company_id)
+  company = db.get(Company, company_id)
+  if company is None or company.deleted_at is not None:
+    return None
+  return company
 
 
 def update_company(db: Session, company_id: int, payload: CompanyUpdate) -> Company | None:
-  company = db.get(Company, company_id)
+  company = get_company(db, company_id)
   if not company:
     return None
   for field, value in payload.model_dump(exclude_unset=True).items():
@@ -41,18 +49,14 @@ def update_company(db: Session, company_id: int, payload: CompanyUpdate) -> Comp
   return company
 
 
-def delete_company(db: Session, company_id: int) -> bool:
-  company = db.get(Company, company_id)
-  if not company:
-    return False
-  db.delete(company)
-  db.commit()
-  return True
+def delete_company(db: Session, company_id: int) -> DeletionJob | None:
+  """Borrado lógico inmediato; chats, etiquetas, plantillas y media se borran en segundo plano"""
+  return soft_delete_company(db, company_id)
 
 
 def update_ycloud_config(db: Session, company_id: int, config: YCloudConfig) -> Company | None:
     """Actualizar la configuración de YCloud para una empresa"""
-    company = db.get(Company, company_id)
+    company = get_company(db, company_id)
     if not company:
         return None
     
@@ -60,7 +64,7 @@ def update_ycloud_config(db: Session, company_id: int, config: YCloudConfig) ->
     if config.api_key is not None:
         company.ycloud_api_key = config.api_key
     if config.phone_number is not None:
-        company.whatsapp_phone_number = config.phone_number
+        company.whatsapp_phone_number = normalize_phone(config.phone_number)
     if config.webhook_url is not None:
         company.ycloud_webhook_url = config.webhook_url
     
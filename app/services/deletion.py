@@ -0,0 +1,282 @@
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+from app.db.unit_of_work import commit, on_commit
+from app.models.chats.chat import (
+    Chat,
+    Message,
+    ChatSummary,
+    Appointment,
+    ChatTag,
+    ChatTagMap,
+    ChatNote,
+    ChatPin,
+    ChatSnooze,
+    ChatAudit,
+)
+from app.models.companies.company import Company
+from app.models.companies.sticker import CompanySticker
+from app.models.templates.template import Template, TemplateItem
+from app.models.auto_replies.auto_reply import AutoReplyRule
+from app.models.assignments.assignment import AssignmentAgent, AssignmentPolicy
+from app.models.users.user import User
+from app.models.system.deletion import DeletionJob
+from app.services.assignment import assignment_engine
+from app.services.chats import forget_chat
+from app.services.media_handler import media_handler
+
+logger = logging.getLogger(__name__)
+
+# Tablas que referencian chats.id, en el orden en que se vacían
+CHAT_DEPENDENTS = (Message, ChatSummary, Appointment, ChatTagMap, ChatNote, ChatPin, ChatSnooze, ChatAudit)
+# Reintentos antes de marcar un borrado como fallido
+MAX_ATTEMPTS = 5
+
+
+class _Interrupted(Exception):
+    """El planificador se está deteniendo; el job se retoma en la próxima ejecución"""
+
+
+def _wake_worker() -> None:
+    from app.services.maintenance import maintenance_scheduler
+    maintenance_scheduler.trigger("cascade_deletions")
+
+
+def soft_delete_chat(db: Session, company_id: int, chat_id: int) -> Optional[DeletionJob]:
+    """
+    Marca el chat como eliminado y encola el borrado de sus datos.
+
+    El chat deja de aparecer en las consultas de inmediato; mensajes, notas, etiquetas,
+    citas, auditoría y archivos multimedia se eliminan después en segundo plano.
+    """
+    chat = (
+        db.query(Chat)
+        .filter(Chat.id == chat_id, Chat.company_id == company_id, Chat.deleted_at.is_(None))
+        .first()
+    )
+    if not chat:
+        return None
+    chat.deleted_at = datetime.utcnow()
+    job = DeletionJob(entity="chat", entity_id=chat_id, company_id=company_id)
+    db.add(job)
+    phone_number = chat.phone_number
+    previous = (chat.assigned_user_id, chat.status)
+
+    def _after_commit() -> None:
+        forget_chat(company_id, phone_number)
+        assignment_engine.chat_changed(company_id, chat_id, previous, (None, None))
+        _wake_worker()
+
+    on_commit(db, _after_commit)
+    commit(db)
+    return job
+
+
+def soft_delete_company(db: Session, company_id: int) -> Optional[DeletionJob]:
+    """Marca la empresa y todos sus chats como eliminados y encola el borrado en cascada"""
+    company = db.get(Company, company_id)
+    if not company or company.deleted_at is not None:
+        return None
+    now = datetime.utcnow()
+    company.deleted_at = now
+    db.execute(
+        update(Chat)
+        .where(Chat.company_id == company_id, Chat.deleted_at.is_(None))
+        .values(deleted_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    job = DeletionJob(entity="company", entity_id=company_id, company_id=company_id)
+    db.add(job)
+
+    def _after_commit() -> None:
+        assignment_engine.forget_company(company_id)
+        _wake_worker()
+
+    on_commit(db, _after_commit)
+    commit(db)
+    return job
+
+
+def get_deletion_job(db: Session, job_id: int) -> Optional[DeletionJob]:
+    return db.get(DeletionJob, job_id)
+
+
+def list_deletion_jobs(db: Session, status: Optional[str] = None, limit: int = 50) -> List[DeletionJob]:
+    query = db.query(DeletionJob)
+    if status:
+        query = query.filter(DeletionJob.status == status)
+    return query.order_by(DeletionJob.id.desc()).limit(limit).all()
+
+
+class _CascadeRunner:
+    """Ejecuta un DeletionJob en lotes cortos, registrando el avance en cada transacción"""
+
+    def __init__(self, ctx, job_id: int) -> None:
+        self.ctx = ctx
+        self.engine = ctx.engine
+        self.batch_size = ctx.batch_size
+        self.job_id = job_id
+        self.rows = 0
+
+    def _progress(self, conn, step: str, rows: int = 0, files: int = 0) -> None:
+        conn.execute(
+            update(DeletionJob)
+            .where(DeletionJob.id == self.job_id)
+            .values(
+                step=step,
+                rows_deleted=DeletionJob.rows_deleted + rows,
+                files_deleted=DeletionJob.files_deleted + files,
+            )
+        )
+
+    def _pause(self) -> None:
+        self.ctx.scheduler.yield_to_foreground()
+        if self.ctx.scheduler.stopping:
+            raise _Interrupted()
+
+    def batches(self, step: str, build_statement) -> None:
+        """Repite ``build_statement(limit)`` hasta que afecte menos filas que el lote"""
+        while True:
+            with self.engine.begin() as conn:
+                affected = conn.execute(build_statement(self.batch_size)).rowcount or 0
+                self._progress(conn, step, rows=affected)
+            self.rows += affected
+            if affected < self.batch_size:
+                return
+            self._pause()
+
+    def delete_where(self, model, condition) -> None:
+        self.batches(model.__tablename__, lambda limit: delete(model).where(
+            model.id.in_(select(model.id).where(condition).limit(limit))
+        ))
+
+    def remove_tree(self, path: Path) -> None:
+        """Borra un directorio de media archivo por archivo, cediendo entre lotes"""
+        if not path.is_dir():
+            return
+        pending = 0
+        for root, dirs, files in os.walk(path, topdown=False):
+            for name in files:
+                try:
+                    os.remove(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                pending += 1
+                if pending >= self.batch_size:
+                    with self.engine.begin() as conn:
+                        self._progress(conn, "media", files=pending)
+                    pending = 0
+                    self._pause()
+            for name in dirs:
+                try:
+                    os.rmdir(os.path.join(root, name))
+                except OSError:
+                    pass
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+        with self.engine.begin() as conn:
+            self._progress(conn, "media", files=pending)
+
+    def delete_chats(self, chat_scope, media_dirs: List[Path]) -> None:
+        for model in CHAT_DEPENDENTS:
+            self.delete_where(model, model.chat_id.in_(chat_scope))
+        for path in media_dirs:
+            self.remove_tree(path)
+        self.delete_where(Chat, Chat.id.in_(chat_scope))
+
+
+def _company_media_dir(company_id: int) -> Path:
+    return media_handler.base_media_path / f"company_{company_id}"
+
+
+def _run_chat_job(runner: _CascadeRunner, job: Dict[str, Any]) -> None:
+    chat_id, company_id = job["entity_id"], job["company_id"]
+    scope = select(Chat.id).where(Chat.id == chat_id, Chat.deleted_at.is_not(None))
+    media_dir = _company_media_dir(company_id) / "whatsapp" / f"chat_{chat_id}"
+    runner.delete_chats(scope, [media_dir])
+
+
+def _run_company_job(runner: _CascadeRunner, job: Dict[str, Any]) -> None:
+    company_id = job["entity_id"]
+    runner.delete_chats(select(Chat.id).where(Chat.company_id == company_id), [_company_media_dir(company_id)])
+    runner.delete_where(ChatTag, ChatTag.company_id == company_id)
+    runner.delete_where(CompanySticker, CompanySticker.company_id == company_id)
+    runner.delete_where(AutoReplyRule, AutoReplyRule.company_id == company_id)
+    runner.delete_where(AssignmentAgent, AssignmentAgent.company_id == company_id)
+    runner.delete_where(AssignmentPolicy, AssignmentPolicy.company_id == company_id)
+    runner.delete_where(TemplateItem, TemplateItem.template_id.in_(select(Template.id).where(Template.company_id == company_id)))
+    runner.delete_where(Template, Template.company_id == company_id)
+    # Los usuarios se conservan, desvinculados de la empresa
+    runner.batches("users", lambda limit: update(User).where(
+        User.id.in_(select(User.id).where(User.company_id == company_id).limit(limit))
+    ).values(company_id=None))
+    runner.batches("companies", lambda limit: delete(Company).where(
+        Company.id == company_id, Company.deleted_at.is_not(None)
+    ))
+
+
+_RUNNERS = {"chat": _run_chat_job, "company": _run_company_job}
+
+
+def process_deletions(ctx) -> int:
+    """Job de mantenimiento: avanza los borrados pendientes, del más antiguo al más nuevo"""
+    engine = ctx.engine
+    with engine.connect() as conn:
+        jobs = [
+            dict(row._mapping)
+            for row in conn.execute(
+                select(DeletionJob.id, DeletionJob.entity, DeletionJob.entity_id, DeletionJob.company_id, DeletionJob.attempts)
+                .where(DeletionJob.status.in_(("pending", "running")))
+                .order_by(DeletionJob.id)
+                .limit(20)
+            )
+        ]
+    total = 0
+    finished = 0
+    for job in jobs:
+        if ctx.scheduler.stopping:
+            break
+        # Reclamo compare-and-set: solo gana el worker que ve el mismo intento que leyó.
+        # Un job "running" de un worker caído se retoma porque el lease del planificador
+        # garantiza que nadie más lo está ejecutando
+        with engine.begin() as conn:
+            claimed = conn.execute(
+                update(DeletionJob)
+                .where(
+                    DeletionJob.id == job["id"],
+                    DeletionJob.status.in_(("pending", "running")),
+                    DeletionJob.attempts == job["attempts"],
+                )
+                .values(status="running", started_at=datetime.utcnow(), attempts=DeletionJob.attempts + 1, error=None)
+            ).rowcount
+        if not claimed:
+            continue
+        runner = _CascadeRunner(ctx, job["id"])
+        try:
+            _RUNNERS[job["entity"]](runner, job)
+        except _Interrupted:
+            total += runner.rows
+            break
+        except Exception as e:
+            logger.warning(f"Borrado en cascada {job['entity']} {job['entity_id']} falló: {e}")
+            status = "failed" if job["attempts"] + 1 >= MAX_ATTEMPTS else "pending"
+            with engine.begin() as conn:
+                conn.execute(update(DeletionJob).where(DeletionJob.id == job["id"]).values(status=status, error=str(e)))
+            total += runner.rows
+            continue
+        with engine.begin() as conn:
+            conn.execute(
+                update(DeletionJob)
+                .where(DeletionJob.id == job["id"])
+                .values(status="done", step=None, finished_at=datetime.utcnow())
+            )
+        total += runner.rows
+        finished += 1
+    ctx.detail = f"completados={finished} pendientes={len(jobs) - finished}"
+    return total
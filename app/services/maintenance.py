@@ -0,0 +1,380 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from sqlalchemy import delete, select, exists, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from app.core.config import settings
+from app.db.session import engine as default_engine
+from app.models.chats.chat import Chat, ChatTagMap, ChatSnooze, ChatAudit
+from app.models.system.maintenance import MaintenanceLease
+from app.services.backup import create_snapshot, apply_retention
+from app.services.deletion import process_deletions
+
+logger = logging.getLogger(__name__)
+
+
+class ForegroundLoad:
+  """Cuenta las peticiones HTTP en curso para que el mantenimiento ceda ante la carga"""
+
+  def __init__(self) -> None:
+    self._active = 0
+    self._lock = threading.Lock()
+
+  def enter(self) -> None:
+    with self._lock:
+      self._active += 1
+
+  def exit(self) -> None:
+    with self._lock:
+      self._active = max(0, self._active - 1)
+
+  @property
+  def active(self) -> int:
+    return self._active
+
+
+load_monitor = ForegroundLoad()
+
+
+@dataclass
+class JobStatus:
+  runs: int = 0
+  total_rows: int = 0
+  last_started_at: Optional[datetime] = None
+  last_duration_ms: Optional[float] = None
+  last_rows: Optional[int] = None
+  last_detail: Optional[str] = None
+  last_error: Optional[str] = None
+
+
+@dataclass
+class MaintenanceJob:
+  name: str
+  interval_seconds: int
+  func: Callable[["JobContext"], int]
+  status: JobStatus = field(default_factory=JobStatus)
+  next_run_at: float = 0.0
+
+
+class JobContext:
+  def __init__(self, scheduler: "MaintenanceScheduler") -> None:
+    self.scheduler = scheduler
+    self.engine = scheduler.engine
+    self.batch_size = scheduler.batch_size
+    self.detail: Optional[str] = None
+
+  def delete_in_batches(self, build_statement: Callable[[int], Any]) -> int:
+    """Ejecuta un DELETE acotado por lotes, cada uno en su propia transacción corta"""
+    total = 0
+    while not self.scheduler.stopping:
+      with self.engine.begin() as conn:
+        deleted = conn.execute(build_statement(self.batch_size)).rowcount or 0
+      total += deleted
+      if deleted < self.batch_size:
+        break
+      self.scheduler.yield_to_foreground()
+    return total
+
+
+def purge_expired_snoozes(ctx: JobContext) -> int:
+  now = datetime.utcnow()
+  return ctx.delete_in_batches(lambda limit: delete(ChatSnooze).where(
+    ChatSnooze.id.in_(select(ChatSnooze.id).where(ChatSnooze.until_at < now).limit(limit))
+  ))
+
+
+def purge_old_audit(ctx: JobContext) -> int:
+  if settings.audit_retention_days <= 0:
+    ctx.detail = "retención deshabilitada"
+    return 0
+  cutoff = datetime.utcnow() - timedelta(days=settings.audit_retention_days)
+  return ctx.delete_in_batches(lambda limit: delete(ChatAudit).where(
+    ChatAudit.id.in_(select(ChatAudit.id).where(ChatAudit.created_at < cutoff).limit(limit))
+  ))
+
+
+def purge_orphan_tag_maps(ctx: JobContext) -> int:
+  orphan = ~exists().where(Chat.id == ChatTagMap.chat_id)
+  return ctx.delete_in_batches(lambda limit: delete(ChatTagMap).where(
+    ChatTagMap.id.in_(select(ChatTagMap.id).where(orphan).limit(limit))
+  ))
+
+
+def optimize_statistics(ctx: JobContext) -> int:
+  with ctx.engine.connect() as conn:
+    conn.exec_driver_sql("PRAGMA optimize")
+  return 0
+
+
+def checkpoint_wal(ctx: JobContext) -> int:
+  # PASSIVE nunca espera a lectores ni escritores
+  with ctx.engine.connect() as conn:
+    busy, log_pages, checkpointed = conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+  ctx.detail = f"busy={busy} log={log_pages}"
+  return max(0, checkpointed or 0)
+
+
+def incremental_vacuum(ctx: JobContext) -> int:
+  with ctx.engine.connect() as conn:
+    mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+    if mode != 2:
+      ctx.detail = "auto_vacuum no es INCREMENTAL; requiere VACUUM manual"
+      return 0
+    before = conn.exec_driver_sql("PRAGMA freelist_count").scalar() or 0
+    conn.exec_driver_sql(f"PRAGMA incremental_vacuum({int(settings.maintenance_vacuum_pages)})")
+    conn.commit()
+    after = conn.exec_driver_sql("PRAGMA freelist_count").scalar() or 0
+  return max(0, before - after)
+
+
+def backup_database(ctx: JobContext) -> int:
+  source = ctx.engine.url.database
+  if not source or source == ":memory:":
+    ctx.detail = "base en memoria; sin backup"
+    return 0
+  result = create_snapshot(source)
+  removed = apply_retention()
+  ctx.detail = (
+    f"{os.path.basename(result.path)} {result.throughput_mb_s} MB/s "
+    f"max_step={result.max_step_ms}ms restarts={result.restarts} retención={len(removed)}"
+  )
+  return result.pages
+
+
+def default_jobs() -> List[MaintenanceJob]:
+  return [
+    MaintenanceJob("purge_expired_snoozes", settings.maintenance_purge_interval, purge_expired_snoozes),
+    MaintenanceJob("purge_old_audit", settings.maintenance_purge_interval, purge_old_audit),
+    MaintenanceJob("purge_orphan_tag_maps", settings.maintenance_purge_interval, purge_orphan_tag_maps),
+    MaintenanceJob("optimize", settings.maintenance_optimize_interval, optimize_statistics),
+    MaintenanceJob("wal_checkpoint", settings.maintenance_checkpoint_interval, checkpoint_wal),
+    MaintenanceJob("incremental_vacuum", settings.maintenance_vacuum_interval, incremental_vacuum),
+    MaintenanceJob("backup", settings.backup_interval, backup_database),
+    MaintenanceJob("cascade_deletions", settings.deletion_interval, process_deletions),
+  ]
+
+
+class MaintenanceScheduler:
+  """
+  Ejecuta jobs de mantenimiento de SQLite en un hilo propio, fuera del camino de las peticiones.
+
+  Antes de cada job y entre lotes espera a que la carga de peticiones baje del umbral
+  configurado (con un tope de espera para no posponer el mantenimiento indefinidamente).
+  """
+
+  def __init__(
+    self,
+    engine: Engine,
+    jobs: List[MaintenanceJob],
+    *,
+    load: ForegroundLoad = load_monitor,
+    batch_size: int = 500,
+    busy_threshold: int = 4,
+    batch_pause: float = 0.05,
+    max_yield_seconds: float = 30.0,
+    tick_seconds: float = 1.0,
+    lease_seconds: float = 120.0,
+  ) -> None:
+    self.engine = engine
+    self.jobs: Dict[str, MaintenanceJob] = {job.name: job for job in jobs}
+    self.load = load
+    self.batch_size = batch_size
+    self.busy_threshold = busy_threshold
+    self.batch_pause = batch_pause
+    self.max_yield_seconds = max_yield_seconds
+    self.tick_seconds = tick_seconds
+    self.lease_seconds = lease_seconds
+    # Identifica a este proceso en maintenance_leases
+    self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    self._lease_name: Optional[str] = None
+    self._lease_renewed_at = 0.0
+    self._stop = threading.Event()
+    self._thread: Optional[threading.Thread] = None
+    self._run_lock = threading.Lock()
+
+  @property
+  def stopping(self) -> bool:
+    return self._stop.is_set()
+
+  @property
+  def running(self) -> bool:
+    return self._thread is not None and self._thread.is_alive()
+
+  def start(self) -> None:
+    if self.running:
+      return
+    self._stop.clear()
+    now = time.monotonic()
+    for index, job in enumerate(self.jobs.values()):
+      # Escalonar la primera ejecución para no lanzar todos los jobs a la vez
+      job.next_run_at = now + min(job.interval_seconds, 60 + index * 15)
+    self._thread = threading.Thread(target=self._loop, name="maintenance-scheduler", daemon=True)
+    self._thread.start()
+
+  def stop(self, timeout: float = 5.0) -> None:
+    self._stop.set()
+    if self._thread is not None:
+      self._thread.join(timeout)
+      self._thread = None
+
+  def trigger(self, name: str) -> None:
+    """Adelanta la próxima ejecución de un job al siguiente tick del planificador"""
+    job = self.jobs.get(name)
+    if job is not None:
+      job.next_run_at = 0.0
+
+  def _claim(self, job: MaintenanceJob, due_only: bool) -> bool:
+    """
+    Toma el lease del job en ``maintenance_leases`` para este proceso.
+
+    El upsert solo reemplaza un lease vencido (y, si ``due_only``, cuya próxima ejecución
+    ya llegó); el rowcount indica si este worker ganó. Así, con varios workers sobre la
+    misma base, cada job corre una vez por intervalo en un único proceso.
+    """
+    now = time.time()
+    interval = job.interval_seconds if job.interval_seconds > 0 else 0
+    stmt = sqlite_insert(MaintenanceLease).values(
+      name=job.name, owner=self.owner, expires_at=now + self.lease_seconds, next_run_at=now + interval,
+    )
+    free = MaintenanceLease.expires_at < now
+    if due_only:
+      free = free & (MaintenanceLease.next_run_at <= now)
+    stmt = stmt.on_conflict_do_update(
+      index_elements=[MaintenanceLease.name],
+      set_={"owner": stmt.excluded.owner, "expires_at": stmt.excluded.expires_at, "next_run_at": stmt.excluded.next_run_at},
+      where=free,
+    )
+    with self.engine.begin() as conn:
+      claimed = (conn.execute(stmt).rowcount or 0) == 1
+    if claimed:
+      self._lease_name = job.name
+      self._lease_renewed_at = now
+    return claimed
+
+  def _renew_lease(self) -> None:
+    """Extiende el lease del job en curso; se llama entre lotes, como mucho cada tercio de su vigencia"""
+    now = time.time()
+    if self._lease_name is None or now - self._lease_renewed_at < self.lease_seconds / 3:
+      return
+    with self.engine.begin() as conn:
+      conn.execute(
+        update(MaintenanceLease)
+        .where(MaintenanceLease.name == self._lease_name, MaintenanceLease.owner == self.owner)
+        .values(expires_at=now + self.lease_seconds)
+      )
+    self._lease_renewed_at = now
+
+  def _release(self, job: MaintenanceJob) -> None:
+    with self.engine.begin() as conn:
+      conn.execute(
+        update(MaintenanceLease)
+        .where(MaintenanceLease.name == job.name, MaintenanceLease.owner == self.owner)
+        .values(owner=None, expires_at=0)
+      )
+    self._lease_name = None
+
+  def yield_to_foreground(self) -> None:
+    """Pausa breve entre lotes y espera mientras haya demasiadas peticiones activas"""
+    self._renew_lease()
+    if self._stop.wait(self.batch_pause):
+      return
+    waited = 0.0
+    while self.load.active >= self.busy_threshold and waited < self.max_yield_seconds:
+      if self._stop.wait(0.1):
+        return
+      waited += 0.1
+
+  def run_job(self, name: str, *, due_only: bool = False) -> Optional[JobStatus]:
+    """
+    Ejecuta el job si este proceso obtiene su lease.
+
+    Retorna ``None`` cuando otro worker lo está ejecutando o, con ``due_only``, cuando
+    otro worker ya lo ejecutó en el intervalo actual.
+    """
+    job = self.jobs[name]
+    with self._run_lock:
+      try:
+        claimed = self._claim(job, due_only)
+      except Exception as e:
+        logger.warning(f"No se pudo tomar el lease del job {name}: {e}")
+        return None
+      if not claimed:
+        return None
+      ctx = JobContext(self)
+      status = job.status
+      status.last_started_at = datetime.utcnow()
+      started = time.perf_counter()
+      try:
+        rows = job.func(ctx)
+        status.last_rows = rows
+        status.total_rows += rows
+        status.last_error = None
+      except Exception as e:
+        logger.warning(f"Job de mantenimiento {name} falló: {e}")
+        status.last_rows = None
+        status.last_error = str(e)
+      finally:
+        try:
+          self._release(job)
+        except Exception as e:
+          # El lease vence solo; otro worker lo retoma tras lease_seconds
+          logger.warning(f"No se pudo liberar el lease del job {name}: {e}")
+          self._lease_name = None
+      status.last_duration_ms = round((time.perf_counter() - started) * 1000, 2)
+      status.last_detail = ctx.detail
+      status.runs += 1
+    return status
+
+  def _loop(self) -> None:
+    while not self._stop.wait(self.tick_seconds):
+      for job in list(self.jobs.values()):
+        if self._stop.is_set():
+          return
+        if job.interval_seconds <= 0 or time.monotonic() < job.next_run_at:
+          continue
+        # trigger() pone next_run_at en 0: se ejecuta aunque otro worker ya haya cubierto el intervalo
+        forced = job.next_run_at == 0.0
+        self.yield_to_foreground()
+        self.run_job(job.name, due_only=not forced)
+        job.next_run_at = time.monotonic() + job.interval_seconds
+
+  def status(self) -> Dict[str, Any]:
+    now = time.monotonic()
+    jobs = []
+    for job in self.jobs.values():
+      jobs.append({
+        "name": job.name,
+        "interval_seconds": job.interval_seconds,
+        "enabled": job.interval_seconds > 0,
+        "next_run_in_seconds": round(max(0.0, job.next_run_at - now), 1) if self.running and job.interval_seconds > 0 else None,
+        "runs": job.status.runs,
+        "total_rows": job.status.total_rows,
+        "last_started_at": job.status.last_started_at,
+        "last_duration_ms": job.status.last_duration_ms,
+        "last_rows": job.status.last_rows,
+        "last_detail": job.status.last_detail,
+        "last_error": job.status.last_error,
+      })
+    return {
+      "running": self.running,
+      "foreground_requests": self.load.active,
+      "busy_threshold": self.busy_threshold,
+      "batch_size": self.batch_size,
+      "jobs": jobs,
+    }
+
+
+maintenance_scheduler = MaintenanceScheduler(
+  default_engine,
+  default_jobs(),
+  batch_size=settings.maintenance_batch_size,
+  busy_threshold=settings.maintenance_busy_requests,
+  lease_seconds=settings.maintenance_lease_seconds,
+)
@@ -0,0 +1,82 @@
+import threading
+from typing import Dict, List, Optional
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.chats.chat import Message
+from app.services.cache import LRUCache
+
+
+def _keys(whatsapp_message_id: Optional[str], wamid: Optional[str]) -> List[tuple]:
+  keys = []
+  if whatsapp_message_id:
+    keys.append(("id", whatsapp_message_id))
+  if wamid:
+    keys.append(("wamid", wamid))
+  return keys
+
+
+def find_message_id(db: Session, whatsapp_message_id: Optional[str], wamid: Optional[str]) -> Optional[int]:
+  """Id del mensaje ya guardado con ese id de YCloud o wamid (ambos con índice único)"""
+  conditions = []
+  if whatsapp_message_id:
+    conditions.append(Message.whatsapp_message_id == whatsapp_message_id)
+  if wamid:
+    conditions.append(Message.wamid == wamid)
+  if not conditions:
+    return None
+  return db.execute(select(Message.id).where(or_(*conditions)).limit(1)).scalar()
+
+
+class InboundDedupe:
+  """
+  Reconoce los reintentos de webhooks de YCloud por id de mensaje y wamid.
+
+  Una LRU en memoria con los ids recientes responde en O(1) en el endpoint, antes de
+  encolar; detrás quedan la consulta del worker antes de descargar adjuntos y los
+  índices únicos de ``messages``, que cubren lo que la LRU no ve (otros procesos,
+  reinicios, ids ya desalojados).
+  """
+
+  def __init__(self, maxsize: int = 50000) -> None:
+    self.recent = LRUCache(maxsize=maxsize)
+    self._lock = threading.Lock()
+    self.checked = 0
+    self.recent_hits = 0
+    self.stored_hits = 0
+
+  def seen(self, whatsapp_message_id: Optional[str], wamid: Optional[str]) -> bool:
+    """True si el mensaje ya pasó por este proceso; cuenta cada consulta para la tasa de duplicados"""
+    keys = _keys(whatsapp_message_id, wamid)
+    if not keys:
+      return False
+    hit = any(key in self.recent for key in keys)
+    with self._lock:
+      self.checked += 1
+      self.recent_hits += hit
+    return hit
+
+  def remember(self, whatsapp_message_id: Optional[str], wamid: Optional[str]) -> None:
+    for key in _keys(whatsapp_message_id, wamid):
+      self.recent.put(key, True)
+
+  def record_stored_duplicate(self, whatsapp_message_id: Optional[str], wamid: Optional[str]) -> None:
+    """Un duplicado que pasó la LRU y lo detectó la base; se recuerda para los siguientes reintentos"""
+    with self._lock:
+      self.stored_hits += 1
+    self.remember(whatsapp_message_id, wamid)
+
+  def stats(self) -> Dict[str, Optional[float]]:
+    duplicates = self.recent_hits + self.stored_hits
+    return {
+      "checked": self.checked,
+      "duplicates": duplicates,
+      "recent_hits": self.recent_hits,
+      "stored_hits": self.stored_hits,
+      "duplicate_rate": round(duplicates / self.checked, 4) if self.checked else None,
+      "recent_ids": len(self.recent),
+      "max_recent_ids": self.recent.maxsize,
+    }
+
+
+inbound_dedupe = InboundDedupe(settings.message_id_cache_size)
@@ -0,0 +1,215 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.unit_of_work import commit
+from app.models.chats.chat import Chat, Message
+from app.services.chats import MESSAGE_STATUS_RANK, apply_message_statuses
+from app.services.realtime import manager
+
+logger = logging.getLogger(__name__)
+
+STATUS_EVENT = "message.status"
+# Ids por sentencia: cada uno aparece en el IN y en los dos CASE del UPDATE
+CHUNK_SIZE = 300
+
+
+def _session() -> Session:
+  from app.db.session import SessionLocal
+  return SessionLocal()
+
+
+def _advance(current: Optional[str], status: str) -> str:
+  if current is None or MESSAGE_STATUS_RANK[status] > MESSAGE_STATUS_RANK[current]:
+    return status
+  return current
+
+
+class MessageStatusBatcher:
+  """
+  Agrupa los ``whatsapp.message.updated`` de YCloud y los aplica por lotes.
+
+  Los acuses de entrega y lectura superan varias veces a los mensajes entrantes. En
+  lugar de un commit por evento, se acumulan durante ``window`` segundos (o hasta
+  ``max_batch`` ids), se fusionan por mensaje quedándose con el estado más avanzado, y
+  cada lote es un UPDATE por índice que solo avanza estados. Por cada chat con cambios
+  sale un único evento ``message.status`` con todos sus mensajes.
+
+  Un acuse puede llegar antes de que el envío guarde su mensaje: los ids sin fila se
+  reintentan en los lotes siguientes durante ``orphan_ttl`` segundos. Los acuses
+  pendientes viven en memoria; al apagar se aplican antes de salir.
+  """
+
+  def __init__(
+    self,
+    session_factory: Callable[[], Session] = _session,
+    *,
+    window: float = 0.2,
+    max_batch: int = 500,
+    orphan_ttl: float = 10.0,
+  ) -> None:
+    self.session_factory = session_factory
+    self.window = window
+    self.max_batch = max_batch
+    self.orphan_ttl = orphan_ttl
+    self._pending: Dict[str, str] = {}
+    # whatsapp_message_id -> (estado, primera vez visto) de acuses cuyo mensaje aún no existe
+    self._orphans: Dict[str, Tuple[str, float]] = {}
+    self._lock = threading.Lock()
+    self._flush_lock = threading.Lock()
+    self._wake = threading.Event()
+    self._stop = threading.Event()
+    self._thread: Optional[threading.Thread] = None
+    self.received = 0
+    self.merged = 0
+    self.batches = 0
+    self.updated = 0
+    self.stale = 0
+    self.orphaned = 0
+    self.events = 0
+    self.errors = 0
+
+  @property
+  def running(self) -> bool:
+    return self._thread is not None and self._thread.is_alive()
+
+  def submit(self, whatsapp_message_id: Optional[str], status: Optional[str]) -> None:
+    """Registra un acuse; sin el hilo en marcha (pruebas, arranque) se aplica de inmediato"""
+    if not whatsapp_message_id or status not in MESSAGE_STATUS_RANK:
+      return
+    with self._lock:
+      self.received += 1
+      current = self._pending.get(whatsapp_message_id)
+      self.merged += current is not None
+      self._pending[whatsapp_message_id] = _advance(current, status)
+      full = len(self._pending) >= self.max_batch
+    if not self.running:
+      self.flush()
+    elif full:
+      self._wake.set()
+
+  def start(self) -> None:
+    if self.running:
+      return
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._loop, name="message-status-batcher", daemon=True)
+    self._thread.start()
+
+  def stop(self, timeout: float = 5.0) -> None:
+    self._stop.set()
+    self._wake.set()
+    if self._thread is not None:
+      self._thread.join(timeout)
+      self._thread = None
+    self.flush()
+
+  def _loop(self) -> None:
+    while not self._stop.is_set():
+      self._wake.wait(self.window)
+      self._wake.clear()
+      if self._stop.is_set():
+        return
+      self.flush()
+
+  def _take(self) -> Dict[str, str]:
+    with self._lock:
+      batch, self._pending = self._pending, {}
+      now = time.time()
+      for key, (status, first_seen) in list(self._orphans.items()):
+        if now - first_seen > self.orphan_ttl:
+          del self._orphans[key]
+          self.orphaned += 1
+          continue
+        batch[key] = _advance(batch.get(key), status)
+    return batch
+
+  def _restore(self, batch: Dict[str, str]) -> None:
+    with self._lock:
+      for key, status in batch.items():
+        self._pending[key] = _advance(self._pending.get(key), status)
+
+  def flush(self) -> int:
+    """Aplica lo acumulado; retorna cuántos mensajes cambiaron de estado"""
+    with self._flush_lock:
+      batch = self._take()
+      if not batch:
+        return 0
+      db = self.session_factory()
+      try:
+        changed = self._apply(db, batch)
+      except Exception as e:
+        db.rollback()
+        self.errors += 1
+        self._restore(batch)
+        logger.warning(f"No se pudieron aplicar {len(batch)} estados de mensajes: {e}")
+        return 0
+      finally:
+        db.close()
+      self.batches += 1
+      return changed
+
+  def _apply(self, db: Session, batch: Dict[str, str]) -> int:
+    keys = list(batch)
+    rows: List[Tuple[int, int, str, str]] = []
+    for start in range(0, len(keys), CHUNK_SIZE):
+      rows.extend(apply_message_statuses(db, {key: batch[key] for key in keys[start:start + CHUNK_SIZE]}))
+
+    missing = set(keys) - {row[2] for row in rows}
+    existing = set()
+    missing_list = list(missing)
+    for start in range(0, len(missing_list), CHUNK_SIZE):
+      existing.update(db.execute(
+        select(Message.whatsapp_message_id).where(Message.whatsapp_message_id.in_(missing_list[start:start + CHUNK_SIZE]))
+      ).scalars())
+
+    by_chat: Dict[int, List[Dict[str, Any]]] = {}
+    for message_id, chat_id, whatsapp_message_id, status in rows:
+      by_chat.setdefault(chat_id, []).append({"id": message_id, "whatsapp_message_id": whatsapp_message_id, "status": status})
+    companies = dict(db.execute(select(Chat.id, Chat.company_id).where(Chat.id.in_(list(by_chat)))).all()) if by_chat else {}
+    for chat_id, messages in by_chat.items():
+      company_id = companies.get(chat_id)
+      if company_id is not None:
+        manager.emit_to_chat(db, company_id, chat_id, STATUS_EVENT, {"chat_id": chat_id, "company_id": company_id, "messages": messages})
+    commit(db)
+
+    now = time.time()
+    with self._lock:
+      for key in missing:
+        if key in existing:
+          # El mensaje ya tenía un estado igual o más avanzado
+          self.stale += 1
+          self._orphans.pop(key, None)
+        elif key not in self._orphans:
+          self._orphans[key] = (batch[key], now)
+        else:
+          self._orphans[key] = (batch[key], self._orphans[key][1])
+      for row in rows:
+        self._orphans.pop(row[2], None)
+    self.updated += len(rows)
+    self.events += sum(chat_id in companies for chat_id in by_chat)
+    return len(rows)
+
+  def stats(self) -> Dict[str, Any]:
+    return {
+      "running": self.running,
+      "window_ms": round(self.window * 1000),
+      "pending": len(self._pending),
+      "orphans": len(self._orphans),
+      "received": self.received,
+      "merged": self.merged,
+      "batches": self.batches,
+      "updated": self.updated,
+      "stale": self.stale,
+      "orphaned": self.orphaned,
+      "events": self.events,
+      "errors": self.errors,
+    }
+
+
+status_batcher = MessageStatusBatcher(
+  window=settings.message_status_window_ms / 1000,
+  max_batch=settings.message_status_max_batch,
+)
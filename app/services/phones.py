@@ -0,0 +1,29 @@
+import re
+from typing import Optional
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_phone(raw: Optional[str]) -> Optional[str]:
+  """
+  Normaliza un número telefónico a formato E.164 (``+`` seguido solo de dígitos).
+
+  Acepta las variantes que llegan desde YCloud, el frontend y las importaciones:
+  ``+57 300-123 4567``, ``573001234567`` o ``0057 300 123 4567``.
+  """
+  if raw is None:
+    return None
+  digits = _NON_DIGITS.sub("", raw)
+  if not digits:
+    return raw.strip()
+  if digits.startswith("00") and not raw.strip().startswith("+"):
+    digits = digits[2:]
+  return f"+{digits}"
+
+
+def phone_variants(raw: Optional[str]) -> set[str]:
+  """Formas con las que un número pudo haberse guardado antes de normalizar"""
+  if not raw:
+    return set()
+  normalized = normalize_phone(raw)
+  return {raw, raw.strip(), normalized, normalized.lstrip("+")}
@@ -1,37 +1,754 @@
-from typing import Dict, Set, Tuple, Any
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Set, Tuple, Any, Awaitable, Callable, Optional
 from fastapi import WebSocket
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.unit_of_work import on_commit
+from app.services.broker import (
+  Broker,
+  BrokerEvent,
+  InProcessBroker,
+  chat_channel,
+  company_channel,
+  create_broker,
+  parse_channel,
+)
+from app.services.visibility import AssignmentMap, SCOPE_ASSIGNED, assignments as shared_assignments
 
+try:
+  import orjson
+except ImportError:  # orjson es opcional; se usa json estándar como respaldo
+  orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+# Eventos que solo importan en su versión más reciente por chat
+COALESCIBLE_EVENTS = {"chat.updated"}
+# Frame que agrupa los chat.updated acumulados durante la ventana de coalescencia
+BATCH_UPDATED_EVENT = "chats.batch_updated"
+# Respuesta a una reconexión con ?last_seq= que ya no se puede reanudar desde el buffer
+RESYNC_EVENT = "resync.required"
+# Cambio de asignación de un chat; actualiza el mapa de asignaciones de cada worker
+ASSIGNED_EVENT = "chat.assigned"
+BULK_UPDATED_EVENT = "chats.bulk_updated"
+# Latido del servidor; el cliente que responde {"action": "pong"} queda sujeto al timeout
+PING_EVENT = "ping"
+
+
+def encode_frame(event: str, data: Any, seq: Optional[int] = None, channel: Optional[str] = None) -> str:
+  """Serializa ``{"event", "data", "channel", "seq"}`` una sola vez; el mismo texto se envía a todos los destinatarios"""
+  message = {"event": event, "data": data}
+  if channel is not None:
+    message["channel"] = channel
+  if seq is not None:
+    message["seq"] = seq
+  if orjson is not None:
+    try:
+      return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode()
+    except TypeError:
+      pass
+  return json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+class Frame:
+  """Mensaje ya serializado, compartido por todas las colas de salida"""
+
+  __slots__ = ("event", "key", "text", "seq", "_sse")
+
+  def __init__(self, event: str, data: Any, seq: Optional[int] = None, channel: Optional[str] = None) -> None:
+    self.event = event
+    self.key = _coalesce_key(event, data)
+    self.text = encode_frame(event, data, seq, channel)
+    self.seq = seq
+    self._sse: Optional[str] = None
+
+  @property
+  def sse(self) -> str:
+    """Bloque ``text/event-stream`` del frame, armado una vez para todos los clientes SSE"""
+    if self._sse is None:
+      head = f"id: {self.seq}\n" if self.seq is not None else ""
+      self._sse = f"{head}event: {self.event}\ndata: {self.text}\n\n"
+    return self._sse
+
+
+def _coalesce_key(event: str, data: Any) -> Optional[Tuple[str, Any]]:
+  if event not in COALESCIBLE_EVENTS:
+    return None
+  return (event, data.get("chat_id") if isinstance(data, dict) else None)
+
+
+class ReplayBuffer:
+  """
+  Últimos eventos de una empresa (su canal y los de sus chats) para reanudar conexiones.
+
+  Por canal se recuerda el rango de ``seq`` que sigue en el buffer; si el cliente pide
+  eventos anteriores a ese rango, o de un canal que este worker no ha visto (reinicio,
+  otro worker), la reanudación no es posible y debe resincronizar por REST.
+  """
+
+  def __init__(self, size: int) -> None:
+    self.size = max(1, size)
+    self._events: Deque[BrokerEvent] = deque()
+    # canal -> [eventos en el buffer, menor seq reanudable, mayor seq visto]
+    self._channels: Dict[str, List[int]] = {}
+
+  def __len__(self) -> int:
+    return len(self._events)
+
+  def append(self, event: BrokerEvent) -> None:
+    state = self._channels.get(event.channel)
+    if state is None:
+      state = self._channels[event.channel] = [0, event.seq, event.seq]
+    state[0] += 1
+    state[1] = min(state[1], event.seq)
+    state[2] = max(state[2], event.seq)
+    self._events.append(event)
+    if len(self._events) > self.size:
+      evicted = self._events.popleft()
+      evicted_state = self._channels[evicted.channel]
+      evicted_state[0] -= 1
+      if evicted_state[0] == 0:
+        del self._channels[evicted.channel]
+      else:
+        evicted_state[1] = max(evicted_state[1], evicted.seq + 1)
+
+  def since(self, channel: str, last_seq: int) -> Optional[List[BrokerEvent]]:
+    """Eventos del canal posteriores a ``last_seq``, o None si ya no se pueden reconstruir"""
+    state = self._channels.get(channel)
+    if state is None or last_seq + 1 < state[1] or last_seq > state[2]:
+      return None
+    missed = [event for event in self._events if event.channel == channel and event.seq > last_seq]
+    missed.sort(key=lambda event: event.seq)
+    return missed
+
+
+class RealtimeOutbox:
+  """
+  Eventos ya confirmados en la base, pendientes de difundir.
+
+  Los hooks post-commit (en el threadpool, en el loop o en scripts) solo los encolan y
+  retornan: nunca esperan un envío por websocket. Una única tarea del loop los publica
+  en orden de llegada. Si se llena (el loop no avanza o no hay dispatcher, como en
+  scripts) se descartan los más antiguos y se cuentan en ``dropped``.
+  """
+
+  def __init__(self, publish: Callable[[BrokerEvent], Awaitable[None]], max_pending: int = 10000) -> None:
+    self.publish = publish
+    self.max_pending = max(1, max_pending)
+    self.dispatched = 0
+    self.dropped = 0
+    self.errors = 0
+    self._pending: Deque[BrokerEvent] = deque()
+    self._lock = threading.Lock()
+    self._loop: Optional[asyncio.AbstractEventLoop] = None
+    self._wake: Optional[asyncio.Event] = None
+    self._task: Optional[asyncio.Task] = None
+
+  @property
+  def depth(self) -> int:
+    return len(self._pending)
+
+  def put(self, events: List[BrokerEvent]) -> None:
+    """Encola eventos desde cualquier hilo y despierta al dispatcher"""
+    with self._lock:
+      for event in events:
+        if len(self._pending) >= self.max_pending:
+          self._pending.popleft()
+          self.dropped += 1
+        self._pending.append(event)
+    loop, wake = self._loop, self._wake
+    if loop is not None and wake is not None:
+      try:
+        loop.call_soon_threadsafe(wake.set)
+      except RuntimeError:
+        # El loop ya se cerró (apagado); los eventos se pierden con el proceso
+        pass
+
+  def _take(self) -> Optional[BrokerEvent]:
+    with self._lock:
+      return self._pending.popleft() if self._pending else None
+
+  async def drain(self) -> int:
+    """Publica todo lo pendiente; retorna cuántos eventos salieron"""
+    count = 0
+    while True:
+      event = self._take()
+      if event is None:
+        return count
+      try:
+        await self.publish(event)
+        self.dispatched += 1
+        count += 1
+      except Exception as e:
+        self.errors += 1
+        logger.warning(f"Error publicando evento de tiempo real {event.event}: {e}")
+
+  async def _run(self) -> None:
+    while True:
+      await self._wake.wait()
+      self._wake.clear()
+      await self.drain()
+
+  def start(self) -> None:
+    if self._task is not None:
+      return
+    self._loop = asyncio.get_running_loop()
+    self._wake = asyncio.Event()
+    self._task = self._loop.create_task(self._run())
+    # Lo encolado antes del arranque sale en la primera vuelta
+    self._wake.set()
+
+  async def stop(self) -> None:
+    task, self._task = self._task, None
+    self._loop = None
+    if task is not None:
+      task.cancel()
+      try:
+        await task
+      except asyncio.CancelledError:
+        pass
+    await self.drain()
+
+  def stats(self) -> Dict[str, Any]:
+    return {
+      "running": self._task is not None,
+      "pending": self.depth,
+      "max_pending": self.max_pending,
+      "dispatched": self.dispatched,
+      "dropped": self.dropped,
+      "errors": self.errors,
+    }
+
+
+class ClientConnection:
+  """
+  Websocket con cola de salida acotada y una tarea escritora propia.
+
+  Los broadcasts solo encolan; si el cliente no consume a tiempo y la cola se llena
+  se aplica la política de consumidor lento:
+
+  - ``drop_oldest``: descarta el mensaje más antiguo de la cola.
+  - ``coalesce``: reemplaza un ``chat.updated`` pendiente del mismo chat por el nuevo;
+    si no hay ninguno, descarta el más antiguo.
+  - ``disconnect``: cierra la conexión para que el cliente se reconecte y resincronice.
+  """
+
+  def __init__(
+    self,
+    websocket: WebSocket,
+    *,
+    max_queue: int = 256,
+    policy: str = "drop_oldest",
+    send_timeout: float = 10.0,
+    on_close: Optional[Callable[["ClientConnection"], None]] = None,
+    latencies: Optional[Deque[float]] = None,
+  ) -> None:
+    if policy not in SLOW_CONSUMER_POLICIES:
+      raise ValueError(f"Política de consumidor lento desconocida: {policy}")
+    self.websocket = websocket
+    self.max_queue = max(1, max_queue)
+    self.policy = policy
+    self.send_timeout = send_timeout
+    self.on_close = on_close
+    # Muestras compartidas de latencia de envío (encolado -> enviado), en segundos
+    self.latencies = latencies
+    self.last_seen = time.monotonic()
+    # Solo se cierra por silencio a quien respondió un pong alguna vez: los clientes
+    # anteriores al latido ignoran el ping y dependen del ping de protocolo de uvicorn
+    self.heartbeat_ack = False
+    # Usuario que abrió la conexión y su alcance (visibility.SCOPE_*); None = sin filtrar
+    self.user_id: Optional[int] = None
+    self.chat_scope: Optional[str] = None
+    self.closed = False
+    self.sent = 0
+    self.dropped = 0
+    self.coalesced = 0
+    self.max_depth = 0
+    # Canales a los que está suscrita; un solo escritor sirve a todos
+    self.channels: Set[str] = set()
+    self._queue: Deque[Tuple[Frame, float]] = deque()
+    self._ready = asyncio.Event()
+    self._idle = asyncio.Event()
+    self._idle.set()
+    self._writer = asyncio.get_running_loop().create_task(self._write_loop())
+
+  @property
+  def depth(self) -> int:
+    return len(self._queue)
+
+  def touch(self) -> None:
+    """El cliente dio señales de vida (pong o cualquier otro mensaje)"""
+    self.last_seen = time.monotonic()
+
+  def enqueue(self, frame: Frame) -> bool:
+    """Encola sin bloquear; retorna False si la conexión está (o quedó) cerrada"""
+    if self.closed:
+      return False
+    if len(self._queue) >= self.max_queue and not self._make_room(frame):
+      return False
+    self._queue.append((frame, time.monotonic()))
+    self.max_depth = max(self.max_depth, len(self._queue))
+    self._idle.clear()
+    self._ready.set()
+    return True
+
+  def _make_room(self, frame: Frame) -> bool:
+    if self.policy == "disconnect":
+      self.dropped += 1
+      self.close(code=1013)
+      return False
+    if self.policy == "coalesce":
+      if frame.key is not None:
+        for index, (queued, _) in enumerate(self._queue):
+          if queued.key == frame.key:
+            del self._queue[index]
+            self.coalesced += 1
+            return True
+    self._queue.popleft()
+    self.dropped += 1
+    return True
+
+  async def _write_loop(self) -> None:
+    try:
+      # En 3.11 wait_for puede absorber la cancelación si el envío termina a la vez;
+      # por eso el bucle también se detiene al ver la conexión cerrada
+      while not self.closed:
+        if not self._queue:
+          self._idle.set()
+          self._ready.clear()
+          await self._ready.wait()
+          continue
+        frame, enqueued_at = self._queue.popleft()
+        await asyncio.wait_for(self._send(frame), self.send_timeout)
+        if self.closed:
+          return
+        self.sent += 1
+        if self.latencies is not None:
+          self.latencies.append(time.monotonic() - enqueued_at)
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      # Cliente caído o demasiado lento para un solo envío
+      self.close()
+
+  async def _send(self, frame: Frame) -> None:
+    await self.websocket.send_text(frame.text)
+
+  async def drain(self) -> None:
+    """Espera a que la cola se vacíe (o a que la conexión se cierre)"""
+    await self._idle.wait()
+
+  def close(self, code: int = 1000) -> None:
+    if self.closed:
+      return
+    self.closed = True
+    self._queue.clear()
+    self._idle.set()
+    self._ready.set()
+    if asyncio.current_task() is not self._writer:
+      self._writer.cancel()
+    asyncio.get_running_loop().create_task(self._close_socket(code))
+    if self.on_close is not None:
+      self.on_close(self)
+
+  async def _close_socket(self, code: int) -> None:
+    try:
+      await self.websocket.close(code=code)
+    except Exception:
+      pass
+
+
+class SSEStream:
+  """
+  Extremo de una respuesta ``text/event-stream``; ocupa el lugar del websocket en el manager.
+
+  La cola interna tiene un solo lugar: el escritor de la conexión espera a que la
+  respuesta consuma cada bloque, así que un visor lento acumula en la cola acotada de
+  ``ClientConnection`` y se le aplica la misma política de consumidor lento.
+  """
 
-class ConnectionManager:
   def __init__(self) -> None:
-    self._chat_connections: Dict[Tuple[int, int], Set[WebSocket]] = {}
-    self._company_connections: Dict[int, Set[WebSocket]] = {}
+    self.closed = False
+    self._chunks: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize=1)
 
-  async def connect(self, websocket: WebSocket, company_id: int, chat_id: int) -> None:
-    key = (company_id, chat_id)
-    if key not in self._chat_connections:
-      self._chat_connections[key] = set()
-    self._chat_connections[key].add(websocket)
+  async def send_text(self, text: str) -> None:
+    await self._chunks.put(text)
+
+  async def close(self, code: int = 1000) -> None:
+    if self.closed:
+      return
+    self.closed = True
+    # Sin esperar: la respuesta puede haber dejado de consumir
+    while not self._chunks.empty():
+      self._chunks.get_nowait()
+    self._chunks.put_nowait(None)
+
+  async def events(self, keepalive: float = 15.0):
+    """Bloques SSE a enviar; cada ``keepalive`` segundos sin eventos emite un comentario"""
+    while True:
+      try:
+        chunk = await asyncio.wait_for(self._chunks.get(), keepalive)
+      except asyncio.TimeoutError:
+        # Los proxies cierran conexiones ociosas; el comentario lo ignora el EventSource
+        yield ": keepalive\n\n"
+        continue
+      if chunk is None:
+        return
+      yield chunk
+
+
+class SSEConnection(ClientConnection):
+  """Conexión de solo lectura por Server-Sent Events; cada frame sale con su ``id`` (seq) para ``Last-Event-ID``"""
+
+  async def _send(self, frame: Frame) -> None:
+    await self.websocket.send_text(frame.sse)
+
+
+class ConnectionManager:
+  """
+  Websockets conectados a este worker y sus suscripciones.
+
+  Cada conexión se suscribe a canales (``company:<id>``, ``chat:<company_id>:<chat_id>``):
+  las rutas ``/ws/company/{id}`` y ``/ws/{company_id}/{chat_id}`` a uno fijo, y ``/ws`` a
+  los que pida con mensajes de control. El índice canal -> conexiones hace que encontrar
+  los destinatarios de un evento sea una búsqueda en un dict.
+
+  Con ``coalesce_window`` > 0 los ``chat.updated`` de una empresa no se envían uno a uno:
+  se acumulan durante la ventana (el último estado de cada chat, combinando sus campos)
+  y salen en un solo ``chats.batch_updated`` con ``{"company_id", "chats": [...]}``.
+  Los demás eventos no se retrasan; antes de enviar otro evento a la empresa se vacían
+  los pendientes, de modo que el orden relativo entre eventos se conserva.
+  """
+
+  def __init__(
+    self,
+    broker: Optional[Broker] = None,
+    *,
+    max_queue: int = 256,
+    policy: str = "drop_oldest",
+    send_timeout: float = 10.0,
+    coalesce_window: float = 0.0,
+    replay_size: int = 1000,
+    max_subscriptions: int = 200,
+    heartbeat_interval: float = 0.0,
+    heartbeat_timeout: float = 0.0,
+    outbox_size: int = 10000,
+    assignments: Optional[AssignmentMap] = None,
+  ) -> None:
+    if policy not in SLOW_CONSUMER_POLICIES:
+      raise ValueError(f"Política de consumidor lento desconocida: {policy}")
+    self.broker: Broker = broker or InProcessBroker()
+    self.outbox = RealtimeOutbox(self._publish, max_pending=outbox_size)
+    self.assignments = assignments or AssignmentMap()
+    self._loading_assignments: Set[asyncio.Task] = set()
+    self.max_queue = max_queue
+    self.policy = policy
+    self.send_timeout = send_timeout
+    self.coalesce_window = coalesce_window
+    self.replay_size = replay_size
+    self.max_subscriptions = max_subscriptions
+    self.heartbeat_interval = heartbeat_interval
+    self.heartbeat_timeout = heartbeat_timeout
+    self._heartbeat_task: Optional[asyncio.Task] = None
+    self.pings_sent = 0
+    self.reaped = 0
+    self._latencies: Deque[float] = deque(maxlen=4096)
+    self._channels: Dict[str, Set[WebSocket]] = {}
+    # Canal de empresa -> usuario -> conexiones que solo ven los chats asignados a ese usuario
+    self._restricted: Dict[str, Dict[int, Set[WebSocket]]] = {}
+    self._clients: Dict[WebSocket, ClientConnection] = {}
+    self.frames_encoded = 0
+    # company_id -> chat_id -> último estado pendiente de enviar
+    self._pending_updates: Dict[int, Dict[Any, Dict[str, Any]]] = {}
+    self._pending_timers: Dict[int, asyncio.TimerHandle] = {}
+    self._pending_seq: Dict[int, int] = {}
+    self._replay: Dict[int, ReplayBuffer] = {}
+    self.replayed = 0
+    self.resyncs = 0
+    self.updates_coalesced = 0
+    self.batches_sent = 0
+    # Contadores de conexiones ya cerradas, para que las métricas no retrocedan
+    self._closed_totals = {"sent": 0, "dropped": 0, "coalesced": 0, "slow_disconnects": 0}
+
+  def _register(
+    self,
+    websocket: WebSocket,
+    policy: Optional[str],
+    connection_class: type = ClientConnection,
+    user_id: Optional[int] = None,
+    chat_scope: Optional[str] = None,
+  ) -> ClientConnection:
+    client = self._clients.get(websocket)
+    if client is None:
+      client = connection_class(
+        websocket,
+        max_queue=self.max_queue,
+        policy=policy or self.policy,
+        send_timeout=self.send_timeout,
+        on_close=self._on_client_closed,
+        latencies=self._latencies,
+      )
+      client.user_id = user_id
+      client.chat_scope = chat_scope if user_id is not None else None
+      self._clients[websocket] = client
+    return client
+
+  def _on_client_closed(self, client: ClientConnection) -> None:
+    websocket = client.websocket
+    if self._clients.pop(websocket, None) is None:
+      return
+    self._closed_totals["sent"] += client.sent
+    self._closed_totals["dropped"] += client.dropped
+    self._closed_totals["coalesced"] += client.coalesced
+    if client.policy == "disconnect" and client.dropped:
+      self._closed_totals["slow_disconnects"] += 1
+    for channel in client.channels:
+      self._unindex(websocket, channel)
+    client.channels.clear()
+
+  def _index(self, websocket: WebSocket, client: ClientConnection, channel: str) -> None:
+    company_id, chat_id = parse_channel(channel)
+    if client.chat_scope == SCOPE_ASSIGNED and chat_id is None:
+      self._restricted.setdefault(channel, {}).setdefault(client.user_id, set()).add(websocket)
+      if not self.assignments.is_loaded(company_id):
+        self._load_assignments(company_id)
+    else:
+      self._channels.setdefault(channel, set()).add(websocket)
+
+  def _unindex(self, websocket: WebSocket, channel: str) -> None:
+    sockets = self._channels.get(channel)
+    if sockets is not None:
+      sockets.discard(websocket)
+      if not sockets:
+        del self._channels[channel]
+    by_user = self._restricted.get(channel)
+    if by_user is not None:
+      for user_id, user_sockets in list(by_user.items()):
+        if websocket in user_sockets:
+          user_sockets.discard(websocket)
+          if not user_sockets:
+            del by_user[user_id]
+      if not by_user:
+        del self._restricted[channel]
+
+  def _load_assignments(self, company_id: int) -> None:
+    """Carga las asignaciones de la empresa en un hilo, sin bloquear el loop"""
+    async def _load() -> None:
+      try:
+        await asyncio.to_thread(self.assignments.load, company_id)
+      except Exception as e:
+        logger.warning(f"No se pudieron cargar las asignaciones de la empresa {company_id}: {e}")
+
+    task = asyncio.get_running_loop().create_task(_load())
+    self._loading_assignments.add(task)
+    task.add_done_callback(self._loading_assignments.discard)
+
+  def _release(self, websocket: WebSocket) -> None:
+    client = self._clients.get(websocket)
+    if client is not None:
+      client.close()
+
+  def subscribe(
+    self,
+    websocket: WebSocket,
+    channel: str,
+    policy: Optional[str] = None,
+    last_seq: Optional[int] = None,
+    connection_class: type = ClientConnection,
+    user_id: Optional[int] = None,
+    chat_scope: Optional[str] = None,
+  ) -> ClientConnection:
+    """
+    Suscribe la conexión a un canal; con ``last_seq`` repite primero lo que se perdió.
+
+    Con ``chat_scope="assigned"`` los eventos de un chat en el canal de la empresa solo
+    le llegan si el chat está asignado a ``user_id``.
+    """
+    company_id, _ = parse_channel(channel)
+    client = self._register(websocket, policy, connection_class, user_id, chat_scope)
+    client.channels.add(channel)
+    self._index(websocket, client, channel)
+    if last_seq is not None:
+      self._resume(client, company_id, channel, last_seq)
+    return client
+
+  def unsubscribe(self, websocket: WebSocket, channel: str) -> bool:
+    client = self._clients.get(websocket)
+    if client is None or channel not in client.channels:
+      return False
+    client.channels.discard(channel)
+    self._unindex(websocket, channel)
+    return True
+
+  async def connect_client(
+    self,
+    websocket: WebSocket,
+    policy: Optional[str] = None,
+    user_id: Optional[int] = None,
+    chat_scope: Optional[str] = None,
+  ) -> ClientConnection:
+    """Registra una conexión multiplexada, todavía sin suscripciones"""
+    return self._register(websocket, policy, user_id=user_id, chat_scope=chat_scope)
+
+  def disconnect_client(self, websocket: WebSocket) -> None:
+    self._release(websocket)
+
+  def touch(self, websocket: WebSocket) -> None:
+    client = self._clients.get(websocket)
+    if client is not None:
+      client.touch()
+
+  def heartbeat(self) -> int:
+    """
+    Envía un ping a cada conexión y cierra las que dejaron de responder dentro del timeout.
+
+    Un peer TCP muerto no hace fallar los envíos hasta que se llena el buffer del
+    kernel; sin esto seguiría suscrito (y recibiendo broadcasts) indefinidamente.
+    Solo se cierran los clientes que ya respondieron algún pong. Retorna cuántas
+    conexiones se cerraron.
+    """
+    now = time.monotonic()
+    ping = Frame(PING_EVENT, {"ts": time.time()})
+    reaped = 0
+    for client in list(self._clients.values()):
+      expired = now - client.last_seen > self.heartbeat_timeout
+      if self.heartbeat_timeout > 0 and client.heartbeat_ack and expired:
+        reaped += 1
+        client.close(code=1001)
+        continue
+      client.enqueue(ping)
+      self.pings_sent += 1
+    self.reaped += reaped
+    return reaped
+
+  async def _heartbeat_loop(self) -> None:
+    while True:
+      await asyncio.sleep(self.heartbeat_interval)
+      try:
+        self.heartbeat()
+        await self.broker.report_worker(self.worker_summary())
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        logger.warning(f"Error en el latido de websockets: {e}")
+
+  def handle_control(self, websocket: WebSocket, text: str) -> None:
+    """
+    Procesa un mensaje de control de ``/ws``; la respuesta sale por la cola de la conexión.
+
+    ``{"action": "subscribe", "channel": "chat:1:5", "last_seq": 12}`` responde
+    ``subscribed`` (seguido de la repetición, si se pidió) y ``{"action": "unsubscribe",
+    "channel": ...}`` responde ``unsubscribed``; los mensajes inválidos reciben ``error``.
+    """
+    client = self._clients.get(websocket)
+    if client is None:
+      return
+    client.touch()
+    try:
+      message = json.loads(text)
+      if not isinstance(message, dict):
+        raise ValueError("Se esperaba un objeto JSON")
+      action, channel, last_seq = message.get("action"), message.get("channel"), message.get("last_seq")
+      if action == "pong":
+        client.heartbeat_ack = True
+        return
+      if action not in ("subscribe", "unsubscribe"):
+        raise ValueError(f"Acción desconocida: {action}")
+      parse_channel(channel)
+      if last_seq is not None and not isinstance(last_seq, int):
+        raise ValueError("last_seq debe ser un entero")
+      if action == "subscribe" and channel not in client.channels and len(client.channels) >= self.max_subscriptions:
+        raise ValueError(f"Máximo de {self.max_subscriptions} suscripciones por conexión")
+    except ValueError as e:
+      client.enqueue(Frame("error", {"message": str(e)}))
+      return
+    if action == "subscribe":
+      client.enqueue(Frame("subscribed", {"channel": channel}))
+      self.subscribe(websocket, channel, last_seq=last_seq)
+    else:
+      self.unsubscribe(websocket, channel)
+      client.enqueue(Frame("unsubscribed", {"channel": channel}))
+
+  async def connect(
+    self,
+    websocket: WebSocket,
+    company_id: int,
+    chat_id: int,
+    policy: Optional[str] = None,
+    last_seq: Optional[int] = None,
+  ) -> None:
+    self.subscribe(websocket, chat_channel(company_id, chat_id), policy=policy, last_seq=last_seq)
 
   def disconnect(self, websocket: WebSocket, company_id: int, chat_id: int) -> None:
-    key = (company_id, chat_id)
-    if key in self._chat_connections:
-      if websocket in self._chat_connections[key]:
-        self._chat_connections[key].remove(websocket)
-      if not self._chat_connections[key]:
-        del self._chat_connections[key]
-
-  async def connect_company(self, websocket: WebSocket, company_id: int) -> None:
-    if company_id not in self._company_connections:
-      self._company_connections[company_id] = set()
-    self._company_connections[company_id].add(websocket)
+    self.unsubscribe(websocket, chat_channel(company_id, chat_id))
+    self._release(websocket)
+
+  async def connect_company(
+    self,
+    websocket: WebSocket,
+    company_id: int,
+    policy: Optional[str] = None,
+    last_seq: Optional[int] = None,
+    user_id: Optional[int] = None,
+    chat_scope: Optional[str] = None,
+  ) -> None:
+    self.subscribe(
+      websocket, company_channel(company_id), policy=policy, last_seq=last_seq, user_id=user_id, chat_scope=chat_scope,
+    )
 
   def disconnect_company(self, websocket: WebSocket, company_id: int) -> None:
-    if company_id in self._company_connections:
-      if websocket in self._company_connections[company_id]:
-        self._company_connections[company_id].remove(websocket)
-      if not self._company_connections[company_id]:
-        del self._company_connections[company_id]
+    self.unsubscribe(websocket, company_channel(company_id))
+    self._release(websocket)
+
+  async def connect_stream(
+    self,
+    stream: SSEStream,
+    company_id: int,
+    policy: Optional[str] = None,
+    last_seq: Optional[int] = None,
+    user_id: Optional[int] = None,
+    chat_scope: Optional[str] = None,
+  ) -> None:
+    """Suscribe un stream SSE al canal de la empresa; ``last_seq`` viene de ``Last-Event-ID``"""
+    self.subscribe(
+      stream,
+      company_channel(company_id),
+      policy=policy,
+      last_seq=last_seq,
+      connection_class=SSEConnection,
+      user_id=user_id,
+      chat_scope=chat_scope,
+    )
+
+  def disconnect_stream(self, stream: SSEStream) -> None:
+    self._release(stream)
+
+  def _resume(self, client: ClientConnection, company_id: int, channel: str, last_seq: int) -> None:
+    # Sin awaits desde el registro: ningún evento en vivo se intercala con la repetición
+    buffer = self._replay.get(company_id)
+    missed = buffer.since(channel, last_seq) if buffer is not None else None
+    if missed is None or len(missed) > client.max_queue:
+      self.resyncs += 1
+      client.enqueue(Frame(RESYNC_EVENT, {"channel": channel, "last_seq": last_seq}))
+      return
+    if client.chat_scope == SCOPE_ASSIGNED and parse_channel(channel)[1] is None:
+      # La repetición respeta el mismo filtro que los eventos en vivo
+      missed = [event for event in missed if self._visible_to(client, company_id, event)]
+    for event in missed:
+      client.enqueue(Frame(event.event, event.data, event.seq, channel))
+    self.replayed += len(missed)
+
+  def _visible_to(self, client: ClientConnection, company_id: int, event: BrokerEvent) -> bool:
+    users = self._interested_users(company_id, event.event, event.data)
+    return users is None or client.user_id in users
 
   async def send_personal_message(self, message: Any, websocket: WebSocket) -> None:
     try:
@@ -39,42 +756,315 @@ class ConnectionManager:
     except Exception:
       pass
 
-  async def broadcast_to_chat(self, company_id: int, chat_id: int, event: str, data: Any) -> None:
-    key = (company_id, chat_id)
-    if key not in self._chat_connections:
+  def _enqueue_all(self, sockets: Set[WebSocket], channel: str, event: str, data: Any, seq: Optional[int] = None) -> None:
+    self._enqueue_groups([sockets], channel, event, data, seq)
+
+  def _enqueue_groups(self, groups: List[Set[WebSocket]], channel: str, event: str, data: Any, seq: Optional[int] = None) -> None:
+    # Se serializa una vez por broadcast, no una vez por destinatario
+    frame = Frame(event, data, seq, channel)
+    self.frames_encoded += 1
+    for sockets in groups:
+      for websocket in list(sockets):
+        client = self._clients.get(websocket)
+        if client is not None:
+          client.enqueue(frame)
+
+  def _interested_users(self, company_id: int, event: str, data: Any) -> Optional[Set[int]]:
+    """
+    Usuarios restringidos a los que concierne un evento de empresa, o None si es para todos.
+
+    Un evento de un chat va a su asignado actual y a los que el propio evento nombra
+    (el nuevo y el anterior en una reasignación), así el chat también sale de la lista
+    de quien lo pierde.
+    """
+    if not isinstance(data, dict):
+      return None
+    chat_ids = [data["chat_id"]] if data.get("chat_id") is not None else data.get("chat_ids")
+    if not chat_ids:
+      return None
+    users = {self.assignments.get(company_id, chat_id) for chat_id in chat_ids}
+    users.add(data.get("assigned_user_id"))
+    users.add(data.get("previous_assigned_user_id"))
+    changes = data.get("changes")
+    if isinstance(changes, dict):
+      users.add(changes.get("assigned_user_id"))
+    users.discard(None)
+    return users
+
+  def _company_groups(self, company_id: int, channel: str, event: str, data: Any) -> List[Set[WebSocket]]:
+    groups = []
+    sockets = self._channels.get(channel)
+    if sockets:
+      groups.append(sockets)
+    by_user = self._restricted.get(channel)
+    if by_user:
+      users = self._interested_users(company_id, event, data)
+      if users is None:
+        groups.extend(by_user.values())
+      else:
+        groups.extend(by_user[user_id] for user_id in users if user_id in by_user)
+    return groups
+
+  def _apply_assignments(self, company_id: int, event: str, data: Any) -> None:
+    """Mantiene el mapa de asignaciones con los eventos de todos los workers"""
+    if not isinstance(data, dict):
       return
-    dead_connections: Set[WebSocket] = set()
-    for connection in list(self._chat_connections[key]):
-      try:
-        await connection.send_json({
-          "event": event,
-          "data": data
-        })
-      except Exception:
-        dead_connections.add(connection)
-    for conn in dead_connections:
-      self._chat_connections[key].discard(conn)
-    if key in self._chat_connections and not self._chat_connections[key]:
-      del self._chat_connections[key]
+    if event == ASSIGNED_EVENT and data.get("chat_id") is not None:
+      self.assignments.assign(company_id, [data["chat_id"]], data.get("assigned_user_id"))
+    elif event == BULK_UPDATED_EVENT:
+      user_id = (data.get("changes") or {}).get("assigned_user_id")
+      if user_id is None:
+        return
+      if data.get("chat_ids") is not None:
+        self.assignments.assign(company_id, data["chat_ids"], user_id)
+      else:
+        # Selección demasiado grande para el evento: se vuelve a leer de la base
+        self.assignments.forget_company(company_id)
+        if company_channel(company_id) in self._restricted:
+          self._load_assignments(company_id)
 
-  async def broadcast_to_company(self, company_id: int, event: str, data: Any) -> None:
-    if company_id not in self._company_connections:
+  async def _send_to_chat(self, company_id: int, chat_id: int, event: str, data: Any, seq: Optional[int] = None) -> None:
+    channel = chat_channel(company_id, chat_id)
+    sockets = self._channels.get(channel)
+    if sockets:
+      self._enqueue_all(sockets, channel, event, data, seq)
+
+  async def _send_to_company(self, company_id: int, event: str, data: Any, seq: Optional[int] = None) -> None:
+    channel = company_channel(company_id)
+    restricted = channel in self._restricted
+    if not restricted and not self._channels.get(channel):
       return
-    dead_connections: Set[WebSocket] = set()
-    for connection in list(self._company_connections[company_id]):
+    if self.coalesce_window > 0 and event in COALESCIBLE_EVENTS and isinstance(data, dict):
+      self._defer_update(company_id, data, seq)
+      return
+    self._flush_updates(company_id)
+    if not restricted:
+      self._enqueue_all(self._channels[channel], channel, event, data, seq)
+      return
+    groups = self._company_groups(company_id, channel, event, data)
+    if groups:
+      self._enqueue_groups(groups, channel, event, data, seq)
+
+  def _defer_update(self, company_id: int, data: Dict[str, Any], seq: Optional[int]) -> None:
+    if seq is not None:
+      # El lote lleva el seq del último evento que agrupa
+      self._pending_seq[company_id] = max(seq, self._pending_seq.get(company_id, 0))
+    pending = self._pending_updates.setdefault(company_id, {})
+    chat_id = data.get("chat_id")
+    current = pending.get(chat_id)
+    if current is None:
+      pending[chat_id] = dict(data)
+    else:
+      # Un chat.updated sin last_message (p. ej. el del webhook) no borra el que ya estaba
+      current.update(data)
+      self.updates_coalesced += 1
+    if company_id not in self._pending_timers:
+      loop = asyncio.get_running_loop()
+      self._pending_timers[company_id] = loop.call_later(self.coalesce_window, self._flush_updates, company_id)
+
+  def _flush_updates(self, company_id: int) -> None:
+    timer = self._pending_timers.pop(company_id, None)
+    if timer is not None:
+      timer.cancel()
+    pending = self._pending_updates.pop(company_id, None)
+    seq = self._pending_seq.pop(company_id, None)
+    if not pending:
+      return
+    channel = company_channel(company_id)
+    sockets = self._channels.get(channel)
+    if sockets:
+      self.batches_sent += 1
+      self._enqueue_all(sockets, channel, BATCH_UPDATED_EVENT, {"company_id": company_id, "chats": list(pending.values())}, seq)
+    by_user = self._restricted.get(channel)
+    if not by_user:
+      return
+    # Cada usuario restringido recibe su propio lote, solo con sus chats asignados
+    per_user: Dict[int, List[Dict[str, Any]]] = {}
+    for chat_id, update in pending.items():
+      user_id = self.assignments.get(company_id, chat_id)
+      if user_id in by_user:
+        per_user.setdefault(user_id, []).append(update)
+    for user_id, updates in per_user.items():
+      self.batches_sent += 1
+      self._enqueue_all(by_user[user_id], channel, BATCH_UPDATED_EVENT, {"company_id": company_id, "chats": updates}, seq)
+
+  async def flush(self) -> None:
+    """Envía los chat.updated pendientes y espera a que todas las colas de salida se vacíen"""
+    for company_id in list(self._pending_updates):
+      self._flush_updates(company_id)
+    for client in list(self._clients.values()):
+      await client.drain()
+
+  def worker_summary(self) -> Dict[str, Any]:
+    return {"pid": os.getpid(), "connections": len(self._clients), "subscriptions": len(self._channels)}
+
+  def latency_percentiles(self) -> Dict[str, Any]:
+    samples = sorted(self._latencies)
+    if not samples:
+      return {"samples": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+
+    def pick(q: float) -> float:
+      return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 3)
+
+    return {
+      "samples": len(samples),
+      "p50_ms": pick(0.50),
+      "p95_ms": pick(0.95),
+      "p99_ms": pick(0.99),
+      "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+  async def connection_stats(self, top_channels: int = 50) -> Dict[str, Any]:
+    """Conexiones por empresa, canal y worker, latencia de envío y conexiones cerradas por el latido"""
+    by_company: Dict[int, int] = {}
+    for client in self._clients.values():
+      for company_id in {parse_channel(channel)[0] for channel in client.channels}:
+        by_company[company_id] = by_company.get(company_id, 0) + 1
+    counts = {channel: len(sockets) for channel, sockets in self._channels.items()}
+    for channel, by_user in self._restricted.items():
+      counts[channel] = counts.get(channel, 0) + sum(len(sockets) for sockets in by_user.values())
+    channels = sorted(counts.items(), key=lambda item: -item[1])
+    return {
+      "worker": self.broker.stats().get("worker_id") or str(os.getpid()),
+      "connections": len(self._clients),
+      "by_company": by_company,
+      "channels": len(channels),
+      "top_channels": [{"channel": channel, "connections": count} for channel, count in channels[:top_channels]],
+      "workers": await self.broker.workers(self.worker_summary()),
+      "send_latency": self.latency_percentiles(),
+      "heartbeat": {
+        "interval": self.heartbeat_interval,
+        "timeout": self.heartbeat_timeout,
+        "pings_sent": self.pings_sent,
+        "reaped": self.reaped,
+      },
+    }
+
+  def queue_stats(self) -> Dict[str, Any]:
+    clients = list(self._clients.values())
+    depths = sorted(client.depth for client in clients)
+    policies: Dict[str, int] = {}
+    streams = 0
+    for client in clients:
+      policies[client.policy] = policies.get(client.policy, 0) + 1
+      streams += isinstance(client, SSEConnection)
+    return {
+      "connections": len(clients),
+      "sse_connections": streams,
+      "restricted_connections": sum(client.chat_scope == SCOPE_ASSIGNED for client in clients),
+      "assignments": self.assignments.stats(),
+      "channels": len(self._channels),
+      "subscriptions": sum(len(client.channels) for client in clients),
+      "max_queue": self.max_queue,
+      "default_policy": self.policy,
+      "policies": policies,
+      "queued": sum(depths),
+      "max_depth": depths[-1] if depths else 0,
+      "p95_depth": depths[int(len(depths) * 0.95)] if depths else 0,
+      "high_water_mark": max((client.max_depth for client in clients), default=0),
+      "sent": self._closed_totals["sent"] + sum(client.sent for client in clients),
+      "dropped": self._closed_totals["dropped"] + sum(client.dropped for client in clients),
+      "coalesced": self._closed_totals["coalesced"] + sum(client.coalesced for client in clients),
+      "slow_disconnects": self._closed_totals["slow_disconnects"],
+      "frames_encoded": self.frames_encoded,
+      "coalesce_window_ms": round(self.coalesce_window * 1000),
+      "updates_coalesced": self.updates_coalesced,
+      "batches_sent": self.batches_sent,
+      "replay_size": self.replay_size,
+      "replay_buffered": sum(len(buffer) for buffer in self._replay.values()),
+      "replayed": self.replayed,
+      "resyncs": self.resyncs,
+      "encoder": "orjson" if orjson is not None else "json",
+      "outbox": self.outbox.stats(),
+    }
+
+  async def deliver(self, event: BrokerEvent) -> None:
+    """Entrega un evento del broker a los websockets conectados a este worker"""
+    if event.seq is not None and self.replay_size > 0:
+      buffer = self._replay.get(event.company_id)
+      if buffer is None:
+        buffer = self._replay[event.company_id] = ReplayBuffer(self.replay_size)
+      buffer.append(event)
+    if event.scope == "chat":
+      await self._send_to_chat(event.company_id, event.chat_id, event.event, event.data, event.seq)
+    else:
+      await self._send_to_company(event.company_id, event.event, event.data, event.seq)
+      # Después de enrutar: quien pierde el chat también recibe la reasignación
+      self._apply_assignments(event.company_id, event.event, event.data)
+
+  def set_broker(self, broker: Broker) -> None:
+    self.broker = broker
+
+  async def start(self) -> None:
+    await self.broker.start(self.deliver)
+    self.outbox.start()
+    if self.heartbeat_interval > 0:
+      self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat_loop())
+
+  async def stop(self) -> None:
+    if self._heartbeat_task is not None:
+      self._heartbeat_task.cancel()
       try:
-        await connection.send_json({
-          "event": event,
-          "data": data
-        })
-      except Exception:
-        dead_connections.add(connection)
-    for conn in dead_connections:
-      self._company_connections[company_id].discard(conn)
-    if company_id in self._company_connections and not self._company_connections[company_id]:
-      del self._company_connections[company_id]
+        await self._heartbeat_task
+      except asyncio.CancelledError:
+        pass
+      self._heartbeat_task = None
+    await self.outbox.stop()
+    for company_id in list(self._pending_updates):
+      self._flush_updates(company_id)
+    await self.broker.stop()
+
+  async def _publish(self, event: BrokerEvent) -> None:
+    if not self.broker.running:
+      # Sin broker iniciado (scripts, tests sin lifespan) solo hay clientes locales
+      await self.deliver(self.broker.stamp(event))
+      return
+    await self.broker.publish(event)
+
+  async def broadcast_to_chat(self, company_id: int, chat_id: int, event: str, data: Any) -> None:
+    await self._publish(BrokerEvent("chat", company_id, chat_id, event, data))
+
+  async def broadcast_to_company(self, company_id: int, event: str, data: Any) -> None:
+    await self._publish(BrokerEvent("company", company_id, None, event, data))
+
+  def _emit(self, db: Optional[Session], event: BrokerEvent) -> None:
+    if db is None:
+      self.outbox.put([event])
+    else:
+      # Si la transacción hace rollback el hook se descarta y el evento nunca sale
+      on_commit(db, lambda: self.outbox.put([event]))
+
+  def emit_to_chat(self, db: Optional[Session], company_id: int, chat_id: int, event: str, data: Any) -> None:
+    """
+    Difunde un evento del chat cuando ``db`` confirme su transacción.
 
+    No bloquea: solo deja el evento en la outbox. Con ``db=None`` el llamador garantiza
+    que los datos ya están confirmados y el evento se encola de inmediato.
+    """
+    self._emit(db, BrokerEvent("chat", company_id, chat_id, event, data))
 
-manager = ConnectionManager()
+  def emit_to_company(self, db: Optional[Session], company_id: int, event: str, data: Any) -> None:
+    """Difunde un evento de la empresa cuando ``db`` confirme su transacción (ver ``emit_to_chat``)"""
+    self._emit(db, BrokerEvent("company", company_id, None, event, data))
 
 
+manager = ConnectionManager(
+  create_broker(
+    settings.realtime_broker,
+    **({
+      "path": settings.realtime_broker_path,
+      "poll_interval": settings.realtime_poll_ms / 1000,
+      "retention_seconds": settings.realtime_retention_seconds,
+    } if settings.realtime_broker == "sqlite" else {}),
+  ),
+  max_queue=settings.realtime_queue_size,
+  policy=settings.realtime_slow_consumer_policy,
+  send_timeout=settings.realtime_send_timeout,
+  coalesce_window=settings.realtime_coalesce_ms / 1000,
+  replay_size=settings.realtime_replay_size,
+  max_subscriptions=settings.realtime_max_subscriptions,
+  heartbeat_interval=settings.realtime_heartbeat_interval,
+  heartbeat_timeout=settings.realtime_heartbeat_timeout,
+  outbox_size=settings.realtime_outbox_size,
+  assignments=shared_assignments,
+)
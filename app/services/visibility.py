@@ -0,0 +1,143 @@
+import json
+import threading
+from typing import Callable, Dict, Iterable, Optional, Set
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.models.chats.chat import Chat
+from app.models.roles.role import Role
+from app.models.users.user import User
+
+# Alcance de una conexión de tiempo real sobre los chats de su empresa
+SCOPE_ALL = "all"
+SCOPE_ASSIGNED = "assigned"
+# Ruta del frontend que da acceso a la bandeja completa; con solo "/my-chats" se ven los asignados
+ALL_CHATS_PATH = "/chats"
+
+
+def resolve_chat_scope(db: Session, user_id: int) -> Optional[str]:
+  """
+  Chats que puede ver un usuario: ``all`` (super admin, rol admin o rol con ``/chats``)
+  o ``assigned`` (solo los que tiene asignados). ``None`` si el usuario no existe.
+  """
+  user = db.get(User, user_id)
+  if user is None:
+    return None
+  if user.is_super_admin:
+    return SCOPE_ALL
+  role = db.get(Role, user.role_id) if user.role_id else None
+  if role is None:
+    return SCOPE_ASSIGNED
+  if role.is_admin:
+    return SCOPE_ALL
+  try:
+    allowed_paths = json.loads(role.allowed_paths or "[]")
+  except Exception:
+    allowed_paths = []
+  return SCOPE_ALL if ALL_CHATS_PATH in allowed_paths else SCOPE_ASSIGNED
+
+
+def load_company_assignments(db: Session, company_id: int) -> Dict[int, int]:
+  rows = db.execute(
+    select(Chat.id, Chat.assigned_user_id).where(
+      Chat.company_id == company_id,
+      Chat.deleted_at.is_(None),
+      Chat.assigned_user_id.is_not(None),
+    )
+  )
+  return {chat_id: user_id for chat_id, user_id in rows}
+
+
+def chat_scope_for_user(user_id: int) -> Optional[str]:
+  """``resolve_chat_scope`` con una sesión propia; para websockets y streams, que viven fuera de una petición"""
+  from app.db.session import SessionLocal
+  db = SessionLocal()
+  try:
+    return resolve_chat_scope(db, user_id)
+  finally:
+    db.close()
+
+
+def _load_with_session(company_id: int) -> Dict[int, int]:
+  from app.db.session import SessionLocal
+  db = SessionLocal()
+  try:
+    return load_company_assignments(db, company_id)
+  finally:
+    db.close()
+
+
+class AssignmentMap:
+  """
+  chat_id -> usuario asignado, por empresa, en memoria.
+
+  Se carga por empresa la primera vez que una conexión restringida a sus chats asignados
+  se suscribe, y desde ahí la mantienen ``assign_chat``, las operaciones masivas y los
+  eventos ``chat.assigned``/``chats.bulk_updated`` que llegan de otros workers. Un chat
+  ausente de una empresa cargada está sin asignar.
+  """
+
+  def __init__(self, loader: Callable[[int], Dict[int, int]] = _load_with_session) -> None:
+    self.loader = loader
+    self._assigned: Dict[int, Dict[int, int]] = {}
+    self._loading: Dict[int, Set[int]] = {}
+    self._lock = threading.Lock()
+    self.loads = 0
+
+  def is_loaded(self, company_id: int) -> bool:
+    return company_id in self._assigned
+
+  def load(self, company_id: int) -> None:
+    """Carga la empresa desde la base; las asignaciones recibidas mientras tanto prevalecen"""
+    with self._lock:
+      if company_id in self._assigned or company_id in self._loading:
+        return
+      self._loading[company_id] = set()
+    try:
+      snapshot = self.loader(company_id)
+    except Exception:
+      with self._lock:
+        self._loading.pop(company_id, None)
+      raise
+    with self._lock:
+      touched = self._loading.pop(company_id, set())
+      current = self._assigned.setdefault(company_id, {})
+      for chat_id, user_id in snapshot.items():
+        if chat_id not in touched:
+          current[chat_id] = user_id
+      self.loads += 1
+
+  def get(self, company_id: int, chat_id: int) -> Optional[int]:
+    company = self._assigned.get(company_id)
+    return company.get(chat_id) if company is not None else None
+
+  def assign(self, company_id: int, chat_ids: Iterable[int], user_id: Optional[int]) -> None:
+    chat_ids = list(chat_ids)
+    with self._lock:
+      loading = self._loading.get(company_id)
+      if loading is not None:
+        loading.update(chat_ids)
+      company = self._assigned.get(company_id)
+      if company is None:
+        if loading is None:
+          # Empresa sin cargar: se leerá completa de la base cuando haga falta
+          return
+        company = self._assigned[company_id] = {}
+      for chat_id in chat_ids:
+        if user_id is None:
+          company.pop(chat_id, None)
+        else:
+          company[chat_id] = user_id
+
+  def forget_company(self, company_id: int) -> None:
+    with self._lock:
+      self._assigned.pop(company_id, None)
+
+  def stats(self) -> Dict[str, int]:
+    return {
+      "companies": len(self._assigned),
+      "assigned_chats": sum(len(company) for company in self._assigned.values()),
+      "loads": self.loads,
+    }
+
+
+assignments = AssignmentMap()
@@ -0,0 +1,242 @@
+import gzip
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_GLOB = "webhooks-*.jsonl.gz"
+
+
+class WebhookArchive:
+  """
+  Archivo append-only de los payloads crudos de webhooks, comprimido y rotado.
+
+  Cada línea es ``{"received_at", "type", "body"}``, con el cuerpo tal como llegó. El
+  endpoint solo encola en memoria; un hilo escribe cada ``flush_interval`` segundos en
+  ``webhooks-<UTC>-<pid>-<n>.jsonl.gz`` (archivos propios de cada proceso) y lo rota por tamaño o
+  antigüedad. Los archivos más viejos que ``keep_days`` se borran al rotar.
+
+  Un corte abrupto pierde como mucho el último intervalo y deja el final del gzip
+  truncado; ``read_archive`` lee hasta ahí. El procesamiento no depende del archivo:
+  la cola durable es ``webhook_queue``.
+  """
+
+  def __init__(
+    self,
+    directory: str,
+    *,
+    rotate_bytes: int = 64 * 1024 * 1024,
+    rotate_seconds: float = 3600.0,
+    keep_days: float = 30.0,
+    flush_interval: float = 0.5,
+    max_pending: int = 100000,
+  ) -> None:
+    self.directory = directory
+    self.rotate_bytes = rotate_bytes
+    self.rotate_seconds = rotate_seconds
+    self.keep_days = keep_days
+    self.flush_interval = flush_interval
+    self.max_pending = max_pending
+    self._pending: Deque[str] = deque()
+    self._lock = threading.Lock()
+    self._write_lock = threading.Lock()
+    self._stop = threading.Event()
+    self._thread: Optional[threading.Thread] = None
+    self._raw = None
+    self._gz: Optional[gzip.GzipFile] = None
+    self._opened_at = 0.0
+    self._sequence = 0
+    self.current_file: Optional[str] = None
+    self.archived = 0
+    self.dropped = 0
+    self.rotations = 0
+    self.removed_files = 0
+    self.errors = 0
+
+  @property
+  def running(self) -> bool:
+    return self._thread is not None and self._thread.is_alive()
+
+  def append(self, body: str, event_type: str, received_at: float) -> None:
+    """No bloquea: deja la línea para el hilo escritor; sin el hilo en marcha no se archiva"""
+    if not self.running:
+      return
+    line = json.dumps({"received_at": received_at, "type": event_type, "body": body}, ensure_ascii=False)
+    with self._lock:
+      if len(self._pending) >= self.max_pending:
+        self._pending.popleft()
+        self.dropped += 1
+      self._pending.append(line)
+
+  def start(self) -> None:
+    if self.running:
+      return
+    os.makedirs(self.directory, exist_ok=True)
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._loop, name="webhook-archive", daemon=True)
+    self._thread.start()
+
+  def stop(self, timeout: float = 5.0) -> None:
+    self._stop.set()
+    if self._thread is not None:
+      self._thread.join(timeout)
+      self._thread = None
+    self.flush()
+    with self._write_lock:
+      self._close()
+
+  def _loop(self) -> None:
+    while not self._stop.wait(self.flush_interval):
+      try:
+        self.flush()
+      except Exception as e:
+        self.errors += 1
+        logger.warning(f"Error escribiendo el archivo de webhooks: {e}")
+
+  def flush(self) -> int:
+    """Escribe lo pendiente en el archivo actual, rotando si corresponde; retorna las líneas escritas"""
+    with self._lock:
+      lines, self._pending = self._pending, deque()
+    if not lines:
+      return 0
+    with self._write_lock:
+      if self._gz is not None and self._should_rotate():
+        self._close()
+        self.rotations += 1
+        self.prune()
+      if self._gz is None:
+        self._open()
+      self._gz.write(("\n".join(lines) + "\n").encode("utf-8"))
+      # Z_SYNC_FLUSH: lo escrito hasta aquí se puede leer aunque el proceso muera después
+      self._gz.flush()
+      self._raw.flush()
+      self.archived += len(lines)
+      return len(lines)
+
+  def _should_rotate(self) -> bool:
+    return self._raw.tell() >= self.rotate_bytes or time.time() - self._opened_at >= self.rotate_seconds
+
+  def _open(self) -> None:
+    os.makedirs(self.directory, exist_ok=True)
+    self._sequence += 1
+    name = f"webhooks-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{os.getpid()}-{self._sequence:04d}.jsonl.gz"
+    self.current_file = os.path.join(self.directory, name)
+    self._raw = open(self.current_file, "ab")
+    self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb")
+    self._opened_at = time.time()
+
+  def _close(self) -> None:
+    if self._gz is not None:
+      self._gz.close()
+      self._raw.close()
+    self._gz = self._raw = None
+    self.current_file = None
+
+  def prune(self) -> int:
+    """Borra los archivos más viejos que ``keep_days`` (0 conserva todo)"""
+    if self.keep_days <= 0:
+      return 0
+    cutoff = time.time() - self.keep_days * 86400
+    removed = 0
+    for path in Path(self.directory).glob(ARCHIVE_GLOB):
+      if str(path) != self.current_file and path.stat().st_mtime < cutoff:
+        path.unlink(missing_ok=True)
+        removed += 1
+    self.removed_files += removed
+    return removed
+
+  def files(self) -> List[Path]:
+    return sorted(Path(self.directory).glob(ARCHIVE_GLOB))
+
+  def stats(self) -> Dict[str, Any]:
+    files = self.files() if os.path.isdir(self.directory) else []
+    return {
+      "running": self.running,
+      "directory": self.directory,
+      "current_file": os.path.basename(self.current_file) if self.current_file else None,
+      "files": len(files),
+      "bytes": sum(path.stat().st_size for path in files),
+      "pending": len(self._pending),
+      "archived": self.archived,
+      "dropped": self.dropped,
+      "rotations": self.rotations,
+      "removed_files": self.removed_files,
+      "errors": self.errors,
+    }
+
+
+def _archive_files(paths: Iterable[str]) -> List[Path]:
+  files: List[Path] = []
+  for value in paths:
+    path = Path(value)
+    files.extend(sorted(path.glob(ARCHIVE_GLOB)) if path.is_dir() else [path])
+  return files
+
+
+def _read_file(path: Path, chunk_size: int = 64 * 1024) -> Iterator[Dict[str, Any]]:
+  """
+  Registros de un archivo, tolerando un final truncado.
+
+  Se descomprime a mano, miembro a miembro, para entregar cada línea completa apenas
+  aparece: ``gzip.open`` descarta el bloque entero que estaba leyendo cuando encuentra
+  el corte de un proceso que murió escribiendo.
+  """
+  decompressor = zlib.decompressobj(wbits=31)
+  pending = b""
+  with open(path, "rb") as raw:
+    for chunk in iter(lambda: raw.read(chunk_size), b""):
+      data, truncated = b"", False
+      try:
+        while chunk:
+          data += decompressor.decompress(chunk)
+          if not decompressor.eof:
+            break
+          # Fin de un miembro (archivo reabierto tras un reinicio): lo que sigue es otro gzip
+          chunk = decompressor.unused_data
+          decompressor = zlib.decompressobj(wbits=31)
+      except zlib.error as e:
+        logger.warning(f"Archivo de webhooks truncado {path.name}: {e}")
+        truncated = True
+      *lines, pending = (pending + data).split(b"\n")
+      for line in lines:
+        if line:
+          yield json.loads(line)
+      if truncated:
+        break
+  if pending:
+    # Última línea a medio escribir de un archivo que se cortó
+    logger.warning(f"Línea incompleta al final de {path.name}")
+
+
+def _keyed(index: int, path: Path) -> Iterator[Tuple[Tuple[float, int, int], Dict[str, Any]]]:
+  for position, record in enumerate(_read_file(path)):
+    yield (record["received_at"], index, position), record
+
+
+def read_archive(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+  """
+  Registros de uno o más archivos (o directorios) en orden de recepción.
+
+  Mezcla los archivos de todos los procesos por ``received_at``; los empates se
+  resuelven por el orden de los archivos, así dos lecturas dan siempre la misma secuencia.
+  """
+  streams = [_keyed(index, path) for index, path in enumerate(_archive_files(paths))]
+  for _, record in heapq.merge(*streams, key=lambda item: item[0]):
+    yield record
+
+
+webhook_archive = WebhookArchive(
+  settings.webhook_archive_dir,
+  rotate_bytes=int(settings.webhook_archive_rotate_mb * 1024 * 1024),
+  rotate_seconds=settings.webhook_archive_rotate_seconds,
+  keep_days=settings.webhook_archive_keep_days,
+)
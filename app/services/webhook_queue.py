@@ -0,0 +1,355 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], None]
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+  if not values:
+    return None
+  values = sorted(values)
+  return round(values[min(len(values) - 1, int(len(values) * q))], 2)
+
+
+class WebhookQueue:
+  """
+  Cola durable de webhooks en un archivo SQLite propio (``data/webhooks.db``).
+
+  El endpoint solo guarda el payload crudo y responde; un pool de hilos lo procesa
+  después. Cada evento lleva una clave de partición (el chat: número de la empresa y del
+  cliente) y su hash decide el shard, así que los eventos de un mismo chat los procesa
+  siempre el mismo worker y en orden de llegada. Si un evento falla se reintenta con
+  backoff exponencial y los siguientes de su chat esperan; agotados los intentos pasa a
+  ``webhook_dead_letters`` y el chat sigue avanzando.
+
+  Con varios procesos sobre el mismo archivo, cada shard lo atiende un solo worker a la
+  vez gracias a un lease en ``webhook_leases``. Un evento se borra de la cola después de
+  procesarse: si el proceso muere a mitad de camino, se vuelve a procesar.
+  """
+
+  def __init__(
+    self,
+    path: str,
+    *,
+    workers: int = 4,
+    batch_size: int = 50,
+    poll_interval: float = 0.2,
+    max_attempts: int = 6,
+    backoff_base: float = 2.0,
+    backoff_max: float = 300.0,
+    lease_seconds: float = 60.0,
+    owner: Optional[str] = None,
+  ) -> None:
+    self.path = path
+    self.workers = max(1, workers)
+    self.batch_size = batch_size
+    self.poll_interval = poll_interval
+    self.max_attempts = max(1, max_attempts)
+    self.backoff_base = backoff_base
+    self.backoff_max = backoff_max
+    self.lease_seconds = lease_seconds
+    self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    self.handler: Optional[Handler] = None
+    self.enqueued = 0
+    self.processed = 0
+    self.retried = 0
+    self.dead_lettered = 0
+    self.errors = 0
+    # Milisegundos entre la recepción y el fin del procesamiento de los últimos eventos
+    self._lags: Deque[float] = deque(maxlen=1000)
+    self._conn: Optional[sqlite3.Connection] = None
+    self._conn_lock = threading.Lock()
+    self._stop = threading.Event()
+    self._wakeups = [threading.Event() for _ in range(self.workers)]
+    self._threads: List[threading.Thread] = []
+
+  def _connect(self) -> sqlite3.Connection:
+    directory = os.path.dirname(self.path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # FULL: un webhook confirmado a YCloud sobrevive también a un corte de energía
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS webhook_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        partition_key TEXT NOT NULL,
+        partition_hash INTEGER NOT NULL,
+        event_type TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        received_at REAL NOT NULL,
+        available_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT
+      )
+    """)
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER NOT NULL,
+        partition_key TEXT NOT NULL,
+        event_type TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        received_at REAL NOT NULL,
+        failed_at REAL NOT NULL,
+        attempts INTEGER NOT NULL,
+        last_error TEXT
+      )
+    """)
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS webhook_leases (
+        shard TEXT PRIMARY KEY,
+        owner TEXT,
+        expires_at REAL NOT NULL
+      )
+    """)
+    return conn
+
+  def _shared(self) -> sqlite3.Connection:
+    if self._conn is None:
+      self._conn = self._connect()
+    return self._conn
+
+  @property
+  def running(self) -> bool:
+    return any(thread.is_alive() for thread in self._threads)
+
+  def shard_of(self, partition_hash: int) -> int:
+    return partition_hash % self.workers
+
+  def enqueue(self, event_type: str, payload: str, partition_key: str) -> int:
+    """Persiste el payload crudo; al retornar el evento ya es durable"""
+    partition_hash = zlib.crc32(partition_key.encode())
+    now = time.time()
+    with self._conn_lock:
+      event_id = self._shared().execute(
+        "INSERT INTO webhook_events (partition_key, partition_hash, event_type, payload, received_at, available_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (partition_key, partition_hash, event_type, payload, now, now),
+      ).lastrowid
+    self.enqueued += 1
+    self._wakeups[self.shard_of(partition_hash)].set()
+    return event_id
+
+  def start(self, handler: Handler) -> None:
+    if self.running:
+      return
+    self.handler = handler
+    self._stop.clear()
+    with self._conn_lock:
+      self._shared()
+    self._threads = [
+      threading.Thread(target=self._loop, args=(shard,), name=f"webhook-worker-{shard}", daemon=True)
+      for shard in range(self.workers)
+    ]
+    for thread in self._threads:
+      thread.start()
+
+  def stop(self, timeout: float = 10.0) -> None:
+    """Termina el evento en curso de cada worker; lo pendiente queda en la cola para el próximo arranque"""
+    self._stop.set()
+    for wakeup in self._wakeups:
+      wakeup.set()
+    for thread in self._threads:
+      thread.join(timeout)
+    self._threads = []
+
+  def _claim(self, conn: sqlite3.Connection, shard: int) -> bool:
+    """Toma o renueva el lease del shard; retorna si este proceso lo tiene"""
+    now = time.time()
+    cursor = conn.execute(
+      "INSERT INTO webhook_leases (shard, owner, expires_at) VALUES (?, ?, ?) "
+      "ON CONFLICT(shard) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+      "WHERE webhook_leases.expires_at < ? OR webhook_leases.owner = excluded.owner",
+      (f"{shard}/{self.workers}", self.owner, now + self.lease_seconds, now),
+    )
+    return cursor.rowcount == 1
+
+  def _release(self, conn: sqlite3.Connection, shard: int) -> None:
+    conn.execute(
+      "UPDATE webhook_leases SET owner = NULL, expires_at = 0 WHERE shard = ? AND owner = ?",
+      (f"{shard}/{self.workers}", self.owner),
+    )
+
+  def _loop(self, shard: int) -> None:
+    conn = self._connect()
+    wakeup = self._wakeups[shard]
+    claimed_at = 0.0
+
+    def keep_lease() -> bool:
+      # Se renueva entre eventos, como mucho cada tercio de su vigencia: una descarga lenta no lo deja vencer
+      nonlocal claimed_at
+      if time.monotonic() - claimed_at > self.lease_seconds / 3:
+        if not self._claim(conn, shard):
+          claimed_at = 0.0
+          return False
+        claimed_at = time.monotonic()
+      return True
+
+    try:
+      while not self._stop.is_set():
+        try:
+          if not keep_lease():
+            self._stop.wait(self.poll_interval * 5)
+            continue
+          wakeup.clear()
+          if self.process_shard(shard, conn, keep_lease) >= self.batch_size:
+            continue
+        except Exception as e:
+          self.errors += 1
+          logger.warning(f"Error en el worker de webhooks {shard}: {e}")
+        wakeup.wait(self.poll_interval)
+    finally:
+      try:
+        self._release(conn, shard)
+      except Exception:
+        pass
+      conn.close()
+
+  def process_shard(
+    self, shard: int, conn: Optional[sqlite3.Connection] = None, keep_lease: Optional[Callable[[], bool]] = None,
+  ) -> int:
+    """
+    Procesa un lote del shard en orden de llegada y retorna cuántos eventos intentó.
+
+    Se saltan los chats cuyo evento más antiguo espera un reintento, así un chat con
+    fallos no frena a los demás del shard pero nunca se procesa fuera de orden.
+    """
+    conn = conn or self._shared()
+    now = time.time()
+    rows = conn.execute(
+      "SELECT id, partition_key, event_type, payload, received_at, attempts FROM webhook_events "
+      "WHERE partition_hash % :workers = :shard AND partition_key NOT IN ("
+      "  SELECT partition_key FROM webhook_events WHERE partition_hash % :workers = :shard AND available_at > :now"
+      ") ORDER BY id LIMIT :limit",
+      {"workers": self.workers, "shard": shard, "now": now, "limit": self.batch_size},
+    ).fetchall()
+    blocked = set()
+    for event_id, partition_key, event_type, payload, received_at, attempts in rows:
+      if self._stop.is_set() or keep_lease is not None and not keep_lease():
+        break
+      if partition_key in blocked:
+        continue
+      try:
+        self.handler(json.loads(payload))
+      except Exception as e:
+        if self._fail(conn, event_id, attempts + 1, str(e)):
+          blocked.add(partition_key)
+        continue
+      conn.execute("DELETE FROM webhook_events WHERE id = ?", (event_id,))
+      self.processed += 1
+      self._lags.append((time.time() - received_at) * 1000)
+    return len(rows)
+
+  def backoff(self, attempts: int) -> float:
+    return min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+
+  def _fail(self, conn: sqlite3.Connection, event_id: int, attempts: int, error: str) -> bool:
+    """Programa el reintento (retorna True) o mueve el evento a dead letters (False)"""
+    now = time.time()
+    if attempts < self.max_attempts:
+      conn.execute(
+        "UPDATE webhook_events SET attempts = ?, available_at = ?, last_error = ? WHERE id = ?",
+        (attempts, now + self.backoff(attempts), error, event_id),
+      )
+      self.retried += 1
+      logger.warning(f"Webhook {event_id} falló (intento {attempts}/{self.max_attempts}): {error}")
+      return True
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+      conn.execute(
+        "INSERT INTO webhook_dead_letters (event_id, partition_key, event_type, payload, received_at, failed_at, attempts, last_error) "
+        "SELECT id, partition_key, event_type, payload, received_at, ?, ?, ? FROM webhook_events WHERE id = ?",
+        (now, attempts, error, event_id),
+      )
+      conn.execute("DELETE FROM webhook_events WHERE id = ?", (event_id,))
+      conn.execute("COMMIT")
+    except BaseException:
+      conn.execute("ROLLBACK")
+      raise
+    self.dead_lettered += 1
+    logger.error(f"Webhook {event_id} enviado a dead letters tras {attempts} intentos: {error}")
+    return False
+
+  def dead_letters(self, limit: int = 50) -> List[Dict[str, Any]]:
+    with self._conn_lock:
+      rows = self._shared().execute(
+        "SELECT id, event_id, partition_key, event_type, payload, received_at, failed_at, attempts, last_error "
+        "FROM webhook_dead_letters ORDER BY id DESC LIMIT ?",
+        (limit,),
+      ).fetchall()
+    return [
+      {
+        "id": row[0], "event_id": row[1], "partition_key": row[2], "event_type": row[3],
+        "payload": json.loads(row[4]), "received_at": row[5], "failed_at": row[6], "attempts": row[7], "last_error": row[8],
+      }
+      for row in rows
+    ]
+
+  def retry_dead_letter(self, dead_letter_id: int) -> Optional[int]:
+    """Devuelve un evento de dead letters a la cola con los intentos en cero; ``None`` si no existe"""
+    with self._conn_lock:
+      conn = self._shared()
+      row = conn.execute(
+        "SELECT partition_key, event_type, payload FROM webhook_dead_letters WHERE id = ?", (dead_letter_id,),
+      ).fetchone()
+      if row is None:
+        return None
+      conn.execute("DELETE FROM webhook_dead_letters WHERE id = ?", (dead_letter_id,))
+    partition_key, event_type, payload = row
+    return self.enqueue(event_type, payload, partition_key)
+
+  def stats(self) -> Dict[str, Any]:
+    now = time.time()
+    with self._conn_lock:
+      conn = self._shared()
+      depth, retrying, oldest = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(available_at > ?), 0), MIN(received_at) FROM webhook_events", (now,),
+      ).fetchone()
+      by_shard = dict(conn.execute(
+        "SELECT partition_hash % ?, COUNT(*) FROM webhook_events GROUP BY 1", (self.workers,),
+      ).fetchall())
+      dead_letters = conn.execute("SELECT COUNT(*) FROM webhook_dead_letters").fetchone()[0]
+    lags = list(self._lags)
+    return {
+      "running": self.running,
+      "workers": self.workers,
+      "depth": depth,
+      "retrying": retrying,
+      "depth_by_shard": {str(shard): by_shard.get(shard, 0) for shard in range(self.workers)},
+      # Antigüedad del evento pendiente más viejo: crece si los workers no dan abasto
+      "lag_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+      "processing_lag_ms": {"p50": _percentile(lags, 0.50), "p99": _percentile(lags, 0.99)},
+      "dead_letters": dead_letters,
+      "enqueued": self.enqueued,
+      "processed": self.processed,
+      "retried": self.retried,
+      "dead_lettered": self.dead_lettered,
+      "errors": self.errors,
+      "max_attempts": self.max_attempts,
+    }
+
+
+webhook_queue = WebhookQueue(
+  settings.webhook_queue_path,
+  workers=settings.webhook_workers,
+  batch_size=settings.webhook_batch_size,
+  poll_interval=settings.webhook_poll_ms / 1000,
+  max_attempts=settings.webhook_max_attempts,
+  backoff_base=settings.webhook_backoff_seconds,
+  backoff_max=settings.webhook_backoff_max_seconds,
+  lease_seconds=settings.webhook_lease_seconds,
+)
@@ -5,6 +5,7 @@ import re
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
+from app.db.unit_of_work import commit
 from app.services.chats import get_or_create_chat, create_message
 from app.schemas.chats.chat import MessageCreate
 from app.models.chats.chat import Message
@@ -287,7 +288,7 @@ async def import_whatsapp_chat(
                                     
                                     if message:
                                         message.attachment_url = f"/api/chats/media/{company_id}/{os.path.basename(media_path)}"
-                                        db.commit()
+                                        commit(db)
                                     
                                     result['media_files_saved'] += 1
                                     media_found = True
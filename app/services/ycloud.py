@@ -8,7 +8,7 @@ from app.core.config import settings
 class YCloudService:
     """Servicio para integración con YCloud WhatsApp API"""
     
-    BASE_URL = "https://api.ycloud.com/v2"
+    BASE_URL = settings.ycloud_api_base_url
     
     def __init__(self, api_key: str):
         self.api_key = api_key
@@ -0,0 +1,172 @@
+"""
+Benchmark del motor de respuestas automáticas con miles de reglas por empresa.
+
+Genera ``--rules`` reglas sintéticas (frases clave de un vocabulario inventado y una
+fracción de regex, algunas sin literal disparador) y mensajes de largo variable, una
+parte con alguna frase clave. Compara el autómata de Aho-Corasick compilado contra la
+evaluación ingenua (cada palabra clave y cada regex contra cada mensaje) y reporta en JSON:
+
+- tiempo de compilación y memoria del autómata (tracemalloc);
+- microsegundos por mensaje, p50/p99, de ambos métodos y la aceleración;
+- que ambos métodos devuelven exactamente las mismas reglas.
+
+No usa la base ni la aplicación: solo ``app.services.auto_replies``.
+
+Uso: python benchmarks/auto_reply_match.py [--rules 10000] [--messages 2000] [--regex-ratio 0.1]
+       [--output resultados.json]
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+if str(BACKEND_ROOT) not in sys.path:
+  sys.path.insert(0, str(BACKEND_ROOT))
+
+from realtime_load import percentiles  # noqa: E402
+
+SYLLABLES = (
+  "ca", "sa", "me", "lo", "ti", "ra", "mu", "ne", "po", "dis", "tran", "ción", "gú", "lle", "ña", "bo", "ri", "xa",
+  "fe", "gi", "ju", "ke", "pla", "tro", "cle", "vi", "zo", "que", "bri", "dro", "mon", "sel", "tar", "pen", "ful", "gar",
+)
+
+
+def word(rng):
+  return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5)))
+
+
+def make_rules(rng, count, regex_ratio, untriggered_ratio):
+  from app.services.auto_replies import RuleSnapshot
+
+  rules = []
+  for rule_id in range(1, count + 1):
+    roll = rng.random()
+    if roll < untriggered_ratio:
+      match_type, pattern = "regex", rf"\b{rng.choice(SYLLABLES)}\w*\d{{{rng.randint(3, 6)}}}\b"
+    elif roll < regex_ratio:
+      match_type, pattern = "regex", rf"{word(rng)}s? (de|del) \w+ {word(rng)}"
+    else:
+      phrases = [" ".join(word(rng) for _ in range(rng.randint(1, 2))) for _ in range(rng.randint(1, 3))]
+      match_type, pattern = "keyword", ", ".join(phrases)
+    rules.append(RuleSnapshot(
+      id=rule_id, name=f"regla {rule_id}", match_type=match_type, pattern=pattern, whole_word=True,
+      reply_type="text", reply_text="ok", template_id=None, priority=rng.randint(1, 100), cooldown_minutes=60,
+    ))
+  return rules
+
+
+def make_messages(rng, rules, count, hit_ratio):
+  from app.services.auto_replies import split_keywords
+
+  keyword_rules = [rule for rule in rules if rule.match_type == "keyword"]
+  messages = []
+  for _ in range(count):
+    words = [word(rng) for _ in range(rng.choice((3, 8, 20, 60)))]
+    if rng.random() < hit_ratio and keyword_rules:
+      words.insert(rng.randrange(len(words) + 1), rng.choice(split_keywords(rng.choice(keyword_rules).pattern)))
+    messages.append(" ".join(words).capitalize() + "?")
+  return messages
+
+
+class NaiveMatcher:
+  """Lo que el autómata reemplaza: cada regla se evalúa contra cada mensaje"""
+
+  def __init__(self, rules):
+    from app.services.auto_replies import compile_regex, split_keywords
+
+    self.checks = []
+    for rule in rules:
+      if rule.match_type == "regex":
+        self.checks.append((rule, [compile_regex(rule.pattern)]))
+      else:
+        self.checks.append((rule, [re.compile(rf"(?<!\w){re.escape(keyword)}(?!\w)") for keyword in split_keywords(rule.pattern)]))
+
+  def match(self, text):
+    from app.services.auto_replies import normalize_text
+
+    normalized = normalize_text(text)
+    matched = [rule for rule, patterns in self.checks if any(pattern.search(normalized) for pattern in patterns)]
+    return sorted(matched, key=lambda rule: rule.order)
+
+
+def timed(match, messages):
+  samples, results = [], []
+  for text in messages:
+    started = time.perf_counter()
+    results.append([rule.id for rule in match(text)])
+    samples.append((time.perf_counter() - started) * 1e6)
+  return samples, results
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--rules", type=int, default=10000)
+  parser.add_argument("--messages", type=int, default=2000)
+  parser.add_argument("--regex-ratio", type=float, default=0.1, help="fracción de reglas regex")
+  parser.add_argument("--untriggered-ratio", type=float, default=0.005, help="fracción de regex sin literal disparador")
+  parser.add_argument("--hit-ratio", type=float, default=0.3, help="fracción de mensajes con una frase clave")
+  parser.add_argument("--naive-messages", type=int, default=300, help="mensajes evaluados con el método ingenuo")
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("--output", help="archivo JSON de resultados (por defecto solo stdout)")
+  args = parser.parse_args()
+
+  from app.services.auto_replies import compile_rules
+
+  rng = random.Random(args.seed)
+  rules = make_rules(rng, args.rules, args.regex_ratio, args.untriggered_ratio)
+  messages = make_messages(rng, rules, args.messages, args.hit_ratio)
+
+  compiled = compile_rules(rules)
+  # Segunda compilación solo para medir memoria: tracemalloc la hace varias veces más lenta
+  tracemalloc.start()
+  measured = compile_rules(rules)
+  automaton_kb = tracemalloc.get_traced_memory()[0] // 1024
+  tracemalloc.stop()
+  del measured
+
+  compiled_us, compiled_results = timed(compiled.match, messages)
+  naive = NaiveMatcher(rules)
+  subset = messages[:args.naive_messages]
+  naive_us, naive_results = timed(naive.match, subset)
+
+  compiled_p50 = percentiles(compiled_us)["p50"]
+  naive_p50 = percentiles(naive_us)["p50"]
+  results = {
+    "rules": {
+      "total": len(rules),
+      "regex": sum(rule.match_type == "regex" for rule in rules),
+      "untriggered_regex": len(compiled.untriggered),
+      "automaton_nodes": len(compiled.automaton),
+      "build_ms": compiled.build_ms,
+      "automaton_kb": automaton_kb,
+    },
+    "messages": {
+      "total": len(messages),
+      "with_match": sum(bool(ids) for ids in compiled_results),
+      "mean_chars": round(sum(map(len, messages)) / len(messages), 1),
+    },
+    "match_us": {
+      "automaton": percentiles(compiled_us),
+      "naive": percentiles(naive_us),
+      "speedup_p50": round(naive_p50 / compiled_p50, 1) if compiled_p50 else None,
+    },
+    "same_results": compiled_results[:len(subset)] == naive_results,
+    "config": vars(args),
+  }
+
+  output = json.dumps(results, indent=2, ensure_ascii=False)
+  print(output)
+  if args.output:
+    with open(args.output, "w") as f:
+      f.write(output)
+  if not results["same_results"]:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,105 @@
+"""
+Micro-benchmark del costo por destinatario de un broadcast de websocket.
+
+Compara, sobre las mismas colas de salida, el envío anterior (``json.dumps`` por cada
+destinatario, como hacía ``send_json``) con el actual (un ``Frame`` serializado una vez
+y compartido por todas las colas),
+y reporta cuánto reduce permessage-deflate los payloads grandes.
+
+Uso: python benchmarks/realtime_broadcast.py [--recipients 200] [--rounds 200]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import zlib
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+if str(BACKEND_ROOT) not in sys.path:
+  sys.path.insert(0, str(BACKEND_ROOT))
+
+from app.services.realtime import ConnectionManager, Frame, encode_frame, orjson  # noqa: E402
+
+
+class NullSocket:
+  async def send_text(self, text):
+    pass
+
+  async def close(self, code=1000):
+    pass
+
+
+def payloads():
+  message = {
+    "id": 123456, "chat_id": 42, "content": "Hola, quisiera saber el precio del plan mensual " * 2,
+    "message_type": "text", "direction": "incoming", "sender_name": "Cliente", "status": "delivered",
+    "whatsapp_message_id": "wamid.HBgMNTczMDAxMjM0NTY3FQIAEhgUM0E", "created_at": "2024-05-01T12:00:00",
+    "attachment_url": None, "user_id": None, "company_id": 1,
+  }
+  return {
+    "chat.updated": {"chat_id": 42, "company_id": 1, "last_message": message},
+    "chats.bulk_updated": {"company_id": 1, "count": 1000, "chat_ids": list(range(1000)), "changes": {"status": "closed"}},
+  }
+
+
+class JsonFrame(Frame):
+  """Frame serializado con json estándar, como lo hacía ``WebSocket.send_json``"""
+
+  def __init__(self, event, data, seq=None, channel=None):
+    message = {"event": event, "data": data}
+    if channel is not None:
+      message["channel"] = channel
+    if seq is not None:
+      message["seq"] = seq
+    self.event = event
+    self.key = None
+    self.text = json.dumps(message)
+
+
+class PerRecipientManager(ConnectionManager):
+  def _enqueue_all(self, sockets, channel, event, data, seq=None):
+    for websocket in list(sockets):
+      self.frames_encoded += 1
+      self._clients[websocket].enqueue(JsonFrame(event, data, seq, channel))
+
+
+async def run(manager_class, recipients, event, data, rounds):
+  manager = manager_class(max_queue=rounds + 1)
+  for _ in range(recipients):
+    await manager.connect_company(NullSocket(), 1)
+  started = time.perf_counter()
+  for _ in range(rounds):
+    await manager.broadcast_to_company(1, event, data)
+  await manager.flush()
+  return time.perf_counter() - started
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--recipients", type=int, default=200)
+  parser.add_argument("--rounds", type=int, default=200)
+  args = parser.parse_args()
+
+  results = {"recipients": args.recipients, "rounds": args.rounds, "encoder": "orjson" if orjson else "json", "events": {}}
+  deliveries = args.recipients * args.rounds
+  for event, data in payloads().items():
+    before = asyncio.run(run(PerRecipientManager, args.recipients, event, data, args.rounds))
+    after = asyncio.run(run(ConnectionManager, args.recipients, event, data, args.rounds))
+    frame = encode_frame(event, data).encode()
+    # permessage-deflate usa DEFLATE sin cabeceras (wbits negativos)
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    deflated = compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    results["events"][event] = {
+      "frame_bytes": len(frame),
+      "deflate_bytes": len(deflated),
+      "per_recipient_json_us": round(before / deliveries * 1e6, 3),
+      "encode_once_us": round(after / deliveries * 1e6, 3),
+      "speedup": round(before / after, 2) if after else None,
+    }
+  print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+  main()
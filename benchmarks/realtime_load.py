@@ -0,0 +1,435 @@
+"""
+Prueba de carga del tiempo real de punta a punta.
+
+Levanta la aplicación en este mismo proceso (uvicorn en un hilo propio, sobre una base
+temporal), abre miles de websockets reales en los canales de empresa y de chat, y envía
+mensajes entrantes por el webhook de YCloud a un ritmo fijo, opcionalmente seguidos de
+una ráfaga. Reporta en JSON:
+
+- latencia de broadcast (desde que se envía el webhook hasta que cada cliente recibe el
+  evento con el mensaje), por fase y por tipo de canal, en percentiles;
+- memoria por conexión (RSS del proceso, incluye ambos extremos del socket);
+- lag del event loop del servidor, medido con una tarea que duerme a intervalos fijos;
+- ``queue_stats`` del ``ConnectionManager`` (incluye la outbox) al terminar.
+
+Cada conexión usa dos descriptores (cliente y servidor); el script sube el límite blando
+de archivos abiertos hasta el duro y avisa si no alcanza.
+
+Uso: python benchmarks/realtime_load.py [--clients 5000] [--chat-fraction 0.2] [--chats 200]
+       [--rate 50] [--duration 20] [--burst 500] [--output resultados.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+if str(BACKEND_ROOT) not in sys.path:
+  sys.path.insert(0, str(BACKEND_ROOT))
+
+COMPANY_PHONE = "+573000000000"
+# Marca única por mensaje dentro del contenido; viaja en message.created y en chat.updated
+MARKER = re.compile(r"loadtest-(\d+)-")
+
+
+def percentiles(values):
+  if not values:
+    return {"count": 0}
+  values = sorted(values)
+  pick = lambda q: values[min(len(values) - 1, int(len(values) * q))]
+  return {
+    "count": len(values),
+    "p50": round(pick(0.50), 3),
+    "p90": round(pick(0.90), 3),
+    "p99": round(pick(0.99), 3),
+    "max": round(values[-1], 3),
+    "mean": round(sum(values) / len(values), 3),
+  }
+
+
+def rss_kb():
+  """RSS actual; /proc solo existe en Linux, en otros sistemas se usa el pico"""
+  try:
+    with open("/proc/self/statm") as statm:
+      return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+  except OSError:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def raise_fd_limit(needed):
+  try:
+    import resource
+  except ImportError:
+    return None
+  soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+  if soft < needed:
+    target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    soft = target
+  if soft < needed:
+    print(f"Aviso: límite de archivos abiertos {soft} < {needed}; subir con ulimit -n", file=sys.stderr)
+  return soft
+
+
+def inbound_payload(index, phone, sent_at):
+  return {
+    "type": "whatsapp.inbound_message.received",
+    "whatsappInboundMessage": {
+      "id": f"loadtest-{index}",
+      "wamid": f"wamid.loadtest.{index}",
+      "from": phone,
+      "to": COMPANY_PHONE,
+      "type": "text",
+      "customerProfile": {"name": f"Cliente {phone[-4:]}"},
+      "text": {"body": f"loadtest-{index}- enviado {sent_at:.6f}"},
+    },
+  }
+
+
+class ServerThread:
+  """uvicorn con su propio event loop, para medir su lag sin mezclarlo con el de los clientes"""
+
+  def __init__(self, app, settings, deflate):
+    import uvicorn
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.sock.bind(("127.0.0.1", 0))
+    self.port = self.sock.getsockname()[1]
+    config = uvicorn.Config(
+      app,
+      log_level="warning",
+      backlog=4096,
+      ws_per_message_deflate=deflate,
+      ws_ping_interval=settings.ws_ping_interval,
+      ws_ping_timeout=settings.ws_ping_timeout,
+    )
+    self.server = uvicorn.Server(config)
+    self.loop = None
+    self.lags = []
+    self._probe_phase = None
+    self._thread = threading.Thread(target=self._run, name="realtime-load-server", daemon=True)
+
+  def _run(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.loop.run_until_complete(self.server.serve(sockets=[self.sock]))
+
+  def start(self):
+    self._thread.start()
+    deadline = time.monotonic() + 30
+    while not self.server.started:
+      if time.monotonic() > deadline or not self._thread.is_alive():
+        raise RuntimeError("El servidor no arrancó")
+      time.sleep(0.05)
+
+  def probe_lag(self, interval):
+    async def probe():
+      while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        self.lags.append((self._probe_phase, (time.perf_counter() - expected) * 1000))
+    asyncio.run_coroutine_threadsafe(probe(), self.loop)
+
+  def set_phase(self, phase):
+    self._probe_phase = phase
+
+  def call(self, coro, timeout=30):
+    return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+  def stop(self):
+    self.server.should_exit = True
+    self._thread.join(30)
+
+
+def seed(chats):
+  """Empresa con su número de WhatsApp y ``chats`` chats ya creados; devuelve (empresa, [(chat_id, teléfono)])"""
+  from app.db.session import SessionLocal
+  from app.models.companies.company import Company
+  from app.services.chats import get_or_create_chat_id
+
+  db = SessionLocal()
+  try:
+    company = Company(
+      nombre="Carga", razon_social="Carga SAS", nit=f"loadtest-{time.time_ns()}", responsable="Bench",
+      email="carga@example.com", telefono=COMPANY_PHONE, direccion="-", whatsapp_phone_number=COMPANY_PHONE,
+    )
+    db.add(company)
+    db.commit()
+    targets = []
+    for index in range(chats):
+      phone = f"+57310{index:07d}"
+      targets.append((get_or_create_chat_id(db=db, company_id=company.id, phone_number=phone, customer_name=f"Cliente {index}"), phone))
+    db.commit()
+    return company.id, targets
+  finally:
+    db.close()
+
+
+class LoadClient:
+  def __init__(self, url, kind):
+    self.url = url
+    self.kind = kind
+    self.seen = set()
+    self.frames = 0
+    self.task = None
+    self.ws = None
+
+  async def open(self, compression):
+    from websockets.asyncio.client import connect
+    self.ws = await connect(self.url, compression=compression, max_size=None, ping_interval=None, open_timeout=60)
+
+  async def receive(self, sent, latencies):
+    try:
+      async for text in self.ws:
+        now = time.perf_counter()
+        self.frames += 1
+        for index in MARKER.findall(text):
+          index = int(index)
+          if index in self.seen or index not in sent:
+            continue
+          self.seen.add(index)
+          phase, started = sent[index]
+          latencies[phase][self.kind].append((now - started) * 1000)
+    except Exception:
+      pass
+
+
+async def connect_all(clients, concurrency, compression):
+  semaphore = asyncio.Semaphore(concurrency)
+  failed = 0
+
+  async def one(client):
+    nonlocal failed
+    async with semaphore:
+      try:
+        await client.open(compression)
+      except Exception:
+        failed += 1
+
+  await asyncio.gather(*(one(client) for client in clients))
+  return failed
+
+
+async def drive(base_url, targets, phase, count, rate, first_index, sent, webhook_ms, max_inflight):
+  """Envía ``count`` webhooks al ritmo ``rate`` (0 = todos de una vez); devuelve los fallidos"""
+  import httpx
+
+  semaphore = asyncio.Semaphore(max_inflight)
+  failures = 0
+  limits = httpx.Limits(max_connections=max_inflight, max_keepalive_connections=max_inflight)
+
+  async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+    async def post(index):
+      nonlocal failures
+      async with semaphore:
+        phone = targets[index % len(targets)][1]
+        started = time.perf_counter()
+        sent[index] = (phase, started)
+        try:
+          response = await http.post("/api/webhooks/ycloud", json=inbound_payload(index, phone, time.time()))
+          if response.status_code != 200:
+            failures += 1
+        except httpx.HTTPError:
+          failures += 1
+        webhook_ms[phase].append((time.perf_counter() - started) * 1000)
+
+    tasks = []
+    origin = time.perf_counter()
+    for offset in range(count):
+      if rate > 0:
+        delay = origin + offset / rate - time.perf_counter()
+        if delay > 0:
+          await asyncio.sleep(delay)
+      tasks.append(asyncio.create_task(post(first_index + offset)))
+    await asyncio.gather(*tasks)
+  return failures
+
+
+async def run(args, server, company_id, targets, manager):
+  base_ws = f"ws://127.0.0.1:{server.port}/api/chats/ws"
+  chat_clients = int(args.clients * args.chat_fraction)
+  clients = []
+  for index in range(args.clients):
+    if index < chat_clients:
+      chat_id = targets[index % len(targets)][0]
+      clients.append(LoadClient(f"{base_ws}/{company_id}/{chat_id}", "chat"))
+    else:
+      clients.append(LoadClient(f"{base_ws}/company/{company_id}", "company"))
+
+  compression = "deflate" if args.deflate else None
+  rss_before = rss_kb()
+  started = time.perf_counter()
+  failed = await connect_all(clients, args.connect_concurrency, compression)
+  connect_seconds = time.perf_counter() - started
+  connected = [client for client in clients if client.ws is not None]
+  # Dejar que el servidor termine de registrar las suscripciones antes de medir
+  await asyncio.sleep(1)
+  rss_after = rss_kb()
+
+  phases = ["steady"] + (["burst"] if args.burst else [])
+  sent = {}
+  latencies = {phase: {"company": [], "chat": []} for phase in phases}
+  webhook_ms = {phase: [] for phase in phases}
+  for client in connected:
+    client.task = asyncio.create_task(client.receive(sent, latencies))
+
+  server.probe_lag(args.lag_interval / 1000)
+  results_phases = {}
+  next_index = 0
+  plan = [("steady", int(args.rate * args.duration), args.rate)]
+  if args.burst:
+    plan.append(("burst", args.burst, 0))
+  for phase, count, rate in plan:
+    server.set_phase(phase)
+    started = time.perf_counter()
+    failures = await drive(
+      f"http://127.0.0.1:{server.port}", targets, phase, count, rate, next_index, sent, webhook_ms, args.max_inflight,
+    )
+    elapsed = time.perf_counter() - started
+    # El webhook responde antes de procesar (cola durable): esperar hasta que dejen de
+    # llegar entregas durante ``settle`` segundos antes de pasar a la siguiente fase
+    quiet_since, delivered = time.perf_counter(), -1
+    while time.perf_counter() - quiet_since < args.settle:
+      await asyncio.sleep(0.25)
+      total = sum(map(len, latencies[phase].values()))
+      if total != delivered:
+        quiet_since, delivered = time.perf_counter(), total
+    chats_per_target = {}
+    for client in connected:
+      if client.kind == "chat":
+        chats_per_target[client.url] = chats_per_target.get(client.url, 0) + 1
+    expected = {"company": sum(client.kind == "company" for client in connected) * count, "chat": 0}
+    for index in range(next_index, next_index + count):
+      chat_id = targets[index % len(targets)][0]
+      expected["chat"] += chats_per_target.get(f"{base_ws}/{company_id}/{chat_id}", 0)
+    results_phases[phase] = {
+      "messages": count,
+      "failed_webhooks": failures,
+      "target_rate": rate or None,
+      "achieved_rate": round(count / elapsed, 1) if elapsed else None,
+      "webhook_ms": percentiles(webhook_ms[phase]),
+      "broadcast_latency_ms": percentiles(latencies[phase]["company"] + latencies[phase]["chat"]),
+      # message.created en el canal del chat nunca se descarta; en el de empresa, la ventana de
+      # coalescencia reemplaza el chat.updated de un chat por el siguiente y el ratio baja de 1
+      "channels": {
+        kind: {
+          "broadcast_latency_ms": percentiles(values),
+          "deliveries": len(values),
+          "expected_deliveries": expected[kind],
+          "delivery_ratio": round(len(values) / expected[kind], 4) if expected[kind] else None,
+        }
+        for kind, values in latencies[phase].items()
+      },
+      "event_loop_lag_ms": percentiles([lag for lag_phase, lag in server.lags if lag_phase == phase]),
+    }
+    next_index += count
+  server.set_phase(None)
+
+  manager_stats = server.call(_queue_stats(manager))
+  for client in connected:
+    await client.ws.close()
+  await asyncio.gather(*(client.task for client in connected), return_exceptions=True)
+
+  return {
+    "connections": {
+      "requested": args.clients,
+      "connected": len(connected),
+      "failed": failed,
+      "company": sum(client.kind == "company" for client in connected),
+      "chat": sum(client.kind == "chat" for client in connected),
+      "connect_seconds": round(connect_seconds, 2),
+    },
+    "memory": {
+      "rss_before_kb": rss_before,
+      "rss_after_kb": rss_after,
+      "per_connection_kb": round((rss_after - rss_before) / len(connected), 2) if connected else None,
+    },
+    "phases": results_phases,
+    "frames_received": sum(client.frames for client in connected),
+    "manager": manager_stats,
+  }
+
+
+async def _queue_stats(manager):
+  # queue_stats se lee en el loop del servidor, dueño de las colas
+  return manager.queue_stats()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--clients", type=int, default=5000)
+  parser.add_argument("--chat-fraction", type=float, default=0.2, help="fracción de clientes en canales de chat")
+  parser.add_argument("--chats", type=int, default=200, help="chats distintos que reciben mensajes")
+  parser.add_argument("--rate", type=float, default=50, help="webhooks por segundo en la fase estable")
+  parser.add_argument("--duration", type=float, default=20, help="segundos de la fase estable")
+  parser.add_argument("--burst", type=int, default=0, help="webhooks enviados de una vez al final (0 = sin ráfaga)")
+  parser.add_argument("--max-inflight", type=int, default=10, help="webhooks concurrentes como máximo")
+  parser.add_argument("--connect-concurrency", type=int, default=200)
+  parser.add_argument("--coalesce-ms", type=float, default=None, help="REALTIME_COALESCE_MS del servidor")
+  parser.add_argument("--policy", default=None, help="REALTIME_SLOW_CONSUMER_POLICY del servidor")
+  parser.add_argument("--deflate", action="store_true", help="negociar permessage-deflate")
+  parser.add_argument("--lag-interval", type=float, default=10, help="ms entre muestras de lag del event loop")
+  parser.add_argument("--settle", type=float, default=2, help="segundos sin entregas nuevas que cierran cada fase")
+  parser.add_argument("--output", help="archivo JSON de resultados (por defecto solo stdout)")
+  args = parser.parse_args()
+
+  fd_limit = raise_fd_limit(args.clients * 2 + 512)
+
+  # Base temporal y sin mantenimiento: nunca tocar data/app.db
+  workdir = tempfile.mkdtemp(prefix="realtime-load-")
+  os.environ["SQLITE_PATH"] = os.path.join(workdir, "app.db")
+  os.environ.setdefault("MAINTENANCE_ENABLED", "0")
+  os.environ.setdefault("REALTIME_BROKER", "memory")
+  if args.coalesce_ms is not None:
+    os.environ["REALTIME_COALESCE_MS"] = str(args.coalesce_ms)
+  if args.policy:
+    os.environ["REALTIME_SLOW_CONSUMER_POLICY"] = args.policy
+
+  from app.core.config import settings  # noqa: E402
+  from app.main import app  # noqa: E402
+  from app.services.realtime import manager  # noqa: E402
+
+  # El webhook registra cada petición en INFO; con miles por segundo domina el tiempo
+  logging.disable(logging.INFO)
+
+  server = ServerThread(app, settings, args.deflate)
+  server.start()
+  try:
+    company_id, targets = seed(args.chats)
+    results = asyncio.run(run(args, server, company_id, targets, manager))
+  finally:
+    server.stop()
+
+  results["config"] = {
+    "clients": args.clients,
+    "chat_fraction": args.chat_fraction,
+    "chats": args.chats,
+    "rate": args.rate,
+    "duration": args.duration,
+    "burst": args.burst,
+    "max_inflight": args.max_inflight,
+    "coalesce_ms": settings.realtime_coalesce_ms,
+    "policy": settings.realtime_slow_consumer_policy,
+    "max_queue": settings.realtime_queue_size,
+    "deflate": args.deflate,
+    "fd_limit": fd_limit,
+    "python": sys.version.split()[0],
+    "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+  }
+  output = json.dumps(results, indent=2)
+  if args.output:
+    Path(args.output).write_text(output + "\n")
+  print(output)
+
+
+if __name__ == "__main__":
+  main()
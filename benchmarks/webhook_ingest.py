@@ -0,0 +1,561 @@
+"""
+Benchmark de ingesta de webhooks de YCloud.
+
+Levanta la aplicación en este mismo proceso (uvicorn en un hilo, sobre una base temporal)
+y un doble local de YCloud que sirve los links de los adjuntos y la API de envío
+(``YCLOUD_API_BASE_URL`` apunta a él). Genera tráfico realista contra
+``/api/webhooks/ycloud``: mensajes entrantes de muchos clientes repartidos entre varias
+empresas, con una fracción de adjuntos (imagen, audio, video, documento, sticker),
+acuses ``whatsapp.message.updated`` de mensajes salientes (sent → delivered → read) y
+reintentos duplicados. Reporta en JSON:
+
+- throughput sostenido: webhooks confirmados por segundo y eventos procesados por
+  segundo (hasta que la cola queda vacía);
+- latencia p50/p99 de la respuesta del webhook y de punta a punta (desde el envío hasta
+  que el mensaje es visible en la base, muestreada cada ``--poll-ms``);
+- crecimiento de la base (``app.db`` tras un checkpoint del WAL), de la cola, del archivo
+  de webhooks y de los adjuntos descargados, total y por mensaje guardado;
+- contadores de la cola, la deduplicación, los acuses y el doble de YCloud.
+
+Umbral de regresión: ``--min-throughput`` y ``--max-p99-ms`` fijan límites absolutos;
+``--baseline resultados.json --tolerance 0.2`` compara contra una corrida anterior. Si
+alguno se incumple se listan en ``regressions`` y el proceso sale con código 1.
+
+Uso: python benchmarks/webhook_ingest.py [--companies 20] [--customers 2000] [--rate 200]
+       [--duration 20] [--media-ratio 0.15] [--status-ratio 1.0] [--output resultados.json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+if str(BACKEND_ROOT) not in sys.path:
+  sys.path.insert(0, str(BACKEND_ROOT))
+
+from realtime_load import ServerThread, percentiles, rss_kb  # noqa: E402
+
+MEDIA_TYPES = {
+  "image": ("image/jpeg", ".jpg"),
+  "audio": ("audio/ogg", ".ogg"),
+  "video": ("video/mp4", ".mp4"),
+  "document": ("application/pdf", ".pdf"),
+  "sticker": ("image/webp", ".webp"),
+}
+TEXTS = (
+  "Hola, ¿a qué hora abren mañana?",
+  "Quiero saber el precio del plan mensual",
+  "¿Tienen envíos a Medellín?",
+  "Gracias, quedo atento",
+  "Buenas tardes, necesito ayuda con mi pedido #{n}",
+  "¿Dónde están ubicados?",
+  "Ok",
+)
+
+
+class YCloudStandIn:
+  """
+  Doble local de YCloud en un ``ThreadingHTTPServer``.
+
+  - ``GET /media/<nombre>``: adjunto de ``media_bytes`` con el content-type de su extensión.
+  - ``POST /v2/whatsapp/messages``: acepta el envío y, como YCloud, devuelve después los
+    acuses ``sent`` y ``delivered`` al webhook de la aplicación.
+  - ``GET /v2/whatsapp/phoneNumbers``: un número verificado.
+  """
+
+  def __init__(self, media_bytes, callback_delay=0.05):
+    self.media = bytes(random.Random(0).getrandbits(8) for _ in range(media_bytes))
+    self.callback_delay = callback_delay
+    self.webhook_url = None
+    self.counters = {"media_requests": 0, "media_bytes": 0, "sends": 0, "status_callbacks": 0, "callback_errors": 0}
+    self._lock = threading.Lock()
+    self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+    self._server.daemon_threads = True
+    self.port = self._server.server_address[1]
+    self.url = f"http://127.0.0.1:{self.port}"
+    self._thread = threading.Thread(target=self._server.serve_forever, name="ycloud-stand-in", daemon=True)
+
+  def _count(self, key, amount=1):
+    with self._lock:
+      self.counters[key] += amount
+
+  def _handler(self):
+    stand_in = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+
+      def log_message(self, *args):
+        pass
+
+      def _json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def do_GET(self):
+        if self.path.startswith("/media/"):
+          extension = os.path.splitext(self.path)[1]
+          mime = next((mime for mime, ext in MEDIA_TYPES.values() if ext == extension), "application/octet-stream")
+          self.send_response(200)
+          self.send_header("Content-Type", mime)
+          self.send_header("Content-Length", str(len(stand_in.media)))
+          self.end_headers()
+          self.wfile.write(stand_in.media)
+          stand_in._count("media_requests")
+          stand_in._count("media_bytes", len(stand_in.media))
+        elif self.path.startswith("/v2/whatsapp/phoneNumbers"):
+          self._json(200, {"phoneNumbers": [{"phoneNumber": "+570000000000", "status": "CONNECTED", "verifiedName": "Bench"}]})
+        else:
+          self._json(404, {"error": "not found"})
+
+      def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if not self.path.startswith("/v2/whatsapp/messages"):
+          self._json(404, {"error": "not found"})
+          return
+        stand_in._count("sends")
+        message_id = f"standin-{time.time_ns()}"
+        self._json(200, {"id": message_id, "status": "accepted", "from": payload.get("from"), "to": payload.get("to")})
+        stand_in.schedule_statuses(message_id, payload.get("from"), payload.get("to"))
+
+    return Handler
+
+  def schedule_statuses(self, message_id, business, customer):
+    if not self.webhook_url:
+      return
+
+    def deliver():
+      import httpx
+      with httpx.Client(timeout=30) as client:
+        for status in ("sent", "delivered"):
+          try:
+            client.post(self.webhook_url, json=status_payload(message_id, business, customer, status))
+            self._count("status_callbacks")
+          except httpx.HTTPError:
+            self._count("callback_errors")
+
+    threading.Timer(self.callback_delay, deliver).start()
+
+  def start(self):
+    self._thread.start()
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+
+def status_payload(message_id, business, customer, status):
+  return {
+    "id": f"evt-{message_id}-{status}",
+    "type": "whatsapp.message.updated",
+    "whatsappMessage": {"id": message_id, "wamid": f"wamid.{message_id}", "from": business, "to": customer, "status": status},
+  }
+
+
+class Workload:
+  """
+  Tráfico sintético y reproducible (``seed``).
+
+  Cada cliente pertenece a una empresa; los mensajes entrantes eligen clientes con una
+  distribución de Zipf (pocos clientes concentran la conversación, como en producción).
+  Los acuses recorren los mensajes salientes sembrados en orden sent → delivered → read.
+  """
+
+  def __init__(self, companies, customers, media_ratio, status_ratio, duplicate_ratio, media_url, seed=1):
+    self.random = random.Random(seed)
+    self.company_phones = [f"+57601{index:07d}" for index in range(companies)]
+    self.customers = [(self.company_phones[index % companies], f"+57320{index:07d}") for index in range(customers)]
+    # Zipf: unos pocos chats muy activos y una cola larga de chats con un par de mensajes
+    self._weights = list(itertools.accumulate(1 / (rank + 1) ** 0.8 for rank in range(customers)))
+    self.random.shuffle(self.customers)
+    self.media_ratio = media_ratio
+    self.status_ratio = status_ratio
+    self.duplicate_ratio = duplicate_ratio
+    self.media_url = media_url
+    self.outgoing = []
+    self._next_status = {}
+    self._inbound = 0
+    self._recent = []
+
+  def customer(self):
+    return self.random.choices(self.customers, cum_weights=self._weights)[0]
+
+  def inbound(self):
+    self._inbound += 1
+    n = self._inbound
+    business, customer = self.customer()
+    message = {
+      "id": f"bench-{n}", "wamid": f"wamid.bench.{n}", "from": customer, "to": business,
+      "customerProfile": {"name": f"Cliente {customer[-4:]}"},
+    }
+    if self.random.random() < self.media_ratio:
+      kind = self.random.choice(list(MEDIA_TYPES))
+      mime, extension = MEDIA_TYPES[kind]
+      message["type"] = kind
+      message[kind] = {"link": f"{self.media_url}/media/bench-{n}{extension}", "mime_type": mime}
+      if kind == "document":
+        message[kind]["filename"] = f"factura-{n}.pdf"
+      elif kind in ("image", "video"):
+        message[kind]["caption"] = f"Adjunto {n}"
+    else:
+      message["type"] = "text"
+      message["text"] = {"body": self.random.choice(TEXTS).format(n=n)}
+    payload = {"id": f"evt-bench-{n}", "type": "whatsapp.inbound_message.received", "whatsappInboundMessage": message}
+    self._recent.append(payload)
+    del self._recent[:-200]
+    return payload
+
+  def status(self):
+    pending = [key for key in self.outgoing if self._next_status.get(key, 0) < 3]
+    if not pending:
+      return None
+    key = self.random.choice(pending[:500])
+    step = self._next_status.get(key, 0)
+    self._next_status[key] = step + 1
+    message_id, business, customer = key
+    return status_payload(message_id, business, customer, ("sent", "delivered", "read")[step])
+
+  def next(self):
+    """(tipo, payload) del siguiente webhook: entrante, acuse o reintento de un entrante reciente"""
+    roll = self.random.random()
+    if self._recent and roll < self.duplicate_ratio:
+      return "duplicate", self.random.choice(self._recent)
+    if self.random.random() < self.status_ratio / (1 + self.status_ratio):
+      payload = self.status()
+      if payload is not None:
+        return "status", payload
+    return "inbound", self.inbound()
+
+
+def seed(workload, outgoing_per_company, api_key):
+  """Empresas (con la API apuntando al doble), chats y mensajes salientes que recibirán acuses"""
+  from app.db.session import SessionLocal
+  from app.models.chats.chat import Message
+  from app.models.companies.company import Company
+  from app.services.chats import get_or_create_chat_id
+
+  db = SessionLocal()
+  try:
+    for index, phone in enumerate(workload.company_phones):
+      db.add(Company(
+        nombre=f"Empresa {index}", razon_social=f"Empresa {index} SAS", nit=f"bench-{index}-{time.time_ns()}",
+        responsable="Bench", email=f"empresa{index}@example.com", telefono=phone, direccion="-",
+        whatsapp_phone_number=phone, ycloud_api_key=api_key,
+      ))
+    db.commit()
+    companies = {company.whatsapp_phone_number: company.id for company in db.query(Company).all()}
+    for business, customer in workload.customers[:outgoing_per_company * len(workload.company_phones)]:
+      chat_id = get_or_create_chat_id(db=db, company_id=companies[business], phone_number=customer, customer_name=f"Cliente {customer[-4:]}")
+      message_id = f"out-{customer}"
+      db.add(Message(chat_id=chat_id, content="Respuesta del agente", direction="outgoing", whatsapp_message_id=message_id, status="accepted"))
+      workload.outgoing.append((message_id, business, customer))
+    db.commit()
+  finally:
+    db.close()
+
+
+def checkpoint(db_path):
+  """Pasa el WAL a la base para que el tamaño medido no dependa de cuándo fue el último checkpoint"""
+  with sqlite3.connect(db_path, timeout=30) as conn:
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def file_sizes(paths):
+  total = 0
+  for path in paths:
+    path = Path(path)
+    if path.is_dir():
+      total += sum(item.stat().st_size for item in path.rglob("*") if item.is_file())
+    else:
+      for candidate in (path, Path(f"{path}-wal"), Path(f"{path}-shm")):
+        if candidate.exists():
+          total += candidate.stat().st_size
+  return total
+
+
+class Visibility:
+  """Muestrea la base para saber cuándo cada mensaje entrante quedó guardado (latencia de punta a punta)"""
+
+  def __init__(self, db_path, interval):
+    self.db_path = db_path
+    self.interval = interval
+    self.seen = {}
+    self.last_id = 0
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name="bench-visibility", daemon=True)
+
+  def _run(self):
+    conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=30)
+    try:
+      while not self._stop.wait(self.interval):
+        rows = conn.execute(
+          "SELECT id, whatsapp_message_id FROM messages WHERE id > ? AND direction = 'incoming'", (self.last_id,),
+        ).fetchall()
+        now = time.perf_counter()
+        for row_id, message_id in rows:
+          self.last_id = max(self.last_id, row_id)
+          self.seen.setdefault(message_id, now)
+    finally:
+      conn.close()
+
+  def start(self):
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    self._thread.join(10)
+
+
+async def drive(base_url, workload, count, rate, max_inflight, sent, ack_ms, kinds):
+  """Envía ``count`` webhooks al ritmo ``rate`` (0 = lo más rápido que permita ``max_inflight``)"""
+  import httpx
+
+  semaphore = asyncio.Semaphore(max_inflight)
+  failures = 0
+  limits = httpx.Limits(max_connections=max_inflight, max_keepalive_connections=max_inflight)
+
+  async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+    async def post(kind, payload):
+      nonlocal failures
+      async with semaphore:
+        started = time.perf_counter()
+        if kind == "inbound":
+          sent[payload["whatsappInboundMessage"]["id"]] = started
+        try:
+          response = await http.post("/api/webhooks/ycloud", json=payload)
+          if response.status_code != 200:
+            failures += 1
+        except httpx.HTTPError:
+          failures += 1
+        ack_ms[kind].append((time.perf_counter() - started) * 1000)
+
+    tasks = []
+    origin = time.perf_counter()
+    for offset in range(count):
+      if rate > 0:
+        delay = origin + offset / rate - time.perf_counter()
+        if delay > 0:
+          await asyncio.sleep(delay)
+      elif len(tasks) >= max_inflight * 4:
+        # Sin ritmo fijo: no crear todas las tareas de una vez
+        await asyncio.sleep(0)
+        tasks = [task for task in tasks if not task.done()]
+      kind, payload = workload.next()
+      kinds[kind] = kinds.get(kind, 0) + 1
+      tasks.append(asyncio.create_task(post(kind, payload)))
+    await asyncio.gather(*tasks)
+  return failures
+
+
+def wait_drained(queue, batcher, timeout):
+  """Espera a que la cola y el batcher de acuses queden vacíos; retorna el instante en que ocurrió"""
+  deadline = time.perf_counter() + timeout
+  while time.perf_counter() < deadline:
+    if queue.stats()["depth"] == 0 and batcher.stats()["pending"] == 0:
+      return time.perf_counter()
+    time.sleep(0.05)
+  return None
+
+
+def check(results, args):
+  regressions = []
+  throughput = results["throughput"]["processed_per_second"] or 0
+  p99 = results["latency_ms"]["end_to_end"].get("p99")
+  if args.min_throughput and throughput < args.min_throughput:
+    regressions.append(f"throughput {throughput}/s < mínimo {args.min_throughput}/s")
+  if args.max_p99_ms and (p99 is None or p99 > args.max_p99_ms):
+    regressions.append(f"p99 de punta a punta {p99} ms > máximo {args.max_p99_ms} ms")
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    base_throughput = baseline["throughput"]["processed_per_second"]
+    base_p99 = baseline["latency_ms"]["end_to_end"].get("p99")
+    if base_throughput and throughput < base_throughput * (1 - args.tolerance):
+      regressions.append(f"throughput {throughput}/s cayó más de {args.tolerance:.0%} frente a {base_throughput}/s")
+    if base_p99 and p99 is not None and p99 > base_p99 * (1 + args.tolerance):
+      regressions.append(f"p99 {p99} ms subió más de {args.tolerance:.0%} frente a {base_p99} ms")
+    base_growth = baseline["db_growth"].get("app_bytes_per_message")
+    growth = results["db_growth"].get("app_bytes_per_message")
+    if base_growth and growth and growth > base_growth * (1 + args.tolerance):
+      regressions.append(f"crecimiento de la base {growth} B/mensaje subió más de {args.tolerance:.0%} frente a {base_growth}")
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--companies", type=int, default=20)
+  parser.add_argument("--customers", type=int, default=2000, help="clientes distintos repartidos entre las empresas")
+  parser.add_argument("--rate", type=float, default=200, help="webhooks por segundo (0 = lo más rápido posible)")
+  parser.add_argument("--duration", type=float, default=20, help="segundos de envío")
+  parser.add_argument("--media-ratio", type=float, default=0.15, help="fracción de entrantes con adjunto")
+  parser.add_argument("--media-kb", type=int, default=64, help="tamaño de cada adjunto servido por el doble")
+  parser.add_argument("--status-ratio", type=float, default=1.0, help="acuses por cada mensaje entrante")
+  parser.add_argument("--duplicate-ratio", type=float, default=0.02, help="fracción de reintentos de YCloud")
+  parser.add_argument("--outgoing-per-company", type=int, default=50, help="mensajes salientes sembrados que reciben acuses")
+  parser.add_argument("--max-inflight", type=int, default=32, help="webhooks concurrentes como máximo")
+  parser.add_argument("--workers", type=int, default=None, help="WEBHOOK_WORKERS del servidor")
+  parser.add_argument("--poll-ms", type=float, default=20, help="intervalo de muestreo de la base para la latencia de punta a punta")
+  parser.add_argument("--drain-timeout", type=float, default=120, help="segundos máximos esperando que la cola se vacíe")
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("--min-throughput", type=float, default=0, help="eventos procesados por segundo mínimos")
+  parser.add_argument("--max-p99-ms", type=float, default=0, help="p99 de punta a punta máximo")
+  parser.add_argument("--baseline", help="resultados JSON de referencia para detectar regresiones")
+  parser.add_argument("--tolerance", type=float, default=0.2, help="regresión tolerada frente a --baseline")
+  parser.add_argument("--output", help="archivo JSON de resultados (por defecto solo stdout)")
+  args = parser.parse_args()
+
+  stand_in = YCloudStandIn(args.media_kb * 1024)
+  stand_in.start()
+
+  # Base, cola, archivo y media temporales: nunca tocar data/ ni media/
+  workdir = tempfile.mkdtemp(prefix="webhook-ingest-")
+  os.environ["SQLITE_PATH"] = os.path.join(workdir, "app.db")
+  os.environ["WEBHOOK_QUEUE_PATH"] = os.path.join(workdir, "webhooks.db")
+  os.environ["WEBHOOK_ARCHIVE_DIR"] = os.path.join(workdir, "webhook_archive")
+  os.environ["YCLOUD_API_BASE_URL"] = f"{stand_in.url}/v2"
+  os.environ.setdefault("MAINTENANCE_ENABLED", "0")
+  os.environ.setdefault("REALTIME_BROKER", "memory")
+  os.environ["WEBHOOK_QUEUE_ENABLED"] = "1"
+  if args.workers:
+    os.environ["WEBHOOK_WORKERS"] = str(args.workers)
+
+  from app.core.config import settings  # noqa: E402
+  from app.main import app  # noqa: E402
+  from app.services.media_handler import media_handler  # noqa: E402
+  from app.services.message_dedupe import inbound_dedupe  # noqa: E402
+  from app.services.message_status import status_batcher  # noqa: E402
+  from app.services.webhook_archive import webhook_archive  # noqa: E402
+  from app.services.webhook_queue import webhook_queue  # noqa: E402
+
+  media_handler.base_media_path = Path(workdir) / "media"
+  media_handler.base_media_path.mkdir(exist_ok=True)
+  # El webhook y los handlers registran cada evento en INFO; con cientos por segundo dominan el tiempo
+  logging.disable(logging.INFO)
+
+  server = ServerThread(app, settings, deflate=False)
+  server.start()
+  base_url = f"http://127.0.0.1:{server.port}"
+  stand_in.webhook_url = f"{base_url}/api/webhooks/ycloud"
+  workload = Workload(
+    args.companies, args.customers, args.media_ratio, args.status_ratio, args.duplicate_ratio, stand_in.url, args.seed,
+  )
+  visibility = Visibility(settings.sqlite_path, args.poll_ms / 1000)
+  try:
+    seed(workload, args.outgoing_per_company, api_key="bench-key")
+    checkpoint(settings.sqlite_path)
+    sizes_before = {
+      "app": file_sizes([settings.sqlite_path]),
+      "queue": file_sizes([settings.webhook_queue_path]),
+      "archive": file_sizes([settings.webhook_archive_dir]),
+      "media": file_sizes([media_handler.base_media_path]),
+    }
+    rss_before = rss_kb()
+    visibility.start()
+
+    sent, kinds = {}, {}
+    ack_ms = {"inbound": [], "status": [], "duplicate": []}
+    count = int(args.rate * args.duration) if args.rate > 0 else int(args.duration * 1000)
+    started = time.perf_counter()
+    failures = asyncio.run(drive(base_url, workload, count, args.rate, args.max_inflight, sent, ack_ms, kinds))
+    sent_seconds = time.perf_counter() - started
+    drained_at = wait_drained(webhook_queue, status_batcher, args.drain_timeout)
+    # Una última muestra para los mensajes guardados justo antes de vaciarse la cola
+    time.sleep(args.poll_ms / 1000 * 3)
+    visibility.stop()
+    # Que el archivo escriba lo pendiente antes de medirlo
+    webhook_archive.flush()
+    processed_seconds = (drained_at or time.perf_counter()) - started
+
+    end_to_end = [(visibility.seen[key] - at) * 1000 for key, at in sent.items() if key in visibility.seen]
+    with sqlite3.connect(settings.sqlite_path) as conn:
+      stored = conn.execute("SELECT COUNT(*) FROM messages WHERE direction = 'incoming'").fetchone()[0]
+      stored_media = conn.execute(
+        "SELECT COUNT(*) FROM messages WHERE direction = 'incoming' AND attachment_url LIKE '/media/%'"
+      ).fetchone()[0]
+      status_counts = dict(conn.execute("SELECT status, COUNT(*) FROM messages WHERE direction = 'outgoing' GROUP BY status").fetchall())
+    checkpoint(settings.sqlite_path)
+    sizes_after = {
+      "app": file_sizes([settings.sqlite_path]),
+      "queue": file_sizes([settings.webhook_queue_path]),
+      "archive": file_sizes([settings.webhook_archive_dir]),
+      "media": file_sizes([media_handler.base_media_path]),
+    }
+    results = {
+      "events": {
+        "sent": count,
+        "by_kind": kinds,
+        "failed_webhooks": failures,
+        "inbound_stored": stored,
+        "inbound_with_media": stored_media,
+        "inbound_not_visible": len(sent) - len(end_to_end),
+        "outgoing_status": status_counts,
+        "drained": drained_at is not None,
+      },
+      "throughput": {
+        "target_rate": args.rate or None,
+        "acked_per_second": round(count / sent_seconds, 1) if sent_seconds else None,
+        "processed_per_second": round(count / processed_seconds, 1) if processed_seconds else None,
+        "sent_seconds": round(sent_seconds, 3),
+        "drain_seconds": round(processed_seconds - sent_seconds, 3),
+      },
+      "latency_ms": {
+        "ack": {kind: percentiles(values) for kind, values in ack_ms.items()},
+        "end_to_end": percentiles(end_to_end),
+        "queue_processing": webhook_queue.stats()["processing_lag_ms"],
+      },
+      "db_growth": {
+        **{f"{name}_bytes": sizes_after[name] - sizes_before[name] for name in sizes_after},
+        "app_bytes_per_message": round((sizes_after["app"] - sizes_before["app"]) / stored, 1) if stored else None,
+        "archive_bytes_per_event": round((sizes_after["archive"] - sizes_before["archive"]) / count, 1) if count else None,
+      },
+      "memory": {"rss_before_kb": rss_before, "rss_after_kb": rss_kb()},
+      "queue": webhook_queue.stats(),
+      "dedupe": inbound_dedupe.stats(),
+      "statuses": status_batcher.stats(),
+      "stand_in": dict(stand_in.counters),
+    }
+  finally:
+    server.stop()
+    stand_in.stop()
+
+  results["config"] = {
+    "companies": args.companies,
+    "customers": args.customers,
+    "rate": args.rate,
+    "duration": args.duration,
+    "media_ratio": args.media_ratio,
+    "media_kb": args.media_kb,
+    "status_ratio": args.status_ratio,
+    "duplicate_ratio": args.duplicate_ratio,
+    "max_inflight": args.max_inflight,
+    "workers": settings.webhook_workers,
+    "seed": args.seed,
+    "workdir": workdir,
+  }
+  results["regressions"] = check(results, args)
+
+  output = json.dumps(results, indent=2, ensure_ascii=False)
+  print(output)
+  if args.output:
+    with open(args.output, "w") as f:
+      f.write(output)
+  if results["regressions"]:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -10,11 +10,20 @@ if str(PROJECT_ROOT) not in sys.path:
 # Try both import paths depending on how it's executed
 try:
   from app.main import app  # when running as script: python backend/run.py
+  from app.core.config import settings
 except ModuleNotFoundError:
   from backend.app.main import app  # when running as module: python -m backend.run
+  from backend.app.core.config import settings
 
 if __name__ == "__main__":
   import uvicorn
-  uvicorn.run(app, host="0.0.0.0", port=8000)
+  uvicorn.run(
+    app,
+    host="0.0.0.0",
+    port=8000,
+    ws_per_message_deflate=settings.ws_per_message_deflate,
+    ws_ping_interval=settings.ws_ping_interval,
+    ws_ping_timeout=settings.ws_ping_timeout,
+  )
 
 
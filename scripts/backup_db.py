@@ -0,0 +1,74 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+
+CURRENT_DIR = Path(__file__).resolve().parent
+BACKEND_ROOT = CURRENT_DIR.parent
+PROJECT_ROOT = BACKEND_ROOT.parent
+
+if str(BACKEND_ROOT) not in sys.path:
+  sys.path.insert(0, str(BACKEND_ROOT))
+
+try:
+  from app.services import backup
+except ModuleNotFoundError:
+  if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+  from backend.app.services import backup
+
+
+def _resolve(value: str, backup_dir: str | None) -> str:
+  path = Path(value)
+  if path.is_file():
+    return str(path)
+  return backup.resolve_snapshot(value, backup_dir)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Snapshots en línea de la base SQLite")
+  parser.add_argument("--dir", help="Directorio de backups (default: BACKUP_DIR)")
+  sub = parser.add_subparsers(dest="command", required=True)
+
+  create = sub.add_parser("create", help="Generar un snapshot comprimido y aplicar retención")
+  create.add_argument("--source", help="Base de origen (default: SQLITE_PATH)")
+  create.add_argument("--pages-per-step", type=int, help="Páginas copiadas por paso")
+  create.add_argument("--keep", type=int, help="Snapshots a conservar (default: BACKUP_KEEP)")
+
+  sub.add_parser("list", help="Listar snapshots")
+
+  verify = sub.add_parser("verify", help="Verificar la integridad de un snapshot")
+  verify.add_argument("snapshot", help="Nombre del snapshot o ruta al archivo .db.gz")
+
+  restore = sub.add_parser("restore", help="Restaurar un snapshot (con el servidor detenido)")
+  restore.add_argument("snapshot", help="Nombre del snapshot o ruta al archivo .db.gz")
+  restore.add_argument("--target", help="Base destino (default: SQLITE_PATH)")
+  restore.add_argument("--yes", action="store_true", help="No pedir confirmación")
+
+  args = parser.parse_args()
+
+  if args.command == "create":
+    result = backup.create_snapshot(args.source, args.dir, pages_per_step=args.pages_per_step)
+    removed = backup.apply_retention(args.dir, args.keep)
+    print(json.dumps({**result.as_dict(), "removed": removed}, default=str, indent=2))
+  elif args.command == "list":
+    for snapshot in backup.list_snapshots(args.dir):
+      print(f"{snapshot['name']}\t{snapshot['size']} bytes\t{snapshot['modified_at']:%Y-%m-%d %H:%M:%S}")
+  elif args.command == "verify":
+    report = backup.verify_snapshot(_resolve(args.snapshot, args.dir))
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["ok"] else 1)
+  elif args.command == "restore":
+    path = _resolve(args.snapshot, args.dir)
+    target = args.target or backup.settings.sqlite_path
+    if not args.yes:
+      answer = input(f"Se sobrescribirá {target} con {Path(path).name}. ¿Continuar? [s/N] ")
+      if answer.strip().lower() not in ("s", "si", "sí", "y", "yes"):
+        print("Restauración cancelada")
+        return
+    report = backup.restore_snapshot(path, target)
+    print(f"Restaurado {report['name']} en {report['target']} ({report['tables']} tablas)")
+
+
+if __name__ == "__main__":
+  main()
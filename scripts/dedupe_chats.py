@@ -0,0 +1,50 @@
+import argparse
+import sys
+from pathlib import Path
+
+CURRENT_DIR = Path(__file__).resolve().parent
+BACKEND_ROOT = CURRENT_DIR.parent
+PROJECT_ROOT = BACKEND_ROOT.parent
+
+if str(BACKEND_ROOT) not in sys.path:
+  sys.path.insert(0, str(BACKEND_ROOT))
+
+try:
+  from app.db.session import SessionLocal, engine
+  from app.services.chat_dedupe import merge_duplicate_chats
+except ModuleNotFoundError:
+  if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+  from backend.app.db.session import SessionLocal, engine
+  from backend.app.services.chat_dedupe import merge_duplicate_chats
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Fusiona chats duplicados (empresa + teléfono) y crea el índice único")
+  parser.add_argument("--dry-run", action="store_true", help="Solo reportar, sin modificar la base")
+  args = parser.parse_args()
+
+  db = SessionLocal()
+  try:
+    counts = merge_duplicate_chats(db, dry_run=args.dry_run)
+  finally:
+    db.close()
+  print(
+    f"Grupos duplicados: {counts['groups']} | chats fusionados: {counts['merged']} | "
+    f"filas reasignadas: {counts['moved_rows']} | teléfonos normalizados: {counts['normalized']}"
+  )
+  if args.dry_run:
+    print("Dry run: no se realizaron cambios")
+    return
+
+  with engine.begin() as conn:
+    conn.exec_driver_sql(
+      "CREATE UNIQUE INDEX IF NOT EXISTS uq_chats_company_phone_live ON chats (company_id, phone_number) "
+      "WHERE deleted_at IS NULL"
+    )
+    conn.exec_driver_sql("DROP INDEX IF EXISTS uq_chats_company_phone")
+  print("Índice único uq_chats_company_phone_live listo")
+
+
+if __name__ == "__main__":
+  main()
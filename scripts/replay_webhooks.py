@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+CURRENT_DIR = Path(__file__).resolve().parent
+BACKEND_ROOT = CURRENT_DIR.parent
+
+if str(BACKEND_ROOT) not in sys.path:
+  sys.path.insert(0, str(BACKEND_ROOT))
+
+MEDIA_TYPES = ("image", "audio", "video", "document", "sticker")
+
+
+def _timestamp(value: str | None) -> float | None:
+  if not value:
+    return None
+  try:
+    return float(value)
+  except ValueError:
+    return datetime.fromisoformat(value).timestamp()
+
+
+def _strip_media(payload: dict) -> dict:
+  """Quita los links de adjuntos: el mensaje se guarda sin descargar nada"""
+  message = payload.get("whatsappInboundMessage") or {}
+  for media_type in MEDIA_TYPES:
+    if isinstance(message.get(media_type), dict):
+      message[media_type].pop("link", None)
+  return payload
+
+
+def _records(args):
+  from app.services.webhook_archive import read_archive
+
+  since, until = _timestamp(args.since), _timestamp(args.until)
+  for record in read_archive(args.paths):
+    if since is not None and record["received_at"] < since:
+      continue
+    if until is not None and record["received_at"] > until:
+      break
+    if args.type and record["type"] not in args.type:
+      continue
+    yield record
+
+
+def _sender(args):
+  """Función que entrega un cuerpo: en línea con ``process_ycloud_event`` o por HTTP a ``--url``"""
+  if args.url:
+    import httpx
+
+    client = httpx.Client(timeout=30)
+
+    def post(body: str) -> None:
+      response = client.post(args.url, content=body.encode("utf-8"), headers={"Content-Type": "application/json"})
+      response.raise_for_status()
+
+    return post
+
+  # Sin la cola ni el batcher en marcha, cada evento (y sus acuses) se aplica antes del siguiente
+  from app.api.routes.webhooks.ycloud import process_ycloud_event
+
+  def process(body: str) -> None:
+    payload = json.loads(body)
+    if args.no_media:
+      payload = _strip_media(payload)
+    process_ycloud_event(payload)
+
+  return process
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Reproducir webhooks archivados de YCloud en orden de recepción")
+  parser.add_argument("paths", nargs="+", help="Archivos .jsonl.gz o directorios del archivo de webhooks")
+  parser.add_argument("--database", help="Base SQLite de destino (default: SQLITE_PATH); se crea si no existe")
+  parser.add_argument("--url", help="Enviar por HTTP a un servidor en marcha en lugar de procesar en línea")
+  parser.add_argument("--speed", type=float, default=0, help="1 = tiempos originales, N = N veces más rápido, 0 = sin esperas (default)")
+  parser.add_argument("--since", help="Desde (epoch o ISO 8601)")
+  parser.add_argument("--until", help="Hasta (epoch o ISO 8601)")
+  parser.add_argument("--type", action="append", help="Solo este tipo de evento (se puede repetir)")
+  parser.add_argument("--no-media", action="store_true", help="No descargar adjuntos al procesar en línea")
+  parser.add_argument("--dry-run", action="store_true", help="Solo contar los registros que se reproducirían")
+  args = parser.parse_args()
+
+  if args.database:
+    os.environ["SQLITE_PATH"] = str(Path(args.database).resolve())
+  # El reproductor no debe archivar de nuevo lo que reproduce ni correr jobs de mantenimiento
+  os.environ.setdefault("WEBHOOK_ARCHIVE_ENABLED", "0")
+  os.environ.setdefault("MAINTENANCE_ENABLED", "0")
+
+  if not args.dry_run and not args.url:
+    # Importar la app crea el esquema y aplica las migraciones sobre la base de destino
+    import app.main  # noqa: F401
+
+  send = None if args.dry_run else _sender(args)
+  summary = {"records": 0, "processed": 0, "errors": 0, "by_type": {}, "max_lag_ms": 0.0}
+  started = time.perf_counter()
+  first_received = None
+  for record in _records(args):
+    summary["records"] += 1
+    summary["by_type"][record["type"]] = summary["by_type"].get(record["type"], 0) + 1
+    if send is None:
+      continue
+    if args.speed > 0:
+      if first_received is None:
+        first_received = record["received_at"]
+      due = started + (record["received_at"] - first_received) / args.speed
+      delay = due - time.perf_counter()
+      if delay > 0:
+        time.sleep(delay)
+      summary["max_lag_ms"] = max(summary["max_lag_ms"], round((time.perf_counter() - due) * 1000, 2))
+    try:
+      send(record["body"])
+      summary["processed"] += 1
+    except Exception as e:
+      summary["errors"] += 1
+      print(f"Error reproduciendo {record['type']} de {record['received_at']}: {e}", file=sys.stderr)
+
+  elapsed = time.perf_counter() - started
+  summary["elapsed_seconds"] = round(elapsed, 3)
+  summary["events_per_second"] = round(summary["processed"] / elapsed, 1) if elapsed and summary["processed"] else None
+  print(json.dumps(summary, indent=2, ensure_ascii=False))
+  if summary["errors"]:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
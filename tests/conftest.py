@@ -0,0 +1,29 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+
+@pytest.fixture
+def db_engine():
+  from app.db.session import Base
+  from app import models  # noqa: F401
+  engine = create_engine(
+    "sqlite://",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+  )
+  Base.metadata.create_all(bind=engine)
+  try:
+    yield engine
+  finally:
+    engine.dispose()
+
+
+@pytest.fixture
+def db(db_engine):
+  session = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)()
+  try:
+    yield session
+  finally:
+    session.close()
@@ -0,0 +1,131 @@
+import pytest
+from app.api.routes.webhooks import ycloud
+from app.models.assignments.assignment import AssignmentAgent, AssignmentPolicy
+from app.models.chats.chat import Chat, ChatTag, ChatTagMap
+from app.models.companies.company import Company
+from app.models.users.user import User
+from app.services import bulk, chats
+from app.services.assignment import AgentState, AssignmentEngine, CompanyLoads, STRATEGIES, load_company
+from app.services.bulk import run_bulk_operations
+from app.services.chats import chat_id_cache, update_chat_status
+
+
+def test_strategies_pick_from_heaps_and_respect_capacity():
+  agents = lambda: [AgentState(1, capacity=3), AgentState(2, tag_ids=frozenset({10})), AgentState(3, tag_ids=frozenset({10}))]
+
+  least = CompanyLoads(STRATEGIES["least_open"], agents(), {1: 0, 2: 2, 3: 1})
+  picks = []
+  for seq in range(1, 7):
+    user_id = least.choose()
+    picks.append(user_id)
+    least.adjust(user_id, 1, seq)
+  assert picks == [1, 3, 1, 2, 3, 1]
+  # El agente 1 llegó a su límite: no vuelve a recibir hasta liberar un chat
+  assert least.loads[1] == 3 and least.choose() == 2
+  least.adjust(1, -1)
+  assert least.choose() == 1
+
+  rr = CompanyLoads(STRATEGIES["round_robin"], agents(), {})
+  picks = []
+  for seq in range(1, 7):
+    picks.append(rr.choose())
+    rr.adjust(picks[-1], 1, seq)
+  assert picks == [1, 2, 3, 1, 2, 3]
+
+  tags = CompanyLoads(STRATEGIES["tags"], agents(), {2: 4, 3: 5})
+  assert tags.choose([10]) == 2
+  assert tags.choose([99]) == 1
+  assert tags.choose() == 1
+
+  # Miles de ajustes no dejan crecer los montículos: se compactan
+  for seq in range(5000):
+    least.adjust(2, 1 if seq % 2 else -1, seq)
+  assert len(least._heaps[None]) < 200
+
+
+@pytest.fixture
+def company(db, monkeypatch):
+  chat_id_cache.clear()
+  company = Company(
+    nombre="Acme", razon_social="Acme SAS", nit="900", responsable="Ana", email="a@acme.co",
+    telefono="", direccion="", whatsapp_phone_number="+573100000000",
+  )
+  db.add(company)
+  db.commit()
+  db.add_all([
+    User(id=uid, first_name=f"A{uid}", last_name="", username=f"a{uid}", email=f"a{uid}@acme.co", hashed_password="x", company_id=company.id)
+    for uid in (1, 2, 3)
+  ])
+  db.commit()
+  engine = AssignmentEngine()
+  for module in (ycloud, chats, bulk):
+    monkeypatch.setattr(module, "assignment_engine", engine)
+  company.engine = engine
+  yield company
+  chat_id_cache.clear()
+
+
+def _inbound(db, n, phone):
+  ycloud.handle_inbound_message({
+    "type": "whatsapp.inbound_message.received",
+    "whatsappInboundMessage": {
+      "id": f"yc-{n}", "wamid": f"wamid.{n}", "from": phone, "to": "+573100000000",
+      "type": "text", "customerProfile": {"name": "Cliente"}, "text": {"body": "hola"},
+    },
+  }, db)
+  return db.query(Chat).filter_by(phone_number=phone).one()
+
+
+def _loads(state):
+  return {user_id: state.loads.get(user_id, 0) for user_id in (1, 2, 3)}
+
+
+def test_inbound_chats_are_assigned_and_counters_follow_every_change(db, company):
+  engine = company.engine
+  db.add_all([Chat(company_id=company.id, phone_number=f"+5730000000{i}", assigned_user_id=1) for i in range(2)])
+  db.add(AssignmentPolicy(company_id=company.id, strategy="least_open"))
+  db.add_all([AssignmentAgent(company_id=company.id, user_id=uid) for uid in (1, 2)])
+  db.commit()
+
+  assigned = [_inbound(db, n, f"+57301000000{n}").assigned_user_id for n in range(3)]
+  assert assigned == [2, 2, 1]
+  # Un mensaje más en un chat ya asignado no lo reasigna
+  assert _inbound(db, 9, "+573010000000").assigned_user_id == 2
+  state = engine._companies[company.id]
+  assert _loads(state) == {1: 3, 2: 2, 3: 0}
+  assert engine.stats()["reserved"] == 0
+
+  first = db.query(Chat).filter_by(phone_number="+573010000000").one()
+  update_chat_status(db, company.id, first.id, "closed")
+  run_bulk_operations(db, company.id, [c.id for c in db.query(Chat).filter_by(assigned_user_id=1)], assigned_user_id=3)
+  # Los contadores en memoria coinciden con recalcular desde la base
+  assert _loads(state) == _loads(load_company(db, company.id)) == {1: 0, 2: 1, 3: 3}
+  assert engine.loads == 1
+
+
+def test_tag_strategy_routes_returning_chats_to_agents_with_that_tag(db, company):
+  tag = ChatTag(company_id=company.id, name="ventas")
+  db.add(tag)
+  db.add(AssignmentPolicy(company_id=company.id, strategy="tags"))
+  db.commit()
+  db.add_all([
+    AssignmentAgent(company_id=company.id, user_id=1),
+    AssignmentAgent(company_id=company.id, user_id=3, tag_ids=f"[{tag.id}]", max_open_chats=1),
+  ])
+  tagged = Chat(company_id=company.id, phone_number="+573020000001")
+  db.add(tagged)
+  db.commit()
+  db.add(ChatTagMap(chat_id=tagged.id, tag_id=tag.id))
+  db.commit()
+
+  assert _inbound(db, 1, "+573020000001").assigned_user_id == 3
+  # El agente de ventas está lleno: el siguiente chat con la etiqueta cae al resto
+  other = Chat(company_id=company.id, phone_number="+573020000002")
+  db.add(other)
+  db.commit()
+  db.add(ChatTagMap(chat_id=other.id, tag_id=tag.id))
+  db.commit()
+  assert _inbound(db, 2, "+573020000002").assigned_user_id == 1
+  assert company.engine.snapshot(db, company.id)["agents"][1] == {
+    "user_id": 3, "open_chats": 1, "max_open_chats": 1, "tag_ids": [tag.id], "available": False,
+  }
@@ -0,0 +1,124 @@
+import random
+import pytest
+from app.api.routes.webhooks import ycloud
+from app.models.auto_replies.auto_reply import AutoReplyRule
+from app.models.chats.chat import Message
+from app.models.companies.company import Company
+from app.models.templates.template import Template, TemplateItem
+from app.schemas.auto_replies.auto_reply import AutoReplyRuleCreate
+from app.services import auto_replies
+from app.services import ycloud as ycloud_service
+from app.services.auto_replies import AhoCorasick, AutoReplyEngine, RuleSnapshot, compile_rules, create_rule, required_literal
+from app.services.chats import chat_id_cache
+
+
+def _rule(rule_id, pattern, match_type="keyword", priority=100, whole_word=True):
+  return RuleSnapshot(
+    id=rule_id, name=f"r{rule_id}", match_type=match_type, pattern=pattern, whole_word=whole_word,
+    reply_type="text", reply_text="ok", template_id=None, priority=priority, cooldown_minutes=60,
+  )
+
+
+def test_automaton_finds_every_occurrence_like_a_naive_scan():
+  rng = random.Random(7)
+  patterns = sorted({"".join(rng.choice("abc") for _ in range(rng.randint(1, 4))) for _ in range(40)})
+  automaton = AhoCorasick([(pattern, pattern) for pattern in patterns])
+  for _ in range(50):
+    text = "".join(rng.choice("abcd") for _ in range(60))
+    expected = sorted(
+      (start, start + len(pattern), pattern)
+      for pattern in patterns for start in range(len(text)) if text.startswith(pattern, start)
+    )
+    assert sorted(automaton.search(text)) == expected
+
+
+def test_rules_match_folded_whole_words_and_regex_by_priority():
+  compiled = compile_rules([
+    _rule(1, "horario, hora de atención", priority=50),
+    _rule(2, "precio, cuánto cuesta"),
+    _rule(3, r"ubicaci[oó]n|direcci[oó]n", match_type="regex"),
+    _rule(4, r"env[ií]os? a (\w+)", match_type="regex", priority=10),
+    _rule(5, "hora", whole_word=False, priority=200),
+  ])
+  assert compiled.untriggered == [3]
+  assert required_literal(r"env[ií]os? a (\w+)") == "envio"
+  match = lambda text: [rule.id for rule in compiled.match(text)]
+
+  assert match("¿Cuál es el HORARIO?") == [1, 5]
+  assert match("¿CUÁNTO   cuesta el plan?") == [2]
+  assert match("la ahora no") == [5]
+  assert match("¿Tienen envíos a Medellín? y la dirección") == [4, 3]
+  assert match("nada que ver") == []
+
+
+@pytest.fixture
+def company(db):
+  chat_id_cache.clear()
+  company = Company(
+    nombre="Acme", razon_social="Acme SAS", nit="900", responsable="Ana", email="a@acme.co",
+    telefono="", direccion="", whatsapp_phone_number="+573100000000", ycloud_api_key="key",
+  )
+  db.add(company)
+  db.commit()
+  yield company
+  chat_id_cache.clear()
+
+
+def test_automaton_is_rebuilt_only_when_rules_change(db, company):
+  engine = AutoReplyEngine(reload_seconds=0)
+  db.add(AutoReplyRule(company_id=company.id, name="Horario", pattern="horario", reply_text="8 a 5"))
+  db.commit()
+  for _ in range(3):
+    assert [rule.name for rule in engine.match(db, company.id, "horario?")] == ["Horario"]
+  assert engine.builds == 1
+
+  # Cambio hecho por otro proceso: lo detecta la huella
+  db.add(AutoReplyRule(company_id=company.id, name="Precio", pattern="precio", reply_text="$10"))
+  db.commit()
+  assert [rule.name for rule in engine.match(db, company.id, "precio")] == ["Precio"]
+  assert engine.builds == 2
+
+
+def test_inbound_message_gets_template_reply_once_per_cooldown(db, company, monkeypatch):
+  sent = []
+
+  class FakeService:
+    async def send_message(self, to, message, from_number, message_type="text", caption=None):
+      sent.append((to, message_type, message, caption))
+      return {"success": True, "message_id": f"out-{len(sent)}"}
+
+  monkeypatch.setattr(ycloud_service, "create_ycloud_service", lambda api_key: FakeService())
+  engine = AutoReplyEngine()
+  monkeypatch.setattr(ycloud, "auto_reply_engine", engine)
+  monkeypatch.setattr(auto_replies, "auto_reply_engine", engine)
+  template = Template(company_id=company.id, name="Ubicación", items=[
+    TemplateItem(order_index=0, item_type="text", text_content="Estamos en la calle 10"),
+    TemplateItem(order_index=1, item_type="image", media_url="/media/company_1/templates/mapa.jpg", caption="Mapa"),
+  ])
+  db.add(template)
+  db.commit()
+  create_rule(db, company.id, AutoReplyRuleCreate(name="Ubicación", pattern="donde estan, ubicacion", reply_type="template", template_id=template.id))
+
+  for n, text in enumerate(("Hola, ¿dónde están?", "¿y la ubicación?")):
+    ycloud.handle_inbound_message({
+      "type": "whatsapp.inbound_message.received",
+      "whatsappInboundMessage": {
+        "id": f"yc-{n}", "wamid": f"wamid.{n}", "from": "+573001234567", "to": "+573100000000",
+        "type": "text", "customerProfile": {"name": "Ana"}, "text": {"body": text},
+      },
+    }, db)
+
+  assert sent == [
+    ("+573001234567", "text", "Estamos en la calle 10", None),
+    ("+573001234567", "image", "/media/company_1/templates/mapa.jpg", "Mapa"),
+  ]
+  outgoing = db.query(Message).filter_by(direction="outgoing").order_by(Message.id).all()
+  assert [(m.whatsapp_message_id, m.message_type, m.sender_name) for m in outgoing] == [
+    ("out-1", "text", "Respuesta automática"), ("out-2", "image", "Respuesta automática"),
+  ]
+  assert engine.stats()["cooldown_skips"] == 1
+
+
+def test_invalid_regex_is_rejected(db, company):
+  with pytest.raises(ValueError):
+    create_rule(db, company.id, AutoReplyRuleCreate(name="x", match_type="regex", pattern="(", reply_text="y"))
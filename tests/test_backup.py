@@ -0,0 +1,74 @@
+import sqlite3
+import threading
+import time
+from app.services import backup
+
+
+def make_source(path, rows=2000):
+  conn = sqlite3.connect(path)
+  conn.execute("PRAGMA journal_mode=WAL")
+  conn.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, payload TEXT)")
+  conn.executemany("INSERT INTO events (payload) VALUES (?)", [("x" * 200,) for _ in range(rows)])
+  conn.commit()
+  conn.close()
+
+
+def test_snapshot_under_concurrent_writes_verify_and_restore(tmp_path):
+  source = str(tmp_path / "app.db")
+  backup_dir = str(tmp_path / "backups")
+  make_source(source)
+
+  stop = threading.Event()
+  writer_latencies = []
+
+  def writer():
+    conn = sqlite3.connect(source, timeout=5)
+    while not stop.is_set():
+      started = time.perf_counter()
+      conn.execute("INSERT INTO events (payload) VALUES ('w')")
+      conn.commit()
+      writer_latencies.append((time.perf_counter() - started) * 1000)
+      time.sleep(0.001)
+    conn.close()
+
+  thread = threading.Thread(target=writer)
+  thread.start()
+  try:
+    result = backup.create_snapshot(source, backup_dir, pages_per_step=8, pause=lambda: time.sleep(0.001))
+  finally:
+    stop.set()
+    thread.join()
+
+  assert result.steps > 1
+  assert result.compressed_bytes < result.raw_bytes
+  assert 0 < result.max_step_ms < result.duration_ms
+  # Los escritores siguen confirmando durante la copia: en WAL no esperan el lock de lectura
+  assert len(writer_latencies) > 1
+  assert max(writer_latencies) < 1000
+  assert backup.list_snapshots(backup_dir)[0]["path"] == result.path
+
+  report = backup.verify_snapshot(result.path)
+  assert report["ok"] and report["tables"] == 1
+
+  target = str(tmp_path / "restored.db")
+  backup.restore_snapshot(result.path, target)
+  conn = sqlite3.connect(target)
+  assert conn.execute("SELECT count(*) FROM events").fetchone()[0] >= 2000
+  conn.close()
+
+
+def test_retention_and_corrupt_snapshot(tmp_path):
+  source = str(tmp_path / "app.db")
+  backup_dir = str(tmp_path / "backups")
+  make_source(source, rows=10)
+  for _ in range(3):
+    backup.create_snapshot(source, backup_dir, pause=lambda: None)
+
+  removed = backup.apply_retention(backup_dir, keep=2)
+  remaining = backup.list_snapshots(backup_dir)
+  assert len(removed) == 1 and len(remaining) == 2
+  assert removed[0] < remaining[-1]["name"]
+
+  corrupt = tmp_path / "backups" / "broken.db.gz"
+  corrupt.write_bytes(b"not gzip")
+  assert backup.verify_snapshot(str(corrupt))["ok"] is False
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+from app.services.broker import BrokerEvent, SQLiteBroker
+from app.services.realtime import ConnectionManager
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class Collector:
+  def __init__(self):
+    self.events = []
+
+  async def __call__(self, event):
+    self.events.append(event)
+
+
+def test_sqlite_broker_fans_out_exactly_once_in_order(tmp_path):
+  path = str(tmp_path / "realtime.db")
+
+  async def scenario():
+    a, b = SQLiteBroker(path, poll_interval=0.01), SQLiteBroker(path, poll_interval=0.01)
+    got_a, got_b = Collector(), Collector()
+    await a.start(got_a)
+    await b.start(got_b)
+    try:
+      for i in range(300):
+        await a.publish(BrokerEvent("company", 1, None, "chat.updated", {"n": i}))
+      await b.publish(BrokerEvent("chat", 1, 7, "message.created", {"n": "b"}))
+      for _ in range(200):
+        if len(got_b.events) == 301 and len(got_a.events) == 301:
+          break
+        await asyncio.sleep(0.01)
+    finally:
+      await a.stop()
+      await b.stop()
+    return got_a.events, got_b.events
+
+  events_a, events_b = asyncio.run(scenario())
+  # Orden por worker de origen; los eventos propios se entregan una sola vez (localmente)
+  assert [e.data["n"] for e in events_b if e.scope == "company"] == list(range(300))
+  assert [e.chat_id for e in events_b if e.scope == "chat"] == [7]
+  assert [e.data["n"] for e in events_a] == list(range(300)) + ["b"]
+  # El seq por canal es el mismo en ambos workers
+  assert [e.seq for e in events_b if e.scope == "company"] == list(range(1, 301))
+  assert [e.seq for e in events_a if e.scope == "company"] == list(range(1, 301))
+  assert [e.seq for e in events_a if e.scope == "chat"] == [1]
+
+
+def test_sqlite_broker_delivers_across_processes(tmp_path):
+  path = str(tmp_path / "realtime.db")
+  publisher = textwrap.dedent(f"""
+    import asyncio
+    from app.services.broker import BrokerEvent, SQLiteBroker
+
+    async def main():
+      broker = SQLiteBroker({path!r})
+      async def ignore(event):
+        pass
+      await broker.start(ignore)
+      for i in range(200):
+        await broker.publish(BrokerEvent("company", 3, None, "chat.updated", {{"n": i}}))
+      await broker.stop()
+
+    asyncio.run(main())
+  """)
+
+  async def scenario():
+    broker = SQLiteBroker(path, poll_interval=0.01)
+    got = Collector()
+    await broker.start(got)
+    try:
+      proc = await asyncio.create_subprocess_exec(sys.executable, "-c", publisher, cwd=str(ROOT))
+      assert await proc.wait() == 0
+      for _ in range(300):
+        if len(got.events) >= 200:
+          break
+        await asyncio.sleep(0.01)
+    finally:
+      await broker.stop()
+    return got.events
+
+  events = asyncio.run(scenario())
+  assert [e.data["n"] for e in events] == list(range(200))
+
+
+def test_manager_delivers_locally_without_started_broker():
+  class FakeSocket:
+    def __init__(self):
+      self.sent = []
+
+    async def send_text(self, text):
+      self.sent.append(json.loads(text))
+
+  async def scenario():
+    manager = ConnectionManager()
+    ws = FakeSocket()
+    await manager.connect_company(ws, 1)
+    await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 1})
+    await manager.broadcast_to_company(2, "chat.updated", {"chat_id": 2})
+    await manager.flush()
+    return ws.sent
+
+  assert asyncio.run(scenario()) == [{"event": "chat.updated", "data": {"chat_id": 1}, "channel": "company:1", "seq": 1}]
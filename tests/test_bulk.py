@@ -0,0 +1,69 @@
+from app.models.chats.chat import Chat, ChatTag, ChatTagMap, ChatAudit
+from app.services.bulk import run_bulk_operations
+
+
+def seed(db, company_id, count):
+  chats = [Chat(company_id=company_id, phone_number=f"+57300{company_id}{i:05d}") for i in range(count)]
+  db.add_all(chats)
+  db.commit()
+  return [c.id for c in chats]
+
+
+def test_bulk_updates_tags_and_audit_in_chunks(db):
+  ids = seed(db, 1, 23)
+  other_ids = seed(db, 2, 3)
+  tags = [ChatTag(company_id=1, name="vip"), ChatTag(company_id=1, name="hot"), ChatTag(company_id=2, name="ajena")]
+  db.add_all(tags)
+  db.commit()
+  db.add(ChatTagMap(chat_id=ids[0], tag_id=tags[0].id))
+  db.commit()
+
+  counts = run_bulk_operations(
+    db,
+    1,
+    ids + other_ids + [ids[0]],
+    status="closed",
+    tag_ids=[t.id for t in tags],
+    user_id=7,
+    chunk_size=5,
+  )
+
+  assert counts["selected"] == 26
+  assert counts["updated"] == 23
+  assert counts["tags_removed"] == 1
+  # La etiqueta de otra empresa se descarta
+  assert counts["tags_added"] == 23 * 2
+  assert counts["audit_rows"] == 23
+  assert counts["chunks"] == 6
+  assert db.query(Chat).filter(Chat.company_id == 2, Chat.status == "closed").count() == 0
+  assert db.query(ChatTagMap).filter(ChatTagMap.chat_id.in_(other_ids)).count() == 0
+  audit = db.query(ChatAudit).filter(ChatAudit.chat_id == ids[0]).one()
+  assert audit.action == "bulk" and audit.user_id == 7
+  assert "status=closed" in audit.details
+
+
+def test_bulk_without_changes_is_noop(db):
+  ids = seed(db, 1, 3)
+  counts = run_bulk_operations(db, 1, ids)
+  assert counts["updated"] == 0 and counts["chunks"] == 0
+  assert db.query(ChatAudit).count() == 0
+
+
+def test_bulk_event_only_carries_matched_ids(db, monkeypatch):
+  from app.services import bulk
+  ids = seed(db, 1, 2)
+  other_ids = seed(db, 2, 2)
+  sent = []
+
+  class Recorder:
+    def emit_to_company(self, db, company_id, event, data):
+      sent.append((company_id, event, data))
+
+  monkeypatch.setattr(bulk, "manager", Recorder())
+  run_bulk_operations(db, 1, other_ids + ids + [999999], status="closed")
+  assert len(sent) == 1
+  assert sorted(sent[0][2]["chat_ids"]) == sorted(ids)
+
+  sent.clear()
+  run_bulk_operations(db, 1, other_ids, status="open")
+  assert sent == []
@@ -0,0 +1,111 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+from app.models.chats.chat import Chat, Message, ChatTag, ChatTagMap
+from app.services.cache import LRUCache
+from app.db.instrumentation import SqlMetrics, install_query_instrumentation, track_queries
+from app.schemas.chats.chat import MessageCreate
+from app.services.chats import chat_id_cache, create_message, get_or_create_chat, get_or_create_chat_id
+from app.services.chat_dedupe import merge_duplicate_chats
+from app.services.phones import normalize_phone
+
+
+@pytest.fixture(autouse=True)
+def clear_chat_cache():
+  chat_id_cache.clear()
+  yield
+  chat_id_cache.clear()
+
+
+def test_normalize_phone_variants():
+  assert normalize_phone("+57 300-123 4567") == "+573001234567"
+  assert normalize_phone("573001234567") == "+573001234567"
+  assert normalize_phone("0057 300 123 4567") == "+573001234567"
+
+
+def test_get_or_create_chat_reuses_normalized_chat(db):
+  first = get_or_create_chat(db, "57 300 123 4567", 1)
+  second = get_or_create_chat(db, "+573001234567", 1, "Ana")
+  other_company = get_or_create_chat(db, "+573001234567", 2)
+
+  assert first.id == second.id
+  assert second.customer_name == "Ana"
+  assert other_company.id != first.id
+  assert db.query(Chat).filter(Chat.company_id == 1).count() == 1
+  assert chat_id_cache.hits >= 1
+
+
+def test_stale_cache_entry_is_ignored(db):
+  chat = get_or_create_chat(db, "+573001234567", 1)
+  db.query(Chat).filter(Chat.id == chat.id).delete()
+  db.commit()
+
+  recreated = get_or_create_chat(db, "+573001234567", 1)
+  assert db.query(Chat).count() == 1
+  assert chat_id_cache.get((1, "+573001234567")) == recreated.id
+
+
+def test_cached_chat_id_skips_the_database(db, db_engine):
+  install_query_instrumentation(db_engine, SqlMetrics())
+  chat_id = get_or_create_chat_id(db, "+573001234567", 1, "Ana")
+  with track_queries("webhook") as stats:
+    assert get_or_create_chat_id(db, "57 300 123 4567", 1, "Ana") == chat_id
+  assert stats.count == 0
+
+
+def test_create_message_rejects_deleted_chat(db):
+  chat = get_or_create_chat(db, "+573001234567", 1)
+  chat.deleted_at = chat.created_at
+  db.commit()
+  with pytest.raises(LookupError):
+    create_message(db, MessageCreate(chat_id=chat.id, content="hola", direction="incoming"))
+  assert db.query(Message).count() == 0
+
+
+def test_unique_index_rejects_duplicates(db):
+  db.add_all([Chat(company_id=1, phone_number="+57300"), Chat(company_id=1, phone_number="+57300")])
+  with pytest.raises(IntegrityError):
+    db.commit()
+
+
+def test_merge_duplicate_chats(db):
+  db.execute(Chat.__table__.delete())
+  db.commit()
+  with db.get_bind().begin() as conn:
+    conn.exec_driver_sql("DROP INDEX uq_chats_company_phone_live")
+  a = Chat(company_id=1, phone_number="573001234567")
+  b = Chat(company_id=1, phone_number="+57 300 123 4567", customer_name="Ana")
+  db.add_all([a, b])
+  db.commit()
+  tag = ChatTag(company_id=1, name="vip")
+  db.add(tag)
+  db.commit()
+  db.add_all([
+    Message(chat_id=a.id, content="hola", direction="incoming"),
+    Message(chat_id=b.id, content="otra", direction="incoming"),
+    ChatTagMap(chat_id=a.id, tag_id=tag.id),
+    ChatTagMap(chat_id=b.id, tag_id=tag.id),
+  ])
+  db.commit()
+
+  assert merge_duplicate_chats(db, dry_run=True)["merged"] == 1
+  assert db.query(Chat).count() == 2
+
+  counts = merge_duplicate_chats(db)
+  survivor = db.query(Chat).one()
+  assert counts == {"groups": 1, "merged": 1, "moved_rows": 2, "normalized": 0}
+  assert survivor.id == a.id
+  assert survivor.phone_number == "+573001234567"
+  assert survivor.customer_name == "Ana"
+  assert db.query(Message).filter(Message.chat_id == a.id).count() == 2
+  assert db.query(ChatTagMap).count() == 1
+
+
+def test_lru_cache_evicts_least_recent():
+  cache = LRUCache(maxsize=2)
+  cache.put("a", 1)
+  cache.put("b", 2)
+  cache.get("a")
+  cache.put("c", 3)
+  assert "b" not in cache
+  assert cache.get("a") == 1
+  assert cache.stats()["size"] == 2
@@ -0,0 +1,106 @@
+from app.models.chats.chat import Chat, Message, ChatNote, ChatTag, ChatTagMap, ChatAudit
+from app.models.companies.company import Company
+from app.models.system.deletion import DeletionJob
+from app.models.users.user import User
+from app.services import deletion
+from app.services.chats import get_chats_by_company, get_or_create_chat, chat_id_cache
+from app.services.companies import get_company, list_companies
+from app.services.maintenance import MaintenanceScheduler, ForegroundLoad, default_jobs
+
+
+def make_scheduler(engine):
+  return MaintenanceScheduler(engine, default_jobs(), load=ForegroundLoad(), batch_size=3, batch_pause=0)
+
+
+def make_company(db):
+  company = Company(nombre="Acme", razon_social="Acme SAS", nit="900", responsable="Ana", email="a@acme.co", telefono="", direccion="")
+  db.add(company)
+  db.commit()
+  return company
+
+
+def test_chat_is_hidden_then_purged_in_batches(db, db_engine, tmp_path, monkeypatch):
+  monkeypatch.setattr(deletion.media_handler, "base_media_path", tmp_path)
+  chat_id_cache.clear()
+  chat = get_or_create_chat(db, "+573001112233", 1)
+  keep = get_or_create_chat(db, "+573009998877", 1)
+  db.add_all([Message(chat_id=chat.id, content=f"m{i}", direction="incoming") for i in range(7)])
+  db.add_all([ChatNote(company_id=1, chat_id=chat.id, user_id=1, content="n"), ChatAudit(company_id=1, chat_id=chat.id, action="x")])
+  db.add(Message(chat_id=keep.id, content="ok", direction="incoming"))
+  db.commit()
+  media_dir = tmp_path / "company_1" / "whatsapp" / f"chat_{chat.id}"
+  media_dir.mkdir(parents=True)
+  for i in range(4):
+    (media_dir / f"f{i}.jpg").write_bytes(b"x")
+
+  chat_id = chat.id
+  job = deletion.soft_delete_chat(db, 1, chat_id)
+  assert [c.id for c in get_chats_by_company(db, 1)] == [keep.id]
+  # El número queda libre para un chat nuevo aunque el borrado siga pendiente
+  assert get_or_create_chat(db, "+573001112233", 1).id != chat_id
+
+  status = make_scheduler(db_engine).run_job("cascade_deletions")
+  assert status.last_error is None
+  job_id = job.id
+  db.expire_all()
+  done = db.get(DeletionJob, job_id)
+  assert done.status == "done"
+  assert done.rows_deleted == 7 + 2 + 1
+  assert done.files_deleted == 4
+  assert not media_dir.exists()
+  assert db.get(Chat, chat_id) is None
+  assert db.query(Message).count() == 1
+
+
+def test_company_soft_delete_cascades(db, db_engine, tmp_path, monkeypatch):
+  monkeypatch.setattr(deletion.media_handler, "base_media_path", tmp_path)
+  company = make_company(db)
+  user = User(first_name="A", last_name="B", username="ab", email="ab@x.co", hashed_password="x", company_id=company.id)
+  tag = ChatTag(company_id=company.id, name="vip")
+  db.add_all([user, tag])
+  db.commit()
+  chats = [Chat(company_id=company.id, phone_number=f"+5730000000{i}") for i in range(5)]
+  db.add_all(chats)
+  db.commit()
+  db.add_all([ChatTagMap(chat_id=c.id, tag_id=tag.id) for c in chats])
+  db.commit()
+
+  company_id, user_id = company.id, user.id
+  job = deletion.soft_delete_company(db, company_id)
+  assert get_company(db, company_id) is None
+  assert list_companies(db) == []
+  assert get_chats_by_company(db, company_id) == []
+
+  job_id = job.id
+  make_scheduler(db_engine).run_job("cascade_deletions")
+  db.expire_all()
+  assert db.get(DeletionJob, job_id).status == "done"
+  assert db.query(Chat).count() == 0
+  assert db.query(ChatTagMap).count() == 0
+  assert db.query(ChatTag).count() == 0
+  assert db.get(Company, company_id) is None
+  assert db.get(User, user_id).company_id is None
+
+
+def test_soft_deleted_chat_is_hidden_and_read_only(db):
+  from datetime import datetime, timedelta
+  from app.services import chats as svc
+  chat_id_cache.clear()
+  chat = get_or_create_chat(db, "+573004445566", 1)
+  tag = ChatTag(company_id=1, name="vip")
+  db.add(tag)
+  db.add(Message(chat_id=chat.id, content="hola", direction="incoming"))
+  db.commit()
+  svc.add_note(db, 1, chat.id, 1, "nota")
+  assert svc.set_chat_tags(db, chat.id, [tag.id])
+
+  deletion.soft_delete_chat(db, 1, chat.id)
+  assert svc.get_messages_by_chat(db, chat.id) == []
+  assert svc.list_chat_tags(db, chat.id) == []
+  assert svc.list_notes(db, 1, chat.id) == []
+  assert svc.list_appointments_by_chat(db, 1, chat.id) == []
+  assert svc.get_chat_summary(db, 1, chat.id) is None
+  assert svc.add_note(db, 1, chat.id, 1, "tarde") is None
+  assert not svc.set_chat_tags(db, chat.id, [tag.id])
+  assert svc.create_appointment(db, 1, chat.id, 1, datetime.utcnow() + timedelta(days=1)) is None
+  assert svc.save_chat_summary(db, 1, chat.id, "s", "Indeciso") is None
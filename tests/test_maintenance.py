@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+from app.models.chats.chat import Chat, ChatTagMap, ChatSnooze, ChatAudit
+from app.services.maintenance import MaintenanceScheduler, ForegroundLoad, default_jobs
+
+
+def make_scheduler(engine):
+  return MaintenanceScheduler(engine, default_jobs(), load=ForegroundLoad(), batch_size=2, batch_pause=0)
+
+
+def test_retention_purges_run_in_batches(db, db_engine):
+  chat = Chat(company_id=1, phone_number="+573001112233")
+  db.add(chat)
+  db.commit()
+  past = datetime.utcnow() - timedelta(days=1)
+  future = datetime.utcnow() + timedelta(days=1)
+  db.add_all([ChatSnooze(chat_id=chat.id, user_id=1, until_at=past) for _ in range(5)])
+  db.add(ChatSnooze(chat_id=chat.id, user_id=2, until_at=future))
+  db.add_all([ChatAudit(company_id=1, chat_id=chat.id, action="old", created_at=datetime.utcnow() - timedelta(days=400)) for _ in range(3)])
+  db.add(ChatAudit(company_id=1, chat_id=chat.id, action="new"))
+  db.add_all([ChatTagMap(chat_id=chat.id, tag_id=1), ChatTagMap(chat_id=999, tag_id=1)])
+  db.commit()
+
+  scheduler = make_scheduler(db_engine)
+  assert scheduler.run_job("purge_expired_snoozes").last_rows == 5
+  assert scheduler.run_job("purge_old_audit").last_rows == 3
+  assert scheduler.run_job("purge_orphan_tag_maps").last_rows == 1
+
+  assert db.query(ChatSnooze).count() == 1
+  assert db.query(ChatAudit).one().action == "new"
+  assert db.query(ChatTagMap).one().chat_id == chat.id
+
+
+def test_status_records_timings_and_errors(db_engine):
+  scheduler = make_scheduler(db_engine)
+  scheduler.run_job("optimize")
+  scheduler.run_job("incremental_vacuum")
+  status = {job["name"]: job for job in scheduler.status()["jobs"]}
+  assert status["optimize"]["runs"] == 1
+  assert status["optimize"]["last_duration_ms"] is not None
+  assert status["optimize"]["last_error"] is None
+  assert status["purge_old_audit"]["runs"] == 0
+
+
+def test_lease_runs_each_job_in_one_worker(db_engine):
+  from app.services.maintenance import MaintenanceJob
+  seen = []
+  first = MaintenanceScheduler(db_engine, [], load=ForegroundLoad(), batch_pause=0)
+  second = MaintenanceScheduler(db_engine, [], load=ForegroundLoad(), batch_pause=0)
+
+  def job(ctx):
+    # Mientras el primer worker lo ejecuta, el segundo no puede tomarlo
+    if ctx.scheduler is first:
+      seen.append(second.run_job("backup"))
+    return 1
+
+  for scheduler in (first, second):
+    scheduler.jobs["backup"] = MaintenanceJob("backup", 3600, job)
+
+  assert first.run_job("backup", due_only=True).runs == 1
+  assert seen == [None]
+  # Ya se ejecutó en este intervalo en otro worker
+  assert second.run_job("backup", due_only=True) is None
+  # Un disparo manual sí corre una vez liberado el lease
+  assert second.run_job("backup") is not None
@@ -0,0 +1,90 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+from app.api.routes.webhooks import ycloud
+from app.models.chats.chat import Message
+from app.models.companies.company import Company
+from app.services.chats import chat_id_cache
+from app.services.message_dedupe import InboundDedupe
+
+
+@pytest.fixture
+def dedupe(monkeypatch):
+  chat_id_cache.clear()
+  dedupe = InboundDedupe(maxsize=100)
+  monkeypatch.setattr(ycloud, "inbound_dedupe", dedupe)
+  yield dedupe
+  chat_id_cache.clear()
+
+
+def _inbound(message_id, wamid, text="Hola"):
+  return {
+    "type": "whatsapp.inbound_message.received",
+    "whatsappInboundMessage": {
+      "id": message_id, "wamid": wamid, "from": "+573001234567", "to": "+573100000000",
+      "type": "text", "customerProfile": {"name": "Ana"}, "text": {"body": text},
+    },
+  }
+
+
+def _company(db):
+  company = Company(
+    nombre="Acme", razon_social="Acme SAS", nit="900", responsable="Ana", email="a@acme.co",
+    telefono="", direccion="", whatsapp_phone_number="+573100000000",
+  )
+  db.add(company)
+  db.commit()
+  return company
+
+
+def test_retried_webhook_is_stored_once(db, dedupe):
+  _company(db)
+  ycloud.handle_inbound_message(_inbound("yc-1", "wamid.1"), db)
+  # El worker de otro proceso no pasó por la LRU de este: lo detiene la consulta previa
+  dedupe.recent.clear()
+  ycloud.handle_inbound_message(_inbound("yc-1", "wamid.1", "Hola otra vez"), db)
+
+  assert [m.content for m in db.query(Message).all()] == ["Hola"]
+  assert dedupe.stored_hits == 1
+  assert dedupe.seen("yc-1", None) and dedupe.seen(None, "wamid.1")
+  assert not dedupe.seen("yc-2", "wamid.2")
+  stats = dedupe.stats()
+  assert (stats["checked"], stats["recent_hits"], stats["stored_hits"]) == (3, 2, 1)
+
+
+def test_unique_indexes_reject_duplicate_ids(db):
+  db.add(Message(chat_id=1, content="a", direction="incoming", whatsapp_message_id="yc-1", wamid="wamid.1"))
+  db.add(Message(chat_id=1, content="sin ids", direction="incoming"))
+  db.add(Message(chat_id=1, content="sin ids", direction="incoming"))
+  db.commit()
+  for duplicate in ({"whatsapp_message_id": "yc-1"}, {"wamid": "wamid.1"}):
+    db.add(Message(chat_id=1, content="b", direction="incoming", **duplicate))
+    with pytest.raises(IntegrityError):
+      db.commit()
+    db.rollback()
+
+
+def test_endpoint_acknowledges_recent_retry_without_enqueuing(dedupe, monkeypatch):
+  import anyio
+  from starlette.requests import Request
+
+  class Queue:
+    running = True
+    events = []
+
+    def enqueue(self, event_type, payload, key):
+      self.events.append(key)
+
+  queue = Queue()
+  monkeypatch.setattr(ycloud, "webhook_queue", queue)
+  body = ycloud.json.dumps(_inbound("yc-9", "wamid.9")).encode()
+
+  async def post():
+    async def receive():
+      return {"type": "http.request", "body": body, "more_body": False}
+    request = Request({"type": "http", "method": "POST", "path": "/", "headers": []}, receive)
+    return await ycloud.ycloud_webhook(request)
+
+  assert anyio.run(post)["message"] == "Webhook encolado"
+  assert anyio.run(post)["message"] == "Webhook duplicado"
+  assert queue.events == ["+573100000000:+573001234567"]
+  assert dedupe.stats()["recent_hits"] == 1
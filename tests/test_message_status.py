@@ -0,0 +1,80 @@
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from app.models.chats.chat import Chat, Message
+from app.services import message_status
+from app.services.chats import update_message_status
+from app.services.message_status import MessageStatusBatcher
+
+
+class Recorder:
+  def __init__(self):
+    self.events = []
+
+  def emit_to_chat(self, db, company_id, chat_id, name, data):
+    self.events.append((company_id, chat_id, name, data))
+
+
+def _seed(db):
+  chats = [Chat(phone_number=f"+57300000000{i}", company_id=7) for i in range(2)]
+  db.add_all(chats)
+  db.flush()
+  for i in range(4):
+    db.add(Message(chat_id=chats[i % 2].id, content=f"m{i}", direction="outgoing", whatsapp_message_id=f"yc-{i}", status="sent"))
+  db.commit()
+  return chats
+
+
+def test_batch_applies_forward_only_with_one_update_and_one_event_per_chat(db_engine, db, monkeypatch):
+  chats = _seed(db)
+  recorder = Recorder()
+  monkeypatch.setattr(message_status, "manager", recorder)
+  batcher = MessageStatusBatcher(sessionmaker(bind=db_engine), window=60)
+  batcher.start()
+  try:
+    for key, status in (
+      ("yc-0", "delivered"), ("yc-0", "read"), ("yc-0", "delivered"),
+      ("yc-1", "failed"), ("yc-2", "delivered"), ("yc-3", "sent"), ("yc-9", "read"),
+    ):
+      batcher.submit(key, status)
+
+    updates = []
+    listener = lambda conn, cursor, statement, *args: updates.append(statement) if statement.startswith("UPDATE") else None
+    event.listen(db_engine, "before_cursor_execute", listener)
+    try:
+      assert batcher.flush() == 3
+    finally:
+      event.remove(db_engine, "before_cursor_execute", listener)
+  finally:
+    batcher.stop()
+
+  assert len(updates) == 1
+  db.expire_all()
+  assert {m.whatsapp_message_id: m.status for m in db.query(Message)} == {
+    "yc-0": "read", "yc-1": "failed", "yc-2": "delivered", "yc-3": "sent",
+  }
+  assert sorted((chat_id, [m["status"] for m in data["messages"]]) for _, chat_id, name, data in recorder.events) == [
+    (chats[0].id, ["read", "delivered"]), (chats[1].id, ["failed"]),
+  ]
+  stats = batcher.stats()
+  assert (stats["received"], stats["merged"], stats["stale"], stats["orphans"]) == (7, 2, 1, 1)
+
+
+def test_late_receipt_never_moves_status_backwards(db):
+  _seed(db)
+  update_message_status(db, "yc-0", "read")
+  assert update_message_status(db, "yc-0", "delivered").status == "read"
+  assert update_message_status(db, "yc-1", "failed").status == "failed"
+  assert update_message_status(db, "yc-1", "read").status == "read"
+
+
+def test_receipt_before_message_is_retried_until_it_exists(db_engine, db, monkeypatch):
+  monkeypatch.setattr(message_status, "manager", Recorder())
+  batcher = MessageStatusBatcher(sessionmaker(bind=db_engine))
+  batcher.submit("yc-0", "delivered")
+  assert batcher.stats()["orphans"] == 1
+
+  _seed(db)
+  assert batcher.flush() == 1
+  db.expire_all()
+  assert db.query(Message).filter_by(whatsapp_message_id="yc-0").one().status == "delivered"
+  assert batcher.stats()["orphans"] == 0
@@ -0,0 +1,398 @@
+import asyncio
+import json
+from app.services.realtime import ConnectionManager
+
+
+class FastSocket:
+  def __init__(self):
+    self.sent = []
+    self.closed_with = None
+
+  async def send_text(self, text):
+    self.sent.append(json.loads(text))
+
+  async def close(self, code=1000):
+    self.closed_with = code
+
+
+class StuckSocket(FastSocket):
+  """Cliente que no lee: cada envío queda bloqueado hasta que se libere"""
+
+  def __init__(self):
+    super().__init__()
+    self.release = asyncio.Event()
+
+  async def send_text(self, text):
+    await self.release.wait()
+    self.sent.append(json.loads(text))
+
+
+def run(scenario):
+  return asyncio.run(scenario())
+
+
+def test_slow_client_does_not_delay_others_and_drops_oldest():
+  async def scenario():
+    manager = ConnectionManager(max_queue=3)
+    fast, slow = FastSocket(), StuckSocket()
+    await manager.connect_company(fast, 1)
+    await manager.connect_company(slow, 1)
+    for i in range(10):
+      await asyncio.wait_for(manager.broadcast_to_company(1, "message.created", {"n": i}), 0.1)
+    await asyncio.sleep(0)
+    stats = manager.queue_stats()
+    slow.release.set()
+    await manager.flush()
+    return fast, slow, stats
+
+  fast, slow, stats = run(scenario)
+  assert [m["data"]["n"] for m in fast.sent] == list(range(10))
+  # El primer mensaje ya estaba en vuelo; de la cola sobreviven los 3 más recientes
+  assert [m["data"]["n"] for m in slow.sent] == [0, 7, 8, 9]
+  assert stats["dropped"] == 6
+  assert stats["max_depth"] == 3
+
+
+def test_coalesce_keeps_latest_update_per_chat():
+  async def scenario():
+    manager = ConnectionManager(max_queue=2, policy="coalesce")
+    slow = StuckSocket()
+    await manager.connect_company(slow, 1)
+    await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 5, "v": 0})
+    await asyncio.sleep(0)
+    for v in range(1, 4):
+      await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 5, "v": v})
+    await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 6, "v": 9})
+    stats = manager.queue_stats()
+    slow.release.set()
+    await manager.flush()
+    return slow, stats
+
+  slow, stats = run(scenario)
+  assert [(m["data"]["chat_id"], m["data"]["v"]) for m in slow.sent] == [(5, 0), (5, 3), (6, 9)]
+  # v1 se reemplaza por v3; el chat 6 no tiene pendiente que reemplazar y descarta v2
+  assert stats["coalesced"] == 1
+  assert stats["dropped"] == 1
+
+
+def test_disconnect_policy_closes_slow_consumer():
+  async def scenario():
+    manager = ConnectionManager(max_queue=1, policy="disconnect")
+    slow = StuckSocket()
+    await manager.connect(slow, 1, 5)
+    for i in range(3):
+      await manager.broadcast_to_chat(1, 5, "message.created", {"n": i})
+    await asyncio.sleep(0)
+    return slow, manager.queue_stats()
+
+  slow, stats = run(scenario)
+  assert slow.closed_with == 1013
+  assert stats["connections"] == 0
+  assert stats["slow_disconnects"] == 1
+
+
+def test_broadcast_encodes_frame_once_for_all_recipients():
+  async def scenario():
+    manager = ConnectionManager()
+    sockets = [FastSocket() for _ in range(50)]
+    for ws in sockets:
+      await manager.connect_company(ws, 1)
+    await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 1, "name": "Año"})
+    await manager.flush()
+    return sockets, manager.queue_stats()
+
+  sockets, stats = run(scenario)
+  assert stats["frames_encoded"] == 1
+  assert all(ws.sent == [{"event": "chat.updated", "data": {"chat_id": 1, "name": "Año"}, "channel": "company:1", "seq": 1}] for ws in sockets)
+
+
+def test_chat_updates_within_window_are_batched_with_latest_state():
+  async def scenario():
+    manager = ConnectionManager(coalesce_window=0.05)
+    inbox, chat_view = FastSocket(), FastSocket()
+    await manager.connect_company(inbox, 1)
+    await manager.connect(chat_view, 1, 5)
+    for n in range(3):
+      await manager.broadcast_to_chat(1, 5, "message.created", {"n": n})
+      await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 5, "last_message": {"n": n}})
+      await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 5, "company_id": 1})
+    await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 6, "last_message": {"n": 9}})
+    await asyncio.sleep(0.01)
+    before_window = list(inbox.sent)
+    await asyncio.sleep(0.08)
+    return inbox, chat_view, before_window, manager.queue_stats()
+
+  inbox, chat_view, before_window, stats = run(scenario)
+  assert [m["data"]["n"] for m in chat_view.sent] == [0, 1, 2]
+  assert before_window == []
+  assert inbox.sent == [{"event": "chats.batch_updated", "data": {"company_id": 1, "chats": [
+    {"chat_id": 5, "last_message": {"n": 2}, "company_id": 1},
+    {"chat_id": 6, "last_message": {"n": 9}},
+  ]}, "channel": "company:1", "seq": 7}]
+  assert stats["updates_coalesced"] == 5
+  assert stats["batches_sent"] == 1
+
+
+def test_other_company_events_flush_pending_updates_first():
+  async def scenario():
+    manager = ConnectionManager(coalesce_window=10)
+    inbox = FastSocket()
+    await manager.connect_company(inbox, 1)
+    await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 5})
+    await manager.broadcast_to_company(1, "chats.bulk_updated", {"chat_ids": [5]})
+    await manager.flush()
+    return inbox
+
+  inbox = run(scenario)
+  assert [m["event"] for m in inbox.sent] == ["chats.batch_updated", "chats.bulk_updated"]
+
+
+def test_reconnect_with_last_seq_replays_missed_events():
+  async def scenario():
+    manager = ConnectionManager(replay_size=4)
+    for n in range(3):
+      await manager.broadcast_to_chat(1, 5, "message.created", {"n": n})
+    await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 5})
+    resumed, unknown = FastSocket(), FastSocket()
+    await manager.connect(resumed, 1, 5, last_seq=1)
+    await manager.connect(unknown, 1, 6, last_seq=1)
+    await manager.broadcast_to_chat(1, 5, "message.created", {"n": 3})
+    await manager.flush()
+    return resumed, unknown
+
+  resumed, unknown = run(scenario)
+  assert [(m["seq"], m["data"]["n"]) for m in resumed.sent] == [(2, 1), (3, 2), (4, 3)]
+  assert unknown.sent == [{"event": "resync.required", "data": {"channel": "chat:1:6", "last_seq": 1}}]
+
+
+def test_reconnect_after_buffer_rollover_requires_resync():
+  async def scenario():
+    manager = ConnectionManager(replay_size=3)
+    for n in range(5):
+      await manager.broadcast_to_company(1, "message.created", {"n": n})
+    late, recent = FastSocket(), FastSocket()
+    await manager.connect_company(late, 1, last_seq=1)
+    await manager.connect_company(recent, 1, last_seq=2)
+    await manager.flush()
+    return late, recent, manager.queue_stats()
+
+  late, recent, stats = run(scenario)
+  assert [m["event"] for m in late.sent] == ["resync.required"]
+  assert [m["seq"] for m in recent.sent] == [3, 4, 5]
+  assert stats["resyncs"] == 1
+  assert stats["replayed"] == 3
+
+
+def test_multiplexed_connection_subscribes_to_many_channels():
+  async def scenario():
+    manager = ConnectionManager()
+    ws = FastSocket()
+    await manager.broadcast_to_chat(1, 5, "message.created", {"n": 0})
+    await manager.connect_client(ws)
+    for channel in ("company:1", "chat:1:5", "chat:1:6"):
+      manager.handle_control(ws, json.dumps({"action": "subscribe", "channel": channel, "last_seq": 0}))
+    manager.handle_control(ws, json.dumps({"action": "subscribe", "channel": "chat:x"}))
+    await manager.broadcast_to_chat(1, 6, "message.created", {"n": 1})
+    await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 6})
+    manager.handle_control(ws, json.dumps({"action": "unsubscribe", "channel": "chat:1:6"}))
+    await manager.broadcast_to_chat(1, 6, "message.created", {"n": 2})
+    await manager.flush()
+    subscribed = manager.queue_stats()
+    manager.disconnect_client(ws)
+    await asyncio.sleep(0)
+    return ws, subscribed, manager.queue_stats()
+
+  ws, subscribed, closed = run(scenario)
+  assert [(m["event"], m.get("channel") or m["data"].get("channel")) for m in ws.sent] == [
+    ("subscribed", "company:1"),
+    ("resync.required", "company:1"),
+    ("subscribed", "chat:1:5"),
+    ("message.created", "chat:1:5"),
+    ("subscribed", "chat:1:6"),
+    ("resync.required", "chat:1:6"),
+    ("error", None),
+    ("message.created", "chat:1:6"),
+    ("chat.updated", "company:1"),
+    ("unsubscribed", "chat:1:6"),
+  ]
+  assert subscribed["connections"] == 1 and subscribed["subscriptions"] == 2
+  assert closed["channels"] == 0
+
+
+def test_legacy_disconnect_removes_channel_subscription():
+  async def scenario():
+    manager = ConnectionManager()
+    company_ws, chat_ws = FastSocket(), FastSocket()
+    await manager.connect_company(company_ws, 1)
+    await manager.connect(chat_ws, 1, 5)
+    manager.disconnect_company(company_ws, 1)
+    manager.disconnect(chat_ws, 1, 5)
+    await asyncio.sleep(0)
+    return manager.queue_stats()
+
+  stats = run(scenario)
+  assert stats["connections"] == 0 and stats["channels"] == 0
+
+
+def test_close_during_send_stops_writer():
+  async def scenario():
+    manager = ConnectionManager()
+    slow = StuckSocket()
+    await manager.connect_company(slow, 1)
+    await manager.broadcast_to_company(1, "message.created", {"n": 0})
+    await asyncio.sleep(0)
+    client = manager._clients[slow]
+    # El envío termina en el mismo ciclo en que llega la cancelación
+    slow.release.set()
+    client.close()
+    for _ in range(5):
+      await asyncio.sleep(0)
+    return client._writer.done()
+
+  assert asyncio.run(asyncio.wait_for(scenario(), 2))
+
+
+def test_heartbeat_reaps_only_clients_that_stopped_answering():
+  async def scenario():
+    manager = ConnectionManager(heartbeat_timeout=0.05)
+    alive, silent, legacy = FastSocket(), FastSocket(), FastSocket()
+    await manager.connect_client(alive)
+    await manager.connect_client(silent)
+    await manager.connect_company(legacy, 1)
+    manager.heartbeat()
+    await manager.flush()
+    for socket in (alive, silent):
+      manager.handle_control(socket, json.dumps({"action": "pong"}))
+    await asyncio.sleep(0.08)
+    manager.handle_control(alive, json.dumps({"action": "pong"}))
+    reaped = manager.heartbeat()
+    await manager.flush()
+    stats = await manager.connection_stats()
+    legacy_closed = legacy.closed_with
+    for socket in (alive, legacy):
+      manager.disconnect_client(socket)
+    await manager.flush()
+    return alive, silent, legacy_closed, reaped, stats
+
+  alive, silent, legacy_closed, reaped, stats = asyncio.run(asyncio.wait_for(scenario(), 2))
+  assert reaped == 1
+  assert silent.closed_with == 1001
+  # El cliente que nunca respondió pong (frontend anterior) no se cierra por el latido
+  assert legacy_closed is None
+  assert [m["event"] for m in alive.sent] == ["ping", "ping"]
+  assert stats["connections"] == 2
+  assert stats["heartbeat"]["reaped"] == 1
+  assert stats["send_latency"]["samples"] == 5
+
+
+def test_outbox_sends_only_committed_events_without_blocking_writers(db):
+  from app.models.chats.chat import Chat
+
+  async def scenario():
+    manager = ConnectionManager()
+    inbox = FastSocket()
+    await manager.connect_company(inbox, 1)
+    await manager.start()
+
+    def write(phone, finish):
+      db.add(Chat(company_id=1, phone_number=phone))
+      manager.emit_to_company(db, 1, "chat.updated", {"chat_id": phone})
+      finish()
+
+    # La escritura corre en otro hilo, como un endpoint síncrono del threadpool
+    await asyncio.to_thread(write, "+1", db.rollback)
+    await asyncio.to_thread(write, "+2", db.commit)
+    for _ in range(50):
+      if inbox.sent:
+        break
+      await asyncio.sleep(0.01)
+    await manager.flush()
+    stats = manager.outbox.stats()
+    await manager.stop()
+    return inbox, stats
+
+  inbox, stats = run(scenario)
+  assert [m["data"]["chat_id"] for m in inbox.sent] == ["+2"]
+  assert stats["dispatched"] == 1 and stats["pending"] == 0
+
+
+def test_sse_stream_resumes_from_last_event_id_and_keeps_alive():
+  from app.services.realtime import SSEStream
+
+  async def next_chunks(events, count):
+    return [await events.__anext__() for _ in range(count)]
+
+  async def scenario():
+    manager = ConnectionManager()
+    first = SSEStream()
+    await manager.connect_stream(first, 1)
+    for i in range(3):
+      await manager.broadcast_to_company(1, "message.created", {"n": i})
+    live = await next_chunks(first.events(keepalive=1), 3)
+    manager.disconnect_stream(first)
+
+    # Reconexión con Last-Event-ID = seq del primer evento
+    again = SSEStream()
+    await manager.connect_stream(again, 1, last_seq=1)
+    events = again.events(keepalive=0.05)
+    resumed = await next_chunks(events, 3)
+    manager.disconnect_stream(again)
+    rest = [chunk async for chunk in events]
+    return live, resumed, rest
+
+  live, resumed, rest = run(scenario)
+  assert live[0].startswith("id: 1\nevent: message.created\ndata: {")
+  assert [chunk.split("\n")[0] for chunk in resumed[:2]] == ["id: 2", "id: 3"]
+  assert resumed[2] == ": keepalive\n\n"
+  assert rest == []
+
+
+def test_company_events_reach_only_users_who_can_see_the_chat():
+  from app.services.visibility import AssignmentMap, SCOPE_ALL, SCOPE_ASSIGNED
+
+  async def scenario():
+    manager = ConnectionManager(assignments=AssignmentMap(loader=lambda company_id: {10: 7}))
+    agent7, agent8, supervisor, legacy = FastSocket(), FastSocket(), FastSocket(), FastSocket()
+    await manager.connect_company(agent7, 1, user_id=7, chat_scope=SCOPE_ASSIGNED)
+    await manager.connect_company(agent8, 1, user_id=8, chat_scope=SCOPE_ASSIGNED)
+    await manager.connect_company(supervisor, 1, user_id=1, chat_scope=SCOPE_ALL)
+    await manager.connect_company(legacy, 1)
+    while not manager.assignments.is_loaded(1):
+      await asyncio.sleep(0.01)
+    await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 10})
+    await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 11})
+    await manager.broadcast_to_company(1, "company.updated", {"company_id": 1})
+    await manager.broadcast_to_company(1, "chat.assigned", {"chat_id": 10, "assigned_user_id": 8, "previous_assigned_user_id": 7})
+    await manager.broadcast_to_company(1, "chat.updated", {"chat_id": 10, "n": 2})
+    await manager.flush()
+    return agent7, agent8, supervisor, legacy, manager.queue_stats()
+
+  agent7, agent8, supervisor, legacy, stats = run(scenario)
+
+  def seen(socket):
+    return [(m["event"], m["data"].get("chat_id")) for m in socket.sent]
+
+  assert seen(agent7) == [("chat.updated", 10), ("company.updated", None), ("chat.assigned", 10)]
+  assert seen(agent8) == [("company.updated", None), ("chat.assigned", 10), ("chat.updated", 10)]
+  assert len(supervisor.sent) == len(legacy.sent) == 5
+  assert stats["restricted_connections"] == 2
+
+
+def test_chat_scope_follows_role(db):
+  import json as _json
+  from app.models.roles.role import Role
+  from app.models.users.user import User
+  from app.services.visibility import resolve_chat_scope, SCOPE_ALL, SCOPE_ASSIGNED
+  inbox = Role(name="Inbox", allowed_paths=_json.dumps(["/chats", "/my-chats"]))
+  own = Role(name="Asesor", allowed_paths=_json.dumps(["/my-chats"]))
+  admin = Role(name="Admin", is_admin=True, allowed_paths="[]")
+  db.add_all([inbox, own, admin])
+  db.commit()
+  users = [
+    User(first_name="a", last_name="a", username=f"u{i}", email=f"u{i}@x.co", hashed_password="x", role_id=role.id)
+    for i, role in enumerate([inbox, own, admin])
+  ]
+  db.add_all(users)
+  db.commit()
+  assert [resolve_chat_scope(db, user.id) for user in users] == [SCOPE_ALL, SCOPE_ASSIGNED, SCOPE_ALL]
+  assert resolve_chat_scope(db, 999) is None
@@ -0,0 +1,39 @@
+from app.db.instrumentation import SqlMetrics, install_query_instrumentation, normalize_statement, parameter_shape, track_queries
+from app.models.chats.chat import Chat, Message
+
+
+def test_normalize_collapses_literals_and_in_lists():
+  shape = normalize_statement("SELECT * FROM chats  WHERE id IN (?, ?, ?) AND name = 'x' AND n > 10")
+  assert shape == "SELECT * FROM chats WHERE id IN (?...) AND name = ? AND n > ?"
+  assert normalize_statement("SELECT a1 FROM t2") == "SELECT a1 FROM t2"
+  assert parameter_shape({"a": 1, "b": "x"}) == "{a: int, b: str}"
+  assert parameter_shape([(1,), (2,)], executemany=True) == "2x(int)"
+
+
+def test_repeated_statement_flags_n_plus_one(db, db_engine):
+  metrics = SqlMetrics(slow_query_ms=10_000, n_plus_one_threshold=3)
+  install_query_instrumentation(db_engine, metrics)
+  chats = [Chat(company_id=1, phone_number=f"+5730000000{i}") for i in range(5)]
+  db.add_all(chats)
+  db.commit()
+
+  with track_queries("GET /chats") as stats:
+    for chat in db.query(Chat).all():
+      db.query(Message).filter(Message.chat_id == chat.id).first()
+  repeated = metrics.record_request(stats)
+
+  assert stats.count == 6
+  assert repeated and repeated[0][1] == 5
+  snapshot = metrics.snapshot()
+  assert snapshot["routes"]["GET /chats"]["n_plus_one"] == 1
+  assert snapshot["n_plus_one"][0]["repeated"][0]["count"] == 5
+
+
+def test_route_labels_are_capped():
+  metrics = SqlMetrics(max_routes=2)
+  for path in ("/a", "/b", "/c", "/d"):
+    with track_queries(f"GET {path}") as stats:
+      pass
+    metrics.record_request(stats)
+  assert sorted(metrics.snapshot()["routes"]) == ["<otras>", "GET /a", "GET /b"]
+  assert metrics.snapshot()["routes"]["<otras>"]["requests"] == 2
@@ -0,0 +1,103 @@
+import asyncio
+import httpx
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.requests import HTTPConnection
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db.session import Base
+from app.db.unit_of_work import UnitOfWorkMiddleware, bind_request_session, commit, on_commit
+from app.models.chats.chat import Chat, ChatAudit
+from app.services.chats import assign_chat
+
+
+def build_app(db_engine, fired):
+  Session = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+  def get_test_db(connection: HTTPConnection):
+    db = Session()
+    bind_request_session(db, connection.scope.get("endpoint"))
+    try:
+      yield db
+    finally:
+      db.close()
+
+  app = FastAPI()
+  app.add_middleware(UnitOfWorkMiddleware)
+
+  @app.post("/chats")
+  def create(phone: str, fail: bool = False, db=Depends(get_test_db)):
+    chat = Chat(company_id=1, phone_number=phone)
+    db.add(chat)
+    commit(db)
+    on_commit(db, lambda: fired.append(chat.id))
+    assert db.info["unit_of_work"] is True
+    if fail:
+      raise HTTPException(status_code=400, detail="error")
+    return {"id": chat.id}
+
+  @app.post("/chats/slow")
+  async def create_then_wait(phone: str, db=Depends(get_test_db)):
+    # Como /chats/start: upsert del chat y luego una llamada externa
+    chat = Chat(company_id=1, phone_number=phone)
+    db.add(chat)
+    commit(db)
+    await asyncio.sleep(0.5)
+    return {"id": chat.id, "unit_of_work": bool(db.info.get("unit_of_work"))}
+
+  return app
+
+
+def test_request_commits_once_and_runs_hooks_after_commit(db, db_engine):
+  fired = []
+  client = TestClient(build_app(db_engine, fired))
+
+  resp = client.post("/chats", params={"phone": "+573000000001"})
+  assert resp.status_code == 200
+  assert fired == [resp.json()["id"]]
+  assert db.query(Chat).count() == 1
+
+  resp = client.post("/chats", params={"phone": "+573000000009", "fail": True})
+  assert resp.status_code == 400
+  assert len(fired) == 1
+  assert db.query(Chat).count() == 1
+
+
+def test_service_writes_change_and_audit_in_one_commit(db):
+  chat = Chat(company_id=1, phone_number="+573000000002")
+  db.add(chat)
+  db.commit()
+  commits = []
+  on_commit(db, lambda: commits.append(True))
+
+  assign_chat(db, 1, chat.id, 5, "high")
+
+  assert commits == [True]
+  assert db.query(ChatAudit).filter(ChatAudit.action == "assign").count() == 1
+
+
+def test_rollback_discards_pending_hooks(db):
+  fired = []
+  db.add(Chat(company_id=1, phone_number="+573000000003"))
+  db.flush()
+  on_commit(db, lambda: fired.append(True))
+  db.rollback()
+  db.commit()
+  assert fired == []
+
+
+def test_async_route_does_not_hold_write_lock_across_await(tmp_path):
+  engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}", connect_args={"check_same_thread": False, "timeout": 0.2})
+  Base.metadata.create_all(bind=engine)
+  app = build_app(engine, [])
+
+  async def scenario():
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+      return await asyncio.gather(*(
+        client.post("/chats/slow", params={"phone": f"+57300000010{i}"}) for i in range(2)
+      ))
+
+  responses = asyncio.run(scenario())
+  engine.dispose()
+  assert [r.status_code for r in responses] == [200, 200]
+  assert [r.json()["unit_of_work"] for r in responses] == [False, False]
@@ -0,0 +1,75 @@
+import gzip
+import json
+import os
+import time
+from app.services.webhook_archive import WebhookArchive, read_archive
+
+
+def _body(n):
+  return json.dumps({"type": "whatsapp.inbound_message.received", "n": n})
+
+
+def test_roundtrip_keeps_raw_bodies_in_order(tmp_path):
+  archive = WebhookArchive(str(tmp_path), flush_interval=60)
+  archive.start()
+  for n in range(5):
+    archive.append(_body(n), "whatsapp.inbound_message.received", 1000.0 + n)
+  archive.stop()
+
+  records = list(read_archive([str(tmp_path)]))
+  assert [json.loads(r["body"])["n"] for r in records] == [0, 1, 2, 3, 4]
+  assert {r["type"] for r in records} == {"whatsapp.inbound_message.received"}
+  assert archive.stats()["archived"] == 5
+
+
+def test_rotates_by_size_and_prunes_old_files(tmp_path):
+  old = tmp_path / "webhooks-20200101T000000-1.jsonl.gz"
+  with gzip.open(old, "wt") as f:
+    f.write(json.dumps({"received_at": 1.0, "type": "x", "body": "{}"}) + "\n")
+  os.utime(old, (time.time() - 10 * 86400,) * 2)
+
+  archive = WebhookArchive(str(tmp_path), rotate_bytes=1, keep_days=1, flush_interval=60)
+  archive.start()
+  archive.append(_body(0), "t", 1.0)
+  archive.flush()
+  first = archive.current_file
+  archive.append(_body(1), "t", 2.0)
+  archive.flush()
+  archive.stop()
+
+  assert archive.rotations == 1 and archive.removed_files == 1
+  assert not old.exists() and os.path.exists(first)
+  assert [r["received_at"] for r in read_archive([str(tmp_path)])] == [1.0, 2.0]
+
+
+def test_merges_files_from_several_processes_by_received_at(tmp_path):
+  for pid, times in ((1, [1.0, 3.0, 5.0]), (2, [2.0, 3.0, 4.0])):
+    with gzip.open(tmp_path / f"webhooks-20240101T000000-{pid}.jsonl.gz", "wt") as f:
+      for t in times:
+        f.write(json.dumps({"received_at": t, "type": "t", "body": str(pid)}) + "\n")
+
+  records = [(r["received_at"], r["body"]) for r in read_archive([str(tmp_path)])]
+  assert records == [(1.0, "1"), (2.0, "2"), (3.0, "1"), (3.0, "2"), (4.0, "2"), (5.0, "1")]
+
+
+def test_truncated_tail_is_read_up_to_the_cut(tmp_path):
+  archive = WebhookArchive(str(tmp_path), flush_interval=60)
+  archive.start()
+  for n in range(3):
+    archive.append(_body(n), "t", float(n))
+  archive.flush()
+  path = archive.current_file
+  complete = os.path.getsize(path)
+  for n in range(3, 6):
+    archive.append(_body(n), "t", float(n))
+  archive.flush()
+  archive.stop()
+  # Proceso que murió a mitad del último bloque
+  with open(path, "rb") as f:
+    data = f.read()
+  with open(path, "wb") as f:
+    f.write(data[:complete + (len(data) - complete) // 2])
+
+  received = [r["received_at"] for r in read_archive([path])]
+  assert 3 <= len(received) < 6
+  assert received == [float(n) for n in range(len(received))]
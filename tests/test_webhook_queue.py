@@ -0,0 +1,102 @@
+import json
+import time
+from app.services.webhook_queue import WebhookQueue
+
+
+def _event(key, n):
+  return json.dumps({"type": "whatsapp.inbound_message.received", "key": key, "n": n})
+
+
+class Handler:
+  def __init__(self, fail=()):
+    self.fail = dict(fail)
+    self.seen = []
+
+  def __call__(self, payload):
+    name = f"{payload['key']}{payload['n']}"
+    if self.fail.get(name, 0) > 0:
+      self.fail[name] -= 1
+      raise RuntimeError(f"{name} falló")
+    self.seen.append(name)
+
+
+def _drain(queue):
+  return sum(queue.process_shard(shard) for shard in range(queue.workers))
+
+
+def test_failed_event_blocks_only_its_chat_until_retried(tmp_path):
+  queue = WebhookQueue(str(tmp_path / "webhooks.db"), workers=2, backoff_base=60)
+  queue.handler = Handler(fail={"a1": 1})
+  for key, n in (("a", 1), ("b", 1), ("a", 2), ("b", 2)):
+    queue.enqueue("whatsapp.inbound_message.received", _event(key, n), key)
+
+  _drain(queue)
+  # a2 espera el reintento de a1; el chat b sigue avanzando
+  assert queue.handler.seen == ["b1", "b2"]
+  stats = queue.stats()
+  assert (stats["depth"], stats["retrying"], stats["retried"]) == (2, 1, 1)
+
+  _drain(queue)
+  assert queue.handler.seen == ["b1", "b2"]
+
+  queue.backoff_base = 0
+  queue._shared().execute("UPDATE webhook_events SET available_at = 0")
+  _drain(queue)
+  assert queue.handler.seen == ["b1", "b2", "a1", "a2"]
+  assert queue.stats()["depth"] == 0
+
+
+def test_exhausted_event_goes_to_dead_letters_and_can_be_retried(tmp_path):
+  queue = WebhookQueue(str(tmp_path / "webhooks.db"), workers=1, max_attempts=2, backoff_base=0)
+  queue.handler = Handler(fail={"a1": 2})
+  queue.enqueue("whatsapp.inbound_message.received", _event("a", 1), "a")
+  queue.enqueue("whatsapp.inbound_message.received", _event("a", 2), "a")
+
+  _drain(queue)
+  _drain(queue)
+  assert queue.handler.seen == ["a2"]
+  stats = queue.stats()
+  assert (stats["depth"], stats["dead_letters"], stats["dead_lettered"]) == (0, 1, 1)
+  [dead] = queue.dead_letters()
+  assert dead["attempts"] == 2 and dead["last_error"] == "a1 falló" and dead["payload"]["n"] == 1
+
+  assert queue.retry_dead_letter(dead["id"]) is not None
+  assert queue.retry_dead_letter(dead["id"]) is None
+  _drain(queue)
+  assert queue.handler.seen == ["a2", "a1"]
+  assert queue.stats()["dead_letters"] == 0
+
+
+def test_workers_process_in_order_per_chat(tmp_path):
+  queue = WebhookQueue(str(tmp_path / "webhooks.db"), workers=3, poll_interval=0.01)
+  handler = Handler()
+  queue.start(handler)
+  try:
+    for n in range(30):
+      for key in ("a", "b", "c", "d"):
+        queue.enqueue("whatsapp.inbound_message.received", _event(key, n), key)
+    deadline = time.monotonic() + 10
+    while len(handler.seen) < 120 and time.monotonic() < deadline:
+      time.sleep(0.01)
+  finally:
+    queue.stop()
+  for key in ("a", "b", "c", "d"):
+    assert [name for name in handler.seen if name[0] == key] == [f"{key}{n}" for n in range(30)]
+  assert queue.stats()["processed"] == 120
+
+
+def test_second_process_does_not_take_a_leased_shard(tmp_path):
+  path = str(tmp_path / "webhooks.db")
+  first, second = WebhookQueue(path, workers=1), WebhookQueue(path, workers=1)
+  assert first._claim(first._shared(), 0)
+  assert not second._claim(second._shared(), 0)
+  first._release(first._shared(), 0)
+  assert second._claim(second._shared(), 0)
+
+
+def test_inbound_message_and_status_share_the_chat_partition():
+  from app.api.routes.webhooks.ycloud import partition_key
+  inbound = {"type": "whatsapp.inbound_message.received", "whatsappInboundMessage": {"from": "573001234567", "to": "+57 310 000 0000"}}
+  status = {"type": "whatsapp.message.updated", "whatsappMessage": {"from": "+573100000000", "to": "+57 300 123 4567"}}
+  assert partition_key(inbound) == partition_key(status) == "+573100000000:+573001234567"
+  assert partition_key({"type": "whatsapp.template.reviewed"}) == "whatsapp.template.reviewed"